@@ -109,7 +109,7 @@ LogFile = logfile() # Create log handler.
 Clock = clock(LogFile=LogFile, ExceptionCounter=ExceptionCounter, RPi=None, TimeValue=time.time()) # Simulate RTC
 LogFile.Clock = Clock # Tell the LogFile which clock to use.
 
-from pilomar.uarthost import uarthost # For serial communication over UART with Raspberry Pi.
+from pilomar.uarthost import uarthost, FRAME_VERSION, FRAME_TRAJECTORY, SEGMENT_FORMAT, SEGMENT_SIZE, SEGMENT_MOTORS, UNIX_EPOCH_OFFSET # For serial communication over UART with Raspberry Pi.
 RPi = uarthost(channel=0,logfile=LogFile,exceptioncounter=ExceptionCounter,statusled=StatusLed,clock=Clock) # Create UART serial comms with Raspberry Pi.
 print("RPi UART communication baud rate:",RPi.BaudRate)
 LogFile.setHost(RPi) # Tell the log file where to send messages.
@@ -665,6 +665,9 @@ def ProcessInput(line):
     elif lineitems[0] == 'tune':
         for i in Motors:
             if i.MotorName == lineitems[2]: i.TunePosition(line)
+    elif line.startswith('binary offer'): # RPi can send trajectories in binary frames.
+        RPi.BinaryFrames = True
+        RPi.Write('binary accept ' + str(FRAME_VERSION))
     elif line.startswith('rpi version'):
         CheckVersionCompatibility(lineitems[3])
     elif line.startswith('pin query'):
@@ -727,6 +730,30 @@ def ProcessInput(line):
     else:
         RPi.Write('error: unrecognised RPi command: ' + line)
 
+def ProcessFrame(frame):
+    """ This is called whenever the UART serial comms receives a binary frame from the RPi.
+        frame = (type,sequence,payload)
+        A trajectory frame carries several segments, each motor reports its status once they are all added. """
+    frametype, sequence, payload = frame
+    if frametype != FRAME_TRAJECTORY:
+        RPi.Write('error: unrecognised frame type ' + str(frametype) + ' sequence ' + str(sequence))
+        return
+    accepted = 0
+    count = len(payload) // SEGMENT_SIZE
+    updated = []
+    for n in range(count):
+        motorindex, start, duration, startangle, endangle, startpos, endpos = struct.unpack_from(SEGMENT_FORMAT,payload,n * SEGMENT_SIZE)
+        if motorindex >= len(SEGMENT_MOTORS): continue
+        start += UNIX_EPOCH_OFFSET # Frame times are unix UTC.
+        for i in Motors:
+            if i.MotorName == SEGMENT_MOTORS[motorindex]:
+                if i.AddTrajectorySegment(start,startangle,start + duration,endangle,startpos,endpos): accepted += 1
+                if not i in updated: updated.append(i)
+    RPi.Write('binary ack ' + str(sequence) + ' ' + str(accepted) + ' ' + str(count))
+    for i in updated:
+        i.SendMotorStatus(immediate=True,codes='atb') # This triggers the next trajectory frame faster than waiting for the regular status message will.
+    Session.MovePermission() # Decide if we have valid trajectories and configuration in every motor. OK to move if we do!
+
 MemMgr = memorymanager()
 
 print('Starting...')
@@ -767,6 +794,14 @@ try:
             print("Main:Failed on",line)
             ExceptionCounter.Raise() # Increment exception count for the session.
 
+        try:
+            frame = RPi.ReadFrame() # Any binary frame from the Raspberry Pi?
+            if frame != None: ProcessFrame(frame)
+        except Exception as e:
+            LogFile.Log("Main:ProcessFrame failed.",e)
+            print("Main:ProcessFrame failed.",e)
+            ExceptionCounter.Raise() # Increment exception count for the session.
+
         try:
             Session.TrajectorySafety() # If no recent receipt from RPi, assume comms break take precautions and clear trajectories.
         except Exception as e:
@@ -217,6 +217,17 @@ class steppermotor():
             self.ExceptionCounter.Raise() # Increment exception count for the session.
         self.SendMotorStatus(immediate=True,codes='atp') # This triggers the next trajectory point faster than waiting for the regular status message will.
 
+    def AddTrajectorySegment(self,starttime,startangle,endtime,endangle,startposition,endposition):
+        """ Add a segment from a binary frame. Several arrive together, the caller sends the motor status once afterwards.
+            Returns True if the segment was added. """
+        result = False
+        try:
+            result = self.Trajectory.AddSegment(starttime,startangle,endtime,endangle,startposition,endposition)
+        except Exception as e:
+            self.Log('steppermotor(',self.MotorName,').AddTrajectorySegment:',starttime,': Failed. ',e)
+            self.ExceptionCounter.Raise() # Increment exception count for the session.
+        return result
+
     def ClearTrajectory(self):
         """ Remove all trajectory points from the motor. """
         self.Trajectory.Clear() # Empty the entire trajectory.
@@ -1057,7 +1068,7 @@ class steppermotor():
             line += self.MotorName + ' ' # 3
             line += BoolToString(self.Trajectory.Valid) + ' ' # 4: TrajectoryValid
             line += IntToTimeString(self.Trajectory.ValidUntil()) + ' ' # 5: When does the trajectory run out?
-            line += str(len(self.Trajectory.TrajectoryList)) + ' ' # 6: How many segments in the trajectory?
+            line += str(self.Trajectory.Length()) + ' ' # 6: How many segments in the trajectory?
             line += str(self.CurrentPosition) + ' ' # 7: Where is the camera at the moment?
             line += str(self.CurrentDegrees()) + ' ' # 8: Where is the camera at the moment?
             line += BoolToString(self.MotorConfigured) + ' ' # 9: MotorConfigured
@@ -15,36 +15,44 @@ class trajectorypoint():
         Each segment is a short straight line path that approximates the arc that
         the target is following. The segment is short enough that it is very
         close to the actual curve that the target follows.
+        The trajectory preallocates its segments and reuses them, Load() fills in a segment from a received message.
         trajectory yymmddhhmmss motorname start startangle end endangle startpos endpos
              0           1         2         3       4       5       6     7        8  """
-    def __init__(self,line,clock):
-        """ line = the trajectory entry received from the RPi.
-
-            For backwards compatibility, if the start/end positions are not in the message 
-            the values are calculated here instead. """
+    def __init__(self,clock):
+        self.Clock = clock # Link to clock instance.
+        self.StartTime = 0
+        self.StartAngle = 0.0
+        self.EndTime = 0
+        self.EndAngle = 0.0
+        self.StartPosition = 0
+        self.EndPosition = 0
+        self.DegreesPerSecond = 0.0
+        self.StepsPerSecond = 0.0
+
+    def Load(self,lineitems):
+        """ lineitems = the trajectory entry received from the RPi, already split into words.
+            Raises an exception if the entry cannot be parsed, the segment must not be used in that case. """
         # Be sure trajectory details are not corrupted.
-        # Don't create the entry if there is any problem with it.
         # The remote server will re-send the record if it doesn't get created this time.
         # trajectory 20210410163444 azimuth 20210410163444 256.57984815616663 20210410163544 256.7949264136615
-        lineitems = line.split(' ')
-        self.Clock = clock # Link to clock instance.
-        self.StartTime = TimeStringToInt(lineitems[3])
-        self.StartAngle = float(lineitems[4])
-        self.EndTime = TimeStringToInt(lineitems[5]) # In the future. Could overflow 'int' eventually and fail somewhere.
-        self.EndAngle = float(lineitems[6])
-        self.StartPosition = int(lineitems[7])
-        self.EndPosition = int(lineitems[8])
+        self.Set(TimeStringToInt(lineitems[3]),float(lineitems[4]),TimeStringToInt(lineitems[5]),float(lineitems[6]),int(lineitems[7]),int(lineitems[8]))
+
+    def Set(self,starttime,startangle,endtime,endangle,startposition,endposition):
+        """ Fill in the segment from values that are already decoded. (eg: from a binary frame) """
+        self.StartTime = starttime
+        self.StartAngle = startangle
+        self.EndTime = endtime # In the future. Could overflow 'int' eventually and fail somewhere.
+        self.EndAngle = endangle
+        self.StartPosition = startposition
+        self.EndPosition = endposition
         # Store gradient of this segment so we don't have to keep recalculating it later on.
-        AngleDelta = self.EndAngle - self.StartAngle
-        PositionDelta = self.EndPosition - self.StartPosition
         TimeDelta = self.EndTime - self.StartTime
         if TimeDelta != 0: 
-            self.DegreesPerSecond = AngleDelta / TimeDelta
-            self.StepsPerSecond = PositionDelta / TimeDelta
+            self.DegreesPerSecond = (self.EndAngle - self.StartAngle) / TimeDelta
+            self.StepsPerSecond = (self.EndPosition - self.StartPosition) / TimeDelta
         else: 
             self.DegreesPerSecond = 0.0
             self.StepsPerSecond = 0.0
-        print("trajectory: New entry: Start pos",self.StartPosition,"end pos",self.EndPosition,"gradient",self.StepsPerSecond)
 
     def Printable(self):
         """ Generate test printable version of the entry. """
@@ -75,21 +83,42 @@ class trajectorypoint():
         positionfinal = int(round(position + positiondecimal,0))
         return positionfinal
 
+TRAJECTORY_CAPACITY = 32 # Maximum segments held per motor. The RPi keeps TrajectoryWindow (default 1200s) queued ahead in 60s or longer segments.
+
 class trajectory():
-    """ A complete trajectory for a target. Consists of a list of individual segments in sequence. """
-    def __init__(self,name,logfile=None,clock=None):
-        self.TrajectoryList = []
+    """ A complete trajectory for a target. Consists of a list of individual segments in sequence.
+        The segments are held in a fixed size ring of preallocated trajectorypoint instances.
+        Adding and expiring segments reuses them in place, so following a trajectory creates no garbage
+        for the collector to clear up while the motors are stepping. """
+    def __init__(self,name,logfile=None,clock=None,capacity=TRAJECTORY_CAPACITY):
+        self.Capacity = capacity # Size of the segment ring.
+        self.Segments = [trajectorypoint(clock) for i in range(capacity)] # The ring of segments.
+        self.Head = 0 # Index of the first (current) segment in the ring.
+        self.Count = 0 # Number of segments in use.
         self.Clock = clock # Handle to clock instance.
         self.LogFile = logfile # Handle to logging instance.
         self.Valid = False # Indicates that the trajectory is useable.
         self.MotorName = name # The parent MotorName to match log messages with the parent motor.
 
+    def Length(self):
+        """ How many segments are in the trajectory? """
+        return self.Count
+
+    def First(self):
+        """ The current segment. Only valid if Count > 0. """
+        return self.Segments[self.Head]
+
+    def Last(self):
+        """ The final segment. Only valid if Count > 0. """
+        return self.Segments[(self.Head + self.Count - 1) % self.Capacity]
+
     def Clean(self): # Trim expired entries from the trajectory list.
         """ All the entries in Trajectory List should complete in the future. """
-        while len(self.TrajectoryList) > 0 and self.TrajectoryList[0].EndTime < self.Clock.Now():
-            self.LogFile.Log('trajectory.Clean: Expired (', self.MotorName, self.TrajectoryList[0].Printable(), ')')
-            #temp = self.TrajectoryList.pop(0) # Remove the first entry from the list, it's not needed anymore.
-            _ = self.TrajectoryList.pop(0) # Remove the first entry from the list, it's not needed anymore.
+        now = self.Clock.Now()
+        while self.Count > 0 and self.Segments[self.Head].EndTime < now:
+            self.LogFile.Log('trajectory.Clean: Expired (', self.MotorName, self.Segments[self.Head].Printable(), ')')
+            self.Head = (self.Head + 1) % self.Capacity # Drop the first entry, it's not needed anymore. The slot is reused later.
+            self.Count -= 1
         self.Validate() # Is the trajectory useable?
 
     def Add(self,line): # Add new entry to the end of the list, any existing entries older than the new entry are trimmed.
@@ -107,20 +136,44 @@ class trajectory():
         # Protect from junk data received over the serial line.
         # The host will send the record again if it fails this time.
         try:
-            # The new entry must always be the last one on the list.
-            # If there are later entries in the list, remove them, they will be resent by the host.
-            while len(self.TrajectoryList) > 0 and starttime <= self.TrajectoryList[-1].StartTime:
-                self.TrajectoryList = self.TrajectoryList[:-1] # Remove last list entry, it's being replaced by new values.
-            self.TrajectoryList.append(trajectorypoint(line,clock=self.Clock)) # Add new entry to the end of the list.
-            result = True # Entry creation was successful.
+            segment = self.Reserve(starttime)
+            if segment != None:
+                segment.Load(lineitems) # Fill the next free slot.
+                self.Count += 1 # Only counts once the entry has been loaded successfully.
+                result = True # Entry creation was successful.
         except Exception as e:
             self.LogFile.Log('trajectory.Add(', self.MotorName ,'): ' + str(line) + ': Failed to create new trajectory point: ' + str(e))
             ExceptionCounter.Raise() # Increment exception count for the session.
         self.Validate() # Is the trajectory useable?
         return result
 
+    def AddSegment(self,starttime,startangle,endtime,endangle,startposition,endposition):
+        """ Add a segment that has already been decoded, eg: from a binary frame. Same rules as Add(). """
+        self.Clean()
+        result = False
+        segment = self.Reserve(starttime)
+        if segment != None:
+            segment.Set(starttime,startangle,endtime,endangle,startposition,endposition)
+            self.Count += 1
+            result = True
+        self.Validate() # Is the trajectory useable?
+        return result
+
+    def Reserve(self,starttime):
+        """ Prepare for a new segment starting at starttime.
+            The new entry must always be the last one on the list.
+            If there are later entries in the list, remove them, they will be resent by the host.
+            Returns the free slot for the new segment, or None if the trajectory is full. """
+        while self.Count > 0 and starttime <= self.Last().StartTime:
+            self.Count -= 1 # Remove last list entry, it's being replaced by new values.
+        if self.Count >= self.Capacity: # The host will resend it once earlier segments expire.
+            self.LogFile.Log('trajectory.Reserve(', self.MotorName ,'): Trajectory full (' + str(self.Capacity) + ' segments), segment rejected.')
+            return None
+        return self.Segments[(self.Head + self.Count) % self.Capacity]
+
     def Clear(self): # Scrub the entire trajectory list.
-        self.TrajectoryList = []
+        self.Head = 0
+        self.Count = 0
         self.Validate() # Is the trajectory useable?
 
     def ValidUntil(self):
@@ -128,8 +181,8 @@ class trajectory():
             The host monitors this value, and sends new entries
             as needed to keep the trajectory valid for the next
             few minutes. """
-        if len(self.TrajectoryList) > 0:
-            validuntil = self.TrajectoryList[-1].EndTime
+        if self.Count > 0:
+            validuntil = self.Last().EndTime
         else:
             validuntil = self.Clock.Now() # Trajectory is empty, so it expires now!
         return validuntil
@@ -145,8 +198,8 @@ class trajectory():
     def EndAngle(self):
         """ What is the final rest position of the trajectory so far?"""
         result = None
-        if len(self.TrajectoryList) > 0:
-            result = self.TrajectoryList[-1].EndAngle
+        if self.Count > 0:
+            result = self.Last().EndAngle
         return result
 
     def ExpectedPosition(self):
@@ -156,8 +209,8 @@ class trajectory():
             that path in the hope that it gets updated soon. """
         self.Clean() # Make sure the list is up to date.
         # Calculate the step position that the motor should be at right now.
-        if len(self.TrajectoryList) > 0:
-            result = self.TrajectoryList[0].ExpectedPosition()
+        if self.Count > 0:
+            result = self.First().ExpectedPosition()
         else:
             result = None # No position set yet.
         return result
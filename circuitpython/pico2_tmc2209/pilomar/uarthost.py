@@ -4,8 +4,43 @@
 import board
 from busio import UART as busio_UART # Only need the UART and I2C features.
 import time
+import struct
 from pilomar.helpers import * # Utility classes and methods used in this program. (logfile, clock, gpio etc)
 
+# Binary frames. (Matches src/pilomarframing.py on the RPi.)
+# Frame = FRAME_START, type, sequence(2), payload length(2), payload, CRC-16/CCITT-FALSE(2). Little-endian.
+# Only used after the RPi has offered them with 'binary offer', otherwise everything is text lines.
+FRAME_VERSION = 1
+FRAME_START = 0xA5 # Text lines are pure ASCII, so this byte can only start a frame.
+FRAME_TRAJECTORY = 0x01 # Payload is a series of SEGMENT_FORMAT records.
+FRAME_HEADER_FORMAT = '<BBHH'
+FRAME_HEADER_SIZE = 6
+FRAME_MAX_PAYLOAD = 512
+SEGMENT_FORMAT = '<BIHffii' # Motor index, start (unix UTC), duration, start angle, end angle, start position, end position.
+SEGMENT_SIZE = 23
+SEGMENT_MOTORS = ('azimuth','altitude') # Motor index used in segment records.
+UNIX_EPOCH_OFFSET = time.mktime((2000,1,1,0,0,0,0,-1,-1)) - 946684800 # 0 if the board's clock counts from 1970, adjusts unix times if it counts from 2000.
+
+def _crctable():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for bit in range(8):
+            if crc & 0x8000: crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else: crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+CRC_TABLE = _crctable()
+
+def Crc16(data,start=0,end=None):
+    """ CRC-16/CCITT-FALSE of data[start:end] without slicing it. """
+    if end == None: end = len(data)
+    crc = 0xFFFF
+    for i in range(start,end):
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ data[i]) & 0xFF]
+    return crc
+
 class uarthost():
     """ UART serial communication handler.
         Handles buffering of received and transmitted data over serial line. """
@@ -36,6 +71,11 @@ class uarthost():
         self.WriteGapms = 100 # ms pause between each chunk of data written.
         self.Name = name
         self.ReceivingLine = '' # Current line being received. It's constructed here until '\n' received.
+        self.BinaryFrames = False # Has the RPi negotiated binary frames?
+        self.ReceivingFrame = None # Binary frame being received. None while receiving text.
+        self.ReceivedFrames = [] # Completed frames. (type,sequence,payload)
+        self.MaxReceivedFrames = 4 # Frames are large, only buffer a few.
+        self.FramesRead = 0 # Total number of valid frames received.
         self.WriteQueue = [] # List of queued messages to be sent when safe.
         self.WriteDrops = 0 # Number of messages dropped because queue filled.
         self.ReadDrops = 0 # How many received messages are dropped because input buffer is full?
@@ -50,6 +90,8 @@ class uarthost():
         """ Reset communications (flush output buffers). """
         self.WriteQueue = [] # Empty the write queue.
         self.ReceivedLines = [] # Empty the input queue.
+        self.ReceivedFrames = []
+        self.ReceivingFrame = None
         self.ExceptionCounter.Reset() # Reset the ExceptionCounter also.
         for i in range(2): self.Write('#' * 20) # Send dummy lines through the UART line to flush out any junk.
         #self.Write('# CP env ' + str(Bootline) + ' ver ' + str(CircuitPythonVersion))
@@ -111,38 +153,77 @@ class uarthost():
             if LoopCounter > 20: break # Max 20 reads performed per call.
             try:
                 bchar = self.uart.read() # Read entire waiting queue.
-                CharsToProcess = ''.join([chr(b) for b in bchar]) # Convert to string.
-                self.CharactersRead += len(CharsToProcess) # Count characters read.
+                if bchar == None: bchar = b''
+                self.CharactersRead += len(bchar) # Count characters read.
             except Exception as e:
                 #LogFile.Log('uarthost.BufferInput: uart.read() or conversion error:',e)
                 self.Log('uarthost.BufferInput: uart.read() or conversion error:',e)
                 self.ExceptionCounter.Raise() # Increment exception count for the session.
+                bchar = b''
             # Process each new character in turn.
-            if len(CharsToProcess) > 0:
-                for cchar in CharsToProcess:
-                    self.ReceivingLine += cchar
-                    if cchar == '\n': # End of line
-                        self.LinesRead += 1
-                        if len(self.ReceivingLine) > 0 and self.ReceivingLine[-1] == '\n':
-                            line = self.ReceivingLine.strip() # Clear special characters.
-                            if len(line) > 0: # Something to process.
-                                if len(self.ReceivedLines) < self.MaxReceivedLines: # Only buffer 10 lines, discard the rest. No space!
-                                    self.ReceivedLines.append(line) # Add to list of lines to handle.
-                                    line = self.RemoveChecksum(line)
-                                    report = 'rec: ' + line
-                                    if self.ShowUartTraffic: print(report) # Report all receipts to serial out.
-                                    if line[0] != "#": # Acknowledge receipt of all messages except comments via the log file back to the RPi too.
-                                        x = line.split(' ')[-1] # Last entry should be message sequence number.
-                                        if x.startswith('['): report = 'rec: ' + x # If we have message sequence number, just report that back to the RPi.
-                                        #LogFile.Log(report)
-                                        self.Log(report)
-                                else:
-                                    print('uarthost.BufferInput full. Ignored: ' + line)
-                                    self.ReadDrops += 1
-                        self.ReceivingLine = '' # Start a new receiving line with the next character received.
+            for b in bchar:
+                if self.ReceivingFrame != None: # Inside a binary frame.
+                    self.BufferFrame(b)
+                    continue
+                if b == FRAME_START and self.BinaryFrames and len(self.ReceivingLine) == 0: # Start of a binary frame.
+                    self.ReceivingFrame = bytearray([b])
+                    continue
+                cchar = chr(b)
+                self.ReceivingLine += cchar
+                if cchar == '\n': # End of line
+                    self.LinesRead += 1
+                    if len(self.ReceivingLine) > 0 and self.ReceivingLine[-1] == '\n':
+                        line = self.ReceivingLine.strip() # Clear special characters.
+                        if len(line) > 0: # Something to process.
+                            if len(self.ReceivedLines) < self.MaxReceivedLines: # Only buffer 10 lines, discard the rest. No space!
+                                self.ReceivedLines.append(line) # Add to list of lines to handle.
+                                line = self.RemoveChecksum(line)
+                                report = 'rec: ' + line
+                                if self.ShowUartTraffic: print(report) # Report all receipts to serial out.
+                                if line[0] != "#": # Acknowledge receipt of all messages except comments via the log file back to the RPi too.
+                                    x = line.split(' ')[-1] # Last entry should be message sequence number.
+                                    if x.startswith('['): report = 'rec: ' + x # If we have message sequence number, just report that back to the RPi.
+                                    #LogFile.Log(report)
+                                    self.Log(report)
+                            else:
+                                print('uarthost.BufferInput full. Ignored: ' + line)
+                                self.ReadDrops += 1
+                    self.ReceivingLine = '' # Start a new receiving line with the next character received.
             self.LastRxms = self.ticks_ms() # When was last message received?
         self.StatusLed.Task('idle')
     
+    def BufferFrame(self,b):
+        """ Add a received byte to the binary frame under construction.
+            Complete frames with a valid CRC are added to the ReceivedFrames list. """
+        frame = self.ReceivingFrame
+        frame.append(b)
+        if len(frame) < FRAME_HEADER_SIZE: return
+        length = frame[4] | (frame[5] << 8)
+        if length > FRAME_MAX_PAYLOAD: # Corrupt header. Drop it, the text protocol resynchronises on the next line.
+            print('uarthost.BufferFrame: Oversized frame ignored.')
+            self.PicoRxErrors += 1
+            self.ReceivingFrame = None
+            return
+        if len(frame) < FRAME_HEADER_SIZE + length + 2: return # Still arriving.
+        self.ReceivingFrame = None
+        sequence = frame[2] | (frame[3] << 8)
+        if Crc16(frame,1,len(frame) - 2) != frame[-2] | (frame[-1] << 8):
+            print('uarthost.BufferFrame: Rejected CRC on frame',sequence)
+            self.Log('uarthost.BufferFrame: Rejected CRC on frame',sequence)
+            self.PicoRxErrors += 1
+        elif len(self.ReceivedFrames) < self.MaxReceivedFrames:
+            self.ReceivedFrames.append((frame[1],sequence,frame[FRAME_HEADER_SIZE:-2]))
+            self.FramesRead += 1
+            if self.ShowUartTraffic: print('rec: frame',sequence,length,'bytes')
+        else:
+            print('uarthost.BufferFrame: Frame buffer full. Ignored frame',sequence)
+            self.ReadDrops += 1
+
+    def ReadFrame(self):
+        """ Return the next received binary frame as (type,sequence,payload) or None. """
+        if len(self.ReceivedFrames) > 0: return self.ReceivedFrames.pop(0)
+        return None
+
     def ReceiveAge(self):
         """ How many ms old is the last receipt? """
         return self.ticks_ms() - self.LastRxms # How old is the last receipt?
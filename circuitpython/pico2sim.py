@@ -0,0 +1,1216 @@
+#!/usr/bin/python
+
+# Host-side simulator for the Pico2 / TMC2209 motor controller firmware.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Runs the unmodified pico2_tmc2209/code.py under CPython on the host.
+# The CircuitPython hardware modules (board, digitalio, busio, analogio, microcontroller, supervisor)
+# are replaced by stand-ins that talk to simulated hardware:
+#   - Two TMC2209 drivers on the single wire UART (GP8/GP9). Registers are emulated well enough for
+#     the tmc2209.py read/write/IFCNT handshake, MRES from CHOPCONF decides how far each STEP pulse moves.
+#   - Two axes driven by the STEP (GP7, GP17), common DIR (GP16) and common ENABLE (GP21) pins.
+#   - An AS5600 on the azimuth axis (register level, via adafruit_bus_device) and a LIS3DH on the
+#     altitude axis (adafruit_lis3dh is a compiled .mpy so it is replaced at the driver level).
+#   - A scripted 'RPi' on UART0 (GP0/GP1) which configures the motors then streams trajectory
+#     segments for a star, the same way pilomar.py does.
+#
+# Virtual clock:
+#   The firmware's time module is replaced. Virtual time advances by
+#     - real CPU time spent in the firmware * CpuScale (how much slower the RP2350 runs the same python),
+#     - the full duration of every time.sleep() call, instantly,
+#     - idle fast-forward: when a main loop iteration did nothing (no steps, no UART traffic) the clock
+#       jumps to the next thing that can happen: a commanded step, a second boundary, a host message,
+#       a UART write slot. A random phase of one idle loop period is added so the firmware does not get
+#       to see every event the instant it happens.
+#   Every bit of simulator bookkeeping is excluded from the virtual clock.
+#   This replays a whole night of trajectory following in well under real time.
+#
+# Reports:
+#   - Main loop iteration times (virtual), excluding idle fast-forward.
+#   - Virtual time spent in ProcessInput(), StepMove(), MoveMotorFast() and the uarthost polling, plus TMC2209 UART transactions.
+#   - Step deadlines per axis: every change of the commanded position is a deadline, it is met when
+#     the STEP pulse for that position is issued. Late = more than 'tolerance' seconds after it was due.
+#     The commanded position is read at the time the firmware's own clock shows, so a deadline falls due when
+#     trajectory.ExpectedPosition() would first return it. The firmware clock only gets whole seconds from the
+#     host and can run up to a second behind, that lag is reported on its own instead of making every step late.
+#   - Position error of the physical axis against the commanded trajectory, and of the commanded
+#     trajectory (straight line segments) against the true path of the target.
+#
+# Usage: python pico2sim.py [hours] [cpuscale] [trace] [binary]
+#        python pico2sim.py trajectory  (Checks the trajectory segment ring against a plain list and measures allocations per segment.)
+#   hours = length of the simulated night. (Default 8)
+#   cpuscale = RP2350 slowdown relative to this host. (Default: calibrated from the ns_sleep() overhead documented in helpers.py)
+#   trace = also print the firmware's UART output to the terminal.
+#   binary = host offers binary trajectory frames (src/pilomarframing.py) and sends segments in batches once accepted.
+#        python pico2sim.py slew [speed] [cpuscale]  (Performs a series of GOTO moves and compares their duration with src/pilomarslew.py predictions.)
+#   speed = Slow, Medium, Fast or Turbo from pilomarslew.SPEEDLIST. (Default Medium)
+#   cpuscale = Defaults to SLEW_CPUSCALE, the value the pilomarslew overheads were calibrated at.
+
+import sys
+import os
+import math
+import types
+import random
+import calendar
+import tempfile
+import functools
+import time as _time
+import gc as _gc
+from array import array
+from collections import deque
+import importlib.util
+
+FIRMWARE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),'pico2_tmc2209') # Where code.py lives.
+FIRMWARE_MODULES = ('pilomar','tmc2209','as5600') # Imported by code.py, reloaded for every run so they bind to the virtual clock.
+PICO_EPOCH = 946684800 # 2000-01-01 00:00:00, where the RP2350 clock starts after power on.
+BOOT_OUT = 'Adafruit CircuitPython 9.2.1 on 2024-11-20; Raspberry Pi Pico 2 with rp2350a\nBoard ID:raspberry_pi_pico2\n'
+PICO2_NS_SLEEP_OVERHEAD = 0.00005 # ns_sleep() overhead on a Pico2 at 220MHz. (From pilomar/helpers.py)
+
+def _loadframing(name='pilomarframing'):
+    """ RPi side modules, eg the binary frame protocol. Loaded by path, src/pilomar.py would hide the firmware's pilomar package. """
+    spec = importlib.util.spec_from_file_location(name,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src',name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+pilomarframing = _loadframing()
+
+# V3.1.1 motor controller board wiring, as defined in code.py.
+STEP_PINS = {'GP7':'azimuth','GP17':'altitude'}
+DIRECTION_PIN = 'GP16'
+ENABLE_PIN = 'GP21'
+LOOP_PIN = 'GP11' # MSTOP. Session.ScanMotorStop() reads it at the top of every main loop iteration.
+INPUT_LEVELS = {'GP11':True,'GP10':False,'GP22':False} # MSTOP not pressed, no TMC2209 DIAG faults.
+MOTOR_IDS = {'azimuth':0,'altitude':1} # TMC2209 UART addresses.
+
+class simulationend(BaseException):
+    """ Stops the firmware. BaseException so the firmware's 'except Exception' handlers don't catch it. """
+    pass
+
+#-----------------------------------------------------------------------------------------------
+# Virtual time.
+#-----------------------------------------------------------------------------------------------
+
+class virtualclock():
+    """ Monotonic nanosecond clock for the simulated microcontroller. """
+
+    def __init__(self,cpuscale=100.0,limit=None):
+        """ cpuscale = Virtual nanoseconds per real nanosecond of host CPU time spent in the firmware.
+            limit = Virtual seconds after which the run is stopped. """
+        self.CpuScale = cpuscale
+        self.LimitNs = None if limit == None else int(limit * 1e9)
+        self.Ns = 0 # Current virtual time.
+        self.CpuNs = 0 # Virtual time spent running firmware code.
+        self.SleptNs = 0 # Virtual time spent in sleep() calls.
+        self.SkippedNs = 0 # Virtual time fast-forwarded while idle.
+        self.RealNs = _time.perf_counter_ns()
+
+    def Sync(self):
+        """ Charge the host CPU time used since the last call to the virtual clock. Returns virtual ns. """
+        real = _time.perf_counter_ns()
+        delta = int((real - self.RealNs) * self.CpuScale)
+        self.Ns += delta
+        self.CpuNs += delta
+        self.RealNs = real
+        if self.LimitNs != None and self.Ns > self.LimitNs:
+            self.LimitNs = None # Only stop once, let the shutdown code run.
+            raise simulationend('Virtual time limit reached.')
+        return self.Ns
+
+    def Resume(self):
+        """ Restart the CPU time measurement. Simulator bookkeeping since the last Sync() is not charged. """
+        self.RealNs = _time.perf_counter_ns()
+
+    def Sleep(self,seconds):
+        """ time.sleep() replacement. """
+        self.Sync()
+        if seconds > 0:
+            ns = int(seconds * 1e9)
+            self.Ns += ns
+            self.SleptNs += ns
+        self.Resume()
+
+    def SkipTo(self,ns):
+        """ Fast-forward an idle controller. """
+        if ns > self.Ns:
+            self.SkippedNs += ns - self.Ns
+            self.Ns = ns
+
+    def Seconds(self):
+        """ Integer seconds, like CircuitPython's time.time(). """
+        return PICO_EPOCH + self.Sync() // 1000000000
+
+def CalibrateCpuScale(calls=20000):
+    """ Estimate how much slower the RP2350 runs the firmware than this host.
+        Times the same code path as helpers.ns_sleep() for a very short delay and compares it with the overhead
+        measured on a Pico2 at 220MHz. """
+    def ns_sleep(delay):
+        start_ns = _time.monotonic_ns()
+        delay_ns = int(delay * 1e9)
+        end_ns = start_ns + delay_ns
+        while True:
+            now_ns = _time.monotonic_ns()
+            if now_ns >= end_ns: break
+            if now_ns < start_ns: break
+    host = None
+    for repeat in range(5): # Best of 5, ignore interference from other processes.
+        start = _time.perf_counter()
+        for i in range(calls): ns_sleep(1e-9)
+        elapsed = (_time.perf_counter() - start) / calls
+        if host == None or elapsed < host: host = elapsed
+    return round(PICO2_NS_SLEEP_OVERHEAD / max(host,1e-9),1)
+
+#-----------------------------------------------------------------------------------------------
+# Simulated hardware.
+#-----------------------------------------------------------------------------------------------
+
+class simpin():
+    """ A board.GPxx pin. """
+    def __init__(self,name):
+        self.Name = name
+    def __repr__(self):
+        return 'board.' + self.Name
+
+class simuart():
+    """ Receive side of a UART. Bytes arrive at the line rate of the baudrate (10 bits per byte). """
+
+    def __init__(self,clock,baudrate,size=64):
+        self.Clock = clock
+        self.BaudRate = baudrate
+        self.Size = size # Receiver buffer size.
+        self.Pending = deque() # [ready_ns,bytes] chunks still on the wire.
+        self.Buffer = bytearray() # Received bytes ready to read.
+        self.LineFreeNs = 0 # When the sender finishes its current transmission.
+        self.Overflows = 0 # Bytes lost because the receive buffer was full.
+
+    def Deliver(self,data,start=None):
+        """ Send bytes towards this receiver. Returns the virtual ns when the last byte arrives. """
+        start = self.Clock.Ns if start == None else start
+        start = max(start,self.LineFreeNs)
+        self.LineFreeNs = start + int(len(data) * 10 * 1e9 / self.BaudRate)
+        self.Pending.append((self.LineFreeNs,bytes(data)))
+        return self.LineFreeNs
+
+    def Arrive(self):
+        """ Move bytes that have arrived into the receive buffer. """
+        now = self.Clock.Ns
+        while self.Pending and self.Pending[0][0] <= now:
+            data = self.Pending.popleft()[1]
+            space = self.Size - len(self.Buffer)
+            if len(data) > space:
+                self.Overflows += len(data) - space
+                data = data[:space]
+            self.Buffer += data
+
+    def NextArrivalNs(self):
+        """ When the next chunk on the wire arrives, or None. """
+        return self.Pending[0][0] if self.Pending else None
+
+    def Waiting(self):
+        self.Arrive()
+        return len(self.Buffer)
+
+    def Read(self,nbytes=None):
+        self.Arrive()
+        if len(self.Buffer) == 0: return None # CircuitPython returns None when nothing was read.
+        if nbytes == None: nbytes = len(self.Buffer)
+        data = bytes(self.Buffer[:nbytes])
+        del self.Buffer[:nbytes]
+        return data
+
+    def Flush(self):
+        self.Arrive()
+        self.Buffer = bytearray()
+
+class simaxis():
+    """ One physical axis, its commanded trajectory and the tracking measurements. """
+
+    def __init__(self,name,stepsperrev,angle,orientation,finemicrosteps,tolerance):
+        self.Name = name
+        self.StepsPerRev = stepsperrev # Fine microsteps per revolution of the axis.
+        self.Orientation = orientation # Wiring: DIR pin high moves the axis this way.
+        self.FineMicrosteps = finemicrosteps
+        self.Position = angle * stepsperrev / 360.0 # Physical position in fine microsteps.
+        self.Tolerance = int(tolerance * 1e9) # Step deadline tolerance (ns).
+        self.Segments = [] # [start,end,startpos,endpos,stepspersecond] as sent to the controller. (host seconds)
+        self.Steps = 0 # STEP pulses received.
+        self.LastStepNs = 0 # Virtual time of the latest STEP pulse.
+        self.Locked = False # Has the axis reached the commanded position for the first time?
+        self.AcquiredNs = None
+        self.LastRounded = None # Rounded commanded position at the previous check.
+        self.Deadlines = deque() # [due_ns,position,direction] waiting for a step.
+        self.Latencies = array('q') # ns from due to STEP pulse.
+        self.Late = 0
+        self.Cancelled = 0 # Deadlines dropped when the commanded direction reversed.
+        self.ErrorCount = 0
+        self.ErrorSumSq = 0.0
+        self.ErrorMax = 0.0
+        self.ChordSumSq = 0.0
+        self.ChordMax = 0.0
+
+    def Angle(self):
+        return 360.0 * self.Position / self.StepsPerRev
+
+    def AngleToStep(self,angle):
+        """ Same as steppermotor.AngleToStep() """
+        return int(round(angle * float(self.StepsPerRev) / 360,0))
+
+    def Step(self,high,msres,now):
+        """ STEP pulse rising edge. high = DIR pin level, msres = TMC2209 microstep resolution. """
+        self.Position += (self.FineMicrosteps / msres) * (1 if high else -1) * self.Orientation
+        self.Steps += 1
+        self.LastStepNs = now
+        position = int(round(self.Position))
+        while self.Deadlines and (position - self.Deadlines[0][1]) * self.Deadlines[0][2] >= 0: # Reached a due position.
+            due = self.Deadlines.popleft()[0]
+            latency = now - due
+            self.Latencies.append(latency)
+            if latency > self.Tolerance: self.Late += 1
+
+    def Clean(self,t):
+        """ Drop segments that have expired at host time t. Same expiry rule as trajectory.Clean() """
+        while len(self.Segments) > 1 and self.Segments[0][1] < int(t): self.Segments.pop(0)
+
+    def Commanded(self,t):
+        """ Commanded position (fine microsteps, unrounded) at host time t, as trajectory.ExpectedPosition() calculates it.
+            Returns (position,stepspersecond) or (None,0) if there's no trajectory. """
+        if not self.Segments: return None,0
+        i = 0
+        while i < len(self.Segments) - 1 and self.Segments[i][1] < int(t): i += 1
+        start,end,startpos,endpos,sps = self.Segments[i]
+        if t >= end: return float(endpos),0
+        if t < start: return float(startpos),0
+        return startpos + (t - start) * sps,sps
+
+    def NextChange(self,t):
+        """ Host time of the next change of the rounded commanded position within this second, or None. """
+        p,sps = self.Commanded(t)
+        if p == None or sps == 0: return None
+        boundary = math.floor(p + 0.5) + 0.5 if sps > 0 else math.ceil(p - 0.5) - 0.5
+        d = (boundary - p) / sps
+        if d <= 0 or t + d >= math.floor(t) + 1: return None
+        return t + d
+
+    def Check(self,t,firmware,now,prevnow,truth):
+        """ Called at the top of each firmware loop iteration. t = host time, firmware = the time the firmware's clock shows,
+            now/prevnow = virtual ns. truth = true target angle.
+            The tracking error is measured at host time. Deadlines follow the firmware's clock, which only receives whole
+            seconds from the host and can lag it by up to a second. That lag is reported separately (clock_lag_ms). """
+        self.Clean(min(t,firmware))
+        p,sps = self.Commanded(t)
+        if p == None: return
+        if not self.Locked:
+            if abs(self.Position - p) > 1: return # Still acquiring.
+            self.Locked = True
+            self.AcquiredNs = now
+            self.LastRounded = int(round(self.Commanded(firmware)[0]))
+        error = self.Position - p
+        self.ErrorCount += 1
+        self.ErrorSumSq += error * error
+        self.ErrorMax = max(self.ErrorMax,abs(error))
+        if truth != None:
+            chord = self.AngleToStep(truth) - p
+            self.ChordSumSq += chord * chord
+            self.ChordMax = max(self.ChordMax,abs(chord))
+        p,sps = self.Commanded(firmware) # The position the firmware is aiming for now.
+        rounded = int(round(p))
+        if rounded != self.LastRounded: # New deadlines.
+            direction = 1 if rounded > self.LastRounded else -1
+            if self.Deadlines and self.Deadlines[-1][2] != direction: # Commanded path reversed.
+                self.Cancelled += len(self.Deadlines)
+                self.Deadlines.clear()
+            for q in range(self.LastRounded + direction,rounded + direction,direction):
+                if sps != 0: due = now - int((p - (q - 0.5 * direction)) / sps * 1e9) # When the commanded position crossed q.
+                else: due = now
+                self.Deadlines.append((min(now,max(prevnow,due)),q,direction))
+            self.LastRounded = rounded
+        while self.Deadlines and (int(round(self.Position)) - self.Deadlines[0][1]) * self.Deadlines[0][2] >= 0: # Already met by an earlier step.
+            due = self.Deadlines.popleft()[0]
+            latency = max(0,self.LastStepNs - due)
+            self.Latencies.append(latency)
+            if latency > self.Tolerance: self.Late += 1
+
+    def Report(self):
+        """ Tracking summary for the axis. """
+        arcsec = 360.0 * 3600.0 / self.StepsPerRev
+        result = {'axis':self.Name,'steps':self.Steps,'deadlines':len(self.Latencies),'late':self.Late,'cancelled':self.Cancelled}
+        result.update(Percentiles(self.Latencies,1e-6,'latency_ms_'))
+        if self.ErrorCount > 0:
+            result['error_rms_arcsec'] = round(math.sqrt(self.ErrorSumSq / self.ErrorCount) * arcsec,2)
+            result['error_max_arcsec'] = round(self.ErrorMax * arcsec,2)
+            result['chord_rms_arcsec'] = round(math.sqrt(self.ChordSumSq / self.ErrorCount) * arcsec,2)
+            result['chord_max_arcsec'] = round(self.ChordMax * arcsec,2)
+        result['acquired_s'] = None if self.AcquiredNs == None else round(self.AcquiredNs / 1e9,1)
+        return result
+
+class tmc2209bus():
+    """ TMC2209 drivers sharing the single wire UART. The controller hears its own transmission echoed back. """
+
+    def __init__(self,sim):
+        self.Sim = sim
+        self.Registers = {} # motor id : {register:value}
+        self.Reads = 0
+        self.Writes = 0
+        self.CrcErrors = 0
+
+    def Driver(self,mtr_id):
+        if mtr_id not in self.Registers:
+            self.Registers[mtr_id] = {0x00:0x000001C1,0x01:0x00000001,0x02:0,0x06:0x21000000,0x6C:0x10000053,0x6F:0}
+        return self.Registers[mtr_id]
+
+    def MicrostepResolution(self,mtr_id):
+        """ Microsteps per full step from the MRES field of CHOPCONF. """
+        mres = (self.Driver(mtr_id)[0x6C] >> 24) & 0x0F
+        return 2 ** (8 - mres)
+
+    def Crc(self,datagram):
+        """ Same CRC8-ATM as TMCStepper.compute_crc8_atm() """
+        crc = 0
+        for byte in datagram:
+            for _ in range(8):
+                if (crc >> 7) ^ (byte & 0x01): crc = ((crc << 1) ^ 0x07) & 0xFF
+                else: crc = (crc << 1) & 0xFF
+                byte = byte >> 1
+        return crc
+
+    def Write(self,uart,data):
+        """ Bytes written by the controller. """
+        uart = uart.Receiver
+        end = uart.Deliver(data) # Single wire echo.
+        if len(data) == 4 and data[0] == 0x55: # Register read request.
+            if data[3] != self.Crc(data[:3]):
+                self.CrcErrors += 1
+                return
+            mtr_id = data[1]
+            if mtr_id not in MOTOR_IDS.values(): return # Nobody at that address.
+            register = data[2] & 0x7F
+            value = self.Driver(mtr_id).get(register,0) & 0xFFFFFFFF
+            reply = [0x05,0xFF,register,(value >> 24) & 0xFF,(value >> 16) & 0xFF,(value >> 8) & 0xFF,value & 0xFF]
+            reply.append(self.Crc(reply))
+            uart.Deliver(bytes(reply),start=end)
+            self.Reads += 1
+        elif len(data) == 8 and data[0] == 0x55 and data[2] & 0x80: # Register write.
+            if data[7] != self.Crc(data[:7]):
+                self.CrcErrors += 1
+                return
+            driver = self.Driver(data[1])
+            driver[data[2] & 0x7F] = (data[3] << 24) | (data[4] << 16) | (data[5] << 8) | data[6]
+            driver[0x02] = (driver[0x02] + 1) & 0xFF # IFCNT counts successful writes.
+            self.Writes += 1
+
+class as5600device():
+    """ AS5600 magnetic rotary sensor, register level. """
+    ADDRESS = 0x36
+
+    def __init__(self,axis,gearing=4):
+        self.Axis = axis
+        self.Gearing = gearing # Sensor revolutions per axis revolution.
+        self.Registers = bytearray(256)
+        self.Registers[0x0B] = 0x20 # STATUS: Magnet detected.
+        self.Registers[0x1A] = 0x80 # AGC
+        self.Registers[0x1B],self.Registers[0x1C] = 0x06,0x00 # MAGNITUDE
+        self.Pointer = 0
+
+    def Refresh(self):
+        raw = int(self.Axis.Angle() * self.Gearing * 4096 / 360.0) % 4096
+        self.Registers[0x0C],self.Registers[0x0D] = raw >> 8,raw & 0xFF # RAW ANGLE
+        self.Registers[0x0E],self.Registers[0x0F] = raw >> 8,raw & 0xFF # ANGLE
+
+    def Write(self,data):
+        self.Pointer = data[0]
+        for i,b in enumerate(data[1:]): self.Registers[(self.Pointer + i) & 0xFF] = b
+
+    def ReadInto(self,buffer):
+        self.Refresh()
+        for i in range(len(buffer)): buffer[i] = self.Registers[(self.Pointer + i) & 0xFF]
+
+class lis3dhdevice():
+    """ LIS3DH accelerometer mounted on the altitude axis. """
+    ADDRESS = 0x18
+
+    def __init__(self,axis,noise=0.02):
+        self.Axis = axis
+        self.Noise = noise # m/s^2 standard deviation.
+        self.Registers = bytearray(256)
+        self.Registers[0x0F] = 0x33 # WHO_AM_I
+        self.Registers[0x20] = 0x77 # CTRL_REG1: 400Hz, all axes.
+        self.Random = random.Random(1)
+
+    def Acceleration(self):
+        a = math.radians(self.Axis.Angle())
+        g = 9.80665
+        return (self.Random.gauss(0,self.Noise),g * math.cos(a) + self.Random.gauss(0,self.Noise),-g * math.sin(a) + self.Random.gauss(0,self.Noise))
+
+#-----------------------------------------------------------------------------------------------
+# The RPi end of the serial link.
+#-----------------------------------------------------------------------------------------------
+
+class simhost():
+    """ Scripted host. Configures the motors then streams trajectory segments for a star, the way pilomar.py does. """
+
+    def __init__(self,sim,start,hours,latitude=52.0,declination=20.0,segment=60,lookahead=180,tracemove=False,binary=False,slews=None,speed=None):
+        """ slews = [(axis name, angle)] GOTO moves to perform one at a time instead of streaming trajectories.
+            speed = (FastTime, SlowTime, TimeDelta) for the configure message. """
+        self.Sim = sim
+        self.Start = start # Host unix time at power on.
+        self.End = start + int(hours * 3600) # Stop streaming trajectories here.
+        self.Latitude = latitude
+        self.Declination = declination
+        self.HourAngle0 = -hours * 15.0 / 2 # Target crosses the meridian in the middle of the night.
+        self.Segment = segment # Seconds per trajectory segment.
+        self.LookAhead = lookahead # Keep the controller's trajectory this far ahead.
+        self.TraceMove = tracemove
+        self.Binary = binary # Offer binary trajectory frames?
+        self.FramesAccepted = False # Has the controller accepted them?
+        self.FrameSequence = 0
+        self.FramesOut = 0
+        self.BytesOut = 0
+        self.Uart = None # simuart, the controller's receiver.
+        self.Queue = deque() # [due_ns,line] scripted messages.
+        self.Counter = 0 # Message sequence number.
+        self.ValidUntil = {} # Per axis, end of the last segment sent.
+        self.NextPollNs = 0
+        self.Started = False
+        self.Stopping = False
+        self.Received = bytearray()
+        self.LinesIn = {} # Count of received lines by type.
+        self.LinesOut = 0
+        self.Trace = False # Print controller output?
+        self.Slews = None if slews == None else deque(slews) # GOTO moves still to perform.
+        self.Speed = speed if speed != None else (0.001,0.05,0.003)
+        self.Slewing = None # (axis name, from angle, to angle, start ns) of the GOTO in progress.
+        self.SlewRecords = [] # (axis name, from angle, to angle, seconds) completed GOTO moves.
+
+    def Now(self):
+        return self.Start + self.Sim.Clock.Ns / 1e9
+
+    def TimeString(self,t):
+        return _time.strftime('%Y%m%d%H%M%S',_time.gmtime(int(t)))
+
+    def Checksum(self,line):
+        """ Same checksum as uarthost.CalculateChecksum() """
+        a = 0
+        for i in range(len(line)):
+            if i % 2 == 0: a += ord(line[i])
+            else: a += ord(line[i]) * 3
+        return str(hex(a % 65536))[2:]
+
+    def Send(self,line):
+        """ Transmit a line to the controller. """
+        self.Counter += 1
+        line = line + ' [' + str(self.Counter) + ']'
+        data = (line + '|' + self.Checksum(line) + '\n').encode('utf-8')
+        self.Uart.Deliver(data)
+        self.LinesOut += 1
+        self.BytesOut += len(data)
+        self.Sim.Activity = True
+
+    def AzAlt(self,t):
+        """ True azimuth and altitude of the target at host time t. """
+        ha = math.radians(self.HourAngle0 + 15.041 * (t - self.Start) / 3600.0)
+        dec = math.radians(self.Declination)
+        lat = math.radians(self.Latitude)
+        alt = math.asin(math.sin(lat) * math.sin(dec) + math.cos(lat) * math.cos(dec) * math.cos(ha))
+        az = math.atan2(-math.cos(dec) * math.sin(ha),math.sin(dec) * math.cos(lat) - math.cos(dec) * math.sin(lat) * math.cos(ha))
+        return math.degrees(az) % 360.0,math.degrees(alt)
+
+    def TrueAngle(self,name,t):
+        az,alt = self.AzAlt(t)
+        return az if name == 'azimuth' else alt
+
+    def ConfigureLine(self,axis,now):
+        """ configure tmc2209 message for an axis. (See steppermotor.ConfigureTmc2209) """
+        minangle,maxangle,rest = (0.0,360.0,180.0) if axis.Name == 'azimuth' else (0.0,90.0,0.0)
+        fields = ['configure','tmc2209',self.TimeString(now),axis.Name,str(axis.Angle()),str(minangle),str(maxangle),'0.0',str(axis.Orientation),
+                  str(self.Speed[0]),str(self.Speed[1]),str(self.Speed[2]),'10','n','n','none','240','400',str(axis.FineMicrosteps),'1','1.0','0.75','0.5','10',str(rest),
+                  'y' if self.Slews != None else 'n','y' if self.TraceMove else 'n'] # SlewMotor when performing GOTO moves.
+        return ' '.join(fields)
+
+    def Poll(self):
+        """ Called at the top of every firmware loop iteration. """
+        now = self.Sim.Clock.Ns
+        while self.Queue and self.Queue[0][0] <= now:
+            self.Send(self.Queue.popleft()[1])
+        if now < self.NextPollNs: return
+        self.NextPollNs = now + 1000000000
+        t = self.Now()
+        if not self.Started: # Power on sequence.
+            self.Started = True
+            self.Send('rpi started')
+            self.Send('set time ' + self.TimeString(t))
+            if self.Binary: self.Send('binary offer ' + str(pilomarframing.FRAME_VERSION))
+            for axis in self.Sim.Axes.values():
+                self.Send(self.ConfigureLine(axis,t))
+                self.ValidUntil[axis.Name] = int(t) + 5 # First segment starts a few seconds from now.
+            return
+        if self.Slews != None: # Performing GOTO moves instead of tracking.
+            if self.Slewing == None and self.Slews and t >= self.Start + 5: # Configuration has been processed.
+                name,angle = self.Slews.popleft()
+                self.Slewing = (name,self.Sim.Axes[name].Angle(),angle,now)
+                self.Send(' '.join(['goto',self.TimeString(t),name,str(angle)]))
+            if self.Slewing != None or self.Slews: return
+        if t >= self.End or (self.Slews != None and self.Slewing == None):
+            if not self.Stopping:
+                self.Stopping = True
+                self.Queue.append((now + 5000000000,'exit'))
+            return
+        batch = [] # Segments for binary frames.
+        for axis in self.Sim.Axes.values(): # Extend the trajectories.
+            while self.ValidUntil[axis.Name] < t + self.LookAhead and self.ValidUntil[axis.Name] < self.End:
+                start = max(self.ValidUntil[axis.Name],int(t))
+                end = start + self.Segment
+                startangle = self.TrueAngle(axis.Name,start)
+                endangle = self.TrueAngle(axis.Name,end)
+                startpos,endpos = axis.AngleToStep(startangle),axis.AngleToStep(endangle)
+                if self.FramesAccepted: batch.append((axis.Name,start,startangle,end,endangle,startpos,endpos))
+                else: self.Send(' '.join(['trajectory',self.TimeString(t),axis.Name,self.TimeString(start),str(startangle),self.TimeString(end),str(endangle),str(startpos),str(endpos)]))
+                axis.Segments.append((start,end,startpos,endpos,(endpos - startpos) / (end - start)))
+                self.ValidUntil[axis.Name] = end
+        for sequence,count,frame in pilomarframing.EncodeTrajectoryFrames(batch,self.FrameSequence,16):
+            self.Uart.Deliver(frame)
+            self.FrameSequence = sequence + 1
+            self.FramesOut += 1
+            self.BytesOut += len(frame)
+            self.Sim.Activity = True
+
+    def NextEventNs(self):
+        result = self.NextPollNs
+        if self.Queue: result = min(result,self.Queue[0][0])
+        return result
+
+    def Write(self,uart,data):
+        """ Bytes written by the controller. """
+        self.Receive(data)
+
+    def Receive(self,data):
+        """ Bytes from the controller. """
+        self.Received += data
+        while b'\n' in self.Received:
+            i = self.Received.index(b'\n')
+            line = self.Received[:i].decode('utf-8','replace')
+            del self.Received[:i + 1]
+            line = line.split('|')[0]
+            if self.Trace: print('pico>',line)
+            words = line.split(' ')
+            key = words[0] if words[0] in ('log','#') else ' '.join(words[:2])
+            if key == 'binary accept': self.FramesAccepted = True
+            if key == 'motor status' and self.Slewing != None and len(words) > 13 and words[3] == self.Slewing[0] and words[13] == 'gte': # GOTO complete.
+                name,fromangle,toangle,start = self.Slewing
+                self.SlewRecords.append((name,fromangle,toangle,(self.Sim.Clock.Ns - start) / 1e9))
+                self.Slewing = None
+            self.LinesIn[key] = self.LinesIn.get(key,0) + 1
+
+#-----------------------------------------------------------------------------------------------
+# Stand-in CircuitPython modules.
+#-----------------------------------------------------------------------------------------------
+
+def BuildModules(sim):
+    """ Create the stand-in modules for a simulator instance. Returns {name:module} """
+    clock = sim.Clock
+    modules = {}
+
+    def module(name,**attributes):
+        m = types.ModuleType(name)
+        for key,value in attributes.items(): setattr(m,key,value)
+        modules[name] = m
+        return m
+
+    # time: Virtual clock. CircuitPython has no timezones, localtime is UTC.
+    t = module('time',monotonic_ns=clock.Sync,monotonic=lambda: clock.Sync() / 1e9,time=clock.Seconds,sleep=clock.Sleep,
+               localtime=lambda secs=None: _time.gmtime(clock.Seconds() if secs == None else secs),
+               mktime=lambda tt: calendar.timegm(tuple(tt)[:6]),struct_time=_time.struct_time)
+    t.__getattr__ = lambda name: getattr(_time,name)
+
+    # gc: RP2350 heap figures.
+    g = module('gc',collect=sim.Collect,mem_free=lambda: sim.MemFree,mem_alloc=lambda: sim.MemAlloc,enable=lambda: None,disable=lambda: None)
+    g.__getattr__ = lambda name: getattr(_gc,name)
+
+    pins = {}
+    for i in range(30): pins['GP' + str(i)] = simpin('GP' + str(i))
+    for name in ('LED','A0','A1','A2','A3','SMPS_MODE','VBUS_SENSE','VOLTAGE_MONITOR'): pins[name] = simpin(name)
+    module('board',board_id='raspberry_pi_pico2',**pins)
+
+    class Direction():
+        INPUT = 'INPUT'
+        OUTPUT = 'OUTPUT'
+    class Pull():
+        UP = 'UP'
+        DOWN = 'DOWN'
+    class DriveMode():
+        PUSH_PULL = 'PUSH_PULL'
+        OPEN_DRAIN = 'OPEN_DRAIN'
+    class DigitalInOut():
+        def __init__(self,pin):
+            self.Pin = pin
+            self.Name = pin.Name
+            self.direction = Direction.INPUT
+            self.pull = None
+            self._value = False
+            sim.Pins[self.Name] = self
+        @property
+        def value(self):
+            if self.direction == Direction.OUTPUT: return self._value
+            return sim.ReadPin(self)
+        @value.setter
+        def value(self,value):
+            if value != self._value:
+                self._value = value
+                if value and self.Name in STEP_PINS: sim.StepEdge(self.Name)
+        def switch_to_output(self,value=False,drive_mode=None):
+            self.direction = Direction.OUTPUT
+            self.value = value
+        def switch_to_input(self,pull=None):
+            self.direction = Direction.INPUT
+            self.pull = pull
+        def deinit(self):
+            pass
+    module('digitalio',Direction=Direction,Pull=Pull,DriveMode=DriveMode,DigitalInOut=DigitalInOut)
+
+    class UART():
+        def __init__(self,tx,rx,baudrate=9600,receiver_buffer_size=64,timeout=1,**kwargs):
+            self.baudrate = baudrate
+            self.Receiver = simuart(clock,baudrate,receiver_buffer_size)
+            self.Device = sim.AttachUart(tx.Name,self)
+        @property
+        def in_waiting(self):
+            return self.Receiver.Waiting()
+        def read(self,nbytes=None):
+            data = self.Receiver.Read(nbytes)
+            if data: sim.Activity = True
+            return data
+        def readline(self):
+            return self.read()
+        def write(self,buf):
+            sim.Activity = True
+            self.Device.Write(self,bytes(buf))
+            return len(buf)
+        def reset_input_buffer(self):
+            self.Receiver.Flush()
+        def deinit(self):
+            pass
+        def __repr__(self):
+            return '<simulated UART ' + str(self.baudrate) + ' baud>'
+    class I2C():
+        def __init__(self,scl,sda,frequency=100000,timeout=255):
+            self.Devices = sim.I2CDevices
+        def try_lock(self):
+            return True
+        def unlock(self):
+            pass
+        def scan(self):
+            return sorted(self.Devices.keys())
+        def deinit(self):
+            pass
+    module('busio',UART=UART,I2C=I2C)
+
+    class AnalogIn():
+        def __init__(self,pin):
+            self.Pin = pin
+        @property
+        def value(self):
+            return sim.VMot
+        def deinit(self):
+            pass
+    module('analogio',AnalogIn=AnalogIn)
+
+    cpu = types.SimpleNamespace(frequency=150000000,reset_reason='microcontroller.ResetReason.POWER_ON',voltage=3.3,temperature=27.0)
+    module('microcontroller',cpu=cpu,cpus=[cpu])
+    module('supervisor',runtime=types.SimpleNamespace(autoreload=True))
+    module('micropython',const=lambda x: x)
+
+    # adafruit_bus_device.i2c_device is a compiled .mpy in lib/. Same interface here.
+    class I2CDevice():
+        def __init__(self,i2c,device_address,probe=True):
+            if device_address not in i2c.Devices: raise ValueError('No I2C device at address: 0x%x' % device_address)
+            self.Device = i2c.Devices[device_address]
+        def __enter__(self):
+            return self
+        def __exit__(self,*args):
+            return False
+        def write(self,buf,start=0,end=None):
+            self.Device.Write(bytes(buf[start:end]))
+        def readinto(self,buf,start=0,end=None):
+            view = bytearray(len(buf[start:end]))
+            self.Device.ReadInto(view)
+            buf[start:start + len(view)] = view
+        def write_then_readinto(self,out_buffer,in_buffer,out_start=0,out_end=None,in_start=0,in_end=None):
+            self.write(out_buffer,out_start,out_end)
+            self.readinto(in_buffer,in_start,in_end)
+    i2c_device = module('adafruit_bus_device.i2c_device',I2CDevice=I2CDevice)
+    module('adafruit_bus_device',i2c_device=i2c_device)
+
+    # adafruit_lis3dh is a compiled .mpy in lib/. Driver level stand-in.
+    class LIS3DH_I2C():
+        def __init__(self,i2c,address=0x18,int1=None,int2=None):
+            if address not in i2c.Devices: raise ValueError('No I2C device at address: 0x%x' % address)
+            self.Device = i2c.Devices[address]
+        @property
+        def acceleration(self):
+            return self.Device.Acceleration()
+        def _read_register(self,register,length=1):
+            return bytearray(self.Device.Registers[register:register + length])
+        def _write_register_byte(self,register,value):
+            self.Device.Registers[register] = value & 0xFF
+        def read_adc_raw(self,adc):
+            return 0
+    module('adafruit_lis3dh',LIS3DH_I2C=LIS3DH_I2C)
+    return modules
+
+#-----------------------------------------------------------------------------------------------
+# Measurement helpers.
+#-----------------------------------------------------------------------------------------------
+
+def Percentiles(values,scale=1.0,prefix=''):
+    """ p50/p99/max of a list of numbers, scaled. """
+    if len(values) == 0: return {}
+    ordered = sorted(values)
+    pick = lambda f: ordered[min(len(ordered) - 1,int(f * len(ordered)))]
+    return {prefix + 'p50':round(pick(0.5) * scale,3),prefix + 'p99':round(pick(0.99) * scale,3),prefix + 'max':round(ordered[-1] * scale,3)}
+
+class probestats():
+    """ Virtual time spent in one firmware function. """
+    def __init__(self,name):
+        self.Name = name
+        self.Durations = array('q')
+    def Report(self):
+        result = {'calls':len(self.Durations),'total_s':round(sum(self.Durations) / 1e9,2)}
+        result.update(Percentiles(self.Durations,1e-6,'ms_'))
+        return result
+
+class consolesink():
+    """ The controller's USB serial console. Counts what the firmware prints. """
+    def __init__(self,echo=False):
+        self.Chars = 0
+        self.Echo = echo
+    def write(self,text):
+        self.Chars += len(text)
+        if self.Echo: sys.__stdout__.write(text)
+        return len(text)
+    def flush(self):
+        pass
+
+#-----------------------------------------------------------------------------------------------
+# The simulator.
+#-----------------------------------------------------------------------------------------------
+
+class pico2simulator():
+    """ Runs code.py against simulated hardware and a scripted host. """
+
+    def __init__(self,hours=8.0,cpuscale=None,tolerance=0.1,finemicrosteps=4,start=None,seed=1,tracemove=False,binary=False,firmware=FIRMWARE_FOLDER,slews=None,speed=None):
+        """ hours = Length of the simulated night.
+            cpuscale = RP2350 slowdown relative to this host. None calibrates it.
+            tolerance = Seconds a step may follow its commanded time before it counts as late.
+            finemicrosteps = Microstepping used for tracking.
+            start = Host unix time at power on. (Default 2025-01-15 20:00 UTC)
+            seed = Random seed for loop phase jitter.
+            tracemove = Ask the controller for TraceMove log messages.
+            binary = Host sends trajectories in binary frames once the controller accepts them.
+            firmware = Folder containing code.py.
+            slews, speed = GOTO moves to perform instead of tracking, and the speed settings. (See simhost) """
+        if cpuscale == None: cpuscale = CalibrateCpuScale()
+        self.Hours = hours
+        self.Firmware = firmware
+        self.Clock = virtualclock(cpuscale,limit=hours * 3600 + 600)
+        self.Random = random.Random(seed)
+        self.Axes = {'azimuth':simaxis('azimuth',400 * finemicrosteps * 240,180.0,-1,finemicrosteps,tolerance),
+                     'altitude':simaxis('altitude',400 * finemicrosteps * 240,0.0,-1,finemicrosteps,tolerance)}
+        if start == None: start = calendar.timegm((2025,1,15,20,0,0))
+        self.Host = simhost(self,start,hours,tracemove=tracemove,binary=binary,slews=slews,speed=speed)
+        self.Tmc = tmc2209bus(self)
+        self.I2CDevices = {as5600device.ADDRESS:as5600device(self.Axes['azimuth']),lis3dhdevice.ADDRESS:lis3dhdevice(self.Axes['altitude'])}
+        self.Pins = {} # name : DigitalInOut
+        self.Uarts = {} # tx pin name : UART
+        self.VMot = 23333 # ADC reading with 12.75V on the motors.
+        self.MemFree = 300000
+        self.MemAlloc = 120000
+        self.Collections = 0
+        self.Namespace = None # code.py globals.
+        self.Activity = False # Something happened during this loop iteration.
+        self.Iterations = 0
+        self.IterationStartNs = None
+        self.LoopTimes = array('q') # Virtual ns per main loop iteration.
+        self.ClockLags = array('q') # ns the firmware clock is behind the host, sampled every loop iteration.
+        self.IdleLoopNs = 0 # Typical duration of an idle iteration, used for phase jitter.
+        self.Probes = {}
+        self.Console = consolesink()
+        self.RealSeconds = None
+        self.Error = None
+
+    # --- Hardware callbacks ---
+
+    def AttachUart(self,txpin,uart):
+        """ Connect a busio.UART to its simulated device. """
+        self.Uarts[txpin] = uart
+        if txpin == 'GP0':
+            self.Host.Uart = uart.Receiver
+            return self.Host
+        if txpin == 'GP8': return self.Tmc
+        raise ValueError('Nothing connected to UART on ' + txpin)
+
+    def ReadPin(self,pin):
+        if pin.Name == LOOP_PIN and 'MemMgr' in self.Namespace: self.LoopMarker() # Only counts once code.py reaches its main loop.
+        if pin.Name in INPUT_LEVELS: return INPUT_LEVELS[pin.Name]
+        return pin.pull == 'UP'
+
+    def StepEdge(self,name):
+        """ STEP pin rising edge. """
+        now = self.Clock.Sync()
+        enable = self.Pins.get(ENABLE_PIN)
+        if enable != None and enable._value: return # ENABLE is active low, motors are off.
+        axis = self.Axes[STEP_PINS[name]]
+        direction = self.Pins.get(DIRECTION_PIN)
+        axis.Step(direction != None and direction._value,self.Tmc.MicrostepResolution(MOTOR_IDS[axis.Name]),now)
+        self.Activity = True
+        self.Clock.Resume()
+
+    def Collect(self):
+        self.Collections += 1
+
+    # --- Main loop instrumentation ---
+
+    def Probe(self,name,function):
+        """ Wrap a firmware function to measure the virtual time spent in it. """
+        stats = self.Probes.setdefault(name,probestats(name))
+        clock = self.Clock
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            start = clock.Sync()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                stats.Durations.append(clock.Sync() - start)
+                clock.Resume()
+        return wrapper
+
+    def InstallProbes(self):
+        """ Called once code.py has defined everything and entered its main loop. """
+        ns = self.Namespace
+        ns['ProcessInput'] = self.Probe('ProcessInput',ns['ProcessInput'])
+        ns['ProcessFrame'] = self.Probe('ProcessFrame',ns['ProcessFrame'])
+        motor = ns['steppermotor']
+        for name in ('StepMove','MoveMotorFast','AddTrajectoryPoint'):
+            setattr(motor,name,self.Probe(name,getattr(motor,name)))
+        host = sys.modules['pilomar.uarthost'].uarthost
+        for name in ('BufferInput','WritePoll'):
+            setattr(host,name,self.Probe('uarthost.' + name,getattr(host,name)))
+
+    def LoopMarker(self):
+        """ Top of each code.py main loop iteration. """
+        clock = self.Clock
+        now = clock.Sync()
+        if self.Iterations == 0: self.InstallProbes()
+        else:
+            duration = now - self.IterationStartNs
+            self.LoopTimes.append(duration)
+            if not self.Activity: self.IdleLoopNs = duration
+        self.Iterations += 1
+        self.Host.Poll()
+        t = self.Host.Now()
+        firmware = self.FirmwareTime(now)
+        if getattr(self.Namespace.get('Clock'),'ClockSynchronised',False): self.ClockLags.append(int((t - firmware) * 1e9))
+        for axis in self.Axes.values():
+            axis.Check(t,firmware,now,self.IterationStartNs or now,self.Host.TrueAngle(axis.Name,t) if axis.Locked else None)
+        if not self.Activity and self.Host.Uart != None and self.Host.Uart.Waiting() == 0:
+            clock.SkipTo(self.NextEventNs(now,firmware) + int(self.Random.random() * self.IdleLoopNs))
+        self.Activity = False
+        self.IterationStartNs = clock.Ns
+        clock.Resume()
+
+    def FirmwareTime(self,now):
+        """ The time trajectory.ExpectedPosition() uses at virtual time now. (helpers.clock.NowDecimal) """
+        clock = self.Namespace.get('Clock')
+        if clock == None: return self.Host.Now()
+        seconds = PICO_EPOCH + now // 1000000000 + clock.TimeDelta
+        if seconds != clock.CurrTime: return float(seconds) # NowDecimal() restarts the fraction at its next call.
+        return clock.CurrTime + (now - clock.FirstNS) / 1e9
+
+    def NextEventNs(self,now,t):
+        """ The next time anything can happen for an idle controller. t = firmware clock time. """
+        candidates = [self.Host.NextEventNs(),(now // 1000000000 + 1) * 1000000000] # Second boundaries: timers and trajectory decimals.
+        for axis in self.Axes.values():
+            change = axis.NextChange(t)
+            if change != None: candidates.append(now + int((change - t) * 1e9))
+        for uart in self.Uarts.values():
+            arrival = uart.Receiver.NextArrivalNs()
+            if arrival != None: candidates.append(arrival)
+        rpi = self.Namespace.get('RPi')
+        if rpi != None and len(rpi.WriteQueue) > 0: candidates.append((rpi.LastTxms + rpi.WriteGapms) * 1000000) # Next write slot.
+        return min(candidates)
+
+    # --- Running ---
+
+    def Install(self):
+        """ Put the stand-in modules and the firmware folder in place. Firmware modules imported after this use the simulated hardware. """
+        self.Saved = {name:sys.modules.get(name) for name in ('time','gc')}
+        self.StandIns = BuildModules(self)
+        for name in list(sys.modules):
+            if name.split('.')[0] in FIRMWARE_MODULES: del sys.modules[name]
+        sys.modules.update(self.StandIns)
+        sys.path.insert(0,self.Firmware)
+
+    def Uninstall(self):
+        """ Restore the host's own modules. """
+        sys.path.remove(self.Firmware)
+        for name in list(sys.modules):
+            if name in self.StandIns or name.split('.')[0] in FIRMWARE_MODULES: del sys.modules[name]
+        for name,m in self.Saved.items():
+            if m != None: sys.modules[name] = m
+
+    def Run(self):
+        """ Run code.py until the host sends 'exit' or the time limit is hit. """
+        self.Install()
+        cwd = os.getcwd()
+        folder = tempfile.mkdtemp(prefix='pico2sim_')
+        with open(os.path.join(folder,'boot_out.txt'),'w') as f: f.write(BOOT_OUT)
+        os.chdir(folder)
+        filename = os.path.join(self.Firmware,'code.py')
+        with open(filename) as f: source = compile(f.read(),filename,'exec')
+        self.Namespace = {'__name__':'__main__','__file__':filename}
+        stdout = sys.stdout
+        sys.stdout = self.Console
+        start = _time.perf_counter()
+        self.Clock.Resume()
+        try:
+            exec(source,self.Namespace)
+        except simulationend as e:
+            self.Error = str(e)
+        finally:
+            self.RealSeconds = _time.perf_counter() - start
+            sys.stdout = stdout
+            os.chdir(cwd)
+            os.remove(os.path.join(folder,'boot_out.txt'))
+            os.rmdir(folder)
+            self.Uninstall()
+        return self.Report()
+
+    def Report(self):
+        """ Summary of the run. """
+        clock = self.Clock
+        ns = self.Namespace
+        rpi = ns.get('RPi')
+        result = {'virtual_s':round(clock.Ns / 1e9,1),'real_s':round(self.RealSeconds,1),'speedup':round(clock.Ns / 1e9 / max(self.RealSeconds,1e-9)),
+                  'cpuscale':clock.CpuScale,'cpu_s':round(clock.CpuNs / 1e9,1),'sleep_s':round(clock.SleptNs / 1e9,1),'idle_s':round(clock.SkippedNs / 1e9,1),
+                  'iterations':self.Iterations,'stopped':self.Error or 'exit'}
+        result['loop'] = Percentiles(self.LoopTimes,1e-6,'ms_')
+        result['loop']['over_100ms'] = sum(1 for d in self.LoopTimes if d > 100000000)
+        result['clock_lag'] = Percentiles(self.ClockLags,1e-6,'ms_')
+        result['functions'] = {name:probe.Report() for name,probe in self.Probes.items()}
+        result['axes'] = {name:axis.Report() for name,axis in self.Axes.items()}
+        result['uart'] = {'host_lines_sent':self.Host.LinesOut,'host_frames_sent':self.Host.FramesOut,'host_bytes_sent':self.Host.BytesOut,'lines_received':self.Host.LinesIn,'console_chars':self.Console.Chars}
+        if rpi != None:
+            result['uart'].update({'write_drops':rpi.WriteDrops,'read_drops':rpi.ReadDrops,'rx_errors':rpi.PicoRxErrors,'queued':len(rpi.WriteQueue)})
+        result['tmc2209'] = {'reads':self.Tmc.Reads,'writes':self.Tmc.Writes,'crc_errors':self.Tmc.CrcErrors}
+        counter = ns.get('ExceptionCounter')
+        result['exceptions'] = None if counter == None else counter.Count
+        return result
+
+def PrintReport(result):
+    """ Readable version of pico2simulator.Report() """
+    print('Simulated',result['virtual_s'],'s in',result['real_s'],'s real (x' + str(result['speedup']) + '), cpuscale',result['cpuscale'],'stopped by',result['stopped'])
+    print('  virtual time: cpu',result['cpu_s'],'s, sleep',result['sleep_s'],'s, idle fast-forward',result['idle_s'],'s')
+    print('  main loop:',result['iterations'],'iterations',result['loop'])
+    print('  firmware clock behind host:',result['clock_lag'],'(Step deadlines follow the firmware clock.)')
+    for name,stats in result['functions'].items(): print('  ' + name.ljust(26),stats)
+    for name,stats in result['axes'].items(): print('  ' + name.ljust(26),stats)
+    print('  uart',result['uart'])
+    print('  tmc2209',result['tmc2209'],'exceptions',result['exceptions'])
+
+#-----------------------------------------------------------------------------------------------
+# Trajectory segment storage benchmark.
+#-----------------------------------------------------------------------------------------------
+
+class nulllog():
+    """ Discards log messages. """
+    def Log(self,*args,**kwargs):
+        pass
+
+def LegacyTrajectory(module):
+    """ The list based trajectory class that the segment ring replaced. Used as the reference for behaviour and allocations.
+        module = The firmware's pilomar.trajectory module. """
+    class legacytrajectory(module.trajectory):
+        def __init__(self,name,logfile=None,clock=None):
+            module.trajectory.__init__(self,name,logfile=logfile,clock=clock,capacity=1)
+            self.TrajectoryList = []
+        def Length(self):
+            return len(self.TrajectoryList)
+        def First(self):
+            return self.TrajectoryList[0]
+        def Last(self):
+            return self.TrajectoryList[-1]
+        def Clean(self):
+            while len(self.TrajectoryList) > 0 and self.TrajectoryList[0].EndTime < self.Clock.Now():
+                self.LogFile.Log('trajectory.Clean: Expired (', self.MotorName, self.TrajectoryList[0].Printable(), ')')
+                _ = self.TrajectoryList.pop(0)
+            self.Validate()
+        def Add(self,line):
+            result = False
+            self.Clean()
+            lineitems = line.split(' ')
+            starttime = module.TimeStringToInt(lineitems[3])
+            try:
+                while len(self.TrajectoryList) > 0 and starttime <= self.TrajectoryList[-1].StartTime:
+                    self.TrajectoryList = self.TrajectoryList[:-1]
+                point = module.trajectorypoint(self.Clock) # A new object per segment, parsed from its own split of the line.
+                point.Load(line.split(' '))
+                self.TrajectoryList.append(point)
+                result = True
+            except Exception as e:
+                self.LogFile.Log('trajectory.Add(', self.MotorName ,'): ' + str(line) + ': Failed to create new trajectory point: ' + str(e))
+            self.Validate()
+            return result
+        def Clear(self):
+            self.TrajectoryList = []
+            self.Validate()
+        def ValidUntil(self):
+            return self.TrajectoryList[-1].EndTime if self.TrajectoryList else self.Clock.Now()
+        def EndAngle(self):
+            return self.TrajectoryList[-1].EndAngle if self.TrajectoryList else None
+        def ExpectedPosition(self):
+            self.Clean()
+            return self.TrajectoryList[0].ExpectedPosition() if self.TrajectoryList else None
+    return legacytrajectory
+
+def BenchmarkTrajectory(segments=5000,seed=1):
+    """ Compare the firmware's segment ring with the list based trajectory it replaced.
+        Both receive the same stream of segments, including resends, duplicates and out of order segments,
+        and must agree on the result of Add(), length, validity, end angle and expected position after every message.
+        Then tracemalloc measures the heap used by each trajectory.Add() call while following a trajectory:
+          transient = peak bytes allocated during the call, above what was in use before it.
+          retained = growth of the heap over all the calls. """
+    import tracemalloc
+    sim = pico2simulator(hours=1,cpuscale=1.0)
+    sim.Clock.LimitNs = None # Run for as long as the benchmark needs.
+    sim.Install()
+    try:
+        helpers = __import__('pilomar.helpers',fromlist=['clock'])
+        module = __import__('pilomar.trajectory',fromlist=['trajectory'])
+        clock = helpers.clock(nulllog(),None)
+        clock.SetTimeFromInt(calendar.timegm((2025,1,15,20,0,0)))
+        ring = module.trajectory('azimuth',logfile=nulllog(),clock=clock)
+        legacy = LegacyTrajectory(module)('azimuth',logfile=nulllog(),clock=clock)
+        rng = random.Random(seed)
+
+        def message(start):
+            """ A trajectory message for a 60 second segment. """
+            now = clock.Now()
+            angle = 180.0 + (start % 86400) * 0.004
+            return ' '.join(['trajectory',helpers.IntToTimeString(now),'azimuth',helpers.IntToTimeString(start),str(angle),
+                             helpers.IntToTimeString(start + 60),str(angle + 0.24),str(int(angle * 1066.67)),str(int((angle + 0.24) * 1066.67))])
+
+        for i in range(segments):
+            now = clock.Now()
+            validuntil = ring.ValidUntil()
+            choice = rng.random()
+            if choice < 0.1: start = validuntil - 60 # Resend of the latest segment.
+            elif choice < 0.15: start = validuntil - 60 * rng.randint(2,3) # Out of order, replaces the tail.
+            elif choice < 0.17: start = validuntil + 60 # Gap in the trajectory.
+            else: start = max(validuntil,now) # The next segment.
+            line = message(max(start,now - 30))
+            a = [ring.Add(line)]
+            b = [legacy.Add(line)]
+            sim.Clock.Sleep(rng.random() * 2)
+            for t,result in ((ring,a),(legacy,b)):
+                result += [t.ExpectedPosition() != None,t.Length(),t.Valid,t.ValidUntil(),t.EndAngle()]
+                if t.Length() > 0: result.append(t.First().ExpectedPosition(clock.Now(),0.5)) # Fixed time, NowDecimal() depends on CPU time.
+            if a != b: raise AssertionError('Segment ring differs from list trajectory after ' + line + ': ' + str(a) + ' != ' + str(b))
+            if ring.ValidUntil() - clock.Now() > 180: sim.Clock.Sleep(rng.randint(30,120)) # The host keeps a few minutes queued.
+        print('Behaviour: segment ring matches the list trajectory for',segments,'messages.')
+
+        for name,t in (('list',legacy),('ring',ring)):
+            t.Clear()
+            transient = 0
+            adds = 1000
+            tracemalloc.start()
+            start = None
+            for i in range(adds):
+                if t.ValidUntil() - clock.Now() > 180: sim.Clock.Sleep(60) # Segments expire as they are replaced.
+                line = message(max(t.ValidUntil(),clock.Now()))
+                _gc.collect()
+                before = tracemalloc.get_traced_memory()[0]
+                if start == None: start = before
+                tracemalloc.reset_peak()
+                t.Add(line)
+                transient += tracemalloc.get_traced_memory()[1] - before
+                del line
+            _gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - start
+            tracemalloc.stop()
+            print(name.ljust(5),'per added segment: transient',round(transient / adds),'bytes, retained',round(retained / adds,1),'bytes, segments held',t.Length())
+    finally:
+        sim.Uninstall()
+
+#-----------------------------------------------------------------------------------------------
+# Slew time predictions.
+#-----------------------------------------------------------------------------------------------
+
+SLEW_CPUSCALE = 100.0 # RP2350 slowdown used when calibrating the pilomarslew overheads. (CalibrateCpuScale() gives 90-100 on an idle host.)
+
+def CheckSlews(speedname='Medium',cpuscale=SLEW_CPUSCALE,seed=1,rounds=3):
+    """ Run a series of GOTO moves through the firmware and compare the durations with src/pilomarslew.py.
+        The simulated time runs from the goto message arriving to the 'gte' motor status, so the RPi latency is excluded.
+        cpuscale is fixed because the firmware overheads in pilomarslew were measured at SLEW_CPUSCALE. The calibrated
+        value can vary by a third between runs on a busy host, which would hide the per pulse cost being checked.
+        The moves are simulated 'rounds' times and the median duration of each is compared, host interference
+        during one run can stretch the firmware's time by 20%. """
+    pilomarslew = _loadframing('pilomarslew')
+    speed = pilomarslew.SPEEDLIST[speedname]
+    rng = random.Random(seed)
+    slews = []
+    angles = {'azimuth':180.0,'altitude':0.0}
+    for i in range(12):
+        name = 'azimuth' if i % 2 == 0 else 'altitude'
+        limit = 360.0 if name == 'azimuth' else 90.0
+        angles[name] = round(rng.uniform(0.0,limit),3) if i % 3 else round(min(limit,max(0.0,angles[name] + rng.uniform(-2.0,2.0))),3) # Some short moves.
+        slews.append((name,angles[name]))
+    runs = []
+    for i in range(rounds):
+        sim = pico2simulator(hours=2.0,cpuscale=cpuscale,slews=slews,speed=(speed['FastTime'],speed['SlowTime'],0.003))
+        result = sim.Run()
+        assert len(sim.Host.SlewRecords) == len(slews), 'Every GOTO should complete.'
+        runs.append(sim.Host.SlewRecords[1:]) # The first GOTO overlaps the power on configuration.
+    records = []
+    spread = 0.0 # Largest run to run difference of one goto.
+    for moves in zip(*runs):
+        name,fromangle,toangle = moves[0][:3]
+        durations = sorted([move[3] for move in moves])
+        spread = max(spread,(durations[-1] - durations[0]) / durations[0])
+        profile = pilomarslew.DefaultProfile(speed,latency=0.0,maxangle=360.0 if name == 'azimuth' else 90.0)
+        records.append((name,fromangle,toangle,profile.MoveSeconds(fromangle,toangle)[1],durations[len(durations) // 2]))
+    print('GOTO moves at',speedname,'speed, cpuscale',result['cpuscale'],'median of',rounds,'runs, largest run to run difference',str(round(100 * spread,1)) + '%')
+    print('axis'.ljust(9),'from'.rjust(9),'to'.rjust(9),'predicted'.rjust(10),'simulated'.rjust(10))
+    for name,fromangle,toangle,predicted,seconds in records:
+        print(name.ljust(9),str(round(fromangle,3)).rjust(9),str(round(toangle,3)).rjust(9),(str(round(predicted,2)) + 's').rjust(10),(str(round(seconds,2)) + 's').rjust(10))
+    profile = pilomarslew.DefaultProfile(speed)
+    pulses = sum([sum(profile.Phases(f,profile.Steps(f,t))) for n,f,t,p,s in records if s > pilomarslew.GOTO_MINIMUM])
+    extra = sum([s - p for n,f,t,p,s in records if s > pilomarslew.GOTO_MINIMUM])
+    print('Simulated time beyond the prediction:',round(1000 * extra / max(pulses,1),3),'ms per pulse on gotos longer than GOTO_MINIMUM.')
+    summary = pilomarslew.CompareRecorded(records)
+    print(summary)
+    assert summary['error_pct_p50'] < 10, 'Predictions should be within the run to run variation of the simulator.'
+    assert summary['error_pct_max'] < 20, 'Long slews should be predicted as well as short ones.'
+    return records
+
+if __name__ == "__main__":
+    if 'trajectory' in sys.argv: # Trajectory storage benchmark.
+        BenchmarkTrajectory()
+    elif 'slew' in sys.argv: # Slew time predictions.
+        speeds = [a for a in sys.argv[1:] if a in ('Slow','Medium','Fast','Turbo')]
+        numbers = [float(a) for a in sys.argv[1:] if a.replace('.','',1).isdigit()]
+        CheckSlews(speeds[0] if speeds else 'Medium',cpuscale=numbers[0] if numbers else SLEW_CPUSCALE)
+    else: # Replay a night of tracking.
+        numbers = [float(a) for a in sys.argv[1:] if a.replace('.','',1).isdigit()] # Words can follow or replace the numbers.
+        hours = numbers[0] if len(numbers) > 0 else 8.0
+        cpuscale = numbers[1] if len(numbers) > 1 else None
+        sim = pico2simulator(hours=hours,cpuscale=cpuscale,binary='binary' in sys.argv)
+        sim.Host.Trace = 'trace' in sys.argv
+        PrintReport(sim.Run())
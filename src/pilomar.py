@@ -152,9 +152,13 @@ from pilomarlib import UTCStringToDatetime,DTSToDatetime,StringToDatetime,IsFloa
 from pilomartrig import * # Trigonometry functions.
 from pilomartimer import timer, progresstimer # Pilomar's timer classes.
 from pilomarlogfile import logfile # Pilomar's logging class.
+from pilomartelemetry import telemetry # Pilomar's structured telemetry recorder.
 from pilomaroscommand import oscommand, NewCommandWindow # Pilomar's OS command executor.
 from pilomardisc import discmonitor # Pilomar's disc storage monitor.
-from pilomarimage import pilomarimage # Pilomar's IMAGE BUFFER handler (combines numpy, OpenCV and pilomar specific routines)
+from pilomarmanifest import foldermanifest # Pilomar's per-folder file manifest. Image counts without directory scans.
+from pilomarimage import pilomarimage,pilomarmeteordetector,pilomartimelapse,pilomarcloudestimator,pilomarstacker # Pilomar's IMAGE BUFFER handler (combines numpy, OpenCV and pilomar specific routines)
+from pilomarpipeline import capturepipeline # Pilomar's overlapped capture pipeline. Processes images while the next exposure runs.
+from pilomarcalibration import calibrationbuilder, calibrationlibrary, calibrator, MasterFilename, KINDS as CALIBRATION_KINDS # Pilomar's calibration master builder.
 from pilomarcelestrak import celestrak # Pilomar's CELESTRAK satellite data handler.
 from pilomarcamera import astrosensor, astrolens, astrocamera # Pilomar's CAMERA elements.
 from pilomarmemory import memorymonitor # Pilomar's memory capacity monitor.
@@ -162,6 +166,13 @@ from pilomarcpu import cpumonitor # Pilomar's CPU monitor.
 from pilomarmetcheck import metcheck_handler # Pilomar's METCHECK weather data class.
 from pilomarviewer import imageviewer # Pilomar's primitive character based image viewer.
 from pilomardialog import filedialog
+from pilomarframing import FRAME_VERSION, ParseTrajectoryLine, EncodeTrajectoryFrames # Pilomar's binary framing for bulk trajectory uploads.
+from pilomartransmit import transmitscheduler, MessageClass, ParseAck # Pilomar's prioritised, acknowledgement paced transmit queue.
+from pilomarsensorfusion import positionfusion # Pilomar's position sensor fusion. Offset, backlash and slip estimates.
+from pilomartrajectory import segmentplanner, Wrap # Pilomar's trajectory segment planner. Segment lengths from the local angular acceleration.
+from pilomarslew import slewprofile # Pilomar's slew planner. GOTO duration predictions and path choice.
+from pilomardashboard import dashboardrenderer # Pilomar's dashboard renderer. Draws the observation dashboard at its own pace.
+from pilomarmessages import messagedispatcher, ParseMotorStatus, ParseSessionStatus, ParseCommsStatus, ParseCpuStatus, ParseBinary, ParseMotorName # Pilomar's dispatch table for microcontroller messages.
 from skyfield.api import Star, Topos, EarthSatellite
 from skyfield.api import Loader # Create own 'load' functionality by specifying the download directory this way.
 from skyfield.api import load_constellation_names 
@@ -1069,6 +1080,10 @@ print("Camera log to", CamLogFileName)
 CamLog = logfile(CamLogFileName,clockoffset=ClockOffset) # Create a CAMERA specific log file. (This runs in separate thread, unsure if logging would be thread-safe.)
 CamLog.Log(SourceCode(),VERSION,SourceDate(),terminal=False) # Identify the program and version to the user.
 
+# Structured telemetry. Motor status, trajectory, UART and camera timing events are also recorded as typed binary records.
+# Load them with pilomartelemetry.ReadTelemetry() instead of searching the log files.
+Telemetry = telemetry(logdir,os.path.splitext(os.path.basename(LogFileName))[0],logger=MainLog,clock=lambda: NowUTC().timestamp()) # Same clock as the log files, including any ClockOffset.
+
 MainLog.Log("Python version:",sys.version,terminal=False)
 MainLog.Log("Main: ReloadData",ReloadData,terminal=False) # Record that 'reload' has been triggered.
 MainLog.Log("Hostname:",HOSTNAME,terminal=False)
@@ -1779,6 +1794,15 @@ class parameters(attributemaster): # Common
         self.ObservationStopPin = self.GetParmVal('ObservationStopPin',25,oldnames=['StopPin']) # Which RPi4 GPIO pin is used as the OBSERVATION STOP button? (Not an EMERGENCY STOP!)
         self.SlipRingFitted = self.GetParmVal('SlipRingFitted',False) # Set to TRUE if telescope uses slipring to eliminate cable entanglement. (Adjusts warnings only at present)
         self.CameraLoopDelay = self.GetParmVal('CameraLoopDelay',0.25) # Small pause in camerahandler at the end of each batch of tasks, to lower CPU demand.
+        self.CameraPipeline = self.GetParmVal('CameraPipeline',True) # TRUE = Process captured images in background threads while the next exposure runs. FALSE = Process each image before the next capture.
+        self.CameraPipelineDepth = self.GetParmVal('CameraPipelineDepth',2) # How many captured light images can wait for processing before the camera pauses.
+        self.CalibrateLightFrames = self.GetParmVal('CalibrateLightFrames',False) # TRUE = Apply master dark/flat frames to light images before meteor scanning and the timelapse movie.
+        self.CalibrationMethod = self.GetParmVal('CalibrationMethod','sigma') # How calibration frames are combined into masters. 'median' or 'sigma' (sigma clipped mean).
+        self.CalibrationMemoryMB = self.GetParmVal('CalibrationMemoryMB',256) # Memory budget (MB) when combining calibration frames into masters.
+        self.CloudPause = self.GetParmVal('CloudPause',False) # TRUE = Stop continuous capture while the sky quality score is poor, take occasional probe images until it recovers.
+        self.CloudPauseScore = self.GetParmVal('CloudPauseScore',0.3) # Pause when the smoothed sky quality score (0.0 - 1.0) drops below this.
+        self.CloudResumeScore = self.GetParmVal('CloudResumeScore',0.5) # Resume when the smoothed sky quality score rises above this.
+        self.CloudProbeInterval = self.GetParmVal('CloudProbeInterval',60) # Seconds between probe images while paused for cloud.
 
         self.TuneOn32Bit = self.GetParmVal('TuneOn32Bit',True) # If running on 32bit O/S tune for performance.
         
@@ -1787,6 +1811,7 @@ class parameters(attributemaster): # Common
         # On later boards it is GP23 because GP4 is now available for the Arducam HiQuality camera with switchable IR Cutoff filter.
         self.MctlResetPin = self.GetParmVal('MctlResetPin',4) # Which RPi4 GPIO pin is used to RESET the microcontroller?
         self.UartRxQueueLimit = self.GetParmVal('UartRxQueueLimit',50) # How many messages can be held in the input queue from the Microcontroller? Kill older entries.
+        self.TelemetryEnabled = self.GetParmVal('TelemetryEnabled',True) # Record motor, trajectory, UART and camera events in the binary telemetry files too?
         # Upgrade from old motor specific parameters to more flexible dictionary solution.
         init_azimuth_params = {'MinAngle':self.GetParmVal('MinAzimuthAngle',0),
                                'MinAngle':self.GetParmVal('MinAzimuthAngle',0),
@@ -1857,6 +1882,7 @@ class parameters(attributemaster): # Common
         self.TraceMove = self.GetParmVal('TraceMove',False,oldnames=['TraceMotor']) # Does the microcontroller send extra development log messages back from the motors?
         self.MctlCommsTimeout = self.GetParmVal('MctlCommsTimeout',120) # How many seconds of inactivity before resetting microcontroller communication?
         self.UseUSBStorage = self.GetParmVal('UseUSBStorage',True) # If USB storage is mounted then images are stored there instead of the SD card.
+        self.ManifestCheckInterval = self.GetParmVal('ManifestCheckInterval',300) # Seconds between quick consistency checks of the folder manifests against the disc.
         self.SDPath = self.GetParmVal('SDPath','/') # The 'path' used by discmonitor for monitoring space on the SD card.
         self.USBPath = self.GetParmVal('USBPath','/media/pi') # The 'path' used by discmonitor for monitoring space on attached USB storage.
         self.FastFlush = self.GetParmVal('FastFlush',False) # When TRUE disc writes are flushed immediately - That hits the SD card hard, but may catch more info for fatal errors.
@@ -1866,6 +1892,7 @@ class parameters(attributemaster): # Common
         self.WeatherUnits = self.GetParmVal('WeatherUnits','METRIC') # Set UOM for metcheck weather display (UK, US, METRIC)
         self.MiscWindowEnabled = self.GetParmVal('MiscWindowEnabled',True) # Render miscellaneous measures window.
         self.SystemWindowEnabled = self.GetParmVal('SystemWindowEnabled',False) # Render system overview window.
+        self.DashboardRefresh = self.GetParmVal('DashboardRefresh',1.0) # Seconds between dashboard refreshes during observations, drawn by its own thread. 0 redraws on every pass of the observation loop.
         self.SplashScreen = self.GetParmVal('SplashScreen',True) # Show pilomar logo at startup.
         self.HorizonAltitude = self.GetParmVal('HorizonAltitude',0.0) # What altitude angle is considered the horizon? Observations cannot go below this even if the motor allows it.
         
@@ -1950,6 +1977,9 @@ class parameters(attributemaster): # Common
         self.ShowPGCEntries = self.GetParmVal('ShowPGCEntries',False) # The NGC catalog includes NGC, IC and PGC items. The PGC list is large and slow to process, but generates a more realistic star field.
         self.GeneratePreview = self.GetParmVal('GeneratePreview',True) # TRUE = Preview images are generated periodically, and can be turned into AVI file when observation ends.
         self.GeneratePreviewVideo = self.GetParmVal('GeneratePreviewVideo',True) # TRUE = IF GeneratePreview enabled, this will save a VIDEO of the images too.
+        self.GenerateLightVideo = self.GetParmVal('GenerateLightVideo',False) # TRUE = Light images are added to a timelapse VIDEO as they are captured.
+        self.LiveStack = self.GetParmVal('LiveStack',True) # TRUE = Light images are registered and stacked as they are captured. The stacked preview is saved as livestack.jpg in the preview folder.
+        self.LiveStackWidth = self.GetParmVal('LiveStackWidth',1014) # Light images are scaled down to this width before stacking. Full size frames take seconds each on the RPi.
         self.GenerateKeogram = self.GetParmVal('GenerateKeogram',False) # TRUE = Keogram is generated at the end of all observations automatically. Aurora always does.
         self.InitialGoTo = self.GetParmVal('InitialGoTo',True) # Perform initial GOTO before downloading the trajectory. (Eases comms with microcontroller.)
         self.TargetInclusionRadius = self.GetParmVal('TargetInclusionRadius',15) # Angle (radius) for inclusion of neighbouring stars when generating target image.
@@ -2194,7 +2224,9 @@ class parameters(attributemaster): # Common
         
         # The following parameters dictate how the trajectory is calculated for the motorcontroller.
         self.TrajectoryWindow = self.GetParmVal('TrajectoryWindow',1200) # How many seconds into the future should the motor trajectory last?
+        self.MctlBinaryFrames = self.GetParmVal('MctlBinaryFrames',True) # Offer binary trajectory frames to the microcontroller? Older firmware ignores the offer and the text protocol is used.
         self.UseDynamicTrajectoryPeriods = self.GetParmVal('UseDynamicTrajectoryPeriods',True) # Can we use flexible time periods in the trajectory plan?
+        self.TrajectoryTolerance = self.GetParmVal('TrajectoryTolerance',0.005) # Largest gap (degrees) allowed between a dynamic trajectory segment and the real path.
         
         self.ScanForMeteors = self.GetParmVal('ScanForMeteors',True) # Scan light images for streaks, report them if found.
         self.MinSatelliteAltitude = self.GetParmVal('MinSatelliteAltitude',30) # Satellites are only considered to RISE if they will culminate above this altitude. (Else too brief and low to see)
@@ -2760,6 +2792,7 @@ class parameters(attributemaster): # Common
 
 Parameters = parameters(filename=ParameterFileName,pilomarsession=Sess) # Create and load parameters.
 Sess.SetParameters(Parameters) # Tell the pilomarsession instance what the parameters are, and copy across any key attributes.
+Telemetry.Enabled = Parameters.TelemetryEnabled # Binary telemetry recording on or off.
 
 # Log the config.txt contents.
 Parameters.ReadConfig() # Record config.txt contents to logfile.
@@ -3335,6 +3368,7 @@ def DefineSessionFolders(campaign_name,exposure=None):
         campaign = "campaign_" + campaign_name + '_e' + str(exposure) + "s/" # Folder specific to the campaign (the target). All images related to the campaign are stored here.
     campaignvalue = campaign
     FolderHandler.NewSession(campaign=campaignvalue,session=sessionvalue) # Update folder structures for the current target and session.
+    FolderHandler.CheckManifests(force=True) # Make sure the manifests of any earlier sessions in this campaign still match the disc.
     
 # ------------------------------------------------------------------------------------------------------
 
@@ -3404,7 +3438,7 @@ SessionWindow.SetBorderColors(OSW_BORDER_FG,OSW_BORDER_BG) # Set border colors.
 #                          0123456789012345678901234567890123456789012345678901234567890123456789012345678
 SessionWindow.PlaceString('  Messages:Rx queued:[RQ]     Rx tot:[RT   ]       Tx queued:[TQ] Tx tot:[TT  ]',row=1,col=0)
 SessionWindow.PlaceString('     State:   Resets:[SR]    DevFail:[DF ]           Last Rx:[LR         ]     ',row=2,col=0)
-SessionWindow.PlaceString(' RPi Bytes:Rx:[BX    ]            Tx:[TX    ]         RxErrs:[RE]              ',row=3,col=0)
+SessionWindow.PlaceString(' RPi Bytes:Rx:[BX    ]            Tx:[TX    ]         RxErrs:[RE] TxLat:[TL   ]',row=3,col=0)
 SessionWindow.PlaceString('MCtl Bytes:Rx:[MRX   ] [MRXR ]    Tx:[MTX   ] [MTXR ] RxErrs:[R2] TxDrops:[TD] ',row=4,col=0)
 SessionWindow.PlaceString('      MCtl:  AutoCtl:[AC ]        RemCtl:[RCL]        ClkSyn:[CS ] Exc:[EXCEPT]',row=5,col=0)
 SessionWindow.PlaceString('            Restarts:Forced:[FR]  Remote:[RR]          Alive:[ALIVE    ]       ',row=6,col=0)
@@ -3456,8 +3490,9 @@ MiscWindow.SetBorderColors(OSW_BORDER_FG,OSW_BORDER_BG) # Set border colors.
 MiscWindow.PlaceString('    Light level: [TWILIGHT            ]  Moon: [MOONP]% [W] Visible: [MOONV]       ',row=2,col=0)
 MiscWindow.PlaceString('    Motor power: [VMOT      ]                                                      ',row=3,col=0)
 MiscWindow.PlaceString(' Field rotation: [FIELDROTATION                        ] Target mag: [MAGNITUDE]   ',row=4,col=0)
-MiscWindow.PlaceString('      Loop time: [TOTLOOP       ]                           Average: [AVELOOP]     ',row=5,col=0)
+MiscWindow.PlaceString('      Loop time: [TOTLOOP       ] [LOOPPCT                ] Average: [AVELOOP]     ',row=5,col=0)
 #MiscWindow.PlaceString('     Loop times: [RECLOOPS                                                     ]   ',row=6,col=0)
+MiscWindow.PlaceString('  Mctl messages: [MSGSTATS                                                     ]   ',row=6,col=0)
 MiscWindow.PlaceString(' Azimuth sensor: [ASINFO                                                       ]   ',row=7,col=0)
 MiscWindow.PlaceString('Altitude sensor: [LSINFO                                                       ]   ',row=8,col=0)
 
@@ -3532,7 +3567,7 @@ SystemWindow.FieldFormat('ALPWR',justify='right')
 SystemWindow.FieldFormat('POWER',justify='center')
 SystemWindow.SetDefault() # Store this 'blank' template to be reused when clearing the display.
 
-ImageStatusWindow = colordisplay(rows=9,cdlayout=0,name='image',fg=OSW_TEXT_FG,bg=OSW_TEXT_BG,titlefg=OSW_TITLE_FG,titlebg=OSW_TITLE_BG,title="Image Status",rjtitle="(" + Parameters.DisplayTZ + ")")
+ImageStatusWindow = colordisplay(rows=11,cdlayout=0,name='image',fg=OSW_TEXT_FG,bg=OSW_TEXT_BG,titlefg=OSW_TITLE_FG,titlebg=OSW_TITLE_BG,title="Image Status",rjtitle="(" + Parameters.DisplayTZ + ")")
 ImageStatusWindow.ClipWindow = True # Allow the display to be clipped if there's not enough terminal space available for the entire display.
 ImageStatusWindow.DrawBorder = True # Draw border around window.
 ImageStatusWindow.SetBorderColors(OSW_BORDER_FG,OSW_BORDER_BG) # Set border colors.
@@ -3545,6 +3580,8 @@ ImageStatusWindow.PlaceString(' Last azimuth tuning: [LAZT
 ImageStatusWindow.PlaceString('Last altitude tuning: [LALT                                                         ]',row=6,col=0)
 ImageStatusWindow.PlaceString('      Session images: [IMAGES                                                       ]',row=7,col=0)
 ImageStatusWindow.PlaceString('   Current image run: [RUN                  ] Acc: [ACCTIME  ] ETA: [ETA            ]',row=8,col=0)
+ImageStatusWindow.PlaceString('    Capture pipeline: [PIPELINE                                                     ]',row=9,col=0)
+ImageStatusWindow.PlaceString('         Sky quality: [SKYQ                                                         ]',row=10,col=0)
 
 ImageStatusWindow.ScanForFields() # Scan the current image for field markers.
 ImageStatusWindow.FieldFormat('CTASK',justify='center')
@@ -3978,6 +4015,12 @@ class folderhandler(attributemaster):
         IsType                    : Return true if file is of a specific type (or in a list of types).
         CreateFolderFromListEntry : Given a folder 'key', make sure it exists and mark the entry accordingly.
         CreateFolderByPath        : Given a filepath, make sure it exists.
+        Manifest                  : Return the file manifest for a folder 'key' or path.
+        RegisterFile              : Record a new/changed/deleted file in its folder's manifest.
+        ListFiles                 : List files in a folder from its manifest.
+        LatestFile                : Most recent file in a folder from its manifest.
+        CampaignFolders           : List the folders within the current campaign.
+        CheckManifests            : Consistency check of folder manifests against the disc, rebuild if needed.
 
         """
         
@@ -4002,6 +4045,9 @@ class folderhandler(attributemaster):
             raise Exception("folderhandler.__init__(" + str(projectroot) + ") does not exist.")
         self.ErrorWindow = None # Handle to optional error window.
         self.ProjectRoot = projectroot # The base of all folders. Only folders beneath this level are created/modified.
+        self.Manifests = {} # foldermanifest instance for each folder path, loaded on first use.
+        self.ManifestLock = threading.Lock() # Files are registered from the camera threads too.
+        self.ManifestTimer = timer(self.Session.Parameters.ManifestCheckInterval) # Rate limit for automatic consistency checks.
         if self.Session.Parameters.UseUSBStorage and Sess.USBDiscMonitor.DriveAvailable:
             temp = self.Session.USBDiscMonitor.DfPath
             self.ImageRoot = temp
@@ -4226,7 +4272,7 @@ class folderhandler(attributemaster):
             filepath = Path(filepath)
         return filepath
 
-    def FileAge(filename):
+    def FileAge(self,filename):
         """ Return timedelta object with age of file. 
             
             Parameters ---------------------------------------
@@ -4239,13 +4285,15 @@ class folderhandler(attributemaster):
             n/a
 
             Returns ------------------------------------------
-            Age of file in seconds (int)           """
+            Age of file (timedelta) or None if the file doesn't exist.           """
         result = None
-        if self.IsFile(filename):
-            result = NowUTC() - os.path.getmtime(filename)
+        try:
+            result = timedelta(seconds=time.time() - os.path.getmtime(filename)) # One stat, doesn't fail if the file has gone.
+        except OSError:
+            pass
         return result 
             
-    def FileExpired(filename,days=0,hours=0,minutes=0,seconds=0):
+    def FileExpired(self,filename,days=0,hours=0,minutes=0,seconds=0):
         """ Return TRUE if a file is too old. 
             
             Parameters ---------------------------------------
@@ -4263,8 +4311,8 @@ class folderhandler(attributemaster):
 
             Returns ------------------------------------------
             result (bool)           """
-        result = True
-        if self.FileAge(filename) >= timedelta(days=days,hours=hours,minutes=minutes,seconds=seconds): result = True
+        age = self.FileAge(filename)
+        result = age == None or age >= timedelta(days=days,hours=hours,minutes=minutes,seconds=seconds) # Missing files count as expired.
         return result 
             
     def GetDictionaryCache(self,filename,days=0,hours=0,minutes=0,seconds=0):
@@ -4287,9 +4335,12 @@ class folderhandler(attributemaster):
             Returns ------------------------------------------
             result (dict) """
         result = None
-        if self.IsFile(filename) and self.IsType(filename,'json') and not self.FileExpired(filename,days=days,hours=hours,minutes=minutes,seconds=seconds): 
-            with open(filename,'r') as f:
-                result = json.load(f)
+        if self.IsType(filename,'json') and not self.FileExpired(filename,days=days,hours=hours,minutes=minutes,seconds=seconds): # FileExpired also covers missing files.
+            try:
+                with open(filename,'r') as f:
+                    result = json.load(f)
+            except (OSError,ValueError) as e:
+                self.Session.Log("folderhandler.GetDictionaryCache(",filename,") failed:",e,level='warning',terminal=False)
         return result
 
     def GetPath(self,key): 
@@ -4526,6 +4577,146 @@ class folderhandler(attributemaster):
             folderpath.mkdir(mode=0o777, parents=True, exist_ok=True) # Create folder and all parent folders if missing.
         except Exception as e:
             MainLog.ReportException(e,command='folderhandler.CreateFolderByPath') # Trap all the exception information in the main log file.
+
+    def Manifest(self,folder):
+        """ Return the foldermanifest for a folder. It is loaded (or built) from disc on first use.
+            
+            Parameters ---------------------------------------
+            folder (str) : Folder key (eg: 'light') or folder path.
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            self.Manifests
+
+            Returns ------------------------------------------
+            manifest (foldermanifest)           """
+        if folder in self.FolderList: folder = self.GetPath(folder)
+        folder = os.path.normpath(str(folder))
+        with self.ManifestLock:
+            manifest = self.Manifests.get(folder,None)
+            if manifest == None: # First use, load it.
+                manifest = foldermanifest(folder,logger=self.Session.Logger)
+                manifest.Load()
+                self.Manifests[folder] = manifest
+        return manifest
+
+    def RegisterFile(self,filename):
+        """ Record that a file has been written (or deleted) in its folder's manifest.
+            Call this after writing any image file so that counts stay current without scanning the folder.
+            
+            Parameters ---------------------------------------
+            filename (str) : Full path of the file.
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            result (bool) : True if the file exists.           """
+        if filename == None: return False
+        try:
+            return self.Manifest(os.path.dirname(str(filename))).Add(filename)
+        except Exception as e: # The manifest is only an index, never let it stop an observation.
+            self.Session.Log("folderhandler.RegisterFile(",filename,") failed:",e,level='warning',terminal=False)
+            return False
+
+    def ListFiles(self,folder,prefix='',suffix=''):
+        """ Return a sorted list of full file paths in a folder, from its manifest.
+            
+            Parameters ---------------------------------------
+            folder (str) : Folder key or path.
+            prefix (str) : Only files starting with this.
+            suffix (str) : Only files ending with this (eg: '.jpg').
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            filelist (list of str)           """
+        manifest = self.Manifest(folder)
+        return [os.path.join(manifest.Folder,name) for name in manifest.Files(prefix=prefix,suffix=suffix)]
+
+    def LatestFile(self,folder,prefix='',suffix=''):
+        """ Return the most recently modified file in a folder, from its manifest. None if there isn't one.
+            
+            Parameters ---------------------------------------
+            folder (str) : Folder key or path.
+            prefix (str)
+            suffix (str)
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            filename (str)           """
+        return self.Manifest(folder).Latest(prefix=prefix,suffix=suffix)
+
+    def CampaignFolders(self):
+        """ Return the folders of the current campaign: the campaign folder, its session folders and their image folders.
+            Only the campaign and session folders are listed, never the (large) image folders themselves.
+            
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            folderlist (list of str)           """
+        campaign = os.path.normpath(self.GetPath('campaign'))
+        folderlist = []
+        if not os.path.isdir(campaign): return folderlist
+        folderlist.append(campaign)
+        try:
+            sessions = [entry.path for entry in os.scandir(campaign) if entry.is_dir()]
+            for session in sorted(sessions):
+                folderlist.append(session)
+                folderlist += sorted(entry.path for entry in os.scandir(session) if entry.is_dir())
+        except OSError as e: # Folder removed while listing.
+            self.Session.Log("folderhandler.CampaignFolders() failed:",e,level='warning',terminal=False)
+        return folderlist
+
+    def CheckManifests(self,folders=None,quick=True,force=False):
+        """ Consistency check of folder manifests against the disc. Manifests that don't match are rebuilt.
+            Unless forced, this only runs every ManifestCheckInterval seconds, so it can be called from display loops.
+            
+            Parameters ---------------------------------------
+            folders (list of str) : Folders to check. Default = all folders of the current campaign.
+            quick (bool) : True = only list folders whose modification time has changed. False = list every folder.
+            force (bool) : True = check now regardless of the timer.
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            rebuilt (list of str) : Folders whose manifest was rebuilt.           """
+        rebuilt = []
+        if not force and not self.ManifestTimer.Due(): return rebuilt
+        if folders == None: folders = self.CampaignFolders()
+        for folder in folders:
+            manifest = self.Manifest(folder)
+            if quick: changed = manifest.QuickCheck()
+            else: changed = manifest.Check(rebuild=True)['rebuilt']
+            if changed: rebuilt.append(folder)
+        if len(rebuilt) > 0:
+            self.Session.Log("folderhandler.CheckManifests(): Rebuilt",len(rebuilt),"manifest(s):",rebuilt,terminal=False)
+        return rebuilt
         
 FolderHandler = folderhandler(projectroot=ProjectRoot,pilomarsession=Sess) # Create FolderHandler instance. Defines folder structures and creates them as needed.
 Sess.FolderHandler = FolderHandler # Record the instance in the Session instance. 
@@ -5037,9 +5228,13 @@ class microcontroller(attributemaster):
         self.ResetPin = outputpin(self.ResetBCM,"MctlReset") # Create GPIO pin if a pin is specified, else create dummy pin. All pins start OFF.
         self.Lines = [] # No lines received yet.
         self.WriteChunkBytes = 32 # Maximum number of characters to send in a batch.
-        self.WriteChunkSeconds = 0.2 # Seconds between chunks written to microcontroller.
+        self.WriteWindowBytes = 768 # Unacknowledged bytes allowed in flight to the microcontroller. (Its UART receive buffer is 1024 bytes)
         self.InputLine = '' # This is the line currently being received. Completed lines are added to Lines list.
-        self.WriteQueue = [] # No output to send yet.
+        self.Transmit = transmitscheduler(chunkbytes=self.WriteChunkBytes,windowbytes=self.WriteWindowBytes) # Prioritised output queue, paced by the microcontroller's acknowledgements.
+        self.WriteEvent = threading.Event() # Wakes the CommsLoop as soon as something is queued.
+        self.TrajectoryBatch = [] # Trajectory segments waiting to be packed into binary frames.
+        self.FrameSequence = 0 # Sequence number of the next binary frame.
+        self.BinaryFrameSegments = 16 # Maximum segments packed into each binary frame.
         self.LinesReceived = 0 # total number of lines received from the microcontroller.
         self.LinesSent = 0 # Total count of lines sent to the microcontroller.
         self.BytesReceived = 0 # Byte count from microcontroller.
@@ -5221,6 +5416,12 @@ class microcontroller(attributemaster):
         self.MctlExceptionCount = 0 # How many exceptions has the Microcontroller handled?
         self.MctlLifeSeconds = 0 # How many seconds has the Microcontroller been running for?
         self.MctlWriteDrops = 0 # How many messages were dropped from send buffer on Microcontroller due to overflow?
+        self.BinaryTrajectories = False # Has the Microcontroller accepted binary trajectory frames?
+        self.FramesSent = 0 # How many binary frames have been sent?
+        self.FramesAcknowledged = 0 # How many binary frames has the Microcontroller acknowledged?
+        self.FrameSegmentsSent = 0 # How many trajectory segments have been sent in binary frames?
+        self.FrameSegmentsRejected = 0 # How many trajectory segments has the Microcontroller rejected from binary frames?
+        self.FramePendingTime = None # When was the last unacknowledged frame sent?
 
     def StartMonitor(self):
         """ Start replicating communications to the terminal. 
@@ -5395,6 +5596,28 @@ class microcontroller(attributemaster):
             self.Write('#'*20)
         self.Write('rpi started') # Tell microcontroller that the RPi has just started.
         self.SetClock() # Set the time on the microcontroller.
+        self.OfferBinary() # Newer firmware can receive trajectories in binary frames.
+
+    def OfferBinary(self):
+        """ Offer binary trajectory frames to the microcontroller. 
+            Firmware that supports them replies 'binary accept n', older firmware reports an unrecognised command
+            and trajectories continue to be sent as text. 
+            
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            Parameters.MctlBinaryFrames
+
+            Sets ---------------------------------------------
+            self.BinaryTrajectories
+
+            Returns ------------------------------------------
+            n/a
+        """
+        self.BinaryTrajectories = False # Text until the microcontroller accepts.
+        if Parameters.MctlBinaryFrames:
+            self.Write('binary offer ' + str(FRAME_VERSION))
 
     def SetClock(self):
         """ Set the microcontroller clock. 
@@ -5547,7 +5770,9 @@ class microcontroller(attributemaster):
             self.uart.reset_input_buffer()
         self.Lines = [] # No lines received yet.
         self.InputLine = '' # This holds the currently arriving line while it is being constructed.
-        self.WriteQueue = [] # No output to send yet.
+        self.Transmit.Clear() # No output to send yet.
+        self.TrajectoryBatch = [] # No trajectory segments waiting either.
+        self.FramePendingTime = None
         self.LineOpenedTime = NowUTC()
         self.LastTxTime = NowUTC() # When was data last sent?
         self.LastRxTime = NowUTC() # When was data last received?
@@ -5662,6 +5887,7 @@ class microcontroller(attributemaster):
                     print(textcolor.red('uart.Read: Ignoring reflected line on port ' + str(self.Port) + ' (' + str(self.InputLine) + ')'))
                     self.Session.Log('uart.Read: Ignoring reflected line on port ' + str(self.Port) + ' (' + str(self.InputLine) + ')',terminal=False)
                 else: # We have a valid line received from the correspondent. 
+                    self.CheckAck(self.InputLine) # Release acknowledged messages from the transmit window straight away.
                     self.Lines.append(self.InputLine) # Add received line to input queue.
                     self.LastRxTime = NowUTC() # Note when last receive activity occurred. 
                     self.ResetAttempts = 0 # We have activity, so clear the restart counter.
@@ -5674,6 +5900,32 @@ class microcontroller(attributemaster):
                 self.InputLine = '' # Start a fresh input line next time anything is received. 
             else: self.InputLine += response # Add the character to the input line we are constructing. 
 
+    def CheckAck(self,line):
+        """ Pass the microcontroller's receipts to the transmit scheduler. 
+            This runs in the CommsLoop thread as each line arrives. The lines are also queued for the MctlHandler as normal,
+            but that only runs during an observation.
+            log :20250115200000:rec: [12]|checksum
+            binary ack 7 16 16|checksum
+            
+            Parameters ---------------------------------------
+            line : Received line, with checksum.
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            self.Transmit
+
+            Returns ------------------------------------------
+            n/a
+        """
+        if line.startswith('log'):
+            messageid = ParseAck(line)
+            if messageid is not None: self.Transmit.Ack(messageid=messageid)
+        elif line.startswith('binary ack '):
+            items = line.split('|')[0].split(' ')
+            if len(items) >= 3 and items[2].isdigit(): self.Transmit.Ack(frame=int(items[2]))
+
     def Read(self):
         """ Return the next input line received (if there is one).
             Validate checksum and ignore anything which fails.
@@ -5695,15 +5947,17 @@ class microcontroller(attributemaster):
         result = ''
         while len(result) == 0 and len(self.Lines) > 0: # No valid line to return yet, and still lines available in the receive buffer.
             result = self.Lines.pop(0).strip()
-            if self.ValidateChecksum(result): # Line is good, remove the checksum.
+            validchecksum = self.ValidateChecksum(result)
+            if validchecksum: # Line is good, remove the checksum.
                 cleanresult = self.RemoveChecksum(result)
             else: # Line is bad. Don't clean it.
                 cleanresult = result
             self.Session.Log('RPi received: ' + cleanresult,terminal=False)
+            Telemetry.Record('uart','r',validchecksum,len(self.Lines),len(cleanresult),cleanresult)
             if self.PrintComms: print(textcolor.magenta('RPi received: ' + cleanresult))
 
             MctlRxWindow.Print(cleanresult)
-            if self.ValidateChecksum(result): # Line is good.
+            if validchecksum: # Line is good.
                 result = cleanresult # self.RemoveChecksum(result)
                 if result == 'pico started' or result == 'controller started': 
                     self.RemoteRestarts += 1 # Record how many times the remote device reports a restart.
@@ -5721,61 +5975,118 @@ class microcontroller(attributemaster):
             if result.startswith('#'): result = '' # Ignore comments.
         return result
 
-    def WritePoll(self,flush=True,debug=False):
-        """ Write a chunk of data from the output buffer to the UART port.
+    def WritePoll(self,flush=True,debug=False,window=True):
+        """ Write a chunk of data from the output queue to the UART port.
             This takes lower priority than the READ from the UART port.
-            It will only send 1 chunk every 0.2 seconds to give the receiving microcontroller
-            time to read the data. 
-            To add lines to the output buffer use the Write() method.
+            Messages leave in priority order (stop, goto etc first, trajectory segments last) and are paced by the 
+            microcontroller's acknowledgements rather than a timer. See pilomartransmit.py.
+            To add lines to the output queue use the Write() method.
             Parameters -------------------------------------------------------------------------
             debug = Enable extra log messages.
             flush = Don't care about inbound queue.
+            window = Respect the flow control window. False sends regardless. (Final flush, nothing is reading acknowledgements)
 
             References ---------------------------------------
-            n/a
+            self.Transmit
 
             Sets ---------------------------------------------
             n/a
 
             Returns ------------------------------------------
-            n/a
+            True if something was written.
         """
             
-        if len(self.WriteQueue) == 0:
-            if debug: print("WritePoll: WriteQueue == 0")
-            return # Nothing to send anyway.
+        if len(self.TrajectoryBatch) > 0: self.QueueTrajectoryFrames() # Pack waiting trajectory segments.
+        if self.Transmit.Depth() == 0:
+            if debug: print("WritePoll: Transmit queue empty")
+            return False # Nothing to send anyway.
         if not hasattr(self.uart,"in_waiting"): # Cannot check state of uart port.
             MctlRxWindow.Print("microcontroller.WritePoll: Cannot check uart state on port " + str(self.Port) + " !")
             WarningFlagName = "microcontroller.WritePoll_undefined" # Which warning message are we considering?
             if WarningFlags.FirstWarning(WarningFlagName): # Only issue the warning message once, don't keep repeating it.
                 self.Session.Log("microcontroller.WritePoll: Cannot check uart.in_waiting condition on port " + str(self.Port),terminal=False)
-            return # Don't perform the poll.
+            return False # Don't perform the poll.
             
         if self.uart.in_waiting: # Priority is given to RECEIVED messages, keep the RX buffer clear!
             if flush: 
                if debug: print("WritePoll: Ignoring in_waiting")
             else:
                if debug: print("WritePoll: in_waiting")
-               return # Input waiting. Handle that first.
-        if self.LastTxTime != None and (NowUTC() - self.LastTxTime).total_seconds() < self.WriteChunkSeconds: # 0.2:
-            if debug: print("WritePoll: too soon")
-            return # Must be 0.2 second gap between each transmitted packet.
+               return False # Input waiting. Handle that first.
         if not self.uart.is_open: 
             MctlTxWindow.Print('uart.WritePoll: uart (' + str(self.Port) + ') is not open!.')
-        if len(self.WriteQueue[0]) < self.WriteChunkBytes: # Can write the entire line in one go.
-            line = self.WriteQueue.pop(0)
-            terminator = '\n'
-        else: # Need to send just a chunk of the line in this pass.
-            line = self.WriteQueue[0][0:self.WriteChunkBytes] # 1st 'chunksize' characters only.
-            self.WriteQueue[0] = self.WriteQueue[0][self.WriteChunkBytes:] # Remove transmitted characters.
-            terminator = ''
-        self.LastLineSent = line # Keep a note of what we sent, if we receive that back it is reflection indicating a problem.
-        line += terminator
-        self.LinesSent += 1
-        self.BytesSent += len(line)
-        if debug: print("WritePoll: Sending:",line)
-        self.uart.write(line.encode('utf-8')) # Send data in UTF-8 format. 
+        chunk, message = self.Transmit.Next(window=window)
+        if chunk is None:
+            if debug: print("WritePoll: waiting for acknowledgements",self.Transmit.Status())
+            return False # Window is full.
+        if message.Offset >= len(message.Data): # Last chunk of the message.
+            if message.Frame is None: # Text line.
+                self.LastLineSent = message.Data.decode('utf-8').rstrip('\n') # Keep a note of what we sent, if we receive that back it is reflection indicating a problem.
+                self.LinesSent += 1
+            else:
+                self.LastLineSent = None # Frames are not reflected as lines.
+        self.BytesSent += len(chunk)
+        if debug: print("WritePoll: Sending:",chunk)
+        self.uart.write(chunk) # Already encoded in UTF-8 format. 
         self.LastTxTime = NowUTC() # Note that time of the last data sent. 
+        return True
+
+    def QueueTrajectoryFrames(self):
+        """ Pack the waiting trajectory segments into binary frames and add them to the output queue. 
+            Segments that arrive in the same WritePoll interval share frames, 
+            the microcontroller acknowledges each frame with 'binary ack seq accepted count'. 
+            
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            self.TrajectoryBatch
+
+            Sets ---------------------------------------------
+            self.Transmit
+            self.FrameSequence
+
+            Returns ------------------------------------------
+            n/a
+        """
+        batch = self.TrajectoryBatch
+        self.TrajectoryBatch = []
+        if self.WriteProhibited:
+            self.Session.Log('microcontroller.QueueTrajectoryFrames: WriteProhibited:',len(batch),'segments dropped.',terminal=False)
+            return
+        for sequence, count, frame in EncodeTrajectoryFrames(batch,self.FrameSequence,self.BinaryFrameSegments):
+            self.Transmit.Add(frame,'frame',frame=sequence)
+            self.WriteEvent.set() # Wake the CommsLoop.
+            self.FrameSequence = (sequence + 1) & 0xFFFF
+            self.FramesSent += 1
+            self.FrameSegmentsSent += count
+            self.FramePendingTime = NowUTC()
+            MctlTxWindow.Print('binary frame ' + str(sequence) + ' ' + str(count) + ' segments')
+            self.Session.Log('RPi queueing (Q# ' + str(self.Transmit.Depth()) + '): binary frame',sequence,count,'segments',len(frame),'bytes',terminal=False)
+            Telemetry.Record('uart','w',True,self.Transmit.Depth(),len(frame),'binary frame ' + str(sequence))
+
+    def FramePending(self):
+        """ Is a binary frame still waiting to be acknowledged? 
+            An acknowledgement that never arrives is abandoned after a few seconds so that the trajectory can be resent. 
+            
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            self.FramePendingTime
+
+            Sets ---------------------------------------------
+            self.FramePendingTime
+
+            Returns ------------------------------------------
+            True if waiting for an acknowledgement.
+        """
+        if len(self.TrajectoryBatch) > 0: return True # Not even packed yet.
+        if self.FramePendingTime is None: return False
+        if (NowUTC() - self.FramePendingTime).total_seconds() > 10:
+            self.Session.Log('microcontroller.FramePending: No acknowledgement for binary frame',(self.FrameSequence - 1) & 0xFFFF,'abandoned it.',terminal=False)
+            self.FramePendingTime = None
+        return self.FramePendingTime is not None
 
     def ReadFlush(self):
         """ Clear the input buffer. Don't actually process them, because you may never reach the end if 
@@ -5816,7 +6127,7 @@ class microcontroller(attributemaster):
             n/a
 
             Sets ---------------------------------------------
-            self.WriteQueue
+            self.Transmit
 
             Returns ------------------------------------------
             Success (bool)          """
@@ -5824,27 +6135,27 @@ class microcontroller(attributemaster):
         result = True
         # *Q* WriteProhibited is causing final shutdown to timeout rather than write final commands? New issue 05.2025.
         if send: # We should try to send outstanding messages.
-            self.Session.Log('WriteFlush: Flushing microcontroller output queue (',len(self.WriteQueue),'pending messages will be sent)...',terminal=False)
+            self.Session.Log('WriteFlush: Flushing microcontroller output queue (',self.Transmit.Depth(),'pending messages will be sent)...',terminal=False)
             self.Session.Log('WriteFlush: WriteProhibited:',self.WriteProhibited,terminal=False)
             TryCount = 0
             wp_hold = self.WriteProhibited # Store current state of WriteProhibited flag.
             self.WriteProhibited = True # Don't allow anything further to be added to the queue at the moment.
-            while len(self.WriteQueue) > 0:
+            while self.Transmit.Depth() > 0:
                 TryCount += 1
-                self.Session.Log("WriteFlush: Queue currently",len(self.WriteQueue),"entries",terminal=False)
-                self.Session.Log("WriteFlush: 1st in queue:",self.WriteQueue[0],terminal=False)
-                self.WritePoll(flush=True) # Send next chunk of data from output buffer if allowed.
+                self.Session.Log("WriteFlush: Queue currently",self.Transmit.Depth(),"entries",terminal=False)
+                self.Session.Log("WriteFlush: 1st in queue:",self.Transmit.First().Data,terminal=False)
+                self.WritePoll(flush=True,window=False) # Send next chunk of data from output buffer. Acknowledgements may not be read any more, the pause paces it instead.
                 time.sleep(0.1) # Pause until the CommsLoop thread has cleared the buffer.
                 if TryCount >= 500:
-                    self.Session.Log('WriteFlush: Flush timeout. Maximum loops.',len(self.WriteQueue),'Remaining messages will be dropped.',terminal=False)
+                    self.Session.Log('WriteFlush: Flush timeout. Maximum loops.',self.Transmit.Depth(),'Remaining messages will be dropped.',terminal=False)
                     result = False
                     break
             #self.WriteProhibited = False # OK to write again to the write queue.
             self.WriteProhibited = wp_hold # Restore initial state of WriteProhibited flag.
         else: 
-            self.Session.Log('WriteFlush: Flushing microcontroller output queue (',len(self.WriteQueue),'pending messages will be dropped)...',terminal=False)
-        self.Session.Log('WriteFlush: At end: send=',send,', WriteProhibited=',self.WriteProhibited,', WriteQueue=',len(self.WriteQueue),terminal=False) 
-        self.WriteQueue = [] # Delete any remaining messages in the queue.
+            self.Session.Log('WriteFlush: Flushing microcontroller output queue (',self.Transmit.Depth(),'pending messages will be dropped)...',terminal=False)
+        self.Session.Log('WriteFlush: At end: send=',send,', WriteProhibited=',self.WriteProhibited,', WriteQueue=',self.Transmit.Depth(),terminal=False) 
+        self.Transmit.Clear() # Delete any remaining messages in the queue.
         return result
 
     def SetLedStatus(self,status=True):
@@ -5889,8 +6200,11 @@ class microcontroller(attributemaster):
         """
             
         self.WriteFlush(send=False) # Scrap the contents of the write buffer. We're starting again.
+        self.TrajectoryBatch = [] # Scrap any trajectory segments waiting to be packed too.
+        self.FramePendingTime = None
         self.Write('# Hello controller') # Acknowledge to the microcontroller that we're restarting the conversation too.
         self.SetLedStatus(self.LedStatus) # Turn on/off the status led on the microcontroller.
+        self.OfferBinary() # The restarted firmware has forgotten any earlier negotiation.
 
     def Write(self,line):
         """ Add a new output message to the queue to be processed.
@@ -5906,7 +6220,7 @@ class microcontroller(attributemaster):
             n/a
 
             Sets ---------------------------------------------
-            n/a
+            self.Transmit
 
             Returns ------------------------------------------
             n/a
@@ -5920,9 +6234,35 @@ class microcontroller(attributemaster):
             if line[-1:] != ' ': line += ' ' # Need a space separator between fields.
             line += '[' + str(self.SendId) + ']' # Append sequential message ID. microcontroller will respond with this ID when it has received OK.
             MctlTxWindow.Print(line)
-            self.WriteQueue.append(self.AddChecksum(line)) # Add to send queue with Checksum.
-            self.Session.Log('RPi queueing (Q# ' + str(len(self.WriteQueue)) + '): ' + line,terminal=False)
-            if self.PrintComms: print(textcolor.green('RPi queueing (Q# ' + str(len(self.WriteQueue)) + '): ' + line))
+            self.Transmit.Add((self.AddChecksum(line) + '\n').encode('utf-8'),MessageClass(line),self.SendId) # Add to send queue with Checksum. Only stop and exit jump the queue.
+            self.WriteEvent.set() # Wake the CommsLoop.
+            self.Session.Log('RPi queueing (Q# ' + str(self.Transmit.Depth()) + '): ' + line,terminal=False)
+            Telemetry.Record('uart','w',True,self.Transmit.Depth(),len(line),line)
+            if self.PrintComms: print(textcolor.green('RPi queueing (Q# ' + str(self.Transmit.Depth()) + '): ' + line))
+
+    def WriteTrajectory(self,line):
+        """ Send a trajectory segment. 
+            If the microcontroller accepted binary frames the segment joins the next frame, 
+            otherwise the text line is queued as normal. 
+            
+            Parameters ---------------------------------------
+            line : Trajectory message in text format. 
+                   trajectory 20210409104504 azimuth 20210325223342 181.6003 20210325223442 181.7003 45000 47500
+
+            References ---------------------------------------
+            self.BinaryTrajectories
+
+            Sets ---------------------------------------------
+            self.TrajectoryBatch
+
+            Returns ------------------------------------------
+            n/a
+        """
+        if self.BinaryTrajectories and not self.WriteProhibited:
+            self.TrajectoryBatch.append(ParseTrajectoryLine(line))
+            self.Session.Log('RPi batching trajectory (B# ' + str(len(self.TrajectoryBatch)) + '): ' + line,terminal=False)
+        else:
+            self.Write(line)
 
 
     def CommsLoop(self,commandqueue): # Runs as own thread.
@@ -5956,7 +6296,7 @@ class microcontroller(attributemaster):
                 self.Session.Log("microcontroller.CommsLoop(): Loop slow. Took",td,"seconds.",terminal=False)
             prevloop = tn
             # Exchange messages with the microcontroller.
-            self.WritePoll() # Send next chunk of data from output buffer if allowed.
+            written = self.WritePoll() # Send next chunk of data from output buffer if allowed.
             self.ReadPoll() # Read anything waiting in the input buffer.
             if threading.main_thread().is_alive() == False: # Check if parent is still alive. Quit if it is nolonger there.
                 self.Session.Log("microcontroller.CommsLoop(): Parent thread is nolonger alive. Stopping.",level='error')
@@ -5966,7 +6306,9 @@ class microcontroller(attributemaster):
                 if ReceivedMessage == "stop":
                     self.Session.Log("microcontroller.CommsLoop(): Received 'stop' command.",terminal=False)
                     break # Terminate this loop. Will require restart by main thread.
-            time.sleep(0.01) # Need a tiny pause otherwise this hogs the processor.
+            if not written: # Nothing more can go yet. Pause until something is queued, or acknowledgements may have arrived.
+                self.WriteEvent.wait(0.01) # Need a tiny pause otherwise this hogs the processor.
+                self.WriteEvent.clear()
         self.Session.Log("microcontroller.CommsLoop(): Final WriteFlush()",terminal=False)
         self.WriteFlush(send=True) # Flush any outbound comms to the microcontroller before closing. Don't care about inbound messages.
         self.Session.Log('microcontroller.CommsLoop(): End',terminal=False)
@@ -6333,11 +6675,13 @@ class motorcontrol(attributemaster):
         self.TimeDelta = timedelta # Acceleration rate for the motor STEP signal. 
         self.StepPeriod = 0 # Time (s) of a single STEP cycle for the motor (indicating speed)
         self.TrajectorySegmentSize = 60 # Seconds.
+        self.TrajectoryPlanner = segmentplanner(minimum=self.TrajectorySegmentSize,maximum=self.TrajectorySegmentSize + 100 * int(self.TrajectorySegmentSize / 4)) # Chooses dynamic segment lengths. Same longest segment as the earlier trial and error extension.
         self.TrajectoryValid = False # Is the microcontroller trajectory valid?
         self.TrajectoryEntries = 0 # Number of trajectory entries stored on the microcontroller.
         self.TrajectoryValidUntil = None # The 'end time' of the trajectory as reported from the microcontroller.
         self.LastSentTrajectoryKey = None # Key to the last send trajectory data, we can repeat the transmission and save recalculating it sometimes.
         self.LastSentTrajectoryData = None # Last trajectory data sent to the microcontroller. This can be re-transmitted to save time if the microcontroller asks again.
+        self.LastSentTrajectoryEnd = None # UTC end of the last trajectory segment sent.
         self.OnTarget = False # Is the motor currently on target? 
         self.LatestTuneStart = None # When did motor last START a TUNE move? (Images could be blurred)
         self.LatestTuneTime = None # When did motor last COMPLETE a TUNE command? (Images could be blurred)
@@ -6352,11 +6696,14 @@ class motorcontrol(attributemaster):
         self.PositionSensorType = motor_parameters.get('PositionSensorType','unknown') # What type of position sensor is connected?
         self.PositionSensorEnabled = motor_parameters.get('PositionSensorEnabled',False) # Should a position sensor be available and used?
         self.PositionSensorTuning = motor_parameters.get('PositionSensorTuning',False) # Should the position sensor be allowed to tune the motor position?
+        self.PositionFusion = positionfusion(self.AxisStepsPerRev) # Separates sensor offset, backlash and slip. Decides when a tune is justified.
         self.reset_position_sensor() # attributes to record absolute position value from the position sensor if available.
         self.StatusMctlTimestamp = None # When did the Microcontroller send the latest status message?
         self.StatusLocalTimestamp = None # When did the RPi process the latest status message?
         self.AxisSpeed = 0.0 # Currently calculated telescope speed (degrees/second).
         self.MonitorMove = False # Set to True to enable text updates as moves are performed. False to suppress. GoToAngle(), HomePosition(), SetMotorAngle respect this.
+        self.LastSlewPredicted = None # Predicted duration (s) of the latest GOTO move.
+        self.LastSlewSeconds = None # Measured duration (s) of the latest GOTO move.
         self.MotorHalt = False # Latch set by microcontroller if MSTOP line is triggered.
         self.Restarted() # Make sure that status flags are reset for a 'new' unconfigured motor.
 
@@ -6497,11 +6844,17 @@ class motorcontrol(attributemaster):
         print("- SlowTime:",self.SlowTime,"s")
         print("  Approximate steps per second:",round((1 / (2 * self.SlowTime)),2))
         print("- TimeDelta:",self.TimeDelta,"s")
+        print(textcolor.white("Slew:"))
+        profile = self.SlewProfile()
+        print("- Predicted GOTO time for 10 degrees:",HRSeconds(int(profile.Leg(0,10).Seconds)),"90 degrees:",HRSeconds(int(profile.Leg(0,90).Seconds)))
+        print("- Latest GOTO predicted:",'n/a' if self.LastSlewPredicted == None else str(round(self.LastSlewPredicted,1)) + "s",
+              "measured:",'n/a' if self.LastSlewSeconds == None else str(round(self.LastSlewSeconds,1)) + "s")
         print(textcolor.white("Motor voltage:"))
         print("- ADC measurement:",self.VMotAdc)
         print("- Voltage estimate:",round(self.VMotVolts,2),"V")
         print(textcolor.white("Trajectory:"))
         print("- TrajectorySegmentSize:",self.TrajectorySegmentSize,"s")
+        print("- TrajectoryPlanner:",self.TrajectoryPlanner.Report())
         print("- TrajectoryValid:",self.TrajectoryValid)
         print("- TrajectoryEntries:",self.TrajectoryEntries)
         print("- TrajectoryValidUntil:",DisplayDT(self.TrajectoryValidUntil))
@@ -6516,6 +6869,7 @@ class motorcontrol(attributemaster):
         print("- position_sensor_init_angle:",self.position_sensor_init_angle)
         print("- position_sensor_init_value:",self.position_sensor_init_value)
         print("- position_sensor_angle_delta:",self.position_sensor_angle_delta)
+        print("- Fusion (steps):",self.PositionFusion.Report())
         print(textcolor.white("Tuning:"))
         print("- LatestTuneStart:",DisplayDT(self.LatestTuneStart))
         print("- LatestTuneTime:",DisplayDT(self.LatestTuneTime))
@@ -6571,6 +6925,7 @@ class motorcontrol(attributemaster):
             self.TrajectoryValidUntil
             self.LastSentTrajectoryKey
             self.LastSentTrajectoryData
+            self.LastSentTrajectoryEnd
             self.StatusMctlTimestamp
             self.StatusLocalTimestamp
             self.PreviousAngle
@@ -6586,6 +6941,7 @@ class motorcontrol(attributemaster):
         self.TrajectoryValidUntil = None # The 'end time' of the trajectory as reported from the microcontroller.
         self.LastSentTrajectoryKey = None # Key to the last send trajectory data, we can repeat the transmission and save recalculating it sometimes.
         self.LastSentTrajectoryData = None # Last trajectory data sent to the microcontroller. This can be re-transmitted to save time if the microcontroller asks again.
+        self.LastSentTrajectoryEnd = None # UTC end of the last trajectory segment sent.
         self.StatusMctlTimestamp = None # When did the Microcontroller send the status message?
         self.StatusLocalTimestamp = None # When did the RPi process the status message?
         self.PreviousAngle = None # Holds angle from previous status message.
@@ -6704,6 +7060,7 @@ class motorcontrol(attributemaster):
         self.Session.Log("Motor",self.MotorName,"received tune acknowledgement:",line,terminal=False)
         lineitems = line.split(" ") # Separate each element of the line. 
         self.LatestTuneTime = MctlStringToDatetime(lineitems[3]) # Element #3 is the timestamp of the last tune command completed.
+        self.PositionFusion.TuneComplete() # Sensor readings from now on include the tune.
         steps = TextToInt(lineitems[4])
         endtime = lineitems[3] # When did the tune complete?
         if len(lineitems) > 5: # When did the tune start?
@@ -6762,6 +7119,43 @@ class motorcontrol(attributemaster):
                     time.sleep(0.3)
             if not success: self.Session.Log("steppermotor.StoreRecoveryAngle (", self.MotorName, ") to", self.RecoveryFileName, ". Failed to write data.",level='error')
 
+    def SlewProfile(self):
+        """ Speed profile of the motor for GOTO moves. Built from the current speed settings, which change with the SpeedList.
+
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            self.FastTime, self.SlowTime, self.AxisStepsPerRev, self.SlewStepMultiplier
+            self.OptimiseMoves, self.MinAngle, self.MaxAngle, self.BacklashAngle
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            slewprofile                                      """
+        return slewprofile(self.AxisStepsPerRev,self.FastTime,self.SlowTime,slewmultiplier=self.SlewStepMultiplier,
+                           slewenabled=self.Session.Parameters.SlewEnabled(),optimisemoves=self.OptimiseMoves,
+                           minangle=self.MinAngle,maxangle=self.MaxAngle,backlash=self.BacklashAngle)
+
+    def PlanSlew(self,targetangle,backlash=True):
+        """ Fastest GOTO path from the current angle to the target angle.
+            The target may be reached through an equivalent angle (+/-360) if the motor limits allow it.
+
+            Parameters ---------------------------------------
+            targetangle (float) : Requested angle.
+            backlash (bool) : Include the pre-alignment move that takes up gear backlash.
+
+            References ---------------------------------------
+            self.CurrentAngle
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            slewpath : .Angle is the angle to send, .Legs the goto moves, .Seconds the predicted duration. """
+        return self.SlewProfile().Plan(self.CurrentAngle,targetangle,backlash=backlash)
+
     def GoToAngle(self,newangle):
         """ Trigger 'goto angle' movement of the motor via the remote microcontroller. 
             This version can accept status messages from all motors.
@@ -6790,6 +7184,12 @@ class motorcontrol(attributemaster):
             self.Session.Log('motorcontrol.GoToAngle(', self.MotorName, '): move limited to maximum', Deg3dp(self.MaxAngle,DegreeSymbol), terminal=False)
             newangle = self.MaxAngle
 
+        startangle = self.CurrentAngle # Where the move began.
+        predicted = self.SlewProfile().Leg(startangle,newangle).Seconds # How long the move should take.
+        self.LastSlewPredicted = predicted
+        self.Session.Log('motorcontrol.GoToAngle(', self.MotorName, '): Predicted move time', HRSeconds(int(predicted)), terminal=False)
+        movestart = NowUTC()
+
         self.Session.Log('motorcontrol.GoToAngle(', self.MotorName, '): Clear unprocessed messages received from microcontroller.', terminal=False)
         Mctl.ReadFlush() # Reset the input buffers. Scrap anything still waiting to be processed.
 
@@ -6844,13 +7244,14 @@ class motorcontrol(attributemaster):
             prevangletime = NowUTC()
             # 3rd task is to wait for the motor to complete.
             if self.MonitorMove: # Display movement progress.
-                print(NowHMS(),self.MotorName,textcolor.white(Deg3dp(self.CurrentAngle,DegreeSymbol)),textcolor.clearlineforward())
+                print(NowHMS(),self.MotorName,textcolor.white(Deg3dp(self.CurrentAngle,DegreeSymbol)),'ETA',HRSeconds(int(predicted)),textcolor.clearlineforward())
             while True:
                 if prevangle != self.CurrentAngle: # The motor has moved.
                     prevangle = self.CurrentAngle
                     prevangletime = NowUTC()
                     if self.MonitorMove: # Display movement progress.
-                        print(textcolor.cursorup(),NowHMS(),self.MotorName,textcolor.white(Deg3dp(self.CurrentAngle,DegreeSymbol)),textcolor.clearlineforward())
+                        remaining = max(0,int(predicted - (NowUTC() - movestart).total_seconds())) # Predicted time still to go.
+                        print(textcolor.cursorup(),NowHMS(),self.MotorName,textcolor.white(Deg3dp(self.CurrentAngle,DegreeSymbol)),'ETA',HRSeconds(remaining),textcolor.clearlineforward())
                 if self.CompareAngles(self.CurrentAngle,newangle,ptolerance=2): # Sometimes there's a mathematical disagreement between microcontroller and this software. So allow a small tolerance when comparing angles.
                     # Move complete.
                     self.Session.Log('motorcontrol.GoToAngle(', self.MotorName, '): CompareAngles considers position is within tolerance, move considered complete.',terminal=False)
@@ -6873,6 +7274,9 @@ class motorcontrol(attributemaster):
         # - Workarounds:-
         #   Move both motors by 10Degrees in any direction, which will increase the positions beyond the tolerances to allow homing again.
         self.Session.Log('motorcontrol.GoToAngle(', self.MotorName, '): Move completed: Got', Deg3dp(self.CurrentAngle,DegreeSymbol), ", expected", Deg3dp(newangle,DegreeSymbol),terminal=False)
+        if result and loopcounter <= 1: # A clean move, worth comparing with the prediction. (pilomarslew.py can summarise these from the log.)
+            self.LastSlewSeconds = (NowUTC() - movestart).total_seconds()
+            self.Session.Log('slew_trace:',self.MotorName,round(startangle,3),round(newangle,3),round(predicted,2),round(self.LastSlewSeconds,2),terminal=False)
         return result # Did we succeed?
 
     def CalculateAxisSpeed(self):
@@ -7061,11 +7465,11 @@ class motorcontrol(attributemaster):
                              self.VMotVolts, # Motor voltage estimation.
                              terminal=False) # Stepper motor pulse acceleration.
             
-    def ReceiveStatus(self,line):
+    def ReceiveStatus(self,record):
         """ Receive Status of a motor and store important parameters
             in this local motor image. 
             
-            This is usually called via CheckMotorStatus(line) which protects updates from unconfigured motors, and handles missing configurations automatically.
+            This is usually called via CheckMotorStatus(record) which protects updates from unconfigured motors, and handles missing configurations automatically.
             This also protects from unconfigured status messages, but will not directly handle the consequences.
 
         Sample message:-
@@ -7092,7 +7496,7 @@ class motorcontrol(attributemaster):
         18: Motor HALT latch set.
                                                                        
             Parameters ---------------------------------------
-            n/a
+            record : mctlmessage, parsed by ParseMotorStatus().
 
             References ---------------------------------------
             n/a
@@ -7103,56 +7507,47 @@ class motorcontrol(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        lineitems = line.split(' ')
-        configuredflag = StringToBool(lineitems[9]) # Is the motor configured?
+        configuredflag = record.Configured # Is the motor configured?
         if configuredflag != self.MotorConfigured: 
             self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): Configured flag set to ",configuredflag,terminal=False)
         self.MotorConfigured = configuredflag # Update the configured flag.
         if self.MotorConfigured: # Only believe the angle once the motor is configured, otherwise it's just a default value and probably inaccurate.
             self.PreviousAngle = self.CurrentAngle # Store previous position.
-            self.CurrentAngle = float(lineitems[8])
+            self.CurrentAngle = float(record.Items[8]) # Raises for a corrupted angle, as before.
             self.StoreRecoveryAngle() # Record the latest position of the motor for restart/recovery later.
-            self.TrajectoryValid = StringToBool(lineitems[4])
-            self.TrajectoryValidUntil = MctlStringToDatetime(lineitems[5])
-            self.TrajectoryEntries = int(lineitems[6])
-            self.OnTarget = StringToBool(lineitems[10]) # Is the motor on target?
+            self.TrajectoryValid = record.TrajectoryValid
+            self.TrajectoryValidUntil = record.ValidUntil
+            self.TrajectoryEntries = record.TrajectoryEntries
+            self.OnTarget = record.OnTarget # Is the motor on target?
         else:
             self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): Motor is not yet configured. Position and trajectory info ignored. Configuring now.",terminal=False)
             self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName, "): Check RPi<>Mctl communication if problem persists.",terminal=False)
             self.SendConfig() # Send motor configuration now.
 
         # Calculate the following attributes regardless of configuration status.
-        self.StepPeriod = float(lineitems[11])
+        self.StepPeriod = record.StepPeriod
         self.PreviousMctlTimestamp = self.StatusMctlTimestamp # Store previous timestamp
-        self.StatusMctlTimestamp = MctlStringToDatetime(lineitems[2]) # When did the Microcontroller send the status message?
+        self.StatusMctlTimestamp = record.Timestamp # When did the Microcontroller send the status message?
         self.StatusLocalTimestamp = NowUTC() # When did the RPi process the status message?
-        if len(lineitems) > 12: 
-            self.VMotAdc = int(lineitems[12]) # Store the ADC value that is measuring the motor power supply voltage.
+        if record.VMotAdc != None: 
+            self.VMotAdc = record.VMotAdc # Store the ADC value that is measuring the motor power supply voltage.
             self.VMotToVolts() # Convert that to estimated volts. Populates self.VMotVolts attribute.
         else: self.VMotAdc = self.VMotVolts = 0
-        if len(lineitems) > 15 and IsInt(lineitems[14]) and IsFloat(lineitems[15]): # We have a valid position_sensor position sensor reading.
-            self.update_position_sensor(value=int(lineitems[14]),angle=float(lineitems[15])) # Update values recorded for position_sensor position sensor.
+        if record.SensorValue != None: # We have a valid position_sensor position sensor reading.
+            self.update_position_sensor(value=record.SensorValue,angle=record.SensorAngle) # Update values recorded for position_sensor position sensor.
         else: # There is no position sensor reading available.
             self.position_sensor_value = None
-        if len(lineitems) > 16: # position_sensor configured flag is available.
-            self.position_sensor_configured = StringToBool(lineitems[16])
-        else:
-            self.position_sensor_configured = False
-        if len(lineitems) > 17: # MotorController fault flag is available.
-            temp = StringToBool(lineitems[17])
-            if temp != self.DriverFault:
-                self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): DriverFault changed to",temp,terminal=False)
-                self.DriverFault = temp
-        else:
-            self.DriverFault = False
-        if len(lineitems) > 18: # MotorHalt latch
-            temp = StringToBool(lineitems[18])
-            if temp != self.MotorHalt:
-                self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): MotorHalt changed to",temp,terminal=False)
-                self.MotorHalt = temp
-        else:
-            self.MotorHalt = False
+        self.position_sensor_configured = record.SensorConfigured # position_sensor configured flag, False if not reported.
+        if record.DriverFault != self.DriverFault: # MotorController fault flag, False if not reported.
+            if len(record.Items) > 17: self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): DriverFault changed to",record.DriverFault,terminal=False)
+            self.DriverFault = record.DriverFault
+        if record.MotorHalt != self.MotorHalt: # MotorHalt latch, False if not reported.
+            if len(record.Items) > 18: self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): MotorHalt changed to",record.MotorHalt,terminal=False)
+            self.MotorHalt = record.MotorHalt
         _ = self.CalculateAxisSpeed() # Check motor speed.
+        Telemetry.Record('motorstatus',self.MotorName,self.StatusMctlTimestamp,record.TrajectoryValid,record.TrajectoryEntries,record.Position,
+                         record.Angle,self.MotorConfigured,self.OnTarget,self.StepPeriod,self.VMotAdc,
+                         self.position_sensor_value,self.position_sensor_angle if self.position_sensor_value != None else None,self.DriverFault,self.MotorHalt)
 
         return True
         
@@ -7177,6 +7572,7 @@ class motorcontrol(attributemaster):
         self.position_sensor_init_angle = None # Initial angle nolonger known.
         self.position_sensor_init_value = None # Initial sensor value nolonger known.
         self.position_sensor_angle_delta = 0 # No difference between reported and measured angle.
+        self.PositionFusion.Reset() # Offset and backlash must be learned again.
         
     def update_position_sensor(self,value,angle):
         """ Update recorded values for position_sensor.
@@ -7202,7 +7598,31 @@ class motorcontrol(attributemaster):
             self.position_sensor_init_angle = self.CurrentAngle # Set initial angle.
             self.position_sensor_init_value = value # Set initial sensor value.
             self.position_sensor_angle_delta = 0 # No difference.
+        if value != None and self.CurrentAngle != None: self.PositionFusion.Add(self.CurrentAngle,angle) # Statistics, outliers are rejected here.
         self.position_sensor_trace() # Log values related to position sensor readings and drive behaviour.
+        self.position_sensor_tune() # Correct slip if the statistics justify it.
+
+    def position_sensor_tune(self):
+        """ Tune the motor when the position sensor shows slip that is large and statistically significant.
+            Single readings never trigger a tune, see pilomarsensorfusion.py.
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            self.PositionFusion
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            n/a
+        """
+        if not (self.PositionSensorTuning and self.position_sensor_configured and self.MotorConfigured): return
+        if len(self.OpenTuneCommands) > 0: return # Wait for earlier tunes to finish.
+        steps = self.PositionFusion.Correction()
+        if steps != None:
+            self.Session.Log('motorcontrol.position_sensor_tune(',self.MotorName,'): Correcting slip by',steps,'steps.',self.PositionFusion.Report(),terminal=False)
+            self.TunePosition(steps,slip=True)
 
 
     def SendConfig_tmc2209(self):
@@ -7407,7 +7827,7 @@ class motorcontrol(attributemaster):
         # Change angle into a number of steps (will be rounded integer result)
         return int(round(deg * float(self.AxisStepsPerRev) / 360,0))
 
-    def TunePosition(self,delta):
+    def TunePosition(self,delta,slip=False):
         """ Tune the motor position (motor steps). This corrects the position of the motor/telescope
             without registering a change in the direction it is currently pointing. 
             Use this for drift adjustment or manual finetuning of the telescope position during setup or after problems.
@@ -7420,7 +7840,10 @@ class motorcontrol(attributemaster):
             3 : steps to move
             4 : tune command reference (for acknowledgements) 
                 Parameters ---------------------------------------
-            n/a
+            delta : Steps to move.
+            slip : True if this corrects slip measured by the position sensor.
+                   False for manual and optical drift tunes, which move the axis on purpose. The position
+                   sensor offset is learned again afterwards, so any slip they removed isn't tuned again.
 
             References ---------------------------------------
             n/a
@@ -7447,6 +7870,7 @@ class motorcontrol(attributemaster):
             self.OpenTuneCommands.append(self.TuneCommandCount) # Note this as a pending tune command, it has not been completed yet.
             line = "tune " + CleanDatetimeString(str(dtn)) + ' ' + self.MotorName + " " + str(delta) + " " + str(self.TuneCommandCount)
             Mctl.Write(line)
+            self.PositionFusion.Tuned(delta,slip=slip) # The sensor error will change once the tune completes.
             # This doesn't wait for feedback, it is up to the motorcontroller to deal with the message when it sees fit.
             # This program may send further tune messages if it still needs to change things.
         else:
@@ -7469,6 +7893,7 @@ class motorcontrol(attributemaster):
                 Static means each segment of the trajectory is the same length of time. Typically very short.
                 Dynamic means that segments can vary in the time span to minimise the number of segments that need to be passed to the microcontroller.
                     Dynamic extends the length of each straight line segment as far as possible while still remaining close to the trajectory arc through the sky. 
+                    The length comes from the local angular acceleration, see pilomartrajectory.segmentplanner. 
             
             *Q*: Experiments suggest that trajectory can be very efficiently represented by angular accelerations rather than specific positions.
                  But this needs more work yet. Both the encoding here, and the decoding in the microcontroller need to be developed.
@@ -7495,7 +7920,7 @@ class motorcontrol(attributemaster):
             n/a
 
             Returns ------------------------------------------
-            n/a
+            UTC end of the segment sent, None if the trajectory is complete.
         """
         line = 'trajectory '
         nowutc = NowUTC()
@@ -7504,8 +7929,9 @@ class motorcontrol(attributemaster):
         if self.LastSentTrajectoryKey == self.TrajectoryValidUntil and self.TrajectoryValidUntil > nowutc: # We have a future result cached already for this...
             self.Session.Log('motorcontroller.ExtendTrajectory(', self.MotorName, '): Using cached trajectory calculation:', "'" + self.LastSentTrajectoryData + "'",terminal=False)
             line += self.LastSentTrajectoryData
-            Mctl.Write(line)
-            return # No need to process further.
+            Mctl.WriteTrajectory(line)
+            Telemetry.Record('trajectory',self.MotorName,None,None,None,None,None,None,True) # Resent the cached segment.
+            return self.LastSentTrajectoryEnd # No need to process further.
         if self.TrajectoryValidUntil is None: # Where does previously downloaded trajectory end? = Start of this chunk.
             startutc = nowutc
         else:
@@ -7528,35 +7954,25 @@ class motorcontrol(attributemaster):
         az, alt = targetobj.AzAltDegrees(time=Datetime2Ts(endutc)) # Needs to be Skyfield time! 
         if self.MotorName == NAME_ALTITUDE: endangle = alt
         else: endangle = az
-        gradient = (endangle - startangle) / segmentsize # What's the gradient of this trajectory segment We can try to extend its validity.
         # DynamicTrajectoryPeriods:
         # - If enabled: Each segment of the trajectory extends over a variable period of time.
         #               This is to maximise movement and minimise the number of trajectory segments required.
-        #               There's a small loss of precision as a result. But should be too small to notice.
+        #               The gap between each straight segment and the real arc stays within Parameters.TrajectoryTolerance,
+        #               except close to the zenith where the azimuth moves so fast that even the minimum segment exceeds it.
         # - If disabled: Each segment of the trajectory extends over a fixed period of time.
         #               This is slightly more precise, but has more segments to pass to the microcontroller.
         if self.Session.Parameters.UseDynamicTrajectoryPeriods and targetobj.IsFixedPoint() == False: # Cannot solve dynamic trajectories for fixed points!
             # We have the 'fixed time period' trajectory extent already calculated. 
-            # Maximise the time period for this extent so that we don't need to pass as many segments to the microcontroller.
-            MaxIterations = 100 # Always quit once MaxIterations hit.
-            while MaxIterations > 0: # Time out if max iterations hit.
-                MaxIterations -= 1 # Reduce timeout.
-                segmentsize += int(self.TrajectorySegmentSize / 4) # Increase the segment size.
-                nextutc = startutc + timedelta(seconds=segmentsize) # Timestamp of the larger segment size.
-                az, alt = targetobj.AzAltDegrees(time=Datetime2Ts(nextutc)) # Needs to be Skyfield time!
-                if self.MotorName == NAME_ALTITUDE: nextangle = alt
-                else: nextangle = az
-                if self.MinObservationAngle > nextangle or self.MaxAngle < nextangle: break # Cannot extend any further. *!*
-                projectedangle = startangle + (gradient * segmentsize) # What would the position be with the original gradient?
-                angledrift = abs(nextangle - projectedangle) # How much drift would there be from the minimum timeslot if we just used that original gradient?
-                if angledrift <= 0.005: # We can extend the time period if we remain close enough to the gradient of the minimum segment size.
-                                        # *Q* This tolerance could be measured in terms of a pixel in the camera, that's possibly what counts.
-                    endangle = nextangle
-                    endutc = nextutc
-                else: # The extended period would drift too far. Don't try anything larger.
-                    break
-            if MaxIterations <= 0: # Iteration limit hit!
-                self.Session.Log('motorcontroller.ExtendTrajectory(', self.MotorName, '): MaxIterations hit. Segment artificially limited to', endutc,terminal=False)
+            # The planner estimates the angular acceleration and picks the longest segment within the tolerance.
+            def AngleAt(seconds): # Axis angle this many seconds after the segment start.
+                az, alt = targetobj.AzAltDegrees(time=Datetime2Ts(startutc + timedelta(seconds=seconds))) # Needs to be Skyfield time!
+                if self.MotorName == NAME_ALTITUDE: return alt
+                return startangle + Wrap(az - startangle) # Continuous through the 0/360 azimuth crossing, a segment must never swing the long way round.
+            if self.MotorName != NAME_ALTITUDE: endangle = startangle + Wrap(endangle - startangle) # Same unwrap as AngleAt().
+            segmentsize, endangle = self.TrajectoryPlanner.Plan(AngleAt,tolerance=self.Session.Parameters.TrajectoryTolerance,
+                                                                low=self.MinObservationAngle,high=self.MaxAngle,
+                                                                known={0:startangle,segmentsize:endangle}) # Re-use the angles already calculated.
+            endutc = startutc + timedelta(seconds=segmentsize)
         line += CleanDatetimeString(str(endutc)) + ' '
         line += str(endangle) + ' '
         startpos = int(self.AngleToStep(startangle))
@@ -7569,12 +7985,16 @@ class motorcontrol(attributemaster):
                  startpos,'-',endpos,'steps', \
                  terminal=False)
         if endangle >= self.MinObservationAngle and endangle <= self.MaxAngle: # We're still within range. *!*
-            Mctl.Write(line)
+            Mctl.WriteTrajectory(line)
+            Telemetry.Record('trajectory',self.MotorName,startutc,startangle,endutc,endangle,startpos,endpos,False)
             self.LastSentTrajectoryKey = self.TrajectoryValidUntil # Cache the trajectory calculation, if the same calculation is triggered, we can re-use the earlier copy for speed.
             self.LastSentTrajectoryData = line[26:] # Store the data sent (without the leading timestamp, a fresh timestamp will be used if resent). 
+            self.LastSentTrajectoryEnd = endutc
             self.Session.Log('motorcontroller.ExtendTrajectory(', self.MotorName, '): Cached trajectory calculation:', "'" + self.LastSentTrajectoryData + "'",terminal=False)
+            return endutc
         else:
             self.Session.Log('motorcontroller.ExtendTrajectory(' + self.MotorName + '): Trajectory is now complete.',terminal=False)
+            return None
 
 # ------------------------------------------------------------------------------------------------------
 
@@ -7654,6 +8074,7 @@ class obs_session(attributemaster):
         self.TerminateMctlHandler = False # Set to TRUE to cause MctlHandler loop to terminate.
         self.ControllerVersion = 'unknown' # The microcontroller should report its software version number and store it here.
         self.TimeDiff = None # Timedelta between remote clock and local clock (includes messaging delays).
+        self.Dispatcher = self.MessageDispatcher() # Routes microcontroller messages to their handlers.
         
     def Reset(self):
         """
@@ -7736,7 +8157,7 @@ class obs_session(attributemaster):
         Mctl.Write('clear trajectory') # Remove any existing trajectory from the motors.
         self.SetMotorControlMode('idle') # We nolonger need to maintain a trajectory.
         
-    def CheckCpuStatus(self,line):
+    def CheckCpuStatus(self,record):
         """ RP2350 sends cpu status messages back too. 
             Monitor these especially if heavily overclocking the microcontroller.
         
@@ -7754,7 +8175,7 @@ class obs_session(attributemaster):
              9 = Feature list from microcontroller. ('_' separated)
             
                 Parameters ---------------------------------------
-            n/a
+            record : mctlmessage, parsed by ParseCpuStatus().
 
             References ---------------------------------------
             n/a
@@ -7765,18 +8186,17 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        lineitems = line.split(' ')
-        Mctl.ReportedResetReason = lineitems[3] # eg 'POWER_ON' # RESET REASON if reported.
-        Mctl.ReportedClockspeed = 1e6 * float(lineitems[4]) # Clock speed in MHz
-        if IsFloat(lineitems[5]): Mctl.ReportedVoltage = float(lineitems[5]) # CPU voltage if known
+        Mctl.ReportedResetReason = record.ResetReason # eg 'POWER_ON' # RESET REASON if reported.
+        Mctl.ReportedClockspeed = record.Clockspeed # Clock speed in Hz
+        if record.Voltage != None: Mctl.ReportedVoltage = record.Voltage # CPU voltage if known
         else: Mctl.ReportedVoltage = 0.0 # Nothing reported.
-        Mctl.ReportedMemAlloc = int(lineitems[6]) # Memory allocated (bytes)
-        Mctl.ReportedMemFree = int(lineitems[7]) # Memory free (bytes)
-        Mctl.ReportedTemperature = float(lineitems[8]) # CPU temperature (C)
-        if len(lineitems) > 9: # Get the feature list from the microcontroller software.
-            Mctl.ReportedFeatures = lineitems[9].split('_')
+        Mctl.ReportedMemAlloc = record.MemAlloc # Memory allocated (bytes)
+        Mctl.ReportedMemFree = record.MemFree # Memory free (bytes)
+        Mctl.ReportedTemperature = record.Temperature # CPU temperature (C)
+        if record.Features != None: # Get the feature list from the microcontroller software.
+            Mctl.ReportedFeatures = record.Features
         
-    def CheckMotorStatus(self,line):
+    def CheckMotorStatus(self,record):
         """ Check the Microcontroller's status message.
             - If it reports that the motor is configured, update the motor status information from this message.
             - If it reports that the motor is NOT configured, then send the configuration immediately.
@@ -7789,7 +8209,7 @@ class obs_session(attributemaster):
             #     0     1           2          3    4     5          6   7     8      9 10  11    12   13  14   15 16 17 18
                                                                                             
     Parameters ---------------------------------------
-            n/a
+            record : mctlmessage, parsed by ParseMotorStatus().
 
             References ---------------------------------------
             n/a
@@ -7800,18 +8220,17 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        lineitems = line.split(' ') # Split out all the elements of the line.
-        motorname = lineitems[3] # Extract motor name.
+        motorname = record.Motor # Extract motor name.
         foundit = False
         for i in MotorControls:
             if i.MotorName == motorname:
                 foundit = True
-                i.ReceiveStatus(line) # Update motor status information.
-        self.CheckTrajectory(line,self.Target) # Check observation is active and keep trajectory up-to-date if needed.
+                i.ReceiveStatus(record) # Update motor status information.
+        self.CheckTrajectory(record,self.Target) # Check observation is active and keep trajectory up-to-date if needed.
         if not foundit: # The motor name was not recognised.
             self.Session.Log('obs_session.CheckMotorStatus did not recognise the motor name (',motorname, ')', level='error')
 
-    def CheckSessionStatus(self,line):
+    def CheckSessionStatus(self,record):
         """ Check the Microcontroller's status message to see if the session is configured. 
             If the time needs synchronising, do that immediately. 
 
@@ -7828,7 +8247,7 @@ class obs_session(attributemaster):
         9: Microcontroller exception count (if available) 
         10: Microcontroller code.py version (if available) 
             Parameters ---------------------------------------
-            n/a
+            record : mctlmessage, parsed by ParseSessionStatus().
 
             References ---------------------------------------
             n/a
@@ -7839,21 +8258,17 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        lineitems = line.split(' ')
-        remotetime = MctlStringToDatetime(lineitems[2]) # What does the remote system report as the time?
+        remotetime = record.Timestamp # What does the remote system report as the time?
         self.TimeDiff = NowUTC() - remotetime # What's the time difference?
-        Mctl.ClockSynchronised = StringToBool(lineitems[3])
-        Mctl.AutonomousControl = StringToBool(lineitems[4])
-        Mctl.RemoteControl = StringToBool(lineitems[5])
-        Mctl.MctlLifeSeconds = int(lineitems[6])
-        if len(lineitems) > 7: # How many times has the microcontroller flushed the trajectory because of comms problems?
-            self.TrajectorySafetyFlushes = int(lineitems[7])
-        else:
-            self.TrajectorySafetyFlushes = 0
-        if len(lineitems) > 9: # Exception count is included in the message.
-           Mctl.MctlExceptionCount = int(lineitems[9])
-        if len(lineitems) > 10: # Code.py version number is available.
-           self.ControllerVersion = lineitems[10]
+        Mctl.ClockSynchronised = record.ClockSynchronised
+        Mctl.AutonomousControl = record.AutonomousControl
+        Mctl.RemoteControl = record.RemoteControl
+        Mctl.MctlLifeSeconds = record.LifeSeconds
+        self.TrajectorySafetyFlushes = record.SafetyFlushes # How many times has the microcontroller flushed the trajectory because of comms problems?
+        if record.ExceptionCount != None: # Exception count is included in the message.
+           Mctl.MctlExceptionCount = record.ExceptionCount
+        if record.Version != None: # Code.py version number is available.
+           self.ControllerVersion = record.Version
         if Mctl.ClockSynchronised == False: # Clock has not yet been synchronised.
             # Synchronise clocks.
             line = 'set time ' + CleanDatetimeString(str(NowUTC()))
@@ -7861,7 +8276,7 @@ class obs_session(attributemaster):
         if Mctl.ClockSynchronised: temp = 'Synchronised'
         else: temp = 'Unsynchronised'
 
-    def CheckCommsStats(self,line):
+    def CheckCommsStats(self,record):
         """ Check the Microcontroller's comms status message for stats.
                    comms status 20210409090929 0 0 538 0
                     0      1           2       3 4  5  6
@@ -7871,7 +8286,7 @@ class obs_session(attributemaster):
         5: str(RPi.CharactersWritten) How many bytes written by Microcontroller to RPi.
         6: str(RPi.WriteDrops) How many messages were dropped due to buffer overflow?  
             Parameters ---------------------------------------
-            n/a
+            record : mctlmessage, parsed by ParseCommsStatus().
 
             References ---------------------------------------
             n/a
@@ -7882,13 +8297,12 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        lineitems = line.split(' ')
-        Mctl.MctlRxErrors = int(lineitems[3])
-        Mctl.MctlRxBytes = int(lineitems[4])
-        Mctl.MctlTxBytes = int(lineitems[5])
-        Mctl.MctlWriteDrops = int(lineitems[6])
+        Mctl.MctlRxErrors = record.RxErrors
+        Mctl.MctlRxBytes = record.RxBytes
+        Mctl.MctlTxBytes = record.TxBytes
+        Mctl.MctlWriteDrops = record.WriteDrops
 
-    def CheckTrajectory(self,line,targetobj): # Needs reworking for actual Skyfield trajectory.
+    def CheckTrajectory(self,record,targetobj): # Needs reworking for actual Skyfield trajectory.
         """ Check the Microcontroller's status message to see if the trajectory is known.
             If it is not known far enough into the future, extend it by a single 'TrajectoryPoint'
             when that one is confirmed back by the Microcontroller, we may add another... 
@@ -7903,7 +8317,8 @@ class obs_session(attributemaster):
             8: str(self.CurrentAngle) + ' '
             9: BoolToString(self.MotorConfigured) + ' ' # MotorConfigured  
                 Parameters ---------------------------------------
-            n/a
+            record : mctlmessage, parsed by ParseMotorStatus().
+            targetobj : The target being tracked.
 
             References ---------------------------------------
             n/a
@@ -7914,27 +8329,69 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        lineitems = line.split(' ')
-        motorname = lineitems[3]
+        motorname = record.Motor
         # This should only send a trajectory update IF we're TRACKING something!
         if self.MaintainTrajectory:
             foundit = False
             for i in MotorControls:
                 if i.MotorName == motorname:
                    foundit = True
-                   i.TrajectoryEntries = int(lineitems[6])
-                   i.TrajectoryValid = StringToBool(lineitems[4])
-                   i.TrajectoryValidUntil = MctlStringToDatetime(lineitems[5])
+                   i.TrajectoryEntries = record.TrajectoryEntries
+                   i.TrajectoryValid = record.TrajectoryValid
+                   i.TrajectoryValidUntil = record.ValidUntil
                    duration = i.TrajectoryValidUntil - NowUTC()
                    #if duration.total_seconds() < Parameters.TrajectoryWindow and self.ClockSynchronised: # We need to add time to the trajectory plan.
                    if duration.total_seconds() < Parameters.TrajectoryWindow and Mctl.ClockSynchronised: # We need to add time to the trajectory plan.
-                       self.Session.Log('obs_session.CheckTrajectory: Decided to extend.',terminal=False)
-                       i.ExtendTrajectory(targetobj)
+                       if not Mctl.BinaryTrajectories: # Text protocol, one segment per status message.
+                           self.Session.Log('obs_session.CheckTrajectory: Decided to extend.',terminal=False)
+                           i.ExtendTrajectory(targetobj)
+                       elif not Mctl.FramePending(): # Binary frames, fill the window in one go.
+                           self.Session.Log('obs_session.CheckTrajectory: Decided to extend (binary).',terminal=False)
+                           for n in range(Mctl.BinaryFrameSegments): # Limit the batch, the next acknowledgement triggers more.
+                               endutc = i.ExtendTrajectory(targetobj)
+                               if endutc is None: break # Trajectory is complete.
+                               i.TrajectoryValidUntil = endutc # Next segment starts where this one ends.
+                               if (endutc - NowUTC()).total_seconds() >= Parameters.TrajectoryWindow: break # Window is full.
             if not foundit: # The motor name was not recognised.
                 self.Session.Log('obs_session.CheckTrajectory did not recognise the motor name (',motorname, ')', level='error')
 
 
-    def CheckControllerStarted(self,line):
+    def CheckBinary(self,record):
+        """ Handle binary frame negotiation and acknowledgements from the Microcontroller.
+            binary accept 1
+            binary ack 12 16 16
+                0   1   2  3  4
+            2 = Frame sequence number.
+            3 = Segments accepted.
+            4 = Segments in the frame.
+
+            Parameters ---------------------------------------
+            record : mctlmessage, parsed by ParseBinary().
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            Mctl.BinaryTrajectories
+            Mctl frame counters
+
+            Returns ------------------------------------------
+            n/a
+        """
+        if record.Action == 'accept' and record.Sequence != None:
+            Mctl.BinaryTrajectories = Parameters.MctlBinaryFrames # Trajectories are sent in binary frames from now on.
+            self.Session.Log('obs_session.CheckBinary: Microcontroller accepted binary frames version',record.Sequence,terminal=False)
+        elif record.Action == 'ack' and hasattr(record,'Segments'):
+            Mctl.FramesAcknowledged += 1
+            if record.Sequence == str((Mctl.FrameSequence - 1) & 0xFFFF): Mctl.FramePendingTime = None # Latest frame arrived, more can be sent.
+            rejected = record.Segments - record.Accepted
+            if rejected > 0:
+                Mctl.FrameSegmentsRejected += rejected
+                self.Session.Log('obs_session.CheckBinary: Microcontroller rejected',rejected,'segments from frame',record.Sequence,terminal=False)
+        else:
+            self.UnrecognisedMessage(record)
+
+    def CheckControllerStarted(self,record):
         """     Parameters ---------------------------------------
             n/a
 
@@ -7953,7 +8410,7 @@ class obs_session(attributemaster):
         self.Session.Log('obs_session:CheckControllerStarted(): Microcontroller reports restart.',terminal=False)
         ErrorWindow.Print(NowHMS() + ' Microcontroller reports restart.')
         
-    def CheckGotoRejected(self,line):
+    def CheckGotoRejected(self,record):
         """     Parameters ---------------------------------------
             n/a
 
@@ -7967,9 +8424,9 @@ class obs_session(attributemaster):
             n/a
         """
         self.Session.Log('obs_session:MctlHandler(): Microcontroller rejected goto command.',terminal=False)
-        ErrorWindow.Print(NowHMS() + ' Microcontroller rejected goto command: ' + line)
+        ErrorWindow.Print(NowHMS() + ' Microcontroller rejected goto command: ' + record.Line)
     
-    def CheckTuneComplete(self,line): # A tune command has been processed.
+    def CheckTuneComplete(self,record): # A tune command has been processed.
         """ tune complete {name} {endtime} {delta} {starttime} 
               0     1       2        3        4        5        
                   Parameters ---------------------------------------
@@ -7985,16 +8442,15 @@ class obs_session(attributemaster):
             n/a
         """
         foundit = False
-        lineitems = line.split(' ')
-        motorname = lineitems[2] # Which motor?
+        motorname = record.Motor # Which motor?
         for i in MotorControls:
             if i.MotorName == motorname:
-                i.TuneComplete(line)
+                i.TuneComplete(record.Line)
                 foundit = True
         if not foundit: # The motor name was not recognised.
             self.Session.Log('obs_session.CheckTuneComplete did not recognise the motor name (',motorname, ')', level='error')
 
-    def UnrecognisedMessage(self,line):
+    def UnrecognisedMessage(self,record):
         """     Parameters ---------------------------------------
             n/a
 
@@ -8007,8 +8463,8 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        self.Session.Log('obs_session:UnrecognisedMessage():',line,terminal=False)
-        ErrorWindow.Print(NowHMS() + ' Unrecognised message: ' + line)
+        self.Session.Log('obs_session:UnrecognisedMessage():',record.Line,terminal=False)
+        ErrorWindow.Print(NowHMS() + ' Unrecognised message: ' + record.Line)
 
     def ValidControllerVersion(self):
         """ Return TRUE if controller version is known and acceptable.
@@ -8037,7 +8493,7 @@ class obs_session(attributemaster):
                 self.Session.Log('obs_session.ValidControllerVersion(): Failed with',str(e),level='error')
         return result
 
-    def CheckControllerVersion(self,line):
+    def CheckControllerVersion(self,record):
         """ Handle controller version message. 
             Message looks like this :-
             
@@ -8059,8 +8515,8 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        self.Session.Log('obs_session:CheckControllerVersion(): ' + line,terminal=False)
-        lineitems = line.split(' ')
+        self.Session.Log('obs_session:CheckControllerVersion(): ' + record.Line,terminal=False)
+        lineitems = record.Items
         result = False
         if len(lineitems) > 2:
             self.ControllerVersion = lineitems[2]
@@ -8075,10 +8531,10 @@ class obs_session(attributemaster):
                 self.Session.Log('obs_session.CheckControllerVersion(): Failed to check',self.ControllerVersion,level='error')
                 self.Session.Log('obs_session.CheckControllerVersion(): Failed with',str(e),level='error')
         else:
-            self.Session.Log('obs_session.CheckControllerVersion(): Response is incomplete:',line,level='warning')
+            self.Session.Log('obs_session.CheckControllerVersion(): Response is incomplete:',record.Line,level='warning')
         return result
 
-    def MctlPinStatus(self,line):
+    def MctlPinStatus(self,record):
         """ Save the status of the pins from the microcontroller locally. 
             This is a development feature supported by Tiny2350. (Not on Tiny2040 version).
             Received a line like this from the microcontroller....
@@ -8096,9 +8552,9 @@ class obs_session(attributemaster):
             Returns ------------------------------------------
             n/a
         """
-        self.Session.Log('obs_session.MctlPinStatus(): Received',line,terminal=False)
+        self.Session.Log('obs_session.MctlPinStatus(): Received',record.Line,terminal=False)
         i = 3 # Start reading the entries out of the received message and update the information in a local dictionary.
-        lineitems = line.split(' ')
+        lineitems = record.Items
         while i < len(lineitems): # Keep reading pin status entries until the whole line has been processed.
             p_num = lineitems[i]
             p_name = lineitems[i + 1]
@@ -8108,6 +8564,39 @@ class obs_session(attributemaster):
             self.MctlPinDict[p_num] = dict_entry
             i += 3 # Move on to next entry.
 
+    def MessageDispatcher(self):
+        """ Build the dispatch table for messages from the microcontroller.
+            Each message is split once, the parser for its verb converts the fields into a typed record,
+            then the handler receives the record. Verbs without a handler are just counted, they are already
+            logged by microcontroller.ReadPoll().
+                Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            messagedispatcher
+        """
+        dispatcher = messagedispatcher(timestamp=MctlStringToDatetime)
+        dispatcher.Register('session status',self.CheckSessionStatus,ParseSessionStatus) # Gather information about the microcontroller general health.
+        dispatcher.Register('comms status',self.CheckCommsStats,ParseCommsStatus) # Gather statistics about UART communication handling.
+        dispatcher.Register('cpu status',self.CheckCpuStatus,ParseCpuStatus) # Check CPU status information from the microcontroller.
+        dispatcher.Register('motor status',self.CheckMotorStatus,ParseMotorStatus) # Check motor info from microcontroller, respond with missing config etc.
+        dispatcher.Register('controller version',self.CheckControllerVersion) # Check that software is compatible across devices.
+        dispatcher.Register('goto rejected',self.CheckGotoRejected) # A goto command was rejected.
+        dispatcher.Register('tune complete',self.CheckTuneComplete,ParseMotorName) # A tune command has been processed.
+        dispatcher.Register('controller started',self.CheckControllerStarted) # Microcontroller reports a restart. Trigger chain of updates.
+        dispatcher.Register('pin status',self.MctlPinStatus) # Store the reported pin status from the microcontroller.
+        dispatcher.Register('binary',self.CheckBinary,ParseBinary) # Binary frame negotiation and acknowledgements.
+        for verb in ('controller log','log','cleared trajectory','controller heartbeat','heartbeat','acknowledged','defined motors','#'):
+            dispatcher.Register(verb) # Just log these. No action needed.
+        dispatcher.RegisterUnrecognised(self.UnrecognisedMessage) # Unexpected or corrupted message.
+        return dispatcher
+
     def MctlHandler(self):
         """ Handles incoming messages from microcontroller queue,
             updates status information in various objects,
@@ -8141,26 +8630,8 @@ class obs_session(attributemaster):
                     break
                 if len(Mctl.Lines) > 0: # Something to handle.
                     line = Mctl.Read() # Pull next available message from microcontroller.
-                    # Are all the same messages received, processed, logged or ignored in the same way?
                     if len(line) > 0: # Data to process.
-                        if line.startswith('session'): self.CheckSessionStatus(line) # Gather information about the microcontroller general health.
-                        elif line.startswith('comms'): self.CheckCommsStats(line) # Gather statistics about UART communication handling.
-                        elif line.startswith('controller log'): pass # Just log messages from the microcontroller. No action needed.
-                        elif line.startswith('log'): pass # Just log messages from the microcontroller. No action needed.
-                        elif line.startswith('cleared trajectory'): pass # Just log these.
-                        elif line.startswith('cpu status'): self.CheckCpuStatus(line) # Check CPU status information from the microcontroller.
-                        elif line.startswith('motor'): self.CheckMotorStatus(line) # Check motor info from microcontroller, respond with missing config etc.
-                        elif line.startswith('controller heartbeat'): pass # Just log these.
-                        elif line.startswith('heartbeat'): pass # Just log these.
-                        elif line.startswith('acknowledged'): pass # Just log these.
-                        elif line.startswith('#'): pass # Comments from microcontroller, ignore them.
-                        elif line.startswith('controller version'): self.CheckControllerVersion(line) # Check that software is compatible across devices.
-                        elif line.startswith('goto rejected'): self.CheckGotoRejected(line) # A goto command was rejected.
-                        elif line.startswith('tune complete'): self.CheckTuneComplete(line) # A tune command has been processed.
-                        elif line.startswith('controller started'): self.CheckControllerStarted(line) # Microcontroller reports a restart. Trigger chain of updates.
-                        elif line.startswith('pin status'): self.MctlPinStatus(line) # Store the reported pin status from the microcontroller. 
-                        elif line.startswith('defined motors'): pass # Just log these.
-                        else: self.UnrecognisedMessage(line) # Unexpected or corrupted message.
+                        self.Dispatcher.Dispatch(line) # Parse once and route by verb. See MessageDispatcher().
                 else: time.sleep(0.1) #  Nothing received this round, so pause to release the pressure on the CPU!
                 # Send occassional heartbeat signal to keep line alive.
                 if heartbeat.Due(): # Microcontroller will panic and flush trajectories if comms goes silent for too long.
@@ -8211,7 +8682,7 @@ class obs_session(attributemaster):
         SessionWindow.Clear(immediate=False)
         SessionWindow.FieldValue('RQ',len(Mctl.Lines)) # Messages: Rx queued
         SessionWindow.FieldValue('RT',Mctl.LinesReceived) # Messages: Rx total
-        SessionWindow.FieldValue('TQ',len(Mctl.WriteQueue)) # Messages: Tx queued
+        SessionWindow.FieldValue('TQ',Mctl.Transmit.Depth()) # Messages: Tx queued
         SessionWindow.FieldValue('TT',Mctl.LinesSent) # Messages: Tx total
         SessionWindow.FieldValue('SR',Mctl.ResetAttempts) # Reset attempts
         SessionWindow.RangeFieldColor('SR',lowlow=-100,low=-10,high=1,highhigh=100) # Anything >= 1 is a POOR value.
@@ -8222,6 +8693,8 @@ class obs_session(attributemaster):
         SessionWindow.FieldValue('BX',HRBytes(Mctl.BytesReceived)) # RPi measure of bytes received.
         SessionWindow.FieldValue('TX',HRBytes(Mctl.BytesSent)) # RPi measure of bytes sent.
         SessionWindow.FieldValue('RE',Mctl.RxErrors) # RPi measure of receive errors.
+        latency = Mctl.Transmit.Latency(99) # Seconds from queueing to transmission.
+        SessionWindow.FieldValue('TL','-' if latency is None else str(round(latency,1)) + 's') # RPi write latency (99th percentile).
         SessionWindow.RangeFieldColor('RE',lowlow=-100,low=-10,high=1,highhigh=100) # Anything >= 1 is a POOR value.
         if Mctl.MctlLifeSeconds > 0: # Microcontroller comms stats, including rate.
             rbps = int(Mctl.MctlRxBytes / Mctl.MctlLifeSeconds)
@@ -8926,6 +9399,7 @@ class imagetracker(attributemaster):
         CameraWindow.Print(NowHMS() + " " + filename.split('/')[-1]) # Note the filename that's been generated.
         DriftWindow.Print(NowHMS() + " Drift analysis image " + str(zone) + " done.") # Note analysis done.
         NewImageBuffer.SaveFile(filename)
+        FolderHandler.RegisterFile(filename) # Keep the folder manifest up to date.
         self.Log("ImageTracker.SaveTrackingAnalysis: End",terminal=False)
 
     def SetLatestImage(self,cvimagebuffer,timestamp=None):
@@ -11021,11 +11495,11 @@ class target(attributemaster):
             result = False
         return result
 
-    def Visible(self,time=None):
+    def Visible(self,time=None,azalt=None):
         """ Return TRUE if the target is currently in a portion of the sky that the telescope can observe. 
             Return FALSE if the target is outside the observable portion of the sky. 
                 Parameters ---------------------------------------
-            n/a
+            azalt (tuple) : Optional (az, alt) already calculated for this moment. Saves calculating the position again.
 
             References ---------------------------------------
             n/a
@@ -11037,7 +11511,8 @@ class target(attributemaster):
             n/a
         """
         result = True
-        az, alt = self.AzAltDegrees(time=time)
+        if azalt != None: az, alt = azalt
+        else: az, alt = self.AzAltDegrees(time=time)
         for i in MotorControls:
             if i.MotorName == NAME_AZIMUTH:
                 if az < i.MinAngle or az > i.MaxAngle: result = False
@@ -11045,11 +11520,11 @@ class target(attributemaster):
                 if alt < i.MinObservationAngle or alt > i.MaxAngle: result = False # *!*
         return result
     
-    def ApproachingLimit(self,time=None):
+    def ApproachingLimit(self,time=None,azalt=None):
         """ Return TRUE if the target is approaching the limit of telescope movement. 
             else FALSE. 
                 Parameters ---------------------------------------
-            n/a
+            azalt (tuple) : Optional (az, alt) already calculated for this moment. Saves calculating the position again.
 
             References ---------------------------------------
             n/a
@@ -11061,7 +11536,8 @@ class target(attributemaster):
             n/a
         """
         result = False
-        az, alt = self.AzAltDegrees(time=time)
+        if azalt != None: az, alt = azalt
+        else: az, alt = self.AzAltDegrees(time=time)
         for i in MotorControls:
             if i.MotorName == NAME_AZIMUTH:
                 if az <= i.MinWarningAngle or az >= i.MaxWarningAngle: result = True
@@ -14160,11 +14636,14 @@ def SplitText(inputline,separators=[' ']):
 
 # ------------------------------------------------------------------------------------------------------
 
-def MarkupPreview(drift_pixels_x=None,drift_pixels_y=None,astrotime=None,overlay=False,filename=None):
+def MarkupPreview(drift_pixels_x=None,drift_pixels_y=None,astrotime=None,overlay=False,filename=None,timelapse=None,imagebuffer=None,captureend=None):
     """ Take the last image registered in CameraInUse.Image and mark up various alignment indicators and labels.
         astrotime = You can specify the date/time that the preview is calculated for.
         overlay = True: A 4 channel transparent image is created, can be used as an overlay. 
         filename = Override default filename with a specific value. 
+        timelapse = pilomartimelapse instance. The finished preview is added to the movie straight from memory.
+        imagebuffer = Image to mark up instead of CameraInUse.Image.ImageBuffer. (The capture pipeline passes the frame it was given.)
+        captureend = Capture end time of that image instead of CameraInUse.CaptureEnd.
             Parameters ---------------------------------------
             n/a
 
@@ -14184,8 +14663,10 @@ def MarkupPreview(drift_pixels_x=None,drift_pixels_y=None,astrotime=None,overlay
     else: 
         t = SkyfieldNow() # Current timestamp in 'astro' time. If there's a delay then there may be some mismatch in placing objects. # Offset supported.
     CamLog.Log("MarkupPreview: MarkupTime:",Ts2Datetime(t),terminal=False)
+    if imagebuffer is None: imagebuffer = CameraInUse.Image.ImageBuffer # Default to the last image captured.
+    if captureend == None: captureend = CameraInUse.CaptureEnd
     CamLog.Log("MarkupPreview: CameraInUse.CaptureStart:",CameraInUse.CaptureStart,terminal=False)
-    CamLog.Log("MarkupPreview: CameraInUse.CaptureEnd:",CameraInUse.CaptureEnd,terminal=False)
+    CamLog.Log("MarkupPreview: CaptureEnd:",captureend,terminal=False)
     # The time should be the time of the actual photo! If several seconds have passed, then things will already have drifted!
     if Parameters.UseLiveLocation: # Use the live target location rather than the last reported camera position for image processing.
         CentreAz, CentreAlt = ObsSession.Target.AzAltDegrees() # What is the alt/az location of the centre of the image?
@@ -14199,7 +14680,7 @@ def MarkupPreview(drift_pixels_x=None,drift_pixels_y=None,astrotime=None,overlay
     CamLog.Log("MarkupPreview: ObjectCatalog contains",len(ObjCat.CatalogDict),"entries.",terminal=False)
     # load the image
     NewImageBuffer = pilomarimage(name='preview',logger=CamLog)
-    NewImageBuffer.LoadBuffer(CameraInUse.Image.ImageBuffer) # Take it directly from memory
+    NewImageBuffer.LoadBuffer(imagebuffer) # Take it directly from memory
     if overlay: # In overlay mode, create bgra image with all pixels transparent by default.
         NewImageBuffer.ChangeType('bgra') # Make sure it's a colour image.
         NewImageBuffer.FillColor((0,0,0,0)) # Set all pixels to transparent.
@@ -14665,13 +15146,13 @@ def MarkupPreview(drift_pixels_x=None,drift_pixels_y=None,astrotime=None,overlay
         
         # Show target location at the end of the photo capture as a cyan circle. Should be close to the centre crosshairs.
         NewImageBuffer.SetPenColor(pilomarimage.BGR('Cyan'))
-        astrotimeend = Datetime2Ts(CameraInUse.CaptureEnd)
+        astrotimeend = Datetime2Ts(captureend)
         end_az_degree, end_alt_degree = ObsSession.Target.AzAltDegrees(time=astrotimeend) # Get estimated current camera position. Not necessarily the same as the target location, there may be a very small difference.
         TempStarX, TempStarY = ImageAltAz(end_alt_degree,end_az_degree,CentreAlt,CentreAz,height,width) # Combine RelativeAltAz() and PlotRelativeAltAz()
         NewImageBuffer.DrawCircle(TempStarX,TempStarY,10,thickness=3)
         x,y = VectorToPixel(centrex,centrey,600,130)
         NewImageBuffer.DrawEdgeLine((TempStarX,TempStarY),(x,y),edgecolor=pilomarimage.BGR('Black'))
-        NewImageBuffer.AddEdgeText('Photo end ' + str(CameraInUse.CaptureEnd),x,y,edgecolor=pilomarimage.BGR('Black'))
+        NewImageBuffer.AddEdgeText('Photo end ' + str(captureend),x,y,edgecolor=pilomarimage.BGR('Black'))
         NewImageBuffer.AddEdgeText(AzAltText(end_az_degree,end_alt_degree,symbol='deg'),x,NewImageBuffer.NextTextY,edgecolor=pilomarimage.BGR('Black'))
         
     if True: # Mark last measured DRIFT indicator.
@@ -14770,7 +15251,10 @@ def MarkupPreview(drift_pixels_x=None,drift_pixels_y=None,astrotime=None,overlay
         CamLog.Log("MarkupPreview: SaveDraft",filename,terminal=False)
         CameraWindow.Print(NowHMS() + " " + filename.split('/')[-1]) # Show the preview filename that's being generated.
         NewImageBuffer.SaveFile(filename)
+        FolderHandler.RegisterFile(filename) # Keep the folder manifest up to date.
         CameraInUse.Previewjpg = filename # Record the filename so that the web interface can access it.
+        if timelapse != None and timelapse.Active(): # Add to the preview movie while the image is still in memory.
+            timelapse.AddFrame(NewImageBuffer)
 
     CamLog.Log("MarkupPreview: Elapsed time ",str((NowUTC() - RoutineStart).total_seconds()),terminal=False)
     CamLog.Log("MarkupPreview: End",terminal=False)
@@ -15620,20 +16104,16 @@ def ImageCount_Session():
     result = ''
     campaignkey = FolderHandler.GetPath('campaign') # Only interested in files within the campaign structure.
     imagetypes = ['jpg','dng','fits']
+    FolderHandler.CheckManifests() # Periodic consistency check of the manifests against the disc. (Rate limited)
     for key,value in FolderHandler.FolderList.items(): # Python3: Check each folder.
         vpath = value['path'] # Get the path.
         if not value['exists']: continue # Folder hasn't been created yet.
         if vpath.startswith(campaignkey):
-            filelist = []
             try:
-                for file in os.listdir(vpath): # List files in folder.
-                    filename = file.split('.')[0]
-                    filetype = file.split('.')[-1]
-                    if filetype in imagetypes: # It's an image file.
-                        if not filename in filelist: filelist.append(filename) # list of unique filenames (minus filetype).
+                count = FolderHandler.Manifest(vpath).Count(imagetypes,unique=True) # Unique filenames (minus filetype) from the folder's manifest, not a directory listing.
             except Exception as e:
                 MainLog.Log("ImageCount_Session: Failed with:",e,level='warning') # Allow graceful failure in case the folder nolonger exists.
-            count = len(filelist)
+                count = 0
             if count > 0: # Only report the folder if there's something in it.
                 result += key + '=' + str(count) + ' ' # Abbreviate image type and number of images.
     if result == '': result = 'None'
@@ -15662,18 +16142,17 @@ def ImageCount_Campaign():
     if Parameters.CameraEnabled != True: selext = '.jpg' # No camera, so only count the simulated jpgs.
     elif CameraInUse.FastImageCapture: selext = '.jpg' # Fast image capture, only initial jpgs exist so far.
     elif CameraInUse.CameraSaveJpg: selext = '.jpg' # Looking for .jpg will detect more than .dng
-    elif CameraInUse.CameraSaveFits: select = '.fits'
+    elif CameraInUse.CameraSaveFits: selext = '.fits'
     elif CameraInUse.CameraSaveDng: selext = '.dng'
     else: selext = '.jpg'
     basedir = FolderHandler.GetPath('campaign')
-    MainLog.Log("ImageCount_Campaign: basedir",basedir,terminal=False)
-    searchpath = basedir + "/**/*" + selext
-    MainLog.Log("ImageCount_Campaign: searchpath",searchpath,terminal=False)
+    MainLog.Log("ImageCount_Campaign: basedir",basedir,selext,terminal=False)
+    FolderHandler.CheckManifests() # Periodic consistency check of the manifests against the disc. (Rate limited)
     FileCountList = {}
-    for file in glob.glob(searchpath, recursive=True): # Recursive search through all the folders of the current campaign.
-        trimmedfile = file.replace(basedir,"") # Strip search path out.
-        foldertype = trimmedfile.split("/")[-2].split('_')[0] # Last remaining item is filename, Penultimate folder is image type.
-        FileCountList[foldertype] = FileCountList.get(foldertype,0) + 1 # How many files of this type so far?
+    for folder in FolderHandler.CampaignFolders(): # All the folders of the current campaign. Counts come from each folder's manifest.
+        foldertype = os.path.basename(folder).split('_')[0] # Folder name is the image type.
+        count = FolderHandler.Manifest(folder).Count([selext[1:]],unique=False)
+        if count > 0: FileCountList[foldertype] = FileCountList.get(foldertype,0) + count # How many files of this type so far?
     # Convert the list of image types and counts into a summarised text string.
     for key,value in FileCountList.items():
         result += key + '=' + str(value) + ' ' # Abbreviate image type and number of images.
@@ -15715,17 +16194,16 @@ def CheckImageSet():
 
 # ------------------------------------------------------------------------------------------------------
 
-def CameraHandler(outboundqueue,inboundqueue):
-    """ This can run in a separate thread to take photos without distrubing tracking functions. 
-        Long exposures (>4seconds) really need the camera to move DURING the exposure.
-        outboundqueue and inboundqueue are the communication queues that can be used to control this thread. 
+def ProcessTrackingFrame(job):
+    """ Capture pipeline 'tracking' stage. Measure drift in a tracking image and tune the motors.
+        This can run while the camera is already capturing the next light image.
         
             Parameters ---------------------------------------
-            outboundqueue (queue)
-            inboundqueue (queue)
+            job (dictionary) : 'ImageBuffer' tracking image, 'ObsStart' capture start time,
+                               'OutboundQueue' to report the drift to ObservationRun, 'TrackingTimer' restarted when finished.
 
             References ---------------------------------------
-            n/a
+            DriftTracker, MotorControls
 
             Sets ---------------------------------------------
             n/a
@@ -15733,38 +16211,241 @@ def CameraHandler(outboundqueue,inboundqueue):
             Returns ------------------------------------------
             n/a
         """
-    RunThread = True # Set to False to terminate the handler. This will shutdown the thread entirely.
-    batch_size = 1
-    CamLog.Log('CameraHandler: Started')
-    CameraWindow.Print(NowHMS() + ' CameraHandler started.')
-    ReadyToObserve = False # When True the handler can start taking photographs. 
-    CamLog.Log('CameraHandler.initial: ReadyToObserve = False',terminal=False)
-    PrevReadyToObserve = False # Detect when the ReadyToObserve status changes.
-    PhotoCount = 0 # Counter of completed photographs. 
-    CameraInUse.BatchCount = 0 # Counter of completed photographs.
-    AzDriftSteps = 0
+    obs_start = job['ObsStart']
+    DriftTracker.SetLatestImage(job['ImageBuffer'],obs_start) # OpenCV (numpy) array of the camera image it is saved in DriftTracker as Grayscale and reduced and enhanced.
+    CamLog.Log('ProcessTrackingFrame: Begin Align CreateTargetImage',terminal=False)
+    if Parameters.TrackingTargetGrayscale: # Generate simplified tracking target.
+        colorflag = False
+    else: # Simulate an actual image.
+        colorflag = True
+    map_span = ObsSession.Target.TrackingMapSpan
+    TempCvBuffer,TempStarCount,TempStarList = CreateTargetImage(color=colorflag,MinMagnitude=Parameters.TargetMinMagnitude,astrotime=Datetime2Ts(obs_start),StarLimit=2000 * map_span,mapspan=map_span) # Create a completely
+    CamLog.Log('ProcessTrackingFrame: End Align CreateTargetImage',terminal=False)
+    CamLog.Log('ProcessTrackingFrame: Align Stars',TempStarCount,':',TempStarList,terminal=False)
+    CamLog.Log('ProcessTrackingFrame: Calling Align SetMasterImage after CreateTargetImage',terminal=False)
+    DriftTracker.SetMasterImage(TempCvBuffer,starcount=TempStarCount,starlist=TempStarList,timestamp=obs_start) # CvImage is an OpenCV (numpy) array of the camera image in grayscale.
+    CamLog.Log('ProcessTrackingFrame: Completed Align SetMasterImage',terminal=False)
+    CamLog.Log('ProcessTrackingFrame: DriftTracker: Align Prep for drift calculation',terminal=False)
+    AzDriftSteps = 0 # No drift unless we safely calculate one.
     AltDriftSteps = 0
-    DriftX = None
-    DriftY = None
-    TimeAllocation = {} # Measure how much time is spent on each task. Helps get scheduling and priorities right.
-    AllocationTimer = timer(600) # Report time allocation figures every 10 minutes.
-    LoopCounter = 0 # Count the number of loops.
-    CameraInUse.CurrentTask = None # No task currently active.
-    # Flush any outstanding commands in the command queue.
-    FlushedCount = 0
-    while inboundqueue.empty() == False: # There are some commands available from ObservationRun to the camera.
-        # Get the incoming message.
-        ReceivedMessage = inboundqueue.get()
-        CamLog.Log("camerahandler: Communication flush: Ignoring:",ReceivedMessage,terminal=False)
-        FlushedCount += 1
-    if FlushedCount > 0:
-        CameraWindow.Print("Flushed",FlushedCount,"old messages.")
-    # Set observation specific parameters. These change based upon the target type etc.
-    # - This sets CameraInUse.CameraTasks, the types of images to save, fast capture mode etc.
-    CameraInUse.SetObservationParameters() # Set observation specific parameters. These change based upon the target type etc.
-
-    TrackingTimer = timer(DriftTracker.TrackingInterval) # Create a timer for drift tracking.
+    DriftX = DriftTracker.dx
+    DriftY = DriftTracker.dy
+    if ObsSession.DebugMode:
+        print(NowHMS(),'Drift',DriftX,"x ,",DriftY,"y pixels")
+    CamLog.Log('ProcessTrackingFrame: Align Detected driftx',DriftX,'drifty',DriftY, terminal=False)
+    temp = len(DriftTracker.LatestStarMatchList) # *Q* Make sure good values don't get overwritten by later bad ones during search.
+    if DriftX != None and temp < Parameters.TrackingMatchThreshold: # Must match a reasonable number of stars for confidence.
+        CamLog.Log('ProcessTrackingFrame: Align low confidence.',temp,'star(s).',terminal=False)
+        DriftWindow.Print(NowHMS() + ' Tracking: Low confidence. Matched ' + str(temp) + ' star(s).' )
+        DriftX = None
+        DriftY = None
+    CamLog.Log('ProcessTrackingFrame: Align DriftTracker trusted driftx',DriftX,'drifty',DriftY,terminal=False)
+    if DriftX != None:
+        AzDriftSteps = int(DriftX / az_pixels_per_fullstep)
+        AltDriftSteps = int(DriftY / alt_pixels_per_fullstep) * -1 # Invert result to convert from IMAGE Y direction to Motor Alt direction.
+        CamLog.Log('ProcessTrackingFrame: Align DriftTracker Predicted drift: x=' + str(round(DriftX,2)) + '(' + str(AzDriftSteps) + 'steps), y=' + str(round(DriftY,2)) + '(' + str(AltDriftSteps) + 'steps)',terminal=False)
+    DriftWindow.Print(NowHMS() + ' DriftTracker Drift result: ' + str(DriftX) + ',' + str(DriftY) + ' px; ' + str(AzDriftSteps) + ',' + str(AltDriftSteps) + ' steps.')
+    # Assign latest drift values back to the motors.
+    for i in MotorControls: # Run through all the motors selecting those that need tuning.
+        if i.MotorName == NAME_AZIMUTH: # Azimuth motor.
+            if AzDriftSteps != None and abs(AzDriftSteps) > Parameters.MinimumDriftCorrection: # Drift is large enough to do something.
+                DriftWindow.Print(NowHMS() + ' Tuning ' + i.MotorName)
+                CamLog.Log('ProcessTrackingFrame: Align tuning ' + i.MotorName,terminal=False)
+                if ObsSession.DebugMode:
+                    print(NowHMS() + ' Tuning',i.MotorName,AzDriftSteps,'steps')
+                i.TunePosition(AzDriftSteps)
+            else: # Drift is too small to worry about.
+                DriftWindow.Print(NowHMS() + ' Not tuning ' + i.MotorName + ', drift is too small.')
+                CamLog.Log('ProcessTrackingFrame: Align not tuning ' + i.MotorName + ', drift is too small.',terminal=False)
+        elif i.MotorName == NAME_ALTITUDE: # Altitude motor.
+            if AltDriftSteps != None and abs(AltDriftSteps) > Parameters.MinimumDriftCorrection: # Drift is large enough to do something.
+                DriftWindow.Print(NowHMS() + ' Tuning ' + i.MotorName)
+                CamLog.Log('ProcessTrackingFrame: Align tuning ' + i.MotorName,terminal=False)
+                if ObsSession.DebugMode:
+                    print(NowHMS() + ' Tuning',i.MotorName,AltDriftSteps,'steps')
+                i.TunePosition(AltDriftSteps)
+            else: # Drift is too small to worry about.
+                DriftWindow.Print(NowHMS() + ' Not align tuning ' + i.MotorName + ', drift is too small.')
+                CamLog.Log('ProcessTrackingFrame: Not tuning ' + i.MotorName + ', drift is too small.',terminal=False)
+    ReplyMessage = {'TimeStamp' : NowUTC(), 'DriftX' : DriftX, 'DriftY' : DriftY, 'AzDriftSteps' : AzDriftSteps, 'AltDriftSteps' : AltDriftSteps} 
+    job['OutboundQueue'].put(ReplyMessage)
+    CameraInUse.TxCount += 1
+    CameraRxWindow.Print(DictionaryToString(ReplyMessage)) # Report communications from Camera to Main.
+    job['TrackingTimer'].Restart() # Start new countdown timer from the moment this finishes.
+    CamLog.Log('ProcessTrackingFrame: End align drift calculation.',terminal=False)
+
+def ProcessLightFrame(job):
+    """ Capture pipeline 'process' stage. Everything that happens to a light image after it is captured.
+        Meteor scan, image details file, telemetry, the light timelapse movie and the live stack.
+        This can run while the camera is already capturing the next light image.
+        
+            Parameters ---------------------------------------
+            job (dictionary) : 'PhotoCount', 'ObsStart', 'ObsEnd', 'ObsTime', 'ObsMult', 'Exposure', 'RaDec', 'AzAlt',
+                               'ImageBuffer' the captured image, 'Filename' the captured file, 'MeteorDetector', 'CloudEstimator'.
+
+            References ---------------------------------------
+            FolderHandler, Telemetry, LightTimelapse, LiveStacker, LocalStars
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            n/a
+        """
+    PhotoCount = job['PhotoCount']
+    obs_start = job['ObsStart']
+    obs_end = job['ObsEnd']
+    obs_time = job['ObsTime']
+    CamLog.Log("ProcessLightFrame: Folder for image details:", FolderHandler.GetPath('session'),terminal=False)
+    detailsfile = FolderHandler.PrepFile('session','imagedetails.txt')
+    tempra, tempdec = job['RaDec'] # RA and DEC of target at the end of the exposure.
+    tempaz, tempalt = job['AzAlt'] # AZ and ALT of target at the end of the exposure.
+    if Parameters.CalibrateLightFrames and job['ImageBuffer'] is not None: # Apply master dark/flat frames if there are any.
+        lightcalibrator = GetLightCalibrator()
+        if lightcalibrator != None:
+            job['ImageBuffer'] = lightcalibrator.Apply(job['ImageBuffer'],exposure=job['Exposure']) # A calibrated copy, the camera's buffer is untouched.
+    skyquality = None
+    if job['ImageBuffer'] is not None: # Sky quality score. Star count against the catalogue plus background statistics.
+        skyquality = job['CloudEstimator'].Estimate(job['ImageBuffer'],expectedstars=LocalStars.StarCount(),timestamp=obs_end)['score']
+    if Parameters.ScanForMeteors and job['ImageBuffer'] is not None and len(job['MeteorDetector'].Scan(job['ImageBuffer'],filename=job['Filename'],timestamp=obs_end,indexfile=FolderHandler.PrepFile('session','meteorcandidates.txt'))) > 0: # Scan latest CvImage buffer for meteors or aircraft trails. Candidates are listed in meteorcandidates.txt
+        streaksdetected = True # Found streaks in image.
+        CameraWindow.Print(NowHMS() + " Trail in image (Meteor/plane/satellite).",fg=OSW_TEXT_POOR,bg=OSW_TEXT_BG) # Alert the operator that there's something spoiling the image.
+    else:
+        streaksdetected = False # Didn't even check.
+    # Record a data file for the captured image (could be exif data?).
+    if not os.path.exists(detailsfile): # Create header line if it's a new file.
+        with open(detailsfile,"w") as f:
+            f.write('Now' + '\t' + 'PhotoCount' + '\t' + 'Obs start' + '\t' + 'Obs end' + '\t')
+            f.write('Obs time' + '\t' + 'RA' + '\t' + 'Dec' + '\t')
+            f.write('Azimuth' + '\t' + 'Altitude' + '\t' + 'Streaks' + '\t' + 'SkyQuality' + '\n')
+    with open(detailsfile,"a") as f:
+        f.write(str(NowUTC()) + '\t' + str(PhotoCount) + '\t' + str(obs_start) + '\t' + str(obs_end) + '\t')
+        f.write(str(obs_time) + '\t' + str(tempra) + '\t' + str(tempdec) + '\t')
+        f.write(str(tempaz) + '\t' + str(tempalt) + '\t' + str(streaksdetected) + '\t' + str(skyquality) + '\n')
+    Telemetry.Record('camera',PhotoCount,job['Exposure'],obs_start,obs_end,obs_time.total_seconds() * 1000,job['ObsMult'],True,streaksdetected)
+    if LightTimelapse.Active() and job['ImageBuffer'] is not None: # Add the light image to the movie while it's in memory.
+        LightTimelapse.AddFrame(job['ImageBuffer'])
+    if Parameters.LiveStack and job['ImageBuffer'] is not None: # Add the light image to the live stack while it's in memory.
+        AddToLiveStack(job['ImageBuffer'])
+
+def AddToLiveStack(imagebuffer):
+    """ Register and stack a light image, then publish the refreshed stacked preview as livestack.jpg in the preview folder.
+        The image is scaled down to Parameters.LiveStackWidth first. Called from the capture pipeline 'process' stage.
+        
+            Parameters ---------------------------------------
+            imagebuffer (numpy array) : The captured (and calibrated) light image.
+
+            References ---------------------------------------
+            LiveStacker, LiveStackFrame, FolderHandler
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            True if the image was stacked.
+        """
+    height, width = imagebuffer.shape[:2]
+    if width > Parameters.LiveStackWidth: # Scale down, the stacker's cost and memory grow with the pixel count.
+        scale = Parameters.LiveStackWidth / width
+        imagebuffer = cv2.resize(imagebuffer,(Parameters.LiveStackWidth,max(1,int(round(height * scale)))),interpolation=cv2.INTER_AREA)
+    LiveStackFrame.ImageBuffer = imagebuffer
+    if not LiveStacker.Add(LiveStackFrame): # Registration failed (cloud, large jump). The previous preview stays.
+        CamLog.Log("AddToLiveStack: Frame not stacked. Rejected frames",LiveStacker.RejectedFrames,terminal=False)
+        return False
+    filename = FolderHandler.PrepFile('preview','livestack.jpg')
+    tempname = FolderHandler.PrepFile('preview','livestack_new.jpg')
+    if LiveStacker.Preview.SaveFile(tempname): os.replace(tempname,filename) # Viewers never see a half written file.
+    CamLog.Log("AddToLiveStack: Stacked",LiveStacker.AcceptedCount,"of",LiveStacker.FrameCount,"frames, shift",
+               [round(v,1) for v in LiveStacker.LastShift],"clipped",round(LiveStacker.LastRejectedPc,2),"%",
+               round(LiveStacker.FrameSeconds[-1],3),"s",terminal=False)
+    return True
+
+def ProcessPreviewFrame(job):
+    """ Capture pipeline 'preview' stage. Generate a labelled copy of an image for monitoring.
+        This can run while the camera is already capturing the next light image.
+        
+            Parameters ---------------------------------------
+            job (dictionary) : 'ImageBuffer' the captured image, 'CaptureEnd' when its capture finished.
+
+            References ---------------------------------------
+            DriftTracker, PreviewTimer, PreviewTimelapse
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            n/a
+        """
+    CamLog.Log('ProcessPreviewFrame: Begin preview image markup',terminal=False)
+    if ObsSession.DebugMode:
+        print (NowHMS() + ' Begin ' + textcolor.magenta('preview') + ' image generation.')
+    astrotimeend = Datetime2Ts(job['CaptureEnd'])
+    MarkupPreview(drift_pixels_x=DriftTracker.dx,drift_pixels_y=DriftTracker.dy,astrotime=astrotimeend,timelapse=PreviewTimelapse,imagebuffer=job['ImageBuffer'],captureend=job['CaptureEnd']) # Generate a marked up copy of the image on disc.
+    CamLog.Log('ProcessPreviewFrame: End image markup',terminal=False)
+    PreviewTimer.Restart() # The countdown to the next preview image begins NOW, so we don't repeat too often and crowd out actual images.
+
+def CameraHandler(outboundqueue,inboundqueue):
+    """ This can run in a separate thread to take photos without distrubing tracking functions. 
+        Long exposures (>4seconds) really need the camera to move DURING the exposure.
+        outboundqueue and inboundqueue are the communication queues that can be used to control this thread. 
+        
+            Parameters ---------------------------------------
+            outboundqueue (queue)
+            inboundqueue (queue)
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            n/a
+        """
+    RunThread = True # Set to False to terminate the handler. This will shutdown the thread entirely.
+    batch_size = 1
+    CamLog.Log('CameraHandler: Started')
+    CameraWindow.Print(NowHMS() + ' CameraHandler started.')
+    ReadyToObserve = False # When True the handler can start taking photographs. 
+    CamLog.Log('CameraHandler.initial: ReadyToObserve = False',terminal=False)
+    PrevReadyToObserve = False # Detect when the ReadyToObserve status changes.
+    PhotoCount = 0 # Counter of completed photographs. 
+    CameraInUse.BatchCount = 0 # Counter of completed photographs.
+    TimeAllocation = {} # Measure how much time is spent on each task. Helps get scheduling and priorities right.
+    AllocationTimer = timer(600) # Report time allocation figures every 10 minutes.
+    LoopCounter = 0 # Count the number of loops.
+    CameraInUse.CurrentTask = None # No task currently active.
+    MeteorDetector = pilomarmeteordetector('meteors',logger=CamLog) # Scans each light image as it is captured. Keeps a rolling background between images.
+    CloudEstimator = pilomarcloudestimator('cloud',pausescore=Parameters.CloudPauseScore,resumescore=Parameters.CloudResumeScore,
+                                           debugfolder=FolderHandler.GetPath('session') if ObsSession.DebugMode else None,logger=CamLog) # Sky quality score for each light image.
+    CloudProbeTimer = timer(Parameters.CloudProbeInterval) # While paused for cloud, take a probe image this often.
+    CloudPaused = False # Is capture currently paused because of cloud?
+    if Parameters.GeneratePreview and Parameters.GeneratePreviewVideo: # Encode the preview movie as the previews are generated.
+        PreviewTimelapse.Start(FolderHandler.PrepFile('preview','preview_' + CleanDatetimeString(str(NowUTC())) + '.mp4'))
+    if Parameters.GenerateLightVideo: # Encode the light movie as the images are captured.
+        LightTimelapse.Start(FolderHandler.PrepFile('light','light_' + CleanDatetimeString(str(NowUTC())) + '.mp4'))
+    LiveStacker.Reset() # Each observation starts a fresh live stack.
+    # Flush any outstanding commands in the command queue.
+    FlushedCount = 0
+    while inboundqueue.empty() == False: # There are some commands available from ObservationRun to the camera.
+        # Get the incoming message.
+        ReceivedMessage = inboundqueue.get()
+        CamLog.Log("camerahandler: Communication flush: Ignoring:",ReceivedMessage,terminal=False)
+        FlushedCount += 1
+    if FlushedCount > 0:
+        CameraWindow.Print("Flushed",FlushedCount,"old messages.")
+    # Set observation specific parameters. These change based upon the target type etc.
+    # - This sets CameraInUse.CameraTasks, the types of images to save, fast capture mode etc.
+    CameraInUse.SetObservationParameters() # Set observation specific parameters. These change based upon the target type etc.
+
+    TrackingTimer = timer(DriftTracker.TrackingInterval) # Create a timer for drift tracking.
     TrackingTimer.Trigger() # Force immediate action.
+    # Processing of captured images overlaps the next exposure. Each stage has its own thread and bounded queue.
+    Pipeline = capturepipeline(threaded=Parameters.CameraPipeline,depth=Parameters.CameraPipelineDepth,logger=CamLog)
+    Pipeline.AddStage('process',ProcessLightFrame) # Light images must all be processed, capture waits if this falls behind.
+    Pipeline.AddStage('preview',ProcessPreviewFrame,depth=1) # Optional, skipped while the previous preview is running.
+    Pipeline.AddStage('tracking',ProcessTrackingFrame,depth=1) # One drift calculation at a time.
+    Pipeline.Start()
    
     CamLog.Log("camerahandler: Begin main loop.",terminal=False)
     while RunThread: # This will run through all queued commands in sequence, then start polling periodically for new ones.
@@ -15838,6 +16519,7 @@ def CameraHandler(outboundqueue,inboundqueue):
         if ReadyToObserve != PrevReadyToObserve: # Note the change in status of ReadyToObserve.
             CameraWindow.Print (NowHMS() + ' ReadyToObserve ' + str(ReadyToObserve))
             PrevReadyToObserve = ReadyToObserve
+            Pipeline.ResetDuty() # Don't count pauses in observing against the duty cycle.
             CamLog.Log('CameraHandler. Change of state: ReadyToObserve from ',PrevReadyToObserve,'to',ReadyToObserve,terminal=False)
 
         if ReadyToObserve:
@@ -15846,6 +16528,8 @@ def CameraHandler(outboundqueue,inboundqueue):
                 TrackingDue = TrackingTimer.Due() # Note if the tracking is due, it's referred to a couple of times here.
                 if Parameters.UseTracking == False: # Tracking currently disabled. (User can dynamically change this switch during observation).
                     if TrackingDue: DriftWindow.Print(NowHMS() + ' Drift tracking disabled.') # Warn the user.
+                elif TrackingDue and not Pipeline.Idle('tracking'): # The previous tracking image is still being analysed.
+                    CamLog.Log('CameraHandler: Tracking: Previous drift calculation still running.',terminal=False)
                 elif TrackingDue:
                     obs_start = NowUTC()
                     CamLog.Log('CameraHandler: Tracking: Begin ALIGN tracking image capture',terminal=False)
@@ -15859,72 +16543,21 @@ def CameraHandler(outboundqueue,inboundqueue):
                         CamLog.ReportException(e,comment='CameraHandler: Align call to TakeTrackingPhoto()')
                         result = False
                     CamLog.Log('CameraHandler: Tracking: End ALIGN tracking image capture',terminal=False)
-                    CamLog.Log('CameraHandler: Tracking: Storing ALIGN latest tracking image.',terminal=False)
-                    DriftTracker.SetLatestImage(CameraInUse.Image.ImageBuffer,obs_start) # OpenCV (numpy) array of the camera image it is saved in DriftTracker as Grayscale and reduced and enhanced.
-                    CamLog.Log( 'CameraHandler: Tracking: Begin Align CreateTargetImage',terminal=False)
-                    if Parameters.TrackingTargetGrayscale: # Generate simplified tracking target.
-                        colorflag = False
-                    else: # Simulate an actual image.
-                        colorflag = True
-                    map_span = ObsSession.Target.TrackingMapSpan
-                    TempCvBuffer,TempStarCount,TempStarList = CreateTargetImage(color=colorflag,MinMagnitude=Parameters.TargetMinMagnitude,astrotime=Datetime2Ts(obs_start),StarLimit=2000 * map_span,mapspan=map_span) # Create a completely
-                    CamLog.Log( 'CameraHandler: Tracking: End Align CreateTargetImage',terminal=False)
-                    CamLog.Log( 'CameraHandler: Tracking: Align Stars',TempStarCount,':',TempStarList,terminal=False)
-                    CamLog.Log( 'CameraHandler: Tracking: Calling Align SetMasterImage after CreateTargetImage',terminal=False)
-                    DriftTracker.SetMasterImage(TempCvBuffer,starcount=TempStarCount,starlist=TempStarList,timestamp=obs_start) # CvImage is an OpenCV (numpy) array of the camera image in grayscale.
-                    CamLog.Log( 'CameraHandler: Tracking: Completed Align SetMasterImage',terminal=False)
-                    CamLog.Log( 'CameraHandler: Tracking: DriftTracker: Align Prep for drift calculation',terminal=False)
-                    AzDriftSteps = 0 # No drift unless we safely calculate one.
-                    AltDriftSteps = 0
-                    DriftX = DriftTracker.dx
-                    DriftY = DriftTracker.dy
-                    if ObsSession.DebugMode:
-                        print(NowHMS(),'Drift',DriftX,"x ,",DriftY,"y pixels")
-                    CamLog.Log('CameraHandler: Tracking: Align Detected driftx',DriftX,'drifty',DriftY, terminal=False)
-                    temp = len(DriftTracker.LatestStarMatchList) # *Q* Make sure good values don't get overwritten by later bad ones during search.
-                    if DriftX != None and temp < Parameters.TrackingMatchThreshold: # Must match a reasonable number of stars for confidence.
-                        CamLog.Log( 'CameraHandler: Tracking: Align low confidence.',temp,'star(s).',terminal=False)
-                        DriftWindow.Print(NowHMS() + ' Tracking: Low confidence. Matched ' + str(temp) + ' star(s).' )
-                        DriftX = None
-                        DriftY = None
-                    CamLog.Log('CameraHandler: Tracking: Align DriftTracker trusted driftx',DriftX,'drifty',DriftY,terminal=False)
-                    if DriftX != None:
-                        AzDriftSteps = int(DriftX / az_pixels_per_fullstep)
-                        AltDriftSteps = int(DriftY / alt_pixels_per_fullstep) * -1 # Invert result to convert from IMAGE Y direction to Motor Alt direction.
-                        CamLog.Log('CameraHandler: Tracking: Align DriftTracker Predicted drift: x=' + str(round(DriftX,2)) + '(' + str(AzDriftSteps) + 'steps), y=' + str(round(DriftY,2)) + '(' + str(AltDriftSteps) + 'steps)',terminal=False)
-                    DriftWindow.Print(NowHMS() + ' DriftTracker Drift result: ' + str(DriftX) + ',' + str(DriftY) + ' px; ' + str(AzDriftSteps) + ',' + str(AltDriftSteps) + ' steps.')
-                    # Assign latest drift values back to the motors.
-                    for i in MotorControls: # Run through all the motors selecting those that need tuning.
-                        if i.MotorName == NAME_AZIMUTH: # Azimuth motor.
-                            if AzDriftSteps != None and abs(AzDriftSteps) > Parameters.MinimumDriftCorrection: # Drift is large enough to do something.
-                                DriftWindow.Print(NowHMS() + ' Tuning ' + i.MotorName)
-                                CamLog.Log('CameraHandler: Tracking: Align tuning ' + i.MotorName,terminal=False)
-                                if ObsSession.DebugMode:
-                                    print(NowHMS() + ' Tuning',i.MotorName,AzDriftSteps,'steps')
-                                i.TunePosition(AzDriftSteps)
-                            else: # Drift is too small to worry about.
-                                DriftWindow.Print(NowHMS() + ' Not tuning ' + i.MotorName + ', drift is too small.')
-                                CamLog.Log('CameraHandler: Tracking: Align not tuning ' + i.MotorName + ', drift is too small.',terminal=False)
-                        elif i.MotorName == NAME_ALTITUDE: # Altitude motor.
-                            if AltDriftSteps != None and abs(AltDriftSteps) > Parameters.MinimumDriftCorrection: # Drift is large enough to do something.
-                                DriftWindow.Print(NowHMS() + ' Tuning ' + i.MotorName)
-                                CamLog.Log('CameraHandler: Tracking: Align tuning ' + i.MotorName,terminal=False)
-                                if ObsSession.DebugMode:
-                                    print(NowHMS() + ' Tuning',i.MotorName,AltDriftSteps,'steps')
-                                i.TunePosition(AltDriftSteps)
-                            else: # Drift is too small to worry about.
-                                DriftWindow.Print(NowHMS() + ' Not align tuning ' + i.MotorName + ', drift is too small.')
-                                CamLog.Log('CameraHandler: Tracking: Not tuning ' + i.MotorName + ', drift is too small.',terminal=False)
-                    ReplyMessage = {'TimeStamp' : NowUTC(), 'DriftX' : DriftX, 'DriftY' : DriftY, 'AzDriftSteps' : AzDriftSteps, 'AltDriftSteps' : AltDriftSteps} 
-                    outboundqueue.put(ReplyMessage)
-                    CameraInUse.TxCount += 1
-                    CameraRxWindow.Print(DictionaryToString(ReplyMessage)) # Report communications from Camera to Main.
-                    TrackingTimer.Restart() # Start new countdown timer from the moment this finishes.
-                    CamLog.Log('CameraHandler: Tracking: End align drift calculation.',terminal=False)
+                    if result: # Measure the drift in the background while the next exposure runs.
+                        Pipeline.Submit('tracking',{'ImageBuffer':CameraInUse.Image.ImageBuffer,'ObsStart':obs_start,'OutboundQueue':outboundqueue,'TrackingTimer':TrackingTimer},block=False)
+                    else: # No tracking image, try again later.
+                        TrackingTimer.Restart()
                     
             if LoopTask == 'image': # Time to take an actual image. (If timelapse is active, only when it's due, otherwise every time.)
+                if Parameters.CloudPause and CloudEstimator.Paused() != CloudPaused: # Sky quality has crossed a threshold.
+                    CloudPaused = CloudEstimator.Paused()
+                    CameraWindow.Print(NowHMS() + (' Cloud: Capture paused. ' if CloudPaused else ' Cloud: Capture resumed. ') + CloudEstimator.Status())
+                    CamLog.Log('CameraHandler: Cloud pause',CloudPaused,CloudEstimator.Latest(),terminal=False)
+                    CloudProbeTimer.Restart()
                 if not CameraInUse.TimelapseDue(): # Check timelapse mechanism.
                     CamLog.Log('CameraHandler: Image task. Timelapse is active but not due.',terminal=False)
+                elif Parameters.CloudPause and CloudPaused and (not Pipeline.Idle('process') or not CloudProbeTimer.Due()): # Cloudy. Only take an occasional probe image, once the previous one has been assessed.
+                    CamLog.Log('CameraHandler: Image task. Paused for cloud, probe image not due.',terminal=False)
                 else: # Timelapse doesn't apply, or it's due. Either way, it's time to capture an image.
                     CamLog.Log('CameraHandler: Image task. Timelapse does not apply or is due, OK to capture an image.',terminal=False)
                     # Now take the actual observation photo ('light' image).
@@ -15951,40 +16584,21 @@ def CameraHandler(outboundqueue,inboundqueue):
                         outboundqueue.put(ReplyMessage) # Report communications from Camera to Main.
                         CameraInUse.TxCount += 1
                         CameraRxWindow.Print(DictionaryToString(ReplyMessage))
-                        CamLog.Log("Folder for image details:", FolderHandler.GetPath('session'),terminal=False)
-                        detailsfile = FolderHandler.PrepFile('session','imagedetails.txt')
-                        tempra, tempdec = ObsSession.Target.RaDecHours() # Current RA and DEC of target.
-                        tempaz, tempalt = ObsSession.Target.AzAltDegrees() # Current AZ and ALT of target.
-                        if Parameters.ScanForMeteors and CameraInUse.Image.ContainsMeteors(): # Scan latest CvImage buffer for meteors or aircraft trails.
-                            streaksdetected = True # Found streaks in image.
-                            CameraWindow.Print(NowHMS() + " Trail in image (Meteor/plane/satellite).",fg=OSW_TEXT_POOR,bg=OSW_TEXT_BG) # Alert the operator that there's something spoiling the image.
-                        else:
-                            streaksdetected = False # Didn't even check.
-                        # Record a data file for the captured image (could be exif data?).
-                        if not os.path.exists(detailsfile): # Create header line if it's a new file.
-                            with open(detailsfile,"w") as f:
-                                f.write('Now' + '\t' + 'PhotoCount' + '\t' + 'Obs start' + '\t' + 'Obs end' + '\t')
-                                f.write('Obs time' + '\t' + 'RA' + '\t' + 'Dec' + '\t')
-                                f.write('Azimuth' + '\t' + 'Altitude' + '\t' + 'Streaks' + '\n')
-                        with open(detailsfile,"a") as f:
-                            f.write(str(NowUTC()) + '\t' + str(PhotoCount) + '\t' + str(obs_start) + '\t' + str(obs_end) + '\t')
-                            f.write(str(obs_time) + '\t' + str(tempra) + '\t' + str(tempdec) + '\t')
-                            f.write(str(tempaz) + '\t' + str(tempalt) + '\t' + str(streaksdetected) + '\n')
+                        Pipeline.RecordCapture(CameraInUse.CaptureStart,CameraInUse.CaptureEnd,CameraInUse.ExposureSeconds) # For the duty cycle.
+                        Pipeline.Submit('process',{'PhotoCount':PhotoCount,'ObsStart':obs_start,'ObsEnd':obs_end,'ObsTime':obs_time,'ObsMult':obs_mult,
+                                                   'Exposure':CameraInUse.ExposureSeconds,'RaDec':ObsSession.Target.RaDecHours(),'AzAlt':ObsSession.Target.AzAltDegrees(),
+                                                   'ImageBuffer':CameraInUse.Image.ImageBuffer,'Filename':CameraInUse.Lastjpg,'MeteorDetector':MeteorDetector,
+                                                   'CloudEstimator':CloudEstimator}) # Waits here if processing has fallen behind.
                     else:
+                        Telemetry.Record('camera',PhotoCount,CameraInUse.ExposureSeconds,obs_start,obs_end,obs_time.total_seconds() * 1000,obs_mult,False,False)
                         CamLog.Log("CameraHandler: Image capture did not succeed. Stopping.",level='error')
                         RunThread = False # Something went wrong, quit!
 
             # Generate a labelled copy of the image periodically. For monitoring.
             if LoopTask == 'preview': # Time to consider making a preview markup.
-                if PreviewTimer.Due() and CameraInUse.Image.ImageExists(): # Periodically prepare a new preview image. This is slow, so don't do it very frequently.
-                    CamLog.Log('CameraHandler: Begin preview image markup',terminal=False)
-                    if ObsSession.DebugMode:
-                        print (NowHMS() + ' Begin ' + textcolor.magenta('preview') + ' image generation.')
+                if PreviewTimer.Due() and CameraInUse.Image.ImageExists() and Pipeline.Idle('preview'): # Periodically prepare a new preview image. This is slow, so don't do it very frequently.
                     # astrocamera.CaptureSet will have loaded the image into OpenCV compatible buffer. This is available to mark up with more information.
-                    astrotimeend = Datetime2Ts(CameraInUse.CaptureEnd)
-                    MarkupPreview(drift_pixels_x=DriftTracker.dx,drift_pixels_y=DriftTracker.dy,astrotime=astrotimeend) # Use last image buffer from CameraInUse.Image to generate a marked up copy of the image on disc.
-                    CamLog.Log('CameraHandler: End image markup',terminal=False)
-                    PreviewTimer.Restart() # The countdown to the next preview image begins NOW, so we don't repeat too often and crowd out actual images.
+                    Pipeline.Submit('preview',{'ImageBuffer':CameraInUse.Image.ImageBuffer,'CaptureEnd':CameraInUse.CaptureEnd},block=False) # Optional, dropped if the previous preview is still running.
 
             # Stop taking photos when the limit is reached. The main thread will also command the photos to stop, but it may be delayed.
             if PhotoCount >= Parameters.BatchSize:
@@ -15994,6 +16608,11 @@ def CameraHandler(outboundqueue,inboundqueue):
                 CamLog.Log('CameraHandler. BatchSize limit: ReadyToObserve = False',terminal=False)
         else: # ReadyToObserve = False - No camera tasks performed.
             ImageStatusWindow.FieldValue('CTASK','WAITING',fg=textcolor.WHITE,bg=textcolor.RED)
+        sensorduty,exposureduty = Pipeline.DutyCycle() # How much of the time is the sensor actually capturing?
+        if sensorduty == None or sensorduty >= 0.8: ImageStatusWindow.FieldValue('PIPELINE',Pipeline.Status(),fg=OSW_TEXT_GOOD)
+        else: ImageStatusWindow.FieldValue('PIPELINE',Pipeline.Status(),fg=OSW_TEXT_POOR)
+        if CloudEstimator.SmoothedScore() >= Parameters.CloudResumeScore: ImageStatusWindow.FieldValue('SKYQ',CloudEstimator.Status(),fg=OSW_TEXT_GOOD)
+        else: ImageStatusWindow.FieldValue('SKYQ',CloudEstimator.Status(),fg=OSW_TEXT_POOR)
 
         if RunThread and LoopTask == 'pause': time.sleep(Parameters.CameraLoopDelay) # Small delay in each loop to relax things.
 
@@ -16012,7 +16631,12 @@ def CameraHandler(outboundqueue,inboundqueue):
                 if totaltime > 0: timepc = int(100 * value / totaltime) # Calculate % share.
                 else: timepc = 0
                 CamLog.Log("CameraHandler: TimeAllocation:",key,value,"seconds (",timepc,"%)",terminal=False)
+            CamLog.Log("CameraHandler: Pipeline:",Pipeline.Status(),terminal=False)
+            for stage in Pipeline.Stages.values():
+                CamLog.Log("CameraHandler: Pipeline stage:",stage.Stats(),terminal=False)
 
+    CamLog.Log('CameraHandler: Waiting for',Pipeline.Pending(),'pipeline job(s) to finish.',terminal=False)
+    Pipeline.Stop() # Finish processing every captured image before reporting that the handler has stopped.
     CameraInUse.CurrentTask = None # No task currently active.
     ReplyMessage = {'TimeStamp' : NowUTC(), 'RunThread' : False}
     outboundqueue.put(ReplyMessage)
@@ -16028,6 +16652,10 @@ def CameraHandler(outboundqueue,inboundqueue):
 CameraStatusQueue = Queue() # Use queue mechanism to send status information from capture thread to ObservationRun. 
 CameraControlQueue = Queue() # Use queue mechanism to CONTROL the capture thread from the ObservationRun.
 CameraThread = None # Pointer to camera thread.
+PreviewTimelapse = pilomartimelapse('preview',framerate=10,scale=0.5,logger=CamLog) # Preview movie, encoded by CameraHandler as each preview is generated.
+LightTimelapse = pilomartimelapse('light',framerate=10,scale=0.5,logger=CamLog) # Light movie, encoded by CameraHandler as each image is captured. (GenerateLightVideo)
+LiveStacker = pilomarstacker('livestack',window=8,sigma=3.0,logger=CamLog) # Live stack of the light images, fed by the capture pipeline 'process' stage. (LiveStack)
+LiveStackFrame = pilomarimage(name='livestackframe',logger=None) # Scaled copy of the latest light image, passed to LiveStacker.
 
 # ------------------------------------------------------------------------------------------------------
 
@@ -16201,6 +16829,33 @@ StartMessageThread() # Fire up communication between the RPi and the microcontro
 
 # ------------------------------------------------------------------------------------------------------
 
+def PredictGoTo(target_object):
+    """ How long will it take to point the camera at the target? 
+        Motors move one after another, so the prediction is the sum of the motor paths.
+
+            Parameters ---------------------------------------
+            target_object (target instance)
+
+            References ---------------------------------------
+            MotorControls, Parameters.BacklashEnabled
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            seconds (float) : Predicted duration of the GOTO.
+            paths (dict) : slewpath for each motor name.     """
+    az, alt = target_object.AzAltDegrees() # What is the current position of the target?
+    paths = {}
+    for i in MotorControls:
+        if i.MotorName == NAME_AZIMUTH: targetangle = az
+        elif i.MotorName == NAME_ALTITUDE: targetangle = alt
+        else: targetangle = i.CurrentAngle # Not pointing a sky coordinate, stays where it is.
+        paths[i.MotorName] = i.PlanSlew(targetangle,backlash=Parameters.BacklashEnabled)
+    return sum([path.Seconds for path in paths.values()]), paths
+
+# ------------------------------------------------------------------------------------------------------
+
 def GoToTarget(target_object):
     """ Point camera at the target. But don't begin an observation. 
         Observations can only start once the microcontroller has a trajectory available to follow. 
@@ -16224,33 +16879,34 @@ def GoToTarget(target_object):
     ObsSession.StopMotors() # Clear anything that's still programmed for the motors. 
     ObsSession.SetMotorControlMode('direct') # We will directly control the movement of the microcontroller, no trajectory needs sending.
 
-    # Prelocate the motors if case we need to handle gear backlash. It is good to go to a slightly lower azimuth position before starting the observation.
+    # Plan the paths. Each motor reaches the target by the fastest legal route, including any backlash pre-alignment.
+    currentalt, currentaz = motorcontrol.LastReportedAltAz() # What is current position of the camera?
+    az, alt = ObsSession.Target.AzAltDegrees() # What is the current position of the target?
+    seconds, paths = PredictGoTo(ObsSession.Target)
+    MainLog.Log('GoToTarget: Predicted GOTO time',HRSeconds(int(seconds)),'from (' + AzAltText(currentaz,currentalt,DegreeSymbol) + ") to (" + AzAltText(az,alt,DegreeSymbol) + ")",terminal=True)
+    for i in MotorControls:
+        MainLog.Log('GoToTarget:',i.MotorName,paths[i.MotorName].Text(),terminal=False)
+
+    # Prelocate the motors if case we need to handle gear backlash. It is good to go to a slightly lower position before starting the observation.
     if Parameters.BacklashEnabled: # We're handling gear backlash.
-        currentalt, currentaz = motorcontrol.LastReportedAltAz() # What is current position of the camera?
-        az, alt = ObsSession.Target.AzAltDegrees() # What is the current position of the target?
         MainLog.Log('GoToTarget: Backlash prealignment: From (' + AzAltText(currentaz,currentalt,DegreeSymbol) + ") to (" + AzAltText(az,alt,DegreeSymbol) + ")")
         # Prealignment for backlash effects. 
         for i in MotorControls: # Check every motor.
-            if i.BacklashAngle != 0: # Does the motor have backlash set?
-                targetangle = i.CurrentAngle
-                if i.MotorName == NAME_AZIMUTH: # Compare target azimuth with current azimuth
-                    if az < currentaz: # We need to move to a lower azimuth position, so move even further to allow the mechanism to take-up any backlash when the gears change position.
-                        targetangle = az - i.BacklashAngle # Position the motor PAST the target so that the observation has to recover the situation, this will take up the slack in the gears.
-                elif i.MotorName == NAME_ALTITUDE: 
-                    if alt < currentalt: # We need to move to a lower altitude position, so move even further to allow the mechanism to take-up any backlash when the gears change position.
-                        targetangle = alt - i.BacklashAngle # Position the motor PAST the target so that the observation has to recover the situation, this will take up the slack in the gears.
-                if i.CompareAngles(i.CurrentAngle,targetangle) == False:
-                    MainLog.Log("GoToTarget: Pre alignment of " + i.MotorName + " motor to allow for gear backlash. Moving to " + Deg3dp(targetangle,DegreeSymbol))
+            prealignment = paths[i.MotorName].Legs[:-1] # Every leg before the final move. Only present if the motor would arrive moving backwards.
+            if len(prealignment) == 0:
+                MainLog.Log('GoToTarget: No backlash adjustment required for ' + i.MotorName)
+            for leg in prealignment:
+                if i.CompareAngles(i.CurrentAngle,leg.To) == False:
+                    MainLog.Log("GoToTarget: Pre alignment of " + i.MotorName + " motor to allow for gear backlash. Moving to " + Deg3dp(leg.To,DegreeSymbol))
                     i.MonitorMove = True # Display movement progress on the terminal.
-                    temp = i.GoToAngle(targetangle) # Move the motor PAST the target position, so that it will have to reverse to get on target. This will take up the slack in the gears.
+                    temp = i.GoToAngle(leg.To) # Move the motor PAST the target position, so that it will have to reverse to get on target. This will take up the slack in the gears.
                     i.MonitorMove = False # Do not display movement progress on the terminal.
                     if not temp: # Move failed.
                         MainLog.Log('GoToTarget: GoToAngle() call failed. Pre alignment of ' + i.MotorName + ' failed.',level='error')
                         return False # Failed!
-            else: MainLog.Log('GoToTarget: No backlash adjustment required for ' + i.MotorName)
 
     # GoTo the target. 
-    az, alt = ObsSession.Target.AzAltDegrees() # What is the current position of the target?
+    az, alt = ObsSession.Target.AzAltDegrees() # What is the current position of the target? (It has moved during any pre-alignment.)
     currentalt, currentaz = motorcontrol.LastReportedAltAz() # What is the current position of the camera?
     MainLog.Log('GoToTarget: Alignment: From ' + AzAltText(currentaz,currentalt,DegreeSymbol) + " to " + AzAltText(az,alt,DegreeSymbol))
     if not ObsSession.Target.Visible(): # Target is nolonger visible. 
@@ -16262,6 +16918,9 @@ def GoToTarget(target_object):
             targetangle = az # Position the motor ON the target.
         elif i.MotorName == NAME_ALTITUDE: 
             targetangle = alt # Position the motor ON the target.
+        path = paths.get(i.MotorName,None)
+        if path != None and not path.Clipped: 
+            targetangle += path.Angle - path.Target # Use the same equivalent angle (+/-360) that the planner chose.
         if i.CompareAngles(i.CurrentAngle,targetangle) == False: # There's a big enough position difference that it's worth moving the camera.
             MainLog.Log("GoToTarget: Target", i.MotorName, "from", Deg3dp(i.CurrentAngle,DegreeSymbol),"to",Deg3dp(targetangle,DegreeSymbol))
             i.MonitorMove = True # Display movement progress on the terminal.
@@ -16497,11 +17156,34 @@ def UpdateMiscMeasures():
     
 # ------------------------------------------------------------------------------------------------------
 
+def StorageAvailable():
+    """ Is there enough storage to continue the observation? 
+        The check used by the ObservationRun control loop, UpdateStorageStatus() shows the details on the dashboard.
+        
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            Sess.ImageStorageMonitor
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            result (bool) : FALSE if storage critically low.
+        """
+    fb = Sess.ImageStorageMonitor.FreeBytes() # How much storage space do we have? 
+    if fb > (150 * (1024 ** 2)): return True
+    MainLog.Log("StorageAvailable: Low storage space (" + str(fb) + " bytes) terminating the observation.",level="error")
+    return False
+
+# ------------------------------------------------------------------------------------------------------
+
 def UpdateStorageStatus():
     """ Checks storage available. 
         Updates displays.
         Returns TRUE if all OK.
-        Returns FALSE if storage critically low. 
+        Returns FALSE if storage critically low. (StorageAvailable() makes the decision during observations.)
         
             Parameters ---------------------------------------
             n/a
@@ -16525,7 +17207,6 @@ def UpdateStorageStatus():
     else: # Space run out.
         ObservationStatusWindow.FieldValue('STORAGE',sfb,fg=OSW_TEXT_BAD) # Red
         result = False # Critically low on memory. Abort!
-        MainLog.Log("UpdateStorageStatus: Low storage space (" + str(fb) + " bytes) terminating the observation.",level="error")
     memtot, memuse, memfree = Sess.MemoryMonitor.GetMemory() # Get system memory usage - memory is usually low because of Linux cache, so this may cause undue panic!
     mempercent = int(100 * (float(memfree) / float(memtot)))
     memrange = Sess.MemoryMonitor.GetFreeRange()
@@ -16688,13 +17369,58 @@ def UpdateWindGustCheck(az):
 
 # ------------------------------------------------------------------------------------------------------
         
+def MovieProgress(done,total,stats):
+    """ Report progress of a batch movie encoding. """
+    print('\r' + textcolor.yellow('Encoded ') + str(done) + '/' + str(total) + ' frames (' + str(stats['fps']) + ' fps)',end='',flush=True)
+    if done == total: print('')
+
+# ------------------------------------------------------------------------------------------------------
+
+def GenerateMovie(timelapse,folder,prefix,filename=None):
+    """ Finish the movie that was encoded during capture, or encode an existing folder in batch mode.
+            Parameters ---------------------------------------
+            timelapse (pilomartimelapse) : Movie encoded during the observation.
+            folder (str) : Folder of existing images, None = current session folder.
+            prefix (str) : 'preview' or 'light'. Selects the folder and image files.
+            filename (str) : Override target filename.
+
+            References ---------------------------------------
+            FolderHandler
+
+            Sets ---------------------------------------------
+            n/a
+
+            Returns ------------------------------------------
+            filename (str) or None if no movie was created.           """
+    if folder is None and filename is None and timelapse.Active(): # Frames were encoded as they were captured, just close the movie.
+        avifilename = timelapse.Finish()
+        stats = timelapse.Stats()
+    else: # Batch mode.
+        print('May take some time...')
+        if folder is None: # No folder named, default to current one.
+            folder = FolderHandler.GetPath(prefix)
+        sourcefiles = FolderHandler.ListFiles(folder,prefix=prefix + '_',suffix='.jpg') # Filenames are timestamped, so name order is capture order.
+        avifilename = FolderHandler.PrepFile(prefix,prefix + '_' + CleanDatetimeString(str(NowUTC())) + '.mp4')
+        if filename != None: # Override target filename.
+            avifilename = filename
+        movie = pilomartimelapse(prefix,framerate=10,scale=0.5,logger=MainLog)
+        avifilename = movie.EncodeFiles(sourcefiles,avifilename,progress=MovieProgress)
+        stats = movie.Stats()
+    MainLog.Log("GenerateMovie(",prefix,"):",avifilename,stats,terminal=False)
+    FolderHandler.RegisterFile(avifilename) # Keep the folder manifest up to date.
+    if avifilename == None: print(textcolor.yellow("No " + prefix + " images to animate."))
+    else: print(textcolor.yellow("Generated"), avifilename, '(' + str(stats['frames']) + ' frames)')
+    return avifilename
+
+# ------------------------------------------------------------------------------------------------------
+
 def GeneratePreviewMovie(folder=None,filename=None):    
     """     Parameters ---------------------------------------
             folder (str)
             filename (str)
 
             References ---------------------------------------
-            n/a
+            PreviewTimelapse
 
             Sets ---------------------------------------------
             n/a
@@ -16703,17 +17429,7 @@ def GeneratePreviewMovie(folder=None,filename=None):
             success (bool)           """
     MainLog.Log("Generating animation of observation previews...",terminal=False)
     print(textcolor.yellow("Generating animation of observation previews (if available)..."))
-    print('May take some time...')
-    if folder is None: # No folder named, default to current one.
-        folder = FolderHandler.GetPath('preview')
-    sourcefilepattern = folder + '/preview_*.jpg'
-    avifilename = FolderHandler.PrepFile('preview','preview_' + CleanDatetimeString(str(NowUTC())) + '.mp4')
-    if filename != None: # Override target filename.
-        avifilename = filename
-    # *Q* GLOB facility may disappear from later versions of ffmpeg, this will need revising when that happens.
-    cmd = "ffmpeg -y -framerate 10 -pattern_type glob -i '" + sourcefilepattern + "' -vf scale='iw/2:ih/2' " + avifilename
-    Sess.osCmd(cmd)
-    print(textcolor.yellow("Generated"), avifilename)
+    GenerateMovie(PreviewTimelapse,folder,'preview',filename=filename)
     MainLog.Log("GeneratePreviewMovie: Completed animation of observation previews.",terminal=False)
     return True
 
@@ -16725,7 +17441,7 @@ def GenerateLightMovie(folder=None,filename=None):
             filename (str)
 
             References ---------------------------------------
-            n/a
+            LightTimelapse
 
             Sets ---------------------------------------------
             n/a
@@ -16734,17 +17450,7 @@ def GenerateLightMovie(folder=None,filename=None):
             success (bool)           """
     MainLog.Log("Generating animation of observation light images...",terminal=False)
     print (textcolor.yellow("Generating animation of observation light images..."))
-    print('May take some time...')
-    if folder is None: # No folder named, default to current one.
-        folder = FolderHandler.GetPath('light')
-    sourcefilepattern = folder + '/light_*.jpg'
-    avifilename = FolderHandler.PrepFile('light','light_' + CleanDatetimeString(str(NowUTC())) + '.mp4')
-    if filename != None: # Override target filename.
-        avifilename = filename
-    # *Q* GLOB facility may disappear from later versions of ffmpeg, this will need revising when that happens.
-    cmd = "ffmpeg -y -framerate 10 -pattern_type glob -i '" + sourcefilepattern + "' -vf scale='iw/2:ih/2' " + avifilename
-    Sess.osCmd(cmd)
-    print(textcolor.yellow("Generated"), avifilename)
+    GenerateMovie(LightTimelapse,folder,'light',filename=filename)
     MainLog.Log("GenerateLightAvi: Completed animation of observation light images.",terminal=False)
     return True
 
@@ -17023,6 +17729,255 @@ def DisplayUTCTZ():
 
 # ------------------------------------------------------------------------------------------------------
 
+class observationdashboard():
+    """ Formats and draws the ObservationRun dashboard from a snapshot published by the control loop.
+        Runs in the dashboardrenderer thread, so the control loop never formats dashboard text itself. 
+        Snapshot keys:
+            utc, obsstart, observationstart : Time of the snapshot, start of the run, start of image capture.
+            ra, dec, az, alt : Target position, calculated once per pass of the control loop.
+            visible, approaching : Target visibility, from the same position.
+            camaz, camalt, latestaz, latestalt : Camera position for the image and the chart.
+            ready, photocount, mstop : Observation status. """
+
+    def __init__(self):
+        """ Set up the state that belongs to the display rather than the observation. 
+
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            n/a
+
+            Sets ---------------------------------------------
+            self.TerminalCols, self.TerminalRows, self.DebugTimer, self.MiscTimer
+
+            Returns ------------------------------------------
+            n/a                                              """
+        temp = textcolor.terminalsize() # Note the size of the window. If it changes, we'll clear the screen.
+        self.TerminalCols = temp[0] # Current screen columns.
+        self.TerminalRows = temp[1] # Current screen rows.
+        self.DebugTimer = timer(120) # In debug mode, update summary status every 2 minutes.
+        self.MiscTimer = timer(240) # Slow changing miscellaneous details are updated according to this timer. Immediately due.
+        self.Renderer = None # The dashboardrenderer drawing this dashboard, it holds the loop time statistics.
+
+    def Render(self,snapshot):
+        """ Update every dashboard field from the snapshot and draw the windows.
+
+            Parameters ---------------------------------------
+            snapshot (dict) : Values published by the ObservationRun control loop.
+
+            References ---------------------------------------
+            Dashboard windows, ObsSession, CameraInUse, DriftTracker, MotorControls
+
+            Sets ---------------------------------------------
+            Dashboard window fields.
+
+            Returns ------------------------------------------
+            n/a                                              """
+        az = snapshot['az']
+        alt = snapshot['alt']
+        # If the window dimensions have changed, clear the screen and let it redraw automatically.
+        if not ObsSession.DebugMode: 
+            temp = textcolor.terminalsize() # Note the size of the window. If it changes, we'll clear the screen.
+            if self.TerminalCols != temp[0] or self.TerminalRows != temp[1]: # Screen size has changed. Trigger refresh.
+                ClearScreen() # Clear screen afterwards.
+                self.TerminalCols = temp[0] # Note the new display dimensions.
+                self.TerminalRows = temp[1]
+        ObservationDuration = (snapshot['utc'] - snapshot['obsstart']).total_seconds() # How long has this observation run been running for?
+        ObservationStatusWindow.FieldValue('TARGET',ObsSession.Target.Name,fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # Update the target name. 
+        ObservationStatusWindow.FieldValue('FOLDER',FolderHandler.GetPath('session'),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # Which folder is the observation data saved in. 
+        if ClockOffset != None: # The clock is not running in realtime.
+            ObservationStatusWindow.FieldValue('CLOCK',str(DisplayDT(snapshot['utc'],decimals=True)).split("+")[0],fg=textcolor.WHITE,bg=textcolor.RED) # System clock in display timezone. 
+        else: # Clock IS running in realtime.
+            ObservationStatusWindow.FieldValue('CLOCK',str(DisplayDT(snapshot['utc'],decimals=True)).split("+")[0],fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # System clock in display timezone. 
+        ObservationStatusWindow.FieldValue('DURATION',HRSeconds(ObservationDuration),fg=OSW_TEXT_GOOD) # How long has this observation been running.
+        ObservationStatusWindow.FieldValue('IMAGETYPES',CameraInUse.ImageTypes(),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # What image types are being recorded?
+        UpdateStorageStatus() # Show storage space available. (The control loop makes its own check.)
+        UpdateCpuLoad() # Update the CPU load figures.
+        # Camera status.
+        UpdateCameraStatus() # Update the camera status.
+        # Motor control mode.
+        ObservationStatusWindow.FieldValue('CMODE',ObsSession.MotorControlMode,fg=OSW_TEXT_GOOD) # *Q* Is MotorControlMode needed anymore?
+        # Target status
+        if snapshot['ready']: # Camera is on target. Report the status.
+            ObservationStatusWindow.FieldValue('TSTATUS',"Acquired   ",fg=OSW_TEXT_GOOD) # Green
+            if Mctl.AutonomousControl or ObsSession.MotorControlMode == 'direct': # We're on target AND there's a trajectory in place, or we've taken direct control of the motors.
+                ObservationStatusWindow.FieldValue('TSDESC',"Ready for observation.    ") # Green
+            else: # We're on target but the motor microcontroller does not have a full trajectory yet, we still need to wait before taking photographs.
+                ObservationStatusWindow.FieldValue('TSDESC',"Waiting for trajectory.   ") # Green
+        else: # The camera has not yet reached the target position.
+            ObservationStatusWindow.FieldValue('TSTATUS',"Acquiring  ",fg=OSW_TEXT_BAD) # Red
+            ObservationStatusWindow.FieldValue('TSDESC',"Not ready for observation.")
+        if snapshot['visible'] == False or snapshot['mstop']: 
+            fgc = fgd = OSW_TEXT_BAD # Field colour if target is not visible, or motors are HALTED. (Red)
+        elif snapshot['approaching']: 
+            fgc = fgd = OSW_TEXT_POOR # Field colour if target is approaching limits. (Yellow)
+        else: 
+            fgc = OSW_TEXT_GOOD # Field colour if target is visible. (Green)
+            fgd = OSW_TEXT_FG # Field colour if target is visible. (Green)
+        dh, dm, ds = AngleToHMS(snapshot['ra']) # Convert target Right Ascension angle into hours, minutes, seconds.
+        if snapshot['mstop']: # MSTOP button triggered on motorcontroller board.
+            ObservationStatusWindow.FieldValue('MSTOP',"STOP",fg=fgc,bg=OSW_TEXT_BG)
+        else:
+            ObservationStatusWindow.FieldValue('MSTOP'," ",fg=fgc,bg=OSW_TEXT_BG)
+        EstimatedAlt, EstimatedAz = motorcontrol.EstimatedAltAz() # Where is the camera estimated to be pointing at given it's latest speed?
+        ObservationStatusWindow.FieldValue('CAMAZ',DisplayDegree(snapshot['latestaz'],15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) # Camera's last reported position.
+        ObservationStatusWindow.FieldValue('CAMALT',DisplayDegree(snapshot['latestalt'],15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) 
+        ObservationStatusWindow.FieldValue('ESTAZ',DisplayDegree(EstimatedAz,15,symbol=DegreeSymbol),fg=fgd,bg=OSW_TEXT_BG) # Camera's estimated current position.
+        ObservationStatusWindow.FieldValue('ESTALT',DisplayDegree(EstimatedAlt,15,symbol=DegreeSymbol),fg=fgd,bg=OSW_TEXT_BG) 
+        ObservationStatusWindow.FieldValue('TARAZ',DisplayDegree(az,15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) # Current target position.
+        ObservationStatusWindow.FieldValue('TARALT',DisplayDegree(alt,15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) 
+        ObservationStatusWindow.FieldValue('COMP',CompassPoint(az),fg=fgc,bg=OSW_TEXT_BG) # Azimuth as compass point.
+        ObservationStatusWindow.FieldValue('RA',DisplayHMS(dh,dm,ds,15,hsym=HourSymbol,msym=MinuteSymbol,ssym=SecondSymbol),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # RA and DEC of target.
+        dec_d, dec_m, dec_s = AngleToDMS(snapshot['dec'])
+        ObservationStatusWindow.FieldValue('DEC',DisplayDMS(dec_d,dec_m,dec_s,length=15,dsym=DegreeSymbol,msym=MinuteSymbol,ssym=SecondSymbol),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) 
+
+        ImageStatusWindow.FieldValue('IMAGES',str(ImageCount_Session()),fg=OSW_TEXT_GOOD) 
+        # Calculate total accumulated image time.
+        PhotoCount = snapshot['photocount']
+        AccumulatedTime = PhotoCount * CameraInUse.ExposureSeconds
+        if AccumulatedTime >= 1: # Show in HH:MM:SS
+            ImageStatusWindow.FieldValue('ACCTIME',HRSeconds(AccumulatedTime),fg=OSW_TEXT_GOOD)
+        else: # Show in 0.00000s
+            ImageStatusWindow.FieldValue('ACCTIME',str(AccumulatedTime) + "s",fg=OSW_TEXT_GOOD)
+        pceta = '' # Don't know the estimated completion time yet.
+        ObservationStartUTC = snapshot['observationstart']
+        if PhotoCount > 0 and ObservationStartUTC != None: # We can estimate when the batch of photographs will be completed.
+            pcprogress = float(PhotoCount) / Parameters.BatchSize # Percentage of way through the image batch.
+            if pcprogress > 0.0: # We've made some progress, so estimate the completion time.
+                pcelapsed = (snapshot['utc'] - ObservationStartUTC).total_seconds() # Elapsed time so far (seconds).
+                pcend = ObservationStartUTC + timedelta(seconds = int(pcelapsed / pcprogress)) # Roughly when will the batch be completed?
+                pceta = str(DisplayDT(pcend))[:16] # YYYY.MM.DD HH:MM
+        ImageStatusWindow.FieldValue('RUN',str(PhotoCount) + " of " + str(Parameters.BatchSize),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG)
+        ImageStatusWindow.FieldValue('ETA',pceta,fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) 
+        UpdateCameraCaptureStatus()
+        UpdateSystemWindow()
+        # Explain what is in the 'last captured image' buffer.
+        if CameraInUse.Image.ImageExists(): # openCV image buffer is loaded.
+            if len(CameraInUse.Image.ImageBuffer.shape) > 2: fmt = "color" # Show whether COLOUR or GRAYSCALE image in the OpenCV buffer.
+            else: fmt = "gray"
+            ImageStatusWindow.FieldValue("OCVIB","loaded " + DisplayHmsFromStamp(CameraInUse.LastImageDateTime) + " " + str(CameraInUse.Image.ImageBuffer.shape[0]).rjust(4) + "*" + str(CameraInUse.Image.ImageBuffer.shape[1]).rjust(4) + " " + fmt,fg=OSW_TEXT_GOOD)
+        else:
+            ImageStatusWindow.FieldValue("OCVIB","empty",fg=OSW_TEXT_POOR)
+        # Explain the status of the TARGET tracking image.
+        if DriftTracker.TargetImage.ImageExists(): # openCV image buffer is loaded.
+            temp = "matched " + str(len(DriftTracker.TargetStarMatchList)) + " of " + str(DriftTracker.TargetImage.StarCount) + " stars"
+            if len(DriftTracker.TargetImage.ImageBuffer.shape) > 2: fmt = "color" # Show whether COLOUR or GRAYSCALE image in the OpenCV buffer.
+            else: fmt = "gray"
+            temp = str(DriftTracker.TargetImage.ImageBuffer.shape[0]).rjust(4) + "*" + str(DriftTracker.TargetImage.ImageBuffer.shape[1]).rjust(4) + " " + fmt + " " + temp
+            ImageStatusWindow.FieldValue("DTI","loaded " + DisplayHmsFromStamp(DriftTracker.TargetTimeStamp) + " " + temp,fg=OSW_TEXT_GOOD)
+        else: # No drift target image available.
+            ImageStatusWindow.FieldValue("DTI","empty",fg=OSW_TEXT_POOR)
+        # Explain the status of the LATEST tracking image.
+        if DriftTracker.LatestImage.ImageExists(): # openCV image buffers are loaded.
+            temp = "matched " + str(len(DriftTracker.LatestStarMatchList)) + " of " + str(DriftTracker.LatestImage.StarCount) + " stars"
+            if len(DriftTracker.LatestImage.ImageBuffer.shape) > 2: fmt = "color" # Show whether COLOUR or GRAYSCALE image in the OpenCV buffer.
+            else: fmt = "gray"
+            temp = str(DriftTracker.LatestImage.ImageBuffer.shape[0]).rjust(4) + "*" + str(DriftTracker.LatestImage.ImageBuffer.shape[1]).rjust(4) + " " + fmt + " " + temp
+            ImageStatusWindow.FieldValue("DLI","loaded " + DisplayHmsFromStamp(DriftTracker.LatestTimeStamp) + " " + temp,fg=OSW_TEXT_GOOD)
+        else: # No current drift image available.
+            ImageStatusWindow.FieldValue("DLI","empty",fg=OSW_TEXT_POOR)
+        for i in MotorControls: # Report tuning status of each motor in turn.
+            if i.LatestTuneTime != None: # This motor has been tuned. 
+                line = str(i.LatestTuneSteps) + " steps at " + str(DisplayDT(i.LatestTuneTime)).split("+")[0] + " UTC"
+            else: # This motor has not been tuned.
+                line = 'None'
+            if i.MotorName == NAME_AZIMUTH:
+                ImageStatusWindow.FieldValue("LAZT",line,fg=OSW_TEXT_GOOD)
+            else:
+                ImageStatusWindow.FieldValue("LALT",line,fg=OSW_TEXT_GOOD)
+        
+        MiscWindow.FieldValue("MSGSTATS",ObsSession.Dispatcher.Status(width=61)) # Busiest microcontroller messages, count/mean handler ms.
+        UpdateWindGustCheck(az)
+        self.ShowLoopTimes()
+
+        # Manually update sprites in the target chart.
+        TargetChart.ManualUpdateSprite(name="target",az=az,alt=alt)
+        TargetChart.ManualUpdateSprite(name="camera",az=snapshot['camaz'],alt=snapshot['camalt'])
+        # Automatically update sprites in the target chart.
+        TargetChart.AutoUpdateSprites() # Update the sprites in the TargetChart. Automatically updated ones.
+
+        if ObsSession.DebugMode: # We're in debug mode, just summary status update.
+            if self.DebugTimer.Due(): # It's time to publish a summary status.
+                print (NowHMS() + " Target " + textcolor.white(ObsSession.Target.Name) + " " + AzAltText(az,alt,DegreeSymbol))
+                print (NowHMS() + " Session images: " + ImageCount_Session()) # Count images in the current SESSION!
+                for line in StorageStrings(): print (NowHMS() + line)
+                print (NowHMS() + " Session: " + FolderHandler.GetPath("session"))
+                if self.Renderer != None: print (NowHMS() + " Loop time: " + self.Renderer.Status())
+                if ClockOffset != None: # Warn that tracking clock is not running in realtime.
+                    print(textcolor.red(NowHMS() + " Tracking clock is offset to",str(NowUTC()).split('.')[0]))
+        else: # Not in debug mode, update the color display.
+            # Refresh status and debug windows.
+            # These will draw if their allocated terminal space is available.
+            TerminalRows = self.TerminalRows
+            TerminalCols = self.TerminalCols
+            ObservationStatusWindow.Display(TerminalRows,TerminalCols) # Refresh the actual display.
+            ImageStatusWindow.Display(TerminalRows,TerminalCols)
+            InstructionWindow.Display(TerminalRows,TerminalCols) # Display session status.
+            AstroSeeing.UpdateWindow(WeatherWindow) # Update weather measures in the window buffers.
+            WeatherWindow.Display(TerminalRows,TerminalCols) # Display weather status.
+            TargetChart.draw(TerminalRows,TerminalCols)
+            if Parameters.SystemWindowEnabled:
+                SystemWindow.Display(TerminalRows,TerminalCols)
+            else: 
+                MiscWindow.Display(TerminalRows,TerminalCols) # Display miscellaneous measurements.
+            if self.MiscTimer.Due(): UpdateMiscMeasures() # Refresh miscellaneous measures in the display.
+            # - Column 2
+            ErrorWindow.Display(TerminalRows,TerminalCols) # Display latest error messages.
+            ObsSession.ShowRemoteStatus() # Update status measures in the window buffers.
+            SessionWindow.Display(TerminalRows,TerminalCols) # Display instructions.
+            MctlRxWindow.Display(TerminalRows,TerminalCols) # Display Microcontroller UART RX traffic.
+            MctlTxWindow.Display(TerminalRows,TerminalCols) # Display Microcontroller UART TX traffic.
+            CameraWindow.Display(TerminalRows,TerminalCols) # Display camera status.
+            # - Column 3
+            DriftWindow.Display(TerminalRows,TerminalCols) # Display drift calculation log.
+            CameraTxWindow.Display(TerminalRows,TerminalCols) # Display Camera command TX traffic.
+            CameraRxWindow.Display(TerminalRows,TerminalCols) # Display Camera command RX traffic.
+            DevWindow.Display(TerminalRows,TerminalCols) # Display developer events messages.
+
+    def ShowLoopTimes(self):
+        """ Control loop times, motor voltage and position sensors in the MiscWindow. 
+
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            self.Renderer, MotorControls
+
+            Sets ---------------------------------------------
+            MiscWindow fields.
+
+            Returns ------------------------------------------
+            n/a                                              """
+        ltts = None if self.Renderer == None else self.Renderer.LatestLoopTime() # How long did the latest pass of the control loop take?
+        if ltts != None:
+            looptimes = list(self.Renderer.LoopTimes)
+            averagelooptime = sum(looptimes) / len(looptimes) # Average of the recent loop times.
+            MiscWindow.FieldValue("AVELOOP",str(round(averagelooptime,3)) + "s")
+            MiscWindow.FieldValue("TOTLOOP",str(round(ltts,3)) + "s") # Latest loop time.
+            MiscWindow.FieldValue("LOOPPCT",self.Renderer.Status()[:23]) # Loop time percentiles.
+            if ltts > 3: MiscWindow.FieldColor("TOTLOOP",fg=OSW_TEXT_BAD) # Loop is taking too long, something may be wrong.
+            elif ltts > 0.5: MiscWindow.FieldColor("TOTLOOP",fg=OSW_TEXT_POOR) # Loop is slower than planned, but not terrible.
+            else: MiscWindow.FieldColor("TOTLOOP",fg=OSW_TEXT_GOOD) # Loop is performing as expected.
+        for i in MotorControls:
+            if i.MotorName == NAME_AZIMUTH: # Pull sensor data related to AZIMUTH motor.
+                temp_volt = i.VMotVolts
+                if temp_volt < 5: temp_fg = fg=OSW_TEXT_BAD
+                elif temp_volt < 11: temp_fg = OSW_TEXT_POOR
+                else: temp_fg = OSW_TEXT_GOOD
+                MiscWindow.FieldValue("VMOT",str(round(temp_volt,2)) + "V",fg=temp_fg)
+                sensorfield = "ASINFO"
+            elif i.MotorName == NAME_ALTITUDE: # Pull sensor data related to ALTITUDE motor.
+                sensorfield = "LSINFO"
+            else: continue
+            if i.position_sensor_angle != None and i.position_sensor_value != None:
+                templine = Deg3dp(i.position_sensor_angle,DegreeSymbol) + " " # Assembly angle.
+                templine += i.PositionFusion.Status() # Slip, offset, backlash and noise (steps), rejected readings and tunes.
+                MiscWindow.FieldValue(sensorfield,templine[:61],fg=OSW_TEXT_GOOD if i.position_sensor_configured else OSW_TEXT_POOR)
+            else: MiscWindow.FieldValue(sensorfield,"NO DATA",fg=OSW_TEXT_POOR)
+
+# ------------------------------------------------------------------------------------------------------
+
 def ObservationRun(batchmode=False):
     """ Perform an observation run. Take a set of photographs and keep the camera pointing at the target. 
         This is the core of the program. This is the main loop that tracks a target and captures photos. 
@@ -17186,8 +18141,6 @@ def ObservationRun(batchmode=False):
     PrevReadyToObserve = False # We are not ready to observe until the whole telescope is synchronised and on target.
     ObservationStartUTC = None # The UTC timestamp when the image capture begins.
     
-    cumulativelooptime = 0 # Cumulative total of all the loop times.
-    cumulativeloopcount = 0 # Count of all the loops executed.
     MainLog.Log('ObservationRun: Initializing motorcontroller...',terminal=False)
     MainLog.Log('ObservationRun: Stopping any previous motor instructions.',terminal=False)
     if Parameters.ObservationResetsMctl: # Do we just force a full reset of the microcontroller to clean it up each time an observation starts?
@@ -17241,10 +18194,13 @@ def ObservationRun(batchmode=False):
         print(textcolor.yellow("Low priority image processing will not be done during the observation."))
         print(textcolor.yellow("If you want to extract raw (.dng) data you must do it separately after the observation."))
     SessionWindow.Clear(immediate=False) # Clear old messages from the session window.
-    DebugTimer = timer(120) # In debug mode, update summary status every 2 minutes.
     _ = Sess.ImageStorageMonitor.FreeBytes(force=True) # Force disc space refresh.
-    MiscTimer = timer(240) # Slow changing miscellaneous details are updated according to this timer. Immediately due.
-    UpdateMiscMeasures() # Initialise the miscellaneous measures, they won't update until MiscTimer is due.
+    UpdateMiscMeasures() # Initialise the miscellaneous measures, they won't update until the dashboard's MiscTimer is due.
+    # The dashboard is drawn from snapshots of the control loop, by its own thread. (Parameters.DashboardRefresh)
+    ObsDashboard = observationdashboard() # Formats the fields and draws the windows.
+    Dashboard = dashboardrenderer(ObsDashboard.Render,period=Parameters.DashboardRefresh,
+                                  errorhandler=lambda e: MainLog.Log("ObservationRun: Dashboard refresh failed:",str(e),level='error',terminal=False))
+    ObsDashboard.Renderer = Dashboard # The dashboard shows the loop time statistics.
     # After this point all messages to the terminal should respect WINDOW and DEBUG MODE selections, otherwise they get overwritten/corrupted.
     if ObsSession.DebugMode: 
         # Do not clear the screen in debug mode. We don't want to lose error messages.
@@ -17257,6 +18213,7 @@ def ObservationRun(batchmode=False):
     if ObsSession.DebugMode:
         MainLog.Log('ObservationRun: (DebugMode) Starting main loop...')
     colordisplay.GlobalForceRedraw() # Force all window buffers to fully redraw initially.
+    Dashboard.Start()
     while RunObservation: # Main loop of the observation.
 
         # Check for keyboard commands...
@@ -17267,11 +18224,13 @@ def ObservationRun(batchmode=False):
             keypress = "" # Don't check keyboard this time round.
         if keypress != "": # Some keyboard input detected. 
             if ord(keypress) == 410: pass # Ignore the 410 character, it is associated with screen resizing.
+            Dashboard.Pause() # Commands may use the terminal. Hold the dashboard off until they are done.
         if keypress == "?" and Parameters.DebugMode: # Show commands available.
             InstructionWindow.DisplayTextLines() # Show content of InstructionWindow but inline and with no color.
         if keypress == "x" or keypress == chr(27): # Break with 'x' or 'esc' key.
             ClearScreen()
             if not AskYesNo("Do you want to stop this observation? [y/N]",default=False): 
+                Dashboard.Resume()
                 continue # User doesn't want to quit yet.
             MainLog.Log("Keyboard interrupt: Terminating observation.",level='warning',terminal=False)
             ErrorWindow.Print(NowHMS() + ' Keyboard interrupt. Terminating observation.')
@@ -17321,14 +18280,8 @@ def ObservationRun(batchmode=False):
             MainLog.Log("Keyboard interrupt: Misc<>System window toggle.",terminal=False)
             ChangeSystemDisplay() # Toggle between 'misc' window choices.
             ClearScreen() # Clear screen afterwards.
+        if keypress != "": Dashboard.Resume() # Commands are done with the terminal.
         # # Start fresh move/capture iteration.
-        # If the window dimensions have changed, clear the screen and let it redraw automatically.
-        if not ObsSession.DebugMode: 
-            temp = textcolor.terminalsize() # Note the size of the window. If it changes, we'll clear the screen.
-            if TerminalCols != temp[0] or TerminalRows != temp[1]: # Screen size has changed. Trigger refresh.
-                ClearScreen() # Clear screen afterwards.
-                TerminalCols = temp[0] # Note the new display dimensions.
-                TerminalRows = temp[1]
         if CameraThread.is_alive() == False: # If the CameraThread has died, quit.
             MainLog.Log("ObservationRun: CameraThread (Camera handler) is not running!",level='error')
             CameraWindow.Print(NowHMS() + " CameraThread is not running.")
@@ -17350,72 +18303,26 @@ def ObservationRun(batchmode=False):
             ObsSession.CameraRxCount += 1 # We received another message from the camera.
             # Extract any useful information from the received messages.
             if 'PhotoCount' in StatusMessage: PhotoCount = StatusMessage['PhotoCount'] # Camera has updated the number of photographs taken during this run.
-        # Calculate the current position of the target. This also updates the cached values, which remain valid for the duration of this loop.
+        # Calculate the current position of the target, once per pass. The rest of the pass and the dashboard share these values.
+        passstart = Dashboard.Clock() # Start of the timed part of the pass.
         dtnow = NowUTC() # In datetime format. 
         ra, dec = ObsSession.Target.RaDecDegrees() # Target's position. Right Ascension and Declination.
         az, alt = ObsSession.Target.AzAltDegrees(updatespeed=True) # Target's position. Altitude and Azimuth from observer's location. Update angular velocity too.
-        ObservationDuration = (dtnow - obsstart).total_seconds() # How long has this observation run been running for?
-        ObservationStatusWindow.FieldValue('TARGET',ObsSession.Target.Name,fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # Update the target name. 
-        ObservationStatusWindow.FieldValue('FOLDER',FolderHandler.GetPath('session'),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # Which folder is the observation data saved in. 
-        if ClockOffset != None: # The clock is not running in realtime.
-            ObservationStatusWindow.FieldValue('CLOCK',str(DisplayDT(NowUTC(),decimals=True)).split("+")[0],fg=textcolor.WHITE,bg=textcolor.RED) # System clock in display timezone. 
-        else: # Clock IS running in realtime.
-            ObservationStatusWindow.FieldValue('CLOCK',str(DisplayDT(NowUTC(),decimals=True)).split("+")[0],fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # System clock in display timezone. 
-        ObservationStatusWindow.FieldValue('DURATION',HRSeconds(ObservationDuration),fg=OSW_TEXT_GOOD) # How long has this observation been running.
-        ObservationStatusWindow.FieldValue('IMAGETYPES',CameraInUse.ImageTypes(),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # What image types are being recorded?
-        # Calculate storage available.    
-        if not UpdateStorageStatus(): # Update storage space available, and decide if it's safe to continue.
+        visible = ObsSession.Target.Visible(azalt=(az,alt)) # Is the target within the range of the telescope?
+        approaching = ObsSession.Target.ApproachingLimit(azalt=(az,alt)) # Is the target approaching the limits of the telescope?
+        # Check storage available.    
+        if not StorageAvailable(): # Decide if it's safe to continue.
             observationresult = False # Don't continue.
             RunObservation = False # Quit the observation run.
             observationstatuslist.append("system:discspace")
             MainLog.Log("ObservationRun: Insufficient storage space terminating the observation.",level="error")
-        UpdateCpuLoad() # Update the CPU load figures.
-        # Camera status.
-        UpdateCameraStatus() # Update the camera status.
-        # Motor control mode.
-        ObservationStatusWindow.FieldValue('CMODE',ObsSession.MotorControlMode,fg=OSW_TEXT_GOOD) # *Q* Is MotorControlMode needed anymore?
-        # Target status
-        if ReadyToObserve: # Camera is on target. Report the status.
-            ObservationStatusWindow.FieldValue('TSTATUS',"Acquired   ",fg=OSW_TEXT_GOOD) # Green
-            #if ObsSession.AutonomousControl or ObsSession.MotorControlMode == 'direct': # We're on target AND there's a trajectory in place, or we've taken direct control of the motors.
-            if Mctl.AutonomousControl or ObsSession.MotorControlMode == 'direct': # We're on target AND there's a trajectory in place, or we've taken direct control of the motors.
-                ObservationStatusWindow.FieldValue('TSDESC',"Ready for observation.    ") # Green
-            else: # We're on target but the motor microcontroller does not have a full trajectory yet, we still need to wait before taking photographs.
-                ObservationStatusWindow.FieldValue('TSDESC',"Waiting for trajectory.   ") # Green
-        else: # The camera has not yet reached the target position.
-            ObservationStatusWindow.FieldValue('TSTATUS',"Acquiring  ",fg=OSW_TEXT_BAD) # Red
-            ObservationStatusWindow.FieldValue('TSDESC',"Not ready for observation.")
-        if ObsSession.Target.Visible() == False or mstop_latch: 
-            fgc = fgd = OSW_TEXT_BAD # Field colour if target is not visible, or motors are HALTED. (Red)
-        elif ObsSession.Target.ApproachingLimit(): 
-            fgc = fgd = OSW_TEXT_POOR # Field colour if target is approaching limits. (Yellow)
-        else: 
-            fgc = OSW_TEXT_GOOD # Field colour if target is visible. (Green)
-            fgd = OSW_TEXT_FG # Field colour if target is visible. (Green)
-        dh, dm, ds = AngleToHMS(ra) # Convert target Right Ascension angle into hours, minutes, seconds.
         if Parameters.UseLiveLocation: # Use the live target location rather than the last reported camera position for image processing.
-            CameraAz, CameraAlt = ObsSession.Target.AzAltDegrees() # What is the alt/az location of the centre of the image?
+            CameraAz, CameraAlt = az, alt # What is the alt/az location of the centre of the image?
             CameraLatestAlt, CameraLatestAz = motorcontrol.LastReportedAltAz() # What is the alt/az location of the centre of the image?
         else: # Use the last reported camera position. Deprecated.
             CameraAlt, CameraAz = motorcontrol.LastReportedAltAz() # What is the alt/az location of the centre of the image?
             CameraLatestAlt = CameraAlt
             CameraLatestAz = CameraAz
-        if mstop_latch: # MSTOP button triggered on motorcontroller board.
-            ObservationStatusWindow.FieldValue('MSTOP',"STOP",fg=fgc,bg=OSW_TEXT_BG)
-        else:
-            ObservationStatusWindow.FieldValue('MSTOP'," ",fg=fgc,bg=OSW_TEXT_BG)
-        EstimatedAlt, EstimatedAz = motorcontrol.EstimatedAltAz() # Where is the camera estimated to be pointing at given it's latest speed?
-        ObservationStatusWindow.FieldValue('CAMAZ',DisplayDegree(CameraLatestAz,15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) # Camera's last reported position.
-        ObservationStatusWindow.FieldValue('CAMALT',DisplayDegree(CameraLatestAlt,15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) 
-        ObservationStatusWindow.FieldValue('ESTAZ',DisplayDegree(EstimatedAz,15,symbol=DegreeSymbol),fg=fgd,bg=OSW_TEXT_BG) # Camera's estimated current position.
-        ObservationStatusWindow.FieldValue('ESTALT',DisplayDegree(EstimatedAlt,15,symbol=DegreeSymbol),fg=fgd,bg=OSW_TEXT_BG) 
-        ObservationStatusWindow.FieldValue('TARAZ',DisplayDegree(az,15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) # Current target position.
-        ObservationStatusWindow.FieldValue('TARALT',DisplayDegree(alt,15,symbol=DegreeSymbol),fg=fgc,bg=OSW_TEXT_BG) 
-        ObservationStatusWindow.FieldValue('COMP',CompassPoint(az),fg=fgc,bg=OSW_TEXT_BG) # Azimuth as compass point.
-        ObservationStatusWindow.FieldValue('RA',DisplayHMS(dh,dm,ds,15,hsym=HourSymbol,msym=MinuteSymbol,ssym=SecondSymbol),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) # RA and DEC of target.
-        #ObservationStatusWindow.FieldValue('DEC',DisplayDegree(dec,15,symbol=DegreeSymbol),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) 
-        dec_d, dec_m, dec_s = AngleToDMS(dec)
-        ObservationStatusWindow.FieldValue('DEC',DisplayDMS(dec_d,dec_m,dec_s,length=15,dsym=DegreeSymbol,msym=MinuteSymbol,ssym=SecondSymbol),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) 
 
         # If we're on target, then activate the camera (it runs in a separate thread until told to stop).
         if True: 
@@ -17475,59 +18382,12 @@ def ObservationRun(batchmode=False):
                     observationstatuslist.append("system:azimuthrange")
                     RunObservation = False
 
-        ImageStatusWindow.FieldValue('IMAGES',str(ImageCount_Session()),fg=OSW_TEXT_GOOD) 
-        # Calculate total accumulated image time.
-        AccumulatedTime = PhotoCount * CameraInUse.ExposureSeconds
-        if AccumulatedTime >= 1: # Show in HH:MM:SS
-            ImageStatusWindow.FieldValue('ACCTIME',HRSeconds(AccumulatedTime),fg=OSW_TEXT_GOOD)
-        else: # Show in 0.00000s
-            ImageStatusWindow.FieldValue('ACCTIME',str(AccumulatedTime) + "s",fg=OSW_TEXT_GOOD)
-        if True:
-            pceta = '' # Don't know the estimated completion time yet.
-            if PhotoCount > 0 and ObservationStartUTC != None: # We can estimate when the batch of photographs will be completed.
-                pcprogress = float(PhotoCount) / Parameters.BatchSize # Percentage of way through the image batch.
-                if pcprogress > 0.0: # We've made some progress, so estimate the completion time.
-                    pcelapsed = (NowUTC() - ObservationStartUTC).total_seconds() # Elapsed time so far (seconds).
-                    pcend = ObservationStartUTC + timedelta(seconds = int(pcelapsed / pcprogress)) # Roughly when will the batch be completed?
-                    pceta = str(DisplayDT(pcend))[:16] # YYYY.MM.DD HH:MM
-            ImageStatusWindow.FieldValue('RUN',str(PhotoCount) + " of " + str(Parameters.BatchSize),fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG)
-            ImageStatusWindow.FieldValue('ETA',pceta,fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) 
-        else:
-            ImageStatusWindow.FieldValue('RUN',str(PhotoCount) + " of " + str(Parameters.BatchSize) + '(dis.)',fg=textcolor.RED1,bg=OSW_TEXT_BG) # Red
-            ImageStatusWindow.FieldValue('ETA','n/a',fg=OSW_TEXT_GOOD,bg=OSW_TEXT_BG) 
         if ObservationStopButton != None and ObservationStopButton.IsLow(): # Emergency stop pin on RPi has been grounded. 
             print(textcolor.red('OBSERVATION STOP BUTTON: Break observation'))
             ErrorWindow.Print(NowHMS() + " OBSERVATION STOP BUTTON pressed.")
             observationresult = False # Don't continue. Consider the stop button to be a 'fail'.
             observationstatuslist.append("user:observationstopbutton")
             RunObservation = False # Quit loop.
-        UpdateCameraCaptureStatus()
-        UpdateSystemWindow()
-        # Explain what is in the 'last captured image' buffer.
-        if CameraInUse.Image.ImageExists(): # openCV image buffer is loaded.
-            if len(CameraInUse.Image.ImageBuffer.shape) > 2: fmt = "color" # Show whether COLOUR or GRAYSCALE image in the OpenCV buffer.
-            else: fmt = "gray"
-            ImageStatusWindow.FieldValue("OCVIB","loaded " + DisplayHmsFromStamp(CameraInUse.LastImageDateTime) + " " + str(CameraInUse.Image.ImageBuffer.shape[0]).rjust(4) + "*" + str(CameraInUse.Image.ImageBuffer.shape[1]).rjust(4) + " " + fmt,fg=OSW_TEXT_GOOD)
-        else:
-            ImageStatusWindow.FieldValue("OCVIB","empty",fg=OSW_TEXT_POOR)
-        # Explain the status of the TARGET tracking image.
-        if DriftTracker.TargetImage.ImageExists(): # openCV image buffer is loaded.
-            temp = "matched " + str(len(DriftTracker.TargetStarMatchList)) + " of " + str(DriftTracker.TargetImage.StarCount) + " stars"
-            if len(DriftTracker.TargetImage.ImageBuffer.shape) > 2: fmt = "color" # Show whether COLOUR or GRAYSCALE image in the OpenCV buffer.
-            else: fmt = "gray"
-            temp = str(DriftTracker.TargetImage.ImageBuffer.shape[0]).rjust(4) + "*" + str(DriftTracker.TargetImage.ImageBuffer.shape[1]).rjust(4) + " " + fmt + " " + temp
-            ImageStatusWindow.FieldValue("DTI","loaded " + DisplayHmsFromStamp(DriftTracker.TargetTimeStamp) + " " + temp,fg=OSW_TEXT_GOOD)
-        else: # No drift target image available.
-            ImageStatusWindow.FieldValue("DTI","empty",fg=OSW_TEXT_POOR)
-        # Explain the status of the LATEST tracking image.
-        if DriftTracker.LatestImage.ImageExists(): # openCV image buffers are loaded.
-            temp = "matched " + str(len(DriftTracker.LatestStarMatchList)) + " of " + str(DriftTracker.LatestImage.StarCount) + " stars"
-            if len(DriftTracker.LatestImage.ImageBuffer.shape) > 2: fmt = "color" # Show whether COLOUR or GRAYSCALE image in the OpenCV buffer.
-            else: fmt = "gray"
-            temp = str(DriftTracker.LatestImage.ImageBuffer.shape[0]).rjust(4) + "*" + str(DriftTracker.LatestImage.ImageBuffer.shape[1]).rjust(4) + " " + fmt + " " + temp
-            ImageStatusWindow.FieldValue("DLI","loaded " + DisplayHmsFromStamp(DriftTracker.LatestTimeStamp) + " " + temp,fg=OSW_TEXT_GOOD)
-        else: # No current drift image available.
-            ImageStatusWindow.FieldValue("DLI","empty",fg=OSW_TEXT_POOR)
         ReadyToObserve = True # Work out if all the motors are on target!
         for i in MotorControls: # Report tuning status of each motor in turn.
             if ObsSession.Target.IsFixedPoint(): # Fixed point, doesn't need the motor to report 'OnTarget' - we decide in this program instead.
@@ -17536,86 +18396,13 @@ def ObservationRun(batchmode=False):
                 if ReadyToObserve != False: # Only display when changing, it reduces duplicate log messages.
                     ReadyToObserve = False # This motor is not on target yet. So we're not ready to observe.
                     MainLog.Log('ObservationRun.',i.MotorName,'Not on target: ReadyToObserve = False',terminal=False)
-            if i.LatestTuneTime != None: # This motor has been tuned. 
-                line = str(i.LatestTuneSteps) + " steps at " + str(DisplayDT(i.LatestTuneTime)).split("+")[0] + " UTC"
-            else: # This motor has not been tuned.
-                line = 'None'
-            if i.MotorName == NAME_AZIMUTH:
-                ImageStatusWindow.FieldValue("LAZT",line,fg=OSW_TEXT_GOOD)
-            else:
-                ImageStatusWindow.FieldValue("LALT",line,fg=OSW_TEXT_GOOD)
-        
-        # MiscWindow.FieldValue("RECLOOPS",str(LoopTimeList))
-        UpdateWindGustCheck(az)
-
-        # Manually update sprites in the target chart.
-        TargetChart.ManualUpdateSprite(name="target",az=az,alt=alt)
-        TargetChart.ManualUpdateSprite(name="camera",az=CameraAz,alt=CameraAlt)
-        # Automatically update sprites in the target chart.
-        TargetChart.AutoUpdateSprites() # Update the sprites in the TargetChart. Automatically updated ones.
 
-        if ObsSession.DebugMode: # We're in debug mode, just summary status update.
-            if DebugTimer.Due(): # It's time to publish a summary status.
-                print (NowHMS() + " Target " + textcolor.white(ObsSession.Target.Name) + " " + AzAltText(az,alt,DegreeSymbol))
-                print (NowHMS() + " Session images: " + ImageCount_Session()) # Count images in the current SESSION!
-                for line in StorageStrings(): print (NowHMS() + line)
-                print (NowHMS() + " Session: " + FolderHandler.GetPath("session"))
-                if ClockOffset != None: # Warn that tracking clock is not running in realtime.
-                    print(textcolor.red(NowHMS() + " Tracking clock is offset to",str(NowUTC()).split('.')[0]))
-        else: # Not in debug mode, update the color display.
-            # Refresh status and debug windows.
-            # These will draw if their allocated terminal space is available.
-            ObservationStatusWindow.Display(TerminalRows,TerminalCols) # Refresh the actual display.
-            ImageStatusWindow.Display(TerminalRows,TerminalCols)
-            InstructionWindow.Display(TerminalRows,TerminalCols) # Display session status.
-            AstroSeeing.UpdateWindow(WeatherWindow) # Update weather measures in the window buffers.
-            WeatherWindow.Display(TerminalRows,TerminalCols) # Display weather status.
-            TargetChart.draw(TerminalRows,TerminalCols)
-            if Parameters.SystemWindowEnabled:
-                SystemWindow.Display(TerminalRows,TerminalCols)
-            else: 
-                MiscWindow.Display(TerminalRows,TerminalCols) # Display miscellaneous measurements.
-            if MiscTimer.Due(): UpdateMiscMeasures() # Refresh miscellaneous measures in the display.
-            # - Column 2
-            ErrorWindow.Display(TerminalRows,TerminalCols) # Display latest error messages.
-            ObsSession.ShowRemoteStatus() # Update status measures in the window buffers.
-            SessionWindow.Display(TerminalRows,TerminalCols) # Display instructions.
-            MctlRxWindow.Display(TerminalRows,TerminalCols) # Display Microcontroller UART RX traffic.
-            MctlTxWindow.Display(TerminalRows,TerminalCols) # Display Microcontroller UART TX traffic.
-            CameraWindow.Display(TerminalRows,TerminalCols) # Display camera status.
-            # - Column 3
-            DriftWindow.Display(TerminalRows,TerminalCols) # Display drift calculation log.
-            CameraTxWindow.Display(TerminalRows,TerminalCols) # Display Camera command TX traffic.
-            CameraRxWindow.Display(TerminalRows,TerminalCols) # Display Camera command RX traffic.
-            DevWindow.Display(TerminalRows,TerminalCols) # Display developer events messages.
-
-        # Calculate how long this loop took to execute.
-        ltts = (NowUTC() - dtnow).total_seconds() # How long did the loop take?
-        cumulativelooptime += ltts # Total processing time of all loops.
-        cumulativeloopcount += 1 # Number of loops.
-        averagelooptime = cumulativelooptime / cumulativeloopcount # Average loop time.
-        MiscWindow.FieldValue("AVELOOP",str(round(averagelooptime,3)) + "s")
-        MiscWindow.FieldValue("TOTLOOP",str(round(ltts,3)) + "s") # Latest loop time.
-        if ltts > 3: MiscWindow.FieldColor("TOTLOOP",fg=OSW_TEXT_BAD) # Loop is taking too long, something may be wrong.
-        elif ltts > 0.5: MiscWindow.FieldColor("TOTLOOP",fg=OSW_TEXT_POOR) # Loop is slower than planned, but not terrible.
-        else: MiscWindow.FieldColor("TOTLOOP",fg=OSW_TEXT_GOOD) # Loop is performing as expected.
-        for i in MotorControls:
-            if i.MotorName == NAME_AZIMUTH: # Pull sensor data related to AZIMUTH motor.
-                temp_volt = i.VMotVolts
-                if temp_volt < 5: temp_fg = fg=OSW_TEXT_BAD
-                elif temp_volt < 11: temp_fg = OSW_TEXT_POOR
-                else: temp_fg = OSW_TEXT_GOOD
-                MiscWindow.FieldValue("VMOT",str(round(temp_volt,2)) + "V",fg=temp_fg)
-                if i.position_sensor_angle != None:
-                    templine = Deg3dp(i.position_sensor_angle,DegreeSymbol) + " " # Assembly angle.
-                    templine += "(Drift " + Deg3dp(i.position_sensor_angle_delta,DegreeSymbol) + ", " # Difference between measured and dead-reckoning angle.
-                    templine += str(i.AngleToStep(i.position_sensor_angle_delta)) + "steps) "
-                    if i.position_sensor_configured: templine + " Conf:Y "
-                    else: templine += " Conf:N "
-                    MiscWindow.FieldValue("ASINFO",templine,fg=OSW_TEXT_GOOD)
-                else: MiscWindow.FieldValue("ASINFO","NO DATA",fg=OSW_TEXT_POOR)
-            elif i.MotorName == NAME_ALTITUDE: # Pull sensor data related to ALTITUDE motor.
-                MiscWindow.FieldValue("LSINFO","NO DATA",fg=OSW_TEXT_POOR)
+        # Publish this pass to the dashboard. It is formatted and drawn by the renderer, not here.
+        Dashboard.Publish({'utc':dtnow,'obsstart':obsstart,'observationstart':ObservationStartUTC,
+                           'ra':ra,'dec':dec,'az':az,'alt':alt,'visible':visible,'approaching':approaching,
+                           'camaz':CameraAz,'camalt':CameraAlt,'latestaz':CameraLatestAz,'latestalt':CameraLatestAlt,
+                           'ready':ReadyToObserve,'photocount':PhotoCount,'mstop':mstop_latch},started=passstart)
+        ltts = Dashboard.LatestLoopTime() # How long did the loop take?
         if ltts > 20: # Exceedingly long loop time. O/S is busy with something else! If frequent it can be a sign that the memory card is aging/fragmented/damaged. Time to reinstall.
             SlowLoopCounter += 1 # Increment the count of slow loops, if we get a lot, there's maybe a problem.
             if SlowLoopCounter % 10 == 0:
@@ -17626,6 +18413,8 @@ def ObservationRun(batchmode=False):
         # End of main ObservationRun loop.
         
     # Observation is over at this point.
+    Dashboard.Stop() # No more dashboard refreshes.
+    MainLog.Log("ObservationRun: Loop latency:",Dashboard.Report(),terminal=False)
     print(textcolor.clearforward()) # Clear the screen from the current location forward, makes the following messages easier to read.
     ReadyToObserve = False
     if True: # Tell the camera it is all over.
@@ -17645,6 +18434,8 @@ def ObservationRun(batchmode=False):
     print ('\n' + textcolor.cursordown(10) + textcolor.clearforward()) # Move cursor below the ObservationRun display and clear the rest of the screen to make way for the menu.
     if Parameters.GeneratePreview and Parameters.GeneratePreviewVideo and not CameraInUse.FastImageCapture: # Preview images were requested, and could have been captured.
         GeneratePreviewMovie()
+    if Parameters.GenerateLightVideo: # Light images were added to a movie as they were captured.
+        GenerateLightMovie()
     if Parameters.GenerateKeogram or ObsSession.Target.SearchGroup in [target.GROUP_METEOR]: # Generate Keogram at end of observation.
         MainLog.Log("Generating Keogram from observation images.",terminal=True)
         CameraInUse.BuildKeogram(altitude=alt,azimuth=az)
@@ -18093,11 +18884,22 @@ def SimplifyRaDec(string):
         
 # ------------------------------------------------------------------------------------------------------
 
+TechHeaderCache = {} # Static parts of the FITS and EXIF header tags. Only rebuilt if the settings they depend on change.
+
 def GetTechFitsHeaderDict():
     """
     Return dictionary of elements for FITS header.
+    Only RA/DEC change during a session, the rest is cached in TechHeaderCache.
     """
     ra,dec = ObsSession.Target.RaDecHours() # Current ra/dec of target.
+    signature = (ObsSession.Target.Name,LensInUse.Length,LensInUse.EquivLength,Parameters.IRFilter,Parameters.PollutionFilter,Parameters.SolarFilter,
+                 Parameters.ImagePrivacy,Parameters._HomeLonVal,Parameters._HomeLatVal) # Everything the static tags depend on.
+    cached = TechHeaderCache.get('fits')
+    if cached != None and cached[0] == signature: # Static tags are unchanged, just refresh the target position.
+        fitstags = dict(cached[1])
+        fitstags["RA"] = {'value':SimplifyRaDec(str(ra)),'comment':'Target right ascension (hh mm ss.ss).'}
+        fitstags["DEC"] = {'value':SimplifyRaDec(str(dec)),'comment':'Target declination (ddd mm ss.ss).'}
+        return fitstags
     # Calculate the FILTER tags for any .FITS files that are generated.
     filtercode = ''
     filtercomment = ''
@@ -18155,6 +18957,7 @@ def GetTechFitsHeaderDict():
         "COMMENT": {'value':SourceCode().upper() + " " + VERSION + " " + str(SourceDate()),
                     'comment':"Observatory software."}
     }
+    TechHeaderCache['fits'] = (signature,dict(fitstags))
     return fitstags    
 
 # ------------------------------------------------------------------------------------------------------
@@ -18188,7 +18991,15 @@ def TechFitsHeaderTags(filename):
 def GetTechExifHeaderDict():
     """
     Return dictionary of EXIF header elements. 
+    Only GPSDateStamp changes during a session, the rest is cached in TechHeaderCache.
     """
+    signature = (ObsSession.Target.SearchGroup,ObsSession.Target.Name,CameraInUse.ExposureSeconds,SensorInUse.Type,LensInUse.Length,LensInUse.EquivLength,
+                 Parameters.ImagePrivacy,Parameters.Owner,Parameters._HomeLonVal,Parameters._HomeLatVal) # Everything the static tags depend on.
+    cached = TechHeaderCache.get('exif')
+    if cached != None and cached[0] == signature: # Static tags are unchanged, just refresh the timestamp.
+        exiftags = dict(cached[1])
+        exiftags["GPSDateStamp"] = str(NowUTC())
+        return exiftags
     lad, lam, las = AngleToDMS(abs(Parameters._HomeLatVal))
     if Parameters._HomeLatVal >= 0: lar = "N"
     else: lar = "S"
@@ -18241,6 +19052,7 @@ def GetTechExifHeaderDict():
      #"Pressure": exif_dict["Exif"][piexif.ExifIFD.Pressure] = self.exif_float(value) # 990.0) # hPa.
      #"Temperature": exif_dict["Exif"][piexif.ExifIFD.Temperature] = self.exif_float(value) # -10.0) # C 
     }
+    TechHeaderCache['exif'] = (signature,dict(exiftags))
     return exiftags 
 
 # ------------------------------------------------------------------------------------------------------
@@ -18492,6 +19304,87 @@ def MenuDarkFlatSet(): # For menu
 
 # ------------------------------------------------------------------------------------------------------
 
+def BuildCalibrationMasters():
+    """ Combine the session's bias, dark-flat, dark and flat image sets into master frames.
+        Sets are combined in strips so memory use stays within Parameters.CalibrationMemoryMB.
+        Masters are saved as master_<kind>.npy (with a .json description) in the same folder as the set.
+        
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            FolderHandler, CameraInUse, Parameters
+
+            Sets ---------------------------------------------
+            LightCalibrator is discarded so that new masters are picked up.
+
+            Returns ------------------------------------------
+            Number of masters built.
+        """
+    global LightCalibrator
+    builder = calibrationbuilder(memory_mb=Parameters.CalibrationMemoryMB,scratchfolder=FolderHandler.GetPath('session'),logger=CamLog)
+    exposures = {'bias':0.001,'darkflat':0.001,'dark':CameraInUse.ExposureSeconds,'flat':None} # Used if the frames have no metadata of their own.
+    built = 0
+    for kind in CALIBRATION_KINDS:
+        filenames = FolderHandler.ListFiles(kind,prefix=kind + '_',suffix='.jpg')
+        if len(filenames) < 3:
+            MainLog.Log("BuildCalibrationMasters:",kind,"has",len(filenames),"images. At least 3 are needed. Skipped.",terminal=True)
+            continue
+        outputfile = MasterFilename(FolderHandler.GetPath(kind),kind)
+        MainLog.Log("BuildCalibrationMasters: Combining",len(filenames),kind,"images.",terminal=True)
+        try:
+            master,metadata = builder.Build(kind,filenames,outputfile,method=Parameters.CalibrationMethod,metadata={'exposure':exposures[kind]})
+        except Exception as e:
+            MainLog.Log("BuildCalibrationMasters:",kind,"failed:",str(e),level='error',terminal=True)
+            continue
+        FolderHandler.RegisterFile(outputfile)
+        FolderHandler.RegisterFile(outputfile.replace('.npy','.json'))
+        MainLog.Log("BuildCalibrationMasters:",outputfile,metadata['stats'],terminal=True)
+        built += 1
+    LightCalibrator = None # Rebuild with the new masters when next needed.
+    return built
+
+# ------------------------------------------------------------------------------------------------------
+
+def GetLightCalibrator():
+    """ Return a calibrator for light images using the session's master frames, or None if there are no masters.
+        Built once and reused. Masters and the flat field correction are precomputed so each light image only costs a subtract and multiply.
+        
+            Parameters ---------------------------------------
+            n/a
+
+            References ---------------------------------------
+            FolderHandler, CameraInUse
+
+            Sets ---------------------------------------------
+            LightCalibrator
+
+            Returns ------------------------------------------
+            calibrator instance or None
+        """
+    global LightCalibrator
+    if LightCalibrator == None:
+        library = calibrationlibrary([FolderHandler.GetPath(kind) for kind in CALIBRATION_KINDS],logger=CamLog)
+        exposure = CameraInUse.ExposureSeconds
+        dark,darkmetadata = library.Find('dark',exposure=exposure)
+        flat,flatmetadata = library.Find('flat')
+        bias,biasmetadata = library.Find('bias')
+        darkflat,darkflatmetadata = library.Find('darkflat')
+        LightCalibrator = calibrator(dark=dark,flat=flat,bias=bias,darkflat=darkflat,darkmetadata=darkmetadata)
+        CamLog.Log("GetLightCalibrator: dark",darkmetadata != None,"flat",flatmetadata != None,"bias",biasmetadata != None,"darkflat",darkflatmetadata != None,terminal=False)
+    if not LightCalibrator.Ready(): return None
+    return LightCalibrator
+
+LightCalibrator = None # Applies master calibration frames to light images. (GetLightCalibrator)
+
+# ------------------------------------------------------------------------------------------------------
+
+def MenuBuildCalibrationMasters(): # For menu
+    built = BuildCalibrationMasters()
+    MainLog.Log("MenuBuildCalibrationMasters:",built,"master frames built.",terminal=True)
+
+# ------------------------------------------------------------------------------------------------------
+
 def MenuManualPreview(): # For Menu
     StartCameraThread()
     ManualPreview() # *Q* should be within AstroCamera class eventually. Some work needed first though.
@@ -18621,25 +19514,62 @@ def MenuSatellitePasses():
 
 # ------------------------------------------------------------------------------------------------------
 
+LogExtractThread = None # Background thread running the latest log extraction.
+
+def StartLogExtract(category,searchterms):
+    """ Extract the lines matching searchterms from the main log file and zip them, in a background thread.
+        The first extraction from a large log takes a while, this keeps the menus responsive.
+        Only one extraction runs at a time.
+        
+            Parameters ---------------------------------------
+            category (str)           Extraction category. Each category keeps its own bundle and only
+                                     reads log data added since its last extraction.
+            searchterms (str)        Selection phrase. (egrep style regular expression)
+
+            References ---------------------------------------
+            MainLog
+
+            Sets ---------------------------------------------
+            LogExtractThread
+
+            Returns ------------------------------------------
+            success (bool)           False if an extraction is still running. """
+    global LogExtractThread # Must be global because it must persist after this function completes.
+    if LogExtractThread is not None and LogExtractThread.is_alive():
+        MainLog.Log("StartLogExtract: The previous extraction is still running, try again when it has finished.",terminal=True)
+        return False
+    LogExtractThread = threading.Thread(target=LogExtract,args=(category,searchterms),daemon=True)
+    LogExtractThread.start()
+    MainLog.Log("StartLogExtract:",category,"extraction running in the background.",terminal=True)
+    return True
+
+def LogExtract(category,searchterms):
+    """ Background thread started by StartLogExtract(). """
+    try:
+        zipfile = MainLog.PackageSearchResult(searchterms,ignorecase=True,category=category) # Incremental, only reads log data added since the last extraction.
+        MainLog.Log("LogExtract: Generated",zipfile,terminal=True)
+    except Exception as e:
+        MainLog.ReportException(e,comment='LogExtract(' + category + ')')
+
+# ------------------------------------------------------------------------------------------------------
+
 def ZipCommsLog():
-    """ Extract communication summary from the main log file and zip it.  """
+    """ Extract communication summary from the main log file and zip it.
+        pilomarreplay.py can play the result back through a virtual serial port. """
     MainLog.Log("ZipCommsLog",terminal=True)
-    zipfile = MainLog.PackageSearchResult('RPi received|RPi queueing|warning|error',ignorecase=True)
-    MainLog.Log("ZipCommsLog: Generated",zipfile,terminal=True)
+    StartLogExtract('comms','RPi received|RPi queueing|warning|error')
 
 # ------------------------------------------------------------------------------------------------------
 
 def ZipTrajectoryLog():
     MainLog.Log("ZipTrajectoryLog",terminal=True)
-    zipfile = MainLog.PackageSearchResult('RPi queueing.*): trajectory ',ignorecase=True)
-    MainLog.Log("ZipTrajectoryLog: Generated",zipfile,terminal=True)
+    StartLogExtract('trajectory','RPi queueing.*): trajectory ')
 
 # ------------------------------------------------------------------------------------------------------
 
 def ZipMotorStatusLog():
     MainLog.Log("ZipMotorStatusLog",terminal=True)
-    zipfile = MainLog.PackageSearchResult('RPi received: motor status',ignorecase=True)
-    MainLog.Log("ZipMotorStatusLog: Generated",zipfile,terminal=True)
+    StartLogExtract('motorstatus','RPi received: motor status')
 
 # ------------------------------------------------------------------------------------------------------
 
@@ -18838,10 +19768,14 @@ def MicrocontrollerStatus():
     print("  (Messages received from microcontroller but not yet processed.)")
     print("Write chunk size:",Mctl.WriteChunkBytes,"bytes")
     print("  (Data is sent to microcontroller in packets of this size.)")
-    print("Write chunk gap:",Mctl.WriteChunkSeconds,"s") # Seconds between chunks written to microcontroller.
-    print("  (Seconds between each packet sent to the microcontroller.)")
+    print("Write window:",Mctl.WriteWindowBytes,"bytes") # Unacknowledged bytes allowed in flight.
+    print("  (Packets are sent until this much data waits for the microcontroller to acknowledge it.)")
+    print("Write scheduler:",Mctl.Transmit.Status())
+    for name,stats in Mctl.Transmit.Report().items():
+        print("  ",name.ljust(12),stats['priority'].ljust(7),"queued:",stats['depth'],"sent:",stats['sent'],"latency p50/p99:",stats['latency_ms_p50'],"/",stats['latency_ms_p99'],"ms",
+              "ack p50:",stats['ack_ms_p50'],"ms timeouts:",stats['timeouts'])
     print("Current receiving line:",Mctl.InputLine)
-    print("Write queue length:",len(Mctl.WriteQueue))
+    print("Write queue length:",Mctl.Transmit.Depth())
     print("  (Messages waiting to be transmitted to the microcontroller.)")
     temp = str(Mctl.LinesReceived)
     if Mctl.LinesReceived < 1:
@@ -18920,6 +19854,12 @@ def MicrocontrollerStatus():
         print("Exceptions handled:",Mctl.MctlExceptionCount)
         print("  (The microcontroller has not reported any runtime exceptions.)")
     print("Outbound message counter:",Mctl.SendId) # Incremental counter, the message number being sent to the microcontroller.
+    print("Inbound messages handled:",ObsSession.Dispatcher.Messages) # Routed through the dispatch table.
+    for verb,stats in ObsSession.Dispatcher.Report().items():
+        temp = str(stats)
+        if stats['errors'] > 0: temp = textcolor.yellow(temp) # Handler or parser failed.
+        print("   ",verb.ljust(21),temp)
+    print("Telemetry recording cost:",Telemetry.Overhead()) # Measured inside Telemetry.Record() at the motor status, trajectory, UART and camera call sites.
     print(textcolor.yellow("Reported measures (if available):"))
     print("Reset reason:",Mctl.ReportedResetReason) # eg 'POWER_ON' # RESET REASON if reported.
     print("Clockspeed:",int(Mctl.ReportedClockspeed),"Hz") # Clock speed in MHz
@@ -19635,6 +20575,9 @@ def RunObservationSchedule():
             MainLog.Log("RunObservationSchedule: Cannot initialize target",i,se.SearchTerm,level='error')
             continue
         ObsSession.Target = obstarget
+        seconds, paths = PredictGoTo(obstarget) # How long will the slew to this target take?
+        MainLog.Log("RunObservationSchedule: Predicted slew to",se.Name,HRSeconds(int(seconds)),terminal=False)
+        DevWindow.Print(NowHMS() + " - Predicted slew " + HRSeconds(int(seconds)))
         # Set the observation parameters.
         CameraInUse.ExposureSeconds = se.ExposureSeconds
         Parameters.BatchSize = se.ObservationFrames
@@ -19761,6 +20704,8 @@ def EnablePositionSensorTune():
     print("Any large position error reported by the position sensors will be")
     print("converted into an automatic TUNE command and fed back to the")
     print("motors to keep the telescope on track.")
+    print("Sensor offset and gear backlash are learned first, only consistent")
+    print("slip is corrected. Single noisy readings are ignored.")
     for i in MotorControls:
         print(i.MotorName,": Enabled")
         if i.PositionSensorTuning == False: i.PositionSensorTuning = True
@@ -19783,15 +20728,18 @@ def AboutPositionSensor():
     for i in MotorControls:
         print(i.MotorName,":")
         print(textcolor.white("Position sensor:"))
-        print("- PositionSensorType:",self.PositionSensorType)
-        print("- PositionSensorEnabled:",self.PositionSensorEnabled)
-        print("- PositionSensorTuning:",self.PositionSensorTuning)
-        print("- position_sensor_configured:",self.position_sensor_configured)
-        print("- position_sensor_value:",self.position_sensor_value)
-        print("- position_sensor_angle:",self.position_sensor_angle)
-        print("- position_sensor_init_angle:",self.position_sensor_init_angle)
-        print("- position_sensor_init_value:",self.position_sensor_init_value)
-        print("- position_sensor_angle_delta:",self.position_sensor_angle_delta)
+        print("- PositionSensorType:",i.PositionSensorType)
+        print("- PositionSensorEnabled:",i.PositionSensorEnabled)
+        print("- PositionSensorTuning:",i.PositionSensorTuning)
+        print("- position_sensor_configured:",i.position_sensor_configured)
+        print("- position_sensor_value:",i.position_sensor_value)
+        print("- position_sensor_angle:",i.position_sensor_angle)
+        print("- position_sensor_init_angle:",i.position_sensor_init_angle)
+        print("- position_sensor_init_value:",i.position_sensor_init_value)
+        print("- position_sensor_angle_delta:",i.position_sensor_angle_delta)
+        print("- Fusion (steps):",i.PositionFusion.Report())
+        print("- Slip histogram (steps):")
+        for line in i.PositionFusion.HistogramLines(): print("  " + line)
         print("")
     
 # ------------------------------------------------------------------------------------------------------
@@ -20148,6 +21096,7 @@ MainMenuOptions = {
     'TakeFlatFrameSet':       {'label':'Take flat frame set',       'call':MenuFlatSet},
     'TakeBiasFrameSet':       {'label':'Take bias/offset frame set','call':MenuBiasSet},
     'TakeDarkFlatFrameSet':   {'label':'Take dark flat frame set',  'call':MenuDarkFlatSet},
+    'BuildCalibrationMasters':{'label':'Build calibration masters', 'call':MenuBuildCalibrationMasters},
     'TakePreviewFrames':      {'label':'Take preview frames',       'call':MenuManualPreview},
     'TakeAutoFrames':         {'label':'Take auto frames',          'call':MenuAutoPhoto},
     'SetTimelapseDelay':      {'label':'Set timelapse delay',       'call':SetTimelapseDelay},
@@ -20239,6 +21188,11 @@ print('')
 print(textcolor.yellow("Cleanup GPIO..."))
 GPIOCleanup() # Reset the GPIO state.
 
+if LogExtractThread is not None and LogExtractThread.is_alive(): # Let it finish, otherwise the bundle is left half written.
+    print('')
+    print(textcolor.yellow("Waiting for the log extraction to finish..."))
+    LogExtractThread.join()
+
 print('')
 print (textcolor.yellow("Saving parameters..."))
 Parameters.SavedUTC = NowUTC() # Write when the parameter file was saved.
@@ -20248,5 +21202,8 @@ ObservationSchedule.CheckDirtyBit() # If the ObservationSchedule has been modifi
 print (textcolor.yellow("Done."))
 print (textcolor.fgbgcolor(textcolor.BLACK,textcolor.GREEN," PILOMAR COMPLETE. OK TO SHUTDOWN "))
 
+Telemetry.Close() # Write any buffered telemetry records.
+MainLog.Log("MAIN: Telemetry records",Telemetry.Status(),terminal=False)
+MainLog.Log("MAIN: Telemetry overhead at the call sites",Telemetry.Overhead(),terminal=False) # Microseconds per Record() call, per channel.
 MainLog.Log("MAIN: PROGRAM COMPLETE",terminal=False)
 
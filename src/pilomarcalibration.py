@@ -0,0 +1,361 @@
+#!/usr/bin/python
+
+# Pilomar's calibration master builder. Combines DARK, FLAT, BIAS and DARKFLAT image sets into master frames
+# and applies them to LIGHT images.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# A median of 50 x 12MP colour frames needs 50 x 36M values in memory at once. That does not fit on a 2GB Pi.
+# The builder combines the set in horizontal strips (tiles) instead. Only one strip of every frame is held in memory.
+#   - .npy files are memory mapped, so a strip is read directly from the file.
+#   - .fits files are memory mapped by astropy if it is available.
+#   - .jpg/.png etc are decoded ONCE each and spilled into a memory mapped scratch file, strips are read from that.
+# The strip height is chosen from the memory budget (calibrationbuilder(memory_mb=...)).
+#
+# Masters are saved as float32 .npy files with a .json sidecar describing them: kind, exposure, gain, temperature.
+# calibrationlibrary finds the best master for a light frame's settings and caches it in memory.
+# calibrator applies the masters to light frames. Everything it needs is precomputed, so each light frame
+# costs a subtract and a multiply.
+# tests/test_calibration.py checks the masters against synthetic frames with known patterns.
+
+import os
+import json
+import time
+import tempfile
+import numpy as np
+import cv2
+try: # astropy is optional, it's only needed to read .fits frames.
+    from astropy.io import fits
+except ImportError:
+    fits = None
+
+MASTER_PREFIX = 'master_' # Master files are named master_<kind>_....npy
+KINDS = ['bias','darkflat','dark','flat'] # Build in this order, later masters can use the earlier ones.
+
+class calibrationbuilder():
+    """ Combine a set of calibration frames into a master frame with bounded memory.
+        Usage
+        builder = calibrationbuilder(memory_mb=256)
+        master,metadata = builder.Build('dark',filelist,'/path/master_dark.npy')
+        """
+
+    def __init__(self,memory_mb=256,scratchfolder=None,logger=None):
+        """ memory_mb = Approximate memory budget for the frame strips being combined.
+            scratchfolder = Where to decode compressed frames. (Defaults to the system temp folder.)
+            logger = Optional logfile instance. """
+        self.MemoryBytes = max(8,memory_mb) * 1024 * 1024
+        self.ScratchFolder = scratchfolder
+        self.Logger = logger
+        self.LastStats = {} # Timing and clipping statistics from the last Combine().
+
+    def Log(self,*args,**kwargs):
+        """ Write to the logger if there is one. """
+        if self.Logger != None:
+            self.Logger.Log(*args,**kwargs)
+
+    def OpenFrame(self,filename):
+        """ Return a memory mapped array for a frame which supports row slicing without loading the file, or None. """
+        ext = filename.split('.')[-1].lower()
+        if ext == 'npy':
+            return np.load(filename,mmap_mode='r')
+        if ext in ['fits','fit'] and fits != None:
+            with fits.open(filename,memmap=True) as hdul:
+                data = hdul[0].data
+                if data is not None and data.ndim == 3 and data.shape[0] in [3,4]: # FITS stores colour planes first.
+                    return None # Would need transposing, decode it instead.
+                return data
+        return None
+
+    def ReadFrame(self,filename):
+        """ Fully decode a frame. Returns a numpy array or None. """
+        ext = filename.split('.')[-1].lower()
+        if ext == 'npy':
+            return np.load(filename)
+        if ext in ['fits','fit'] and fits != None:
+            with fits.open(filename) as hdul:
+                data = np.asarray(hdul[0].data)
+                if data.ndim == 3 and data.shape[0] in [3,4]: data = np.moveaxis(data,0,-1) # Colour planes last, like OpenCV.
+                return data
+        return cv2.imread(filename,cv2.IMREAD_UNCHANGED)
+
+    def FrameMetadata(self,filename):
+        """ Read exposure (seconds), gain and temperature from the frame's .json sidecar if pilomarfits wrote one. """
+        result = {}
+        sidecar = os.path.splitext(filename)[0] + '.json'
+        if os.path.exists(sidecar):
+            try:
+                with open(sidecar,'r') as f:
+                    md = json.load(f)
+                if 'ExposureTime' in md: result['exposure'] = md['ExposureTime'] / 1000000.0 # Microseconds.
+                if 'AnalogueGain' in md: result['gain'] = md['AnalogueGain']
+                if md.get('SensorTemperature',None) != None: result['temperature'] = md['SensorTemperature']
+            except Exception as e:
+                self.Log("calibrationbuilder.FrameMetadata(): Cannot read",sidecar,str(e),level='warning',terminal=False)
+        return result
+
+    def TileRows(self,frames,width,channels):
+        """ How many rows of every frame fit in the memory budget?
+            The working copy is float32 plus a few temporaries of the same size during clipping. """
+        bytesperrow = frames * width * channels * 4 * 4 # data, dev, squares + the keep mask and reductions.
+        return max(1,int(self.MemoryBytes // bytesperrow))
+
+    def Sources(self,filenames):
+        """ Open every frame for strip reading. Compressed frames are decoded once into a scratch memmap.
+            Returns (sources,scratch) where sources is a list of arrays and scratch is the scratch filename (or None). """
+        sources = [None] * len(filenames)
+        decode = []
+        shape = None
+        dtype = None
+        for i,filename in enumerate(filenames):
+            frame = self.OpenFrame(filename)
+            if frame is None:
+                decode.append(i)
+            else:
+                sources[i] = frame
+                shape,dtype = frame.shape,frame.dtype
+        scratch = None
+        if len(decode) > 0:
+            first = self.ReadFrame(filenames[decode[0]])
+            if first is None: raise ValueError('Cannot read ' + filenames[decode[0]])
+            shape,dtype = first.shape,first.dtype
+            handle,scratch = tempfile.mkstemp(prefix='pilomar_calibration_',suffix='.dat',dir=self.ScratchFolder)
+            os.close(handle)
+            store = np.memmap(scratch,dtype=dtype,mode='w+',shape=(len(decode),) + shape)
+            for n,i in enumerate(decode):
+                frame = first if n == 0 else self.ReadFrame(filenames[i])
+                if frame is None or frame.shape != shape:
+                    raise ValueError('Frame ' + filenames[i] + ' is missing or a different size.')
+                store[n] = frame
+                sources[i] = store[n]
+            store.flush()
+        for frame in sources:
+            if frame.shape != shape:
+                raise ValueError('Calibration frames are not all the same size.')
+        return sources,scratch
+
+    def CombineTile(self,stack,method='median',sigma=3.0,iterations=3):
+        """ Combine a (frames,rows,width[,channels]) stack along the first axis.
+            method = 'median' or 'sigma'.
+            sigma clipping starts from the median and a robust spread (1.4826 x median absolute deviation),
+            rejects pixels further than sigma x spread, then repeats with the mean and standard deviation of the survivors.
+            Returns (tile,rejected) where rejected counts the clipped values. """
+        data = stack.astype(np.float32)
+        centre = np.median(data,axis=0)
+        if method != 'sigma' or data.shape[0] < 3:
+            return centre,0
+        dev = np.abs(data - centre)
+        spread = 1.4826 * np.median(dev,axis=0)
+        floor = 0.5 # Integer data has a spread of at least half a count. Stops everything being rejected in flat areas.
+        squares = data * data
+        keep = None
+        for i in range(iterations):
+            newkeep = dev <= sigma * np.maximum(spread,floor)
+            if keep is not None and np.array_equal(newkeep,keep): break # Converged.
+            keep = newkeep
+            count = keep.sum(axis=0,dtype=np.float32)
+            safecount = np.maximum(count,1)
+            mean = np.sum(data,axis=0,where=keep) / safecount
+            var = np.sum(squares,axis=0,where=keep) / safecount - mean * mean # E[x^2] - E[x]^2 of the survivors.
+            centre = np.where(count > 0,mean,centre)
+            spread = np.sqrt(np.maximum(var,0) * safecount / np.maximum(count - 1,1)) # Sample standard deviation.
+            np.subtract(data,centre,out=dev)
+            np.abs(dev,out=dev)
+        return centre.astype(np.float32),int(keep.size - keep.sum())
+
+    def Combine(self,filenames,method='median',sigma=3.0,iterations=3):
+        """ Combine frames into a single float32 master, one strip at a time. """
+        if len(filenames) < 1: raise ValueError('No frames to combine.')
+        start = time.time()
+        sources,scratch = self.Sources(filenames)
+        loaded = time.time()
+        try:
+            shape = sources[0].shape
+            height,width = shape[0],shape[1]
+            channels = shape[2] if len(shape) > 2 else 1
+            rows = self.TileRows(len(sources),width,channels)
+            master = np.empty(shape,np.float32)
+            stack = np.empty((len(sources),min(rows,height)) + shape[1:],sources[0].dtype) # Reused for every strip.
+            rejected = 0
+            for r0 in range(0,height,rows):
+                r1 = min(height,r0 + rows)
+                for i,frame in enumerate(sources):
+                    stack[i,:r1 - r0] = frame[r0:r1]
+                master[r0:r1],clipped = self.CombineTile(stack[:,:r1 - r0],method=method,sigma=sigma,iterations=iterations)
+                rejected += clipped
+        finally:
+            sources = None
+            if scratch != None and os.path.exists(scratch): os.remove(scratch)
+        self.LastStats = {'frames':len(filenames),'tile_rows':rows,'tiles':(height + rows - 1) // rows,
+                          'load_s':round(loaded - start,2),'combine_s':round(time.time() - loaded,2),
+                          'rejected_fraction':round(rejected / float(len(filenames) * master.size),5)}
+        self.Log("calibrationbuilder.Combine():",method,self.LastStats,terminal=False)
+        return master
+
+    def Build(self,kind,filenames,outputfile,method='median',sigma=3.0,metadata=None):
+        """ Combine a set of frames and save the master with its metadata.
+            kind = 'dark', 'flat', 'bias' or 'darkflat'.
+            metadata = Optional dictionary of exposure/gain/temperature to use if the frames have no sidecar files.
+            Returns (master,metadata). """
+        master = self.Combine(filenames,method=method,sigma=sigma)
+        md = {'kind':kind,'method':method,'sigma':sigma,'frames':len(filenames),'shape':list(master.shape),
+              'created':time.strftime('%Y-%m-%d %H:%M:%S'),'source':os.path.dirname(filenames[0])}
+        if metadata != None: md.update(metadata)
+        framedata = [self.FrameMetadata(f) for f in filenames] # Average the settings recorded with the frames.
+        for key in ['exposure','gain','temperature']:
+            values = [d[key] for d in framedata if key in d]
+            if len(values) > 0: md[key] = round(float(np.mean(values)),6)
+        md['stats'] = self.LastStats
+        SaveMaster(outputfile,master,md)
+        return master,md
+
+def MasterFilename(folder,kind,exposure=None):
+    """ Standard name for a master file. """
+    name = MASTER_PREFIX + kind
+    if exposure != None: name += '_' + str(round(exposure,4)).replace('.','p') + 's'
+    return os.path.join(folder,name + '.npy')
+
+def SaveMaster(filename,master,metadata):
+    """ Save a master frame and its .json sidecar. """
+    np.save(filename,master.astype(np.float32))
+    with open(os.path.splitext(filename)[0] + '.json','w') as f:
+        json.dump(metadata,f,indent=1)
+
+def LoadMaster(filename):
+    """ Load a master frame and its metadata. Returns (master,metadata). """
+    with open(os.path.splitext(filename)[0] + '.json','r') as f:
+        metadata = json.load(f)
+    return np.load(filename),metadata
+
+class calibrationlibrary():
+    """ Finds and caches master frames from one or more folders. """
+
+    def __init__(self,folders=[],logger=None):
+        self.Folders = list(folders)
+        self.Logger = logger
+        self.Cache = {} # filename: (mtime,master,metadata)
+
+    def Log(self,*args,**kwargs):
+        """ Write to the logger if there is one. """
+        if self.Logger != None:
+            self.Logger.Log(*args,**kwargs)
+
+    def Catalog(self):
+        """ List the metadata of every master in the folders. Each entry gains a 'filename'. """
+        result = []
+        for folder in self.Folders:
+            if not os.path.isdir(folder): continue
+            for name in os.listdir(folder):
+                if name.startswith(MASTER_PREFIX) and name.endswith('.json'):
+                    filename = os.path.join(folder,name[:-5] + '.npy')
+                    if not os.path.exists(filename): continue
+                    try:
+                        with open(os.path.join(folder,name),'r') as f:
+                            md = json.load(f)
+                    except Exception as e:
+                        self.Log("calibrationlibrary.Catalog(): Cannot read",name,str(e),level='warning',terminal=False)
+                        continue
+                    md['filename'] = filename
+                    result.append(md)
+        return result
+
+    def Find(self,kind,exposure=None,gain=None,temperature=None,maxtempdiff=5.0):
+        """ Return (master,metadata) of the closest matching master or (None,None).
+            Exposure and gain mismatches cost more than temperature. Masters more than maxtempdiff C away are ignored. """
+        best = None
+        for md in self.Catalog():
+            if md.get('kind') != kind: continue
+            score = 0.0
+            if exposure != None and md.get('exposure') != None:
+                score += abs(np.log(max(exposure,1e-6) / max(md['exposure'],1e-6))) * 10
+            if gain != None and md.get('gain') != None:
+                score += abs(gain - md['gain'])
+            if temperature != None and md.get('temperature') != None:
+                if abs(temperature - md['temperature']) > maxtempdiff: continue
+                score += abs(temperature - md['temperature']) / maxtempdiff
+            if best == None or score < best[0]: best = (score,md)
+        if best == None: return None,None
+        return self.Load(best[1]['filename'])
+
+    def Load(self,filename):
+        """ Load a master, from memory if it hasn't changed on disc. """
+        mtime = os.path.getmtime(filename)
+        cached = self.Cache.get(filename)
+        if cached == None or cached[0] != mtime:
+            master,md = LoadMaster(filename)
+            self.Cache[filename] = (mtime,master,md)
+            self.Log("calibrationlibrary.Load():",filename,md.get('kind'),md.get('exposure'),terminal=False)
+        return self.Cache[filename][1],self.Cache[filename][2]
+
+class calibrator():
+    """ Apply master frames to light frames.
+        calibrated = (light - dark) x flatgain + pedestal
+        dark is the master dark, rescaled for the light exposure if a bias master is available.
+        flatgain is 1 / normalised (flat - darkflat), precomputed.
+        pedestal (the mean dark level) keeps the background above zero for integer images.
+        This is calculated as (light + offset) x flatgain where offset = pedestal / flatgain - dark is precomputed,
+        so each light frame costs one add and one multiply.
+        Not thread safe, a working buffer is reused between calls. """
+
+    def __init__(self,dark=None,flat=None,bias=None,darkflat=None,darkmetadata=None):
+        self.Dark = dark
+        self.Bias = bias
+        self.DarkExposure = None if darkmetadata == None else darkmetadata.get('exposure')
+        self.Offsets = {} # (pedestal / flatgain - dark) for the latest exposure.
+        self.Work = None # Reused float32 working buffer.
+        self.FlatGain = None
+        if flat is not None:
+            base = darkflat if darkflat is not None else bias # Remove the flat's own dark signal.
+            flatsignal = flat.astype(np.float32) - (base if base is not None else 0)
+            level = flatsignal.reshape(-1,flatsignal.shape[2]).mean(axis=0) if flatsignal.ndim == 3 else flatsignal.mean()
+            norm = flatsignal / np.maximum(level,1e-6) # Normalise each colour channel to 1.0.
+            self.FlatGain = (1.0 / np.maximum(norm,0.05)).astype(np.float32) # Limit correction in dead/dust areas.
+        self.Pedestal = float(np.mean(dark)) if dark is not None else 0.0
+
+    def DarkFor(self,exposure):
+        """ Dark frame for an exposure. Dark current scales with exposure, bias doesn't. """
+        if self.Dark is None: return None
+        if exposure == None or self.DarkExposure == None or self.Bias is None or abs(exposure - self.DarkExposure) < 1e-6:
+            return self.Dark
+        ratio = exposure / max(self.DarkExposure,1e-6)
+        return self.Bias + (self.Dark - self.Bias) * ratio
+
+    def OffsetFor(self,exposure):
+        """ (pedestal / flatgain - dark) for an exposure, calculated once per exposure. """
+        key = None if exposure == None else round(exposure,6)
+        if key not in self.Offsets:
+            dark = self.DarkFor(exposure)
+            if dark is None: offset = None
+            elif self.FlatGain is not None and self.FlatGain.shape == dark.shape: offset = self.Pedestal / self.FlatGain - dark
+            else: offset = self.Pedestal - dark
+            self.Offsets = {key:None if offset is None else offset.astype(np.float32)} # Only keep the latest.
+        return self.Offsets[key]
+
+    def Ready(self):
+        """ Is there anything to apply? """
+        return self.Dark is not None or self.FlatGain is not None
+
+    def Apply(self,image,exposure=None):
+        """ Return a calibrated copy of image, same dtype and shape. Integer results are rounded and saturated. """
+        depth = {np.dtype(np.uint8):cv2.CV_8U,np.dtype(np.uint16):cv2.CV_16U,np.dtype(np.float32):cv2.CV_32F}.get(image.dtype,None)
+        offset = self.OffsetFor(exposure)
+        gain = self.FlatGain
+        if offset is not None and offset.shape != image.shape: offset = None # Master doesn't match this image.
+        if gain is not None and gain.shape != image.shape: gain = None
+        if depth == None or (offset is None and gain is None):
+            return image.copy() # Nothing can be applied.
+        if gain is None: # Dark only.
+            return cv2.add(image,offset,dtype=depth)
+        if offset is None: # Flat only.
+            return cv2.multiply(image,gain,dtype=depth)
+        if self.Work is None or self.Work.shape != image.shape: self.Work = np.empty(image.shape,np.float32)
+        cv2.add(image,offset,dst=self.Work,dtype=cv2.CV_32F)
+        return cv2.multiply(self.Work,gain,dtype=depth)
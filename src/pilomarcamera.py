@@ -948,8 +948,17 @@ class astrocamera():
         if self.Lastjpg != None:
             cmd = "rm " + self.Lastjpg
             self.osCmd(cmd)
+            self.RegisterFiles(self.Lastjpg) # Remove it from the folder manifest.
             self.Lastjpg = None # Clear the saved filename.
 
+    def RegisterFiles(self,filename):
+        """ Tell the FolderHandler's manifest about an image file and its .dng/.fits companions.
+            Files that exist are recorded, files that don't are removed from the manifest. """
+        if self.FolderHandler != None and hasattr(self.FolderHandler,'RegisterFile'):
+            root = os.path.splitext(filename)[0]
+            for filetype in ['.jpg','.dng','.fits']:
+                self.FolderHandler.RegisterFile(root + filetype)
+
     def FakeAurora(self,srcimg): # Generate a fake aurora effect.
         """ Create a series of aurura like color blocks on an image. 
             srcimg = numpy buffer.
@@ -1270,6 +1279,7 @@ class astrocamera():
                 self.Log("astrocamera.CaptureSetFull(): Remove temporary outputfile",outputfile,terminal=False)
                 cmd = 'rm ' + outputfile
                 self.osCmd(cmd,output='log')
+            self.RegisterFiles(outputfile) # Record the files that now exist in the folder manifest.
             # Estimate ETA. If we're looping through a batch of photos.
             if batch_size > 1:
                 dt_now = self.NowUTC() # Current time.
@@ -1361,6 +1371,7 @@ class astrocamera():
                 self.Log("astrocamera.CaptureSetFast(): imread of",outputfile,"failed.",terminal=False)
             self.LastImageDateTime = self.NowUTC() # *Q* This timestamp is AFTER the image has been captured. Can it be estimated better? CaptureStart + (CaptureEnd - CaptureStart) / 2 ?
             self.Log("astrocamera.CaptureSetFast(): Image loaded.",terminal=False)
+            self.RegisterFiles(outputfile) # Record the file in the folder manifest.
             # Estimate ETA. If we're looping through a batch of photos.
             if batch_size > 1:
                 dt_now = self.NowUTC() # Current time.
@@ -1532,6 +1543,7 @@ class astrocamera():
                         self.Log("astrocamera.ProcessImageFiles: Deleting intermediate .jpg file...",terminal=False)
                         cmd = 'rm ' + file
                         self.osCmd(cmd,output='log')
+                    self.RegisterFiles(file) # Update the folder manifest with the converted files.
         else:
             print(textcolor.yellow("No suitable unprocessed files were found."))
             print("- There is no RAW data in simulated images (Is the camera disabled?)")
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+# Pilomar's dashboard renderer. Draws the observation dashboard from a snapshot, at its own pace.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# ObservationRun() used to format and redraw every dashboard field on every pass of its main loop.
+# The loop also keeps the camera, the microcontroller trajectory and the safety checks going, so the
+# drawing competed with them for the CPU, and a slow terminal slowed the whole observation down.
+#
+# Now the control loop calculates the values it needs once per pass (target position etc) and publishes
+# them as a snapshot. It never formats dashboard text itself.
+#   - dashboardrenderer runs its own thread. Every 'period' seconds it passes the latest snapshot to the
+#     render function, which formats the fields and draws the windows. Snapshots published in between
+#     are simply replaced, they are never queued.
+#   - Nothing is drawn unless a new snapshot has arrived, so the dashboard stops changing if the control
+#     loop stops.
+#   - Pause() waits for any drawing in progress to finish and holds the renderer off, so the control loop
+#     can use the terminal for prompts and submenus.
+#   - period = 0 renders inline each time a snapshot is published. That is the old behaviour, useful to
+#     compare the loop latency with and without the renderer on real hardware.
+#
+# The control loop records how long each pass takes, the renderer reports the percentiles.
+#
+# tests/test_dashboard.py compares the loop latency with inline and threaded rendering.
+# (The render function there is synthetic, the pilomar dashboard needs the full program.)
+
+import time
+import threading
+from collections import deque
+
+def Percentile(values,percent):
+    """ Nearest rank percentile of a sequence, None if empty. """
+    if len(values) == 0: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1,int(len(ordered) * percent / 100.0))]
+
+class dashboardrenderer():
+    """ Renders the latest published snapshot at a fixed rate, in its own thread. """
+
+    def __init__(self,render,period=1.0,history=1000,errorhandler=None,clock=time.monotonic):
+        """ render = Function(snapshot) that formats and draws the dashboard.
+            period = Seconds between refreshes. 0 renders inline on every Publish().
+            history = Loop and render times kept for the percentiles.
+            errorhandler = Function(exception), called if the render function fails.
+            clock = Time source in seconds. """
+        self.Render = render
+        self.Period = max(0.0,period)
+        self.ErrorHandler = errorhandler
+        self.Clock = clock
+        self.Lock = threading.Lock() # Protects the snapshot.
+        self.RenderLock = threading.Lock() # Held while drawing.
+        self.Snapshot = None # Latest snapshot from the control loop.
+        self.Published = 0 # Snapshots published.
+        self.Rendered = 0 # Sequence number of the latest snapshot drawn.
+        self.Renders = 0 # Number of refreshes.
+        self.Errors = 0 # Render failures.
+        self.Paused = False
+        self.Stopping = threading.Event()
+        self.Thread = None
+        self.LoopTimes = deque(maxlen=history) # Control loop pass durations. (s)
+        self.RenderTimes = deque(maxlen=history) # Render durations. (s)
+
+    def Threaded(self):
+        """ Is the dashboard drawn by its own thread? """
+        return self.Period > 0
+
+    def Start(self):
+        """ Start the renderer thread. """
+        if self.Threaded() and self.Thread == None:
+            self.Stopping.clear()
+            self.Thread = threading.Thread(target=self.Run,daemon=True)
+            self.Thread.start()
+
+    def Stop(self):
+        """ Stop the renderer thread, after any drawing in progress. """
+        self.Stopping.set()
+        if self.Thread != None:
+            self.Thread.join()
+            self.Thread = None
+
+    def Run(self):
+        """ Renderer thread. """
+        while not self.Stopping.wait(self.Period):
+            self.RenderLatest()
+
+    def Publish(self,snapshot,started=None):
+        """ Replace the snapshot. started = Clock() at the start of the control loop pass that produced it.
+            The pass duration is recorded after any inline drawing, so both modes measure the whole pass. """
+        with self.Lock:
+            self.Snapshot = snapshot
+            self.Published += 1
+        if not self.Threaded(): self.RenderLatest()
+        if started != None:
+            with self.Lock:
+                self.LoopTimes.append(self.Clock() - started)
+
+    def LatestLoopTime(self):
+        """ Duration of the latest control loop pass (s), None if nothing recorded. """
+        with self.Lock:
+            return self.LoopTimes[-1] if len(self.LoopTimes) > 0 else None
+
+    def Latest(self):
+        """ The latest snapshot, None before the first one. """
+        with self.Lock:
+            return self.Snapshot
+
+    def RenderLatest(self,force=False):
+        """ Draw the latest snapshot if it hasn't been drawn yet. Returns True if it was drawn. """
+        with self.RenderLock:
+            with self.Lock:
+                snapshot = self.Snapshot
+                sequence = self.Published
+            if snapshot == None or self.Paused: return False
+            if sequence == self.Rendered and not force: return False # Nothing new.
+            start = self.Clock()
+            try:
+                self.Render(snapshot)
+            except Exception as e:
+                self.Errors += 1
+                if self.ErrorHandler != None: self.ErrorHandler(e)
+            self.RenderTimes.append(self.Clock() - start)
+            self.Rendered = sequence
+            self.Renders += 1
+            return True
+
+    def Pause(self):
+        """ Hold the renderer off, so the terminal can be used for something else. Waits for any drawing in progress. """
+        self.Paused = True
+        with self.RenderLock: pass
+
+    def Resume(self):
+        """ Allow the renderer to draw again. """
+        self.Paused = False
+
+    def LoopLatency(self,percent=50):
+        """ Control loop pass duration percentile (s), None if nothing recorded. """
+        with self.Lock:
+            return Percentile(list(self.LoopTimes),percent)
+
+    def RenderLatency(self,percent=50):
+        """ Render duration percentile (s), None if nothing rendered. """
+        return Percentile(list(self.RenderTimes),percent)
+
+    def Report(self):
+        """ Loop and render latency summary. Milliseconds. """
+        result = {'mode':'threaded' if self.Threaded() else 'inline','period':self.Period,
+                  'loops':self.Published,'renders':self.Renders,'errors':self.Errors}
+        for name,function in (('loop',self.LoopLatency),('render',self.RenderLatency)):
+            for percent in (50,90,99,100):
+                value = function(percent)
+                result[name + '_ms_' + ('max' if percent == 100 else 'p' + str(percent))] = None if value == None else round(value * 1000,1)
+        return result
+
+    def Status(self):
+        """ Short loop latency text for the dashboard. """
+        p50 = self.LoopLatency(50)
+        p99 = self.LoopLatency(99)
+        if p50 == None: return '-'
+        return 'p50 ' + str(round(p50 * 1000,1)) + 'ms p99 ' + str(round(p99 * 1000,1)) + 'ms'
@@ -80,6 +80,10 @@
 #                                --exif-tag-file filename1.json filename2.json filename3.json
 #                      Multiple files are supported beause there may be several different sources of tags.
 #   --image-type       The type of image being captured (eg LIGHT, DARK, BIAS etc). Default is 'LIGHT' if nothing specified.
+#   --mmap             Write the .fits and .npy files through memory-maps instead of building complete copies in RAM first.
+#                      The FITS header is written, the file is extended to full size and the pixel rows are copied straight in.
+#                      Reduces peak memory and SD card double-buffering for large raw captures.
+#                      Read the files back with pilomarimage.LoadFile(filename,mapped=True) to touch only the rows you need.
 #   --verbose          Log messages are copied to the terminal display.
 #   --debug            Extra analysis during processing. (Slows processing down.)
 # 
@@ -340,6 +344,8 @@ if '--verbose' in ArgumentDict: VerboseMode = True # Show all log messages to th
 else: VerboseMode = False # Log messages ONLY to the log file.
 if '--debug' in ArgumentDict: DebugMode = True # Extra analysis during processing.
 else: DebugMode = False # No extra analysis, just core processing.
+if '--mmap' in ArgumentDict: MmapMode = True # Write .fits and .npy files via memory-maps.
+else: MmapMode = False # Write .fits and .npy files via in-memory copies.
 
 # Is a logfile specified?
 if '--log-file' in ArgumentDict:
@@ -420,6 +426,46 @@ def NormalizeArray(input_array,min_out,max_out,min_in=None,max_in=None):
     
 # -----------------------------------------------------------------------------------------    
 
+def WriteFitsMapped(filename,array,header):
+    """ Write a 2D array as the primary HDU of a .fits file without building the full HDU in memory first.
+        The header is written, the file is extended to full size, then the rows are copied into a memory-map of the data area.
+        Rows are written in reverse order (bottom-up) to match the cv2.flip() of the in-memory path.
+        Parameters ------------------------------------------------------------------------
+        filename : The .fits file to create. (Overwritten if it exists.)
+        array : 2D numpy array. Stored as 32bit floats.
+        header : fits.Header containing the tags to write. """
+    MainLog.Log(PROGRAMNAME + ": WriteFitsMapped(",filename,array.shape,")",terminal=VerboseMode)
+    hdu = fits.PrimaryHDU(data=np.zeros((1,1),dtype=np.float32)) # Tiny placeholder to generate a valid primary header.
+    hdu.header['NAXIS1'] = array.shape[1]
+    hdu.header['NAXIS2'] = array.shape[0]
+    for card in header.cards: hdu.header.append(card,end=True)
+    hdu.header.tofile(filename,overwrite=True)
+    databytes = array.shape[0] * array.shape[1] * 4 # float32 data.
+    databytes = ((databytes + 2879) // 2880) * 2880 # FITS blocks are 2880 bytes.
+    with open(filename,'rb+') as f: # Extend the file to its full size, sparse where supported.
+        f.seek(len(hdu.header.tostring()) + databytes - 1)
+        f.write(b'\0')
+    with fits.open(filename,mode='update',memmap=True) as hdulist:
+        hdulist[0].data[:] = array[::-1] # Bottom-up, no intermediate flipped copy.
+        hdulist.flush()
+
+# -----------------------------------------------------------------------------------------    
+
+def SaveNumpyMapped(filename,array,dtype=np.uint16):
+    """ Save an array as a .npy file by filling a memory-mapped .npy directly.
+        Avoids the temporary converted copy that np.save(filename,array.astype(dtype)) creates.
+        Parameters ------------------------------------------------------------------------
+        filename : The .npy file to create.
+        array : The array to save.
+        dtype : The datatype stored in the file. """
+    MainLog.Log(PROGRAMNAME + ": SaveNumpyMapped(",filename,array.shape,dtype,")",terminal=VerboseMode)
+    target = np.lib.format.open_memmap(filename,mode='w+',dtype=dtype,shape=array.shape)
+    np.copyto(target,array,casting='unsafe')
+    target.flush()
+    del target # Release the mapping.
+
+# -----------------------------------------------------------------------------------------    
+
 # List of potential control parameters that can be used in set_controls.
 # These are pulled from the runtime arguments and used to construct the set_controls call.
 # It translates the command line option into the set_controls attribute.
@@ -597,10 +643,14 @@ if '--raw' in ArgumentDict:
     if temp != '': fitsfilename = temp # Override the default filename.
     MainLog.Log(PROGRAMNAME + ": fitsfilename:",fitsfilename,terminal=VerboseMode)
     # Write image data.
-    hdulist = fits.HDUList()
-    hdulist.append(fits.ImageHDU(data=cv2.flip(data32,0),name='SCI')) # Flip vertically. Makes it BOTTOM-UP?
+    if MmapMode: # Data is copied straight into the file later. Just build the header now.
+        hh = fits.Header()
+        hh['EXTNAME'] = 'SCI'
+    else:
+        hdulist = fits.HDUList()
+        hdulist.append(fits.ImageHDU(data=cv2.flip(data32,0),name='SCI')) # Flip vertically. Makes it BOTTOM-UP?
+        hh = hdulist[0].header
     # Write header tags.
-    hh = hdulist[0].header
     xt = ControlsToApply.get('ExposureTime',None) # Did command line specify the exposure time?
     xtc = 'Specified exposure time (s).'
     if xt == None: # No command line exposure time, so use the value from the metadata.
@@ -635,7 +685,8 @@ if '--raw' in ArgumentDict:
             hh.append((key,details['value'],details['comment']),end=True)
     # ROWORDER - 'TOP-DOWN' / 'BOTTOM-UP' ?
     # BAYERPAT - 'RGGB' (BOTTOM-UP?), 'GBRG' (TOP-DOWN?) - Check?
-    hdulist.writeto(fitsfilename,overwrite=True) # Save fits.
+    if MmapMode: WriteFitsMapped(fitsfilename,data32,hh) # Save fits via memory-map.
+    else: hdulist.writeto(fitsfilename,overwrite=True) # Save fits.
 RawSaveEndTime = NowUTC() # When did FITS file generation finish?
     
 # Now convert to colour. Debayer the matrix.
@@ -682,7 +733,8 @@ if '--numpy-file' in ArgumentDict: # Save the debayered data as a .npy array fil
     temp = ArgumentDict['--numpy-file']['all'] # Is there a filename?
     if temp != '': numpyfilename = temp # Use specified filename rather than default.
     MainLog.Log(PROGRAMNAME + ": numpyfilename:",numpyfilename,terminal=VerboseMode)
-    np.save(numpyfilename,colour.astype(np.uint16))
+    if MmapMode: SaveNumpyMapped(numpyfilename,colour,dtype=np.uint16)
+    else: np.save(numpyfilename,colour.astype(np.uint16))
 NumpyEndTime = NowUTC() # When did numpy save complete?
 
 colour = colour.clip(0,(2 ** 12 - 1)) # Limit back to 0 - 4095 range. (2 ^ 12) This is in case the gains have pushed the values above int12 space, we consider any excess to be 'overblown', otherwise they can distort the normalised image saved in the jpeg file.
@@ -734,15 +786,15 @@ if '--exif-tag-file' in ArgumentDict:
 # Always save the .jpg file.
 JpgStartTime = NowUTC() # When did jpg save start?
 MainLog.Log(PROGRAMNAME + ": jpgfilename:",jpgfilename,"(shape",colour.shape,")",terminal=VerboseMode)
-cv2.imwrite(jpgfilename,colour,[int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
-JpgEndTime = NowUTC() # When did jpg save end?
-
-# Optionally add EXIF tags to the .jpg file if tags exist. (*Q* This is SLOW!)
-ExifStartTime = NowUTC() # When did EXIF handling start?
-if len(ExifTagDict) > 0: # Exif tags exist, add those to the image. (Done separately via PIL)
+# Any EXIF tags are embedded while the file is written. The file used to be written, then re-opened and re-saved by PIL to add the tags.
+if len(ExifTagDict) > 0: # Exif tags exist, encode the image in memory with the tags then write it once.
     pim = pilomarimage(name='camera',logger=MainLog)
-    pim.AddExifTags(jpgfilename,ExifTagDict) # Works directly on the disc file, no need to load/save.
-ExifEndTime = NowUTC() # When did EXIF handling end?
+    JpgBytes = pim.SaveJpeg(jpgfilename,colour.astype(np.uint8),quality=quality,tagdicts=ExifTagDict)
+else: # No tags, plain OpenCV save.
+    cv2.imwrite(jpgfilename,colour,[int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    JpgBytes = os.path.getsize(jpgfilename) if os.path.exists(jpgfilename) else 0
+JpgEndTime = NowUTC() # When did jpg save end?
+ExifStartTime = ExifEndTime = JpgEndTime # EXIF handling is now part of the jpg save, kept for metadata compatibility.
 
 # Finally write metadata if needed.
 MetaStartTime = NowUTC() # When did metadata save start?
@@ -771,6 +823,7 @@ if '--metadata' in ArgumentDict: # Extract and save metadata.
     metadata['NumpyDuration'] = (NumpyEndTime - NumpyStartTime).total_seconds() # How long did numpy save take?
     metadata['JpgDuration'] = (JpgEndTime - JpgStartTime).total_seconds() # How long did jpg save take?
     metadata['ExifDuration'] = (ExifEndTime - ExifStartTime).total_seconds() # How long did EXIF tag handling take?
+    metadata['JpgBytes'] = JpgBytes # How many bytes were written for the jpg file?
     metadata['camera_properties'] = PropertyDict # Export camera properties too.
         
     # Cleanup.
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+# Pilomar's binary framing for bulk data sent to the microcontroller.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# The RPi and microcontroller normally talk in text lines: 'command fields... [n]|checksum\n'.
+# A trajectory segment costs over 100 bytes that way. Binary frames carry many segments in one message
+# at 23 bytes each, and sit in the same byte stream as the text lines.
+#
+# Frame layout (little-endian):
+#   1 byte   FRAME_START (0xA5). The text protocol is pure ASCII so this byte can only start a frame.
+#   1 byte   frame type. (FRAME_TRAJECTORY)
+#   2 bytes  sequence number. The microcontroller acknowledges each frame with 'binary ack {sequence} {accepted} {count}'.
+#   2 bytes  payload length. (Max FRAME_MAX_PAYLOAD)
+#   n bytes  payload.
+#   2 bytes  CRC-16/CCITT-FALSE of the type, sequence, length and payload.
+#
+# FRAME_TRAJECTORY payload is a series of SEGMENT_FORMAT records:
+#   motor index (MOTOR_NAMES), start (unix UTC seconds), duration (seconds), start angle, end angle, start position, end position.
+#
+# Negotiation: The RPi sends 'binary offer {FRAME_VERSION}' when it connects. Firmware that understands frames enables them and
+# replies 'binary accept {version}'. Older firmware rejects the unknown command, the RPi never sees an accept and keeps
+# sending trajectories as text lines.
+#
+# The microcontroller has its own copy of the decoder in circuitpython/pico2_tmc2209/pilomar/uarthost.py.
+# tests/test_framing.py checks the round trip and compares text and binary throughput over a pty loopback.
+
+import time
+import struct
+import calendar
+
+FRAME_VERSION = 1 # Offered during negotiation.
+FRAME_START = 0xA5 # First byte of every frame.
+FRAME_TRAJECTORY = 0x01 # Frame type: trajectory segments.
+FRAME_HEADER_FORMAT = '<BBHH' # Start, type, sequence, payload length.
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+FRAME_MAX_PAYLOAD = 512 # The microcontroller abandons anything longer as corrupt.
+SEGMENT_FORMAT = '<BIHffii' # Motor, start, duration, start angle, end angle, start position, end position.
+SEGMENT_SIZE = struct.calcsize(SEGMENT_FORMAT)
+FRAME_MAX_SEGMENTS = FRAME_MAX_PAYLOAD // SEGMENT_SIZE
+MOTOR_NAMES = ('azimuth','altitude') # Motor index used in segment records.
+
+def _crctable():
+    """ Lookup table for Crc16(). """
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for bit in range(8):
+            if crc & 0x8000: crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else: crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+CRC_TABLE = _crctable()
+
+def Crc16(data,crc=0xFFFF):
+    """ CRC-16/CCITT-FALSE of a bytes-like object. """
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ b) & 0xFF]
+    return crc
+
+def Checksum(line):
+    """ The text protocol checksum. (Same as microcontroller.CalculateChecksum) """
+    a = 0
+    for i in range(len(line)):
+        if i % 2 == 0: a += ord(line[i])
+        else: a += ord(line[i]) * 3
+    return str(hex(a % 65536))[2:]
+
+def EncodeFrame(frametype,sequence,payload):
+    """ Wrap a payload in a frame. Returns bytes. """
+    if len(payload) > FRAME_MAX_PAYLOAD: raise ValueError('Frame payload too long: ' + str(len(payload)) + ' bytes.')
+    body = struct.pack(FRAME_HEADER_FORMAT,FRAME_START,frametype,sequence & 0xFFFF,len(payload)) + bytes(payload)
+    return body + struct.pack('<H',Crc16(body[1:]))
+
+def TimeStringToUnix(text):
+    """ 'yyyymmddhhmmss' UTC to unix seconds. """
+    return calendar.timegm(time.strptime(text,'%Y%m%d%H%M%S'))
+
+def ParseTrajectoryLine(line):
+    """ Convert a text trajectory message into a segment tuple.
+        trajectory 20210409104504 azimuth 20210325223342 181.6003 20210325223442 181.7003 45000 47500
+            0             1          2           3          4            5           6      7     8
+        Returns (motorname,start,startangle,end,endangle,startpos,endpos) with unix UTC times. """
+    items = line.split()
+    return (items[2],TimeStringToUnix(items[3]),float(items[4]),TimeStringToUnix(items[5]),float(items[6]),int(items[7]),int(items[8]))
+
+def EncodeSegment(motorname,start,startangle,end,endangle,startpos,endpos):
+    """ Pack one trajectory segment. Times are unix UTC seconds. """
+    return struct.pack(SEGMENT_FORMAT,MOTOR_NAMES.index(motorname),int(start),int(end - start),startangle,endangle,int(startpos),int(endpos))
+
+def DecodeSegments(payload):
+    """ Unpack a FRAME_TRAJECTORY payload. Returns a list of (motorname,start,startangle,end,endangle,startpos,endpos) """
+    result = []
+    for offset in range(0,len(payload) - SEGMENT_SIZE + 1,SEGMENT_SIZE):
+        motor,start,duration,startangle,endangle,startpos,endpos = struct.unpack_from(SEGMENT_FORMAT,payload,offset)
+        result.append((MOTOR_NAMES[motor],start,startangle,start + duration,endangle,startpos,endpos))
+    return result
+
+def EncodeTrajectoryFrames(segments,sequence,maxsegments=FRAME_MAX_SEGMENTS):
+    """ Pack a list of segment tuples into as few frames as possible.
+        sequence = Sequence number for the first frame, incremented for each following frame.
+        Returns a list of (sequence,segmentcount,bytes). """
+    frames = []
+    maxsegments = max(1,min(maxsegments,FRAME_MAX_SEGMENTS))
+    for i in range(0,len(segments),maxsegments):
+        batch = segments[i:i + maxsegments]
+        payload = b''.join([EncodeSegment(*s) for s in batch])
+        frames.append((sequence & 0xFFFF,len(batch),EncodeFrame(FRAME_TRAJECTORY,sequence,payload)))
+        sequence += 1
+    return frames
+
+class framereceiver():
+    """ Splits a received byte stream into text lines and binary frames. The same state machine as the microcontroller's uarthost.BufferInput(). """
+
+    def __init__(self):
+        self.Line = bytearray() # Text line being received.
+        self.Frame = None # Binary frame being received, None when receiving text.
+        self.Lines = [] # Completed text lines.
+        self.Frames = [] # Completed frames. (type,sequence,payload)
+        self.FrameErrors = 0 # CRC failures and oversized frames.
+
+    def Feed(self,data):
+        """ Process received bytes. """
+        for b in data:
+            if self.Frame != None: # Inside a binary frame.
+                self.Frame.append(b)
+                if len(self.Frame) == FRAME_HEADER_SIZE:
+                    if struct.unpack_from(FRAME_HEADER_FORMAT,self.Frame)[3] > FRAME_MAX_PAYLOAD: # Corrupt length, resynchronise on the next line.
+                        self.FrameErrors += 1
+                        self.Frame = None
+                elif len(self.Frame) > FRAME_HEADER_SIZE:
+                    start,frametype,sequence,length = struct.unpack_from(FRAME_HEADER_FORMAT,self.Frame)
+                    if len(self.Frame) == FRAME_HEADER_SIZE + length + 2: # Complete.
+                        if Crc16(memoryview(self.Frame)[1:-2]) == struct.unpack_from('<H',self.Frame,len(self.Frame) - 2)[0]:
+                            self.Frames.append((frametype,sequence,bytes(self.Frame[FRAME_HEADER_SIZE:-2])))
+                        else:
+                            self.FrameErrors += 1
+                        self.Frame = None
+            elif b == FRAME_START and len(self.Line) == 0: # Frames only start between lines.
+                self.Frame = bytearray([b])
+            elif b == 10: # '\n'
+                line = self.Line.decode('utf-8','replace').strip()
+                if len(line) > 0: self.Lines.append(line)
+                self.Line = bytearray()
+            else:
+                self.Line.append(b)
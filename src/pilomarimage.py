@@ -29,7 +29,14 @@ try: # Try to load piexif library.
     import piexif # Seems to be included as standard in Bookworm O/S pilomar build.
 except: # Load failed, assume it's not available.
     piexif = None # Create empty holder for the class instead.
+try: # Try to load astropy fits library.
+    from astropy.io import fits # Only needed when reading .fits files directly.
+except: # Load failed, assume it's not available.
+    fits = None # Create empty holder for the module instead.
 import json 
+import time
+import io # In-memory jpeg encoding.
+import mmap # Memory-mapped file support. (astropy maps .fits files with this.)
 
 class data_set():
     """ Data set list of data points. """
@@ -871,6 +878,7 @@ class pilomarimage():
             'GradientPolyGrayStep':{
                 'method':'removegradient_polygray',
                 'order':3,
+                'binning':16, # Fit the background to the mean of 16x16 pixel cells, within 1 DN of fitting every pixel ('binning':1, slow). See tests/test_background.py.
                 'comment':'Remove gradient from grayscale image using polynomials',
                 } # /GradientPolyGrayStep
             }, # /RemoveGradientPolyGray
@@ -878,6 +886,7 @@ class pilomarimage():
             'GradientPolyColorStep':{
                 'method':'removegradient_polycolor',
                 'order':3,
+                'binning':16, # Fit the background to the mean of 16x16 pixel cells, within 1 DN of fitting every pixel ('binning':1, slow). See tests/test_background.py.
                 'comment':'Remove gradient from color image using polynomials',
                 } # /GradientPolyColorStep
             }, # /RemoveGradientPolyColor
@@ -885,6 +894,7 @@ class pilomarimage():
             'GradientPolyGrayColorMaskedStep':{
                 'method':'removegradient_polycolormasked',
                 'order':3,
+                'binning':16, # Fit the background to the mean of 16x16 pixel cells, within 1 DN of fitting every pixel ('binning':1, slow). See tests/test_background.py.
                 'comment':'Remove gradient from color image using polynomials and star masking',
                 } # /GradientPolyColorMaskedStep
             }, # /RemoveGradientPolyColor
@@ -980,6 +990,15 @@ class pilomarimage():
         self.LogDrawing = False # Record individual drawing commands in the log file?
         self.Font = cv2.FONT_HERSHEY_SIMPLEX
         self.InvertHeight = False # When set to TRUE, height pixel values are inverted, so they count UP FROM THE BOTTOM instead of DOWN FROM THE TOP.
+        # Filter script cache. These survive LoadFile/LoadBuffer so slowly varying products (eg gradient models) can be reused on the next frame.
+        self.FilterCache = {} # Cached products from filter steps. See CachedFilterProduct().
+        self.FilterCacheEnabled = True # Set FALSE to recalculate every product on every frame.
+        self.FilterCacheMaxAge = 300 # Seconds before a cached product is always recalculated.
+        self.FilterCacheMaxUses = 20 # Number of frames a cached product can be reused before it is recalculated.
+        self.FilterCacheTolerance = 3.0 # Recalculate if the frame's thumbnail differs from the cached one by more than this mean pixel value.
+        self.FilterWork = None # Reusable float32 work buffer for the filter steps.
+        self.FilterTimings = [] # [stepname, method, seconds, cached] for each step of the last RunFilterScript().
+        self.LastFilterCached = False # Did the last filter step reuse a cached product?
         self._initialize()
         self.ResetGraph() # Create structures for graphing data.
 
@@ -1294,11 +1313,15 @@ class pilomarimage():
         self.ImageMask = None # Array identifying which cells are occupied and which to ignore.
         self.ImageAccumulator = None # Array of cumulative image values. (For live stacking)
         self.ImageCounter = None # Array of how many values are accumulated into each pixel of self.ImageAccumulator. (For live stacking)
+        self.AccumulatorType = np.uint8 # Datatype of the buffers being accumulated. (For live stacking)
         self.ActionList = [['__version__',str(pilomarimage.__version__)]] # List of actions performed on the image.
         self.CreatedTimestamp = self.NowUTC()
         self.ModifiedTimestamp = None
         self.StarList = [] # Was None
         self.StarCount = 0
+        self.StarData = {} # Measurements of each star in StarList. See CountStars().
+        self.CountStarsSeconds = 0.0 # Time taken by the last CountStars().
+        self.CountStarsCrowded = 3.0 # CountStars() labels pixels instead of tracing contours when more than this % of the image is above the threshold.
         self.StarMatchList = None
         self.HorizontalSpread = 0 # % of horizonal spread of stars.
         self.VerticalSpread = 0 # % of vertical spread of stars.
@@ -1496,15 +1519,9 @@ class pilomarimage():
             HIGH values mean that the stars are spread out more evenly across the frame.
             Sets % value for each axis and the total image. """
         if self.ImageExists() and len(self.StarList) > 0: # There's an image loaded and stars were identified.
-            HMin = None # Lowest 'X' position of a star.
-            HMax = None # Highest 'X' position of a star.
-            VMin = None # Lowest 'Y' position of a star.
-            VMax = None # Highest 'Y' position of a star.
-            for star in self.StarList: # Each star is a list of [x, y, radius]
-                if HMin == None or HMin > star[0]: HMin = star[0]
-                if HMax == None or HMax < star[0]: HMax = star[0]
-                if VMin == None or VMin > star[1]: VMin = star[1]
-                if VMax == None or VMax < star[1]: VMax = star[1]
+            positions = np.array([star[:2] for star in self.StarList]) # Each star is a list of [x, y, radius]
+            HMin, VMin = positions.min(axis=0) # Lowest 'X' and 'Y' position of a star.
+            HMax, VMax = positions.max(axis=0) # Highest 'X' and 'Y' position of a star.
             self.HorizontalSpread = 100 * (HMax - HMin) / self.GetWidth()
             self.VerticalSpread = 100 * (VMax - VMin) / self.GetHeight()
             self.AreaSpread = 100 * ((self.HorizontalSpread / 100) * (self.VerticalSpread / 100))
@@ -1561,28 +1578,37 @@ class pilomarimage():
             self.Log("pilomarimage",self.Name,".LoadBuffer(). FROM buffer is None.",terminal=False)
         return self.ImageExists()
         
-    def AccumulateBuffer(self,buffer):
+    def AccumulateBuffer(self,buffer,mask=None):
         """ Accumulate values in a buffer into a running total buffer. 
-            buffer is a reference to another pilomarimage instance."""
+            buffer is a reference to another pilomarimage instance.
+            mask = Optional boolean array (same shape as the buffer). Only TRUE cells are accumulated.
+                   Used by pilomarstacker to leave out rejected pixels. """
         self.Log("pilomarimage",self.Name,".AccumulateBuffer()",terminal=False)
         if isinstance(self.ImageAccumulator,type(None)): # Initialize accumulator.
-            self.ImageAccumulator = np.zeros_like(buffer.ImageBuffer,np.uint16) # Create array of same dimensions, but with larger storage type.
-            self.ImageCounter = np.zeros_like(buffer.ImageBuffer,np.uint8) # Create array of same dimensions but with uint8 storage type.
+            self.ImageAccumulator = np.zeros_like(buffer.ImageBuffer,np.float32) # Create array of same dimensions, but with larger storage type.
+            self.ImageCounter = np.zeros_like(buffer.ImageBuffer,np.uint16) # Create array of same dimensions to count the values in each cell.
+            self.AccumulatorType = buffer.ImageBuffer.dtype # ResolveAccumulator returns the original datatype.
         # Now accumulate the values.
-        self.ImageAccumulator.add(self.ImageAccumulator,buffer.ImageBuffer)
-        self.ImageCount += 1
+        if isinstance(mask,type(None)): # Accumulate every cell.
+            np.add(self.ImageAccumulator,buffer.ImageBuffer,out=self.ImageAccumulator,casting='unsafe')
+            self.ImageCounter += 1
+        else: # Accumulate only the selected cells.
+            np.add(self.ImageAccumulator,buffer.ImageBuffer,out=self.ImageAccumulator,where=mask,casting='unsafe')
+            self.ImageCounter += mask
         self.ActionList.append(['accumulatebuffer',buffer.Name])
         self.ModifiedTimestamp = self.NowUTC()
         return True
         
     def ResolveAccumulator(self):
+        """ Convert the accumulated totals into the average value of each cell in the main ImageBuffer. """
         self.Log("pilomarimage",self.Name,".ResolveAccumulator()",terminal=False)
         if isinstance(self.ImageAccumulator,type(None)):
             print("pilomarimage.ResolveAccumulator(): ImageAccumulator is not initialised.")
             return False
         # Create fresh image buffer.
-        self.ImageBuffer = np.zeros_like(self.ImageAccumulator,np.uint8) # Create array of same dimensions, but with regular image datatype.
-        self.ImageBuffer[self.ImageCount != 0] = self.ImageAccumulator / self.ImageCount
+        average = np.zeros_like(self.ImageAccumulator) 
+        np.divide(self.ImageAccumulator,self.ImageCounter,out=average,where=(self.ImageCounter != 0)) # Cells with no values remain zero.
+        self.ImageBuffer = average.astype(self.AccumulatorType) # Same datatype as the original buffers.
         self.ActionList.append(['resolveaccumulator'])
         self.ModifiedTimestamp = self.NowUTC()
         return True
@@ -1667,37 +1693,50 @@ class pilomarimage():
         if piexif == None: # Check piexif library is available.
             print("pilomarimage.AddExifTags: piexif library is not available. Try installing it.")
             return False
+        safedicts = self.LoadExifTagDicts(tagdicts) # Convert filenames into dictionaries.
+        # If no dictionaries available, simply return.
+        if len(safedicts) < 1: 
+            #print("pilomarimage.AddExifTags: No dictionaries available.")
+            return 
+        with PIL_Image.open(filename) as im: # PIL only reads the jpeg header here, the image data is not decoded.
+            w, h = im.size # Get image dimensions.
+        exif_dict = piexif.load(filename) # Get any existing EXIF data.
+        exif_bytes = piexif.dump(self.BuildExifDict(safedicts,w,h,exif_dict)) # Turn exif data back into binary.
+        piexif.insert(exif_bytes,filename) # Splice the EXIF segment into the file. The compressed image data is copied as-is, not decoded and re-encoded.
+        return True
+
+    def LoadExifTagDicts(self,tagdicts):
+        """ Convert the tagdicts parameter of AddExifTags() into a list of tag dictionaries.
+            Dictionaries are used directly, anything else is treated as a .json filename and loaded.
+            None entries and files which cannot be parsed are skipped. """
         if type(tagdicts) != list: tagdicts = [tagdicts] # If a single dictionary received turn it into a list.
         safedicts = [] # Build new list of validated dictionaries.
-        # Convert filenames into dictionaries.
         for i,c in enumerate(tagdicts):
-            #print("pilomarimage.AddExifTags: Considering",i,c)
+            #print("pilomarimage.LoadExifTagDicts: Considering",i,c)
             if c == None: continue # Ignore None values.
             if type(c) != dict: # It's not already a dictionary, so load and convert it.
-                #print("pilomarimage.AddExifTags: Loading",c)
+                #print("pilomarimage.LoadExifTagDicts: Loading",c)
                 try:
                     with open(c,'r') as f:
                         c = json.load(f)
                 except Exception as e:
-                    print("pilomarimage.AddExifTags: Parsing",c,"as a dictionary failed. Skipping.")
+                    print("pilomarimage.LoadExifTagDicts: Parsing",c,"as a dictionary failed. Skipping.")
                     print("error:",e)
                     continue # Move on to the entry.
             safedicts.append(c)
-            #print("pilomarimage.AddExifTags: Gathered",c)
-        # If no dictionaries available, simply return.
-        if len(safedicts) < 1: 
-            #print("pilomarimage.AddExifTags: No dictionaries available.")
-            return 
-        
-        im = PIL_Image.open(filename) # Open the image in PIL.
-        if 'exif' in im.info: # Create empty dictionary for exif data if it's not already in the information area.
-            exif_dict = piexif.load(im.info["exif"]) # Get EXIF data.
-        else:
-            exif_dict = {}
+            #print("pilomarimage.LoadExifTagDicts: Gathered",c)
+        return safedicts
+
+    def BuildExifDict(self,safedicts,w,h,exif_dict=None):
+        """ Apply a list of tag dictionaries to a piexif exif dictionary.
+            safedicts: List of tag dictionaries. (See LoadExifTagDicts())
+            w,h:       Image dimensions in pixels.
+            exif_dict: Existing piexif dictionary to update, or None to start a new one.
+            Returns the piexif dictionary, ready for piexif.dump(). """
+        if exif_dict == None: exif_dict = {}
         for a in ["0th","Exif","GPS","1st"]: # Make sure all the sections of exif data are available.
             if not a in exif_dict:
                 exif_dict[a] = {}
-        w, h = im.size # Get image dimensions.
         # Beware setting these tag values. piexif does not protect you from using the wrong datatype, but it will fail upon saving.
         # If you are setting tags which expect FLOAT values you must convert your float using the self.exif_float() method.
         # Integers must be integers.
@@ -1743,9 +1782,44 @@ class pilomarimage():
                 elif key == 'Pressure': exif_dict["Exif"][piexif.ExifIFD.Pressure] = self.exif_float(value) # 990.0) # hPa.
                 elif key == 'ShutterSpeedValue': exif_dict["Exif"][piexif.ExifIFD.ShutterSpeedValue] = self.exif_float(value) # 0.5) # Exposure seconds.
                 elif key == 'Temperature': exif_dict["Exif"][piexif.ExifIFD.Temperature] = self.exif_float(value) # -10.0) # C 
-        exif_bytes = piexif.dump(exif_dict) # Turn exif data back into binary.
-        im.save(filename, "jpeg", exif=exif_bytes, quality=100) # Save image with new exif data tags. Still at 100% quality, but some artifacts will be created.
-        return True
+        return exif_dict
+
+    def ExifBytes(self,tagdicts,w,h):
+        """ Build the binary EXIF segment for an image of w x h pixels from tag dictionaries or .json files.
+            Returns None if piexif is missing or there are no tags. """
+        if piexif == None: return None
+        safedicts = self.LoadExifTagDicts(tagdicts)
+        if len(safedicts) < 1: return None
+        return piexif.dump(self.BuildExifDict(safedicts,w,h))
+
+    def SaveJpeg(self,filename,image,quality=95,tagdicts=None):
+        """ Encode and write a jpeg file in a single pass with its EXIF tags already embedded.
+            Replaces cv2.imwrite() followed by AddExifTags(), which wrote the file, read it back and wrote it again.
+            The image is encoded in memory, the EXIF segment is spliced in, then the file is written once.
+
+            Parameters ----------------------------------------------------
+            filename: The jpeg file to create.
+            image:    OpenCV image array.
+            quality:  jpeg quality. (0 - 100)
+            tagdicts: Optional EXIF tags. Same format as AddExifTags(), a dictionary, .json filename or a list of them.
+
+            Returns -------------------------------------------------------
+            Number of bytes written. 0 if the encoding failed. """
+        success,encoded = cv2.imencode('.jpg',image,[int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        if not success:
+            print("pilomarimage.SaveJpeg(",filename,"): Encoding failed.")
+            return 0
+        data = encoded.tobytes()
+        if tagdicts != None:
+            h,w = image.shape[:2]
+            exif_bytes = self.ExifBytes(tagdicts,w,h)
+            if exif_bytes != None:
+                output = io.BytesIO()
+                piexif.insert(exif_bytes,data,output) # Splice the EXIF segment in after the jpeg SOI marker.
+                data = output.getvalue()
+        with open(filename,'wb') as f:
+            f.write(data)
+        return len(data)
 
     def merge_exif_dict(self,master_dict,*dicts):
         """ Merge secondary_dict contents into master_dict.
@@ -1796,9 +1870,14 @@ class pilomarimage():
             self.Log("pilomarimage.GetExif(",filename,") piexif not available.",terminal=False)
         exif_data = self.ValidateExifStructure(exif_data) # Make sure all the sections are available.
         
-    def LoadFile(self,filename,loadexif=False):
-        """ Load image buffer from disc. """
+    def LoadFile(self,filename,loadexif=False,mapped=False):
+        """ Load image buffer from disc. 
+            .npy and .fits files are passed to LoadNumpyFile() and LoadFitsFile().
+            mapped = True: .npy and .fits files are memory-mapped rather than read into RAM. """
         self.Log("pilomarimage",self.Name,".LoadFile(",filename,")",terminal=False)
+        ift = self.ImageFileType(filename)
+        if ift in ['npy']: return self.LoadNumpyFile(filename,mapped=mapped)
+        if ift in ['fits','fit','fts']: return self.LoadFitsFile(filename,mapped=mapped)
         self._initialize()
         self.ImageBuffer = cv2.imread(filename,cv2.IMREAD_COLOR)
         if self.ImageExists():
@@ -1817,6 +1896,97 @@ class pilomarimage():
             result = False
         return result
 
+    def LoadNumpyFile(self,filename,mapped=False):
+        """ Load a .npy array (eg from pilomarfits.py --numpy-file) into the image buffer.
+            mapped = True: The file is memory-mapped copy-on-write. Only the rows that are
+                     actually touched are read from disc, and changes are never written back.
+                     Call ResolveMapping() if the whole array must be pulled into RAM. """
+        self.Log("pilomarimage",self.Name,".LoadNumpyFile(",filename,"mapped",mapped,")",terminal=False)
+        self._initialize()
+        try:
+            if mapped: self.ImageBuffer = np.load(filename,mmap_mode='c') # Copy-on-write mapping.
+            else: self.ImageBuffer = np.load(filename)
+        except Exception as e:
+            self.Log("pilomarimage",self.Name,".LoadNumpyFile(",filename,") failed:",e,terminal=False)
+            self.ImageBuffer = None
+        return self._LoadedArray(filename,mapped)
+
+    def LoadFitsFile(self,filename,mapped=False,hdu=0):
+        """ Load the image data from a .fits file into the image buffer.
+            The FITS data is stored bottom-up by pilomarfits.py, so it is flipped back here. (A view, not a copy.)
+            mapped = True: astropy memory-maps the file. Only rows that are touched are read from disc. 
+            Requires astropy. """
+        self.Log("pilomarimage",self.Name,".LoadFitsFile(",filename,"mapped",mapped,")",terminal=False)
+        self._initialize()
+        if fits == None:
+            self.Log("pilomarimage",self.Name,".LoadFitsFile(",filename,") astropy not available.",terminal=False)
+            return False
+        try:
+            hdulist = fits.open(filename,memmap=mapped,mode='readonly')
+            data = hdulist[hdu].data
+            if mapped: self.ImageBuffer = data[::-1] # Keep the mapping, hdulist stays open while the buffer is referenced.
+            else: 
+                self.ImageBuffer = np.ascontiguousarray(data[::-1]) # Read fully into RAM.
+                hdulist.close()
+        except Exception as e:
+            self.Log("pilomarimage",self.Name,".LoadFitsFile(",filename,") failed:",e,terminal=False)
+            self.ImageBuffer = None
+        return self._LoadedArray(filename,mapped)
+
+    def _LoadedArray(self,filename,mapped):
+        """ Common bookkeeping after LoadNumpyFile() or LoadFitsFile(). """
+        if self.ImageExists():
+            if not mapped: self.ImageMask = np.ones_like(self.ImageBuffer,np.uint8) # All cells are active. (Skipped for mapped files, it would touch every page.)
+            self.ActionList.append(['load',filename])
+            self.CreatedTimestamp = self.NowUTC()
+            self.ExifData = {} # No EXIF data in these formats.
+            self.Log("pilomarimage",self.Name,"._LoadedArray(): Loaded",self.ImageBuffer.shape,self.ImageBuffer.dtype,"mapped:",self.IsMapped(),terminal=False)
+            result = True
+        else:
+            self.Log("pilomarimage",self.Name,"._LoadedArray(",filename,") failed.",terminal=False)
+            result = False
+        return result
+
+    def IsMapped(self):
+        """ Return TRUE if the image buffer is backed by a memory-mapped file. """
+        buffer = self.ImageBuffer
+        while isinstance(buffer,np.ndarray): # Views of a memmap keep a reference to it via .base
+            if isinstance(buffer,np.memmap): return True
+            buffer = buffer.base
+        return isinstance(buffer,mmap.mmap) # astropy maps directly via the mmap module.
+
+    def ResolveMapping(self):
+        """ Pull a memory-mapped image buffer fully into RAM. 
+            Use this before long sequences of whole-frame operations. """
+        if self.ImageExists() and self.IsMapped():
+            self.ImageBuffer = np.array(self.ImageBuffer) # Real in-memory copy.
+            self.ActionList.append(['resolvemapping'])
+        return self.ImageExists()
+
+    def GetRows(self,ystart,yend):
+        """ Return a view of rows ystart:yend of the image buffer. 
+            With a memory-mapped buffer only these rows are read from disc. """
+        return self.ImageBuffer[max(0,int(ystart)):min(self.GetHeight(),int(yend))]
+
+    def SaveNumpyFile(self,filename,mapped=False,dtype=None):
+        """ Save the image buffer as a .npy array. 
+            mapped = True: The .npy file is created as a memory-map and filled directly, 
+                     avoiding the intermediate converted copy that np.save() needs when dtype changes. """
+        self.Log("pilomarimage",self.Name,".SaveNumpyFile(",filename,"mapped",mapped,")",terminal=False)
+        if not self.ImageExists():
+            print("pilomarimage.SaveNumpyFile(",filename,"): No ImageBuffer.")
+            return False
+        if dtype == None: dtype = self.ImageBuffer.dtype
+        if mapped:
+            target = np.lib.format.open_memmap(filename,mode='w+',dtype=dtype,shape=self.ImageBuffer.shape)
+            np.copyto(target,self.ImageBuffer,casting='unsafe')
+            target.flush()
+            del target # Close the mapping.
+        else:
+            np.save(filename,self.ImageBuffer.astype(dtype,copy=False))
+        self.ActionList.append(['save',filename])
+        return os.path.exists(filename)
+
     def ImageFileType(self,filename):
         """ Given a filename, return a lower case file type. """
         return filename.split('.')[-1].lower()
@@ -1830,18 +2000,19 @@ class pilomarimage():
             quality:   Set the 'quality' input parameter when making this call to override the jpg quality to your preferred value.
             library:   library can be 'opencv' or 'pil'. Image is saved via appropriate library.
                        When using pil library, it saves as .jpg files only.
-            exif_dict: Can be a dictionary of exif_tags to write. Created by piexif utility. (Fill force writing via 'pil' library.)
-                       If you specify EXIF tags in this parameter the library will automatically switch to 'pil'. """
+            exif_dict: Can be a dictionary of exif_tags to write. Same format as AddExifTags(). (Forces a .jpg file.)
+                       The tags are embedded while the file is written, see SaveJpeg(). """
         self.Log("pilomarimage",self.Name,".SaveFile(",filename,")",terminal=False)
-        if exif_dict != None: 
-            library = 'pil' # Must use Pillow to write files with exif tags.
         if self.ImageExists():
-            if library == 'pil': # Use Pillow to write the image file.
+            if exif_dict != None: # Write the jpeg and its exif tags in one pass.
+                self.Log("pilomarimage",self.Name,".SaveFile(",filename,") with EXIF tags.",terminal=False)
+                if quality == None: quality = 95 # OpenCV default jpeg quality.
+                self.SaveJpeg(filename,self.ImageBuffer,quality=quality,tagdicts=exif_dict)
+            elif library == 'pil': # Use Pillow to write the image file.
                 self.Log("pilomarimage",self.Name,".SaveFile(",filename,") via PIL.",terminal=False)
                 pil_buffer = self.OpenCVtoPIL(self.ImageBuffer) # Get buffer as a PIL object.
-                if exif_dict == None: exif_dict = {} # No EXIF tags to write.
                 if quality == None: quality = 75 # Default to 75% quality.
-                pil_buffer.save(targetfile, "jpeg", exif=exif_bytes, quality=quality) # Save with specific quality and exif tags.
+                pil_buffer.save(filename, "jpeg", quality=quality) # Save with specific quality.
             else: # Use OpenCV to write the image file.
                 self.Log("pilomarimage",self.Name,".SaveFile(",filename,") via OpenCV.",terminal=False)
                 if quality != None: # Image quality was specified.
@@ -2069,11 +2240,13 @@ class pilomarimage():
         else: self.ImageAccumulator = donor.ImageAccumulator.copy()
         if isinstance(donor.ImageCounter,type(None)): self.ImageCounter = None 
         else: self.ImageCounter = donor.ImageCounter.copy()
+        self.AccumulatorType = donor.AccumulatorType
         self.ActionList = [['__version__',str(pilomarimage.__version__)]]
         self.CreatedTimestamp = self.CreatedTimestamp
         self.ModifiedTimestamp = donor.ModifiedTimestamp
         self.StarList = donor.StarList
         self.StarCount = donor.StarCount
+        self.StarData = donor.StarData
         self.ActionList.append(['cloneimage',donor.Name])
         return self.ImageExists()
 
@@ -2334,10 +2507,10 @@ class pilomarimage():
         longest = 0 # Length of longest line.
         if type(lines) != type(None): # We have something to process.
             for i,line in enumerate(lines): # Check each detected line in turn.
-                x1, y1, x2, y2 = line[0] # Coordinates of each end of the line.
+                x1, y1, x2, y2 = [int(v) for v in np.ravel(line)[:4]] # Coordinates of each end of the line. (OpenCV 4 returns [[x1,y1,x2,y2]], OpenCV 5 returns [x1,y1,x2,y2])
                 length = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2) # Length of the line.
                 if length < 10: continue # Too short.
-                self.Log("pilomarimage",self.Name,".LineDetection: Line", i, ",", line[0], ", length", length,terminal=False)
+                self.Log("pilomarimage",self.Name,".LineDetection: Line", i, ",", [x1,y1,x2,y2], ", length", length,terminal=False)
                 longest = max(length,longest) # Is this the longest line found so far?
                 linereturn.append([x1,y1,x2,y2]) # Add to the list of detected lines.
                 if markupfile != None: # Created a marked up copy of the image on disc.
@@ -2371,32 +2544,35 @@ class pilomarimage():
                 linereturn.append([x1,y1,x2,y2]) # Add to the list of detected lines.
         return linereturn
 
-    def CloudDetection(self,threshold=127): # In pilomarimage
-        """ Detect clouds in image. 
-            *Q* UNDER DEVELOPMENT 
-            threshold = minimum brightness at which a pixel could be a cloud. """
+    def CloudDetection(self,threshold=127,scale=0.25,debugfolder=None): # In pilomarimage
+        """ Detect bright clouds in image. 
+            Works on a downsampled copy. For a per-frame sky quality score use pilomarcloudestimator instead.
+            threshold = minimum brightness at which a pixel could be a cloud.
+            scale = The image is analysed at this fraction of its size.
+            debugfolder = Optional folder for the intermediate images. Nothing is written otherwise.
+            Returns a list of [center_x,center_y,area] in full resolution pixels. """
         cloudlist = []
-        mincloudpixels = 400
+        mincloudpixels = 400 * scale * scale # Full resolution area, scaled.
         # Simplify image
-        # - Grayscale
-        imagebuffer = self.NewBufferType('grayscale') # Convert to grayscale.
-        cv2.imwrite('/home/pi/pilomar/data/CloudDetectionGrayscale.jpg',imagebuffer)
+        # - Grayscale and downsample
+        imagebuffer = cv2.resize(self.NewBufferType('grayscale'),None,fx=scale,fy=scale,interpolation=cv2.INTER_AREA)
+        if debugfolder != None: cv2.imwrite(os.path.join(debugfolder,'CloudDetectionGrayscale.jpg'),imagebuffer)
         # - Blur
         imagebuffer = cv2.GaussianBlur(imagebuffer,(5,5),0)
-        cv2.imwrite('/home/pi/pilomar/data/CloudDetectionBlurred.jpg',imagebuffer)
+        if debugfolder != None: cv2.imwrite(os.path.join(debugfolder,'CloudDetectionBlurred.jpg'),imagebuffer)
         # - Threshold
-        ret,imagebuffer = cv2.threshold(imagebuffer,threshold,255,0)
-        cv2.imwrite('/home/pi/pilomar/data/CloudDetectionThreshold.jpg',imagebuffer)
+        ret,imagebuffer = cv2.threshold(imagebuffer,threshold,255,cv2.THRESH_BINARY)
+        if debugfolder != None: cv2.imwrite(os.path.join(debugfolder,'CloudDetectionThreshold.jpg'),imagebuffer)
         # Analyse image
-        contours = cv2.findContours(imagebuffer,1,2)
+        contours,hierarchy = cv2.findContours(imagebuffer,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)
         for contour in contours:
             moments = cv2.moments(contour)
-            center_x = int(moments['m10']/moments['m00'])
-            center_y = int(moments['m01']/moments['m00'])
-            area = int(moments['m00']) # Contour area.
-            if area > mincloudpixels: 
-                cloudlist.append([center_x,center_y,area])
-                self.Log("pilomarimage",self.Name,".CloudDetection (",center_x,",",center_y,")",area,"pixels",terminal=False)
+            if moments['m00'] < mincloudpixels: continue # Too small. (Also avoids dividing by zero.)
+            center_x = int(moments['m10'] / moments['m00'] / scale)
+            center_y = int(moments['m01'] / moments['m00'] / scale)
+            area = int(moments['m00'] / (scale * scale)) # Contour area.
+            cloudlist.append([center_x,center_y,area])
+            self.Log("pilomarimage",self.Name,".CloudDetection (",center_x,",",center_y,")",area,"pixels",terminal=False)
         return cloudlist
     
     def GetType(self):
@@ -2564,10 +2740,107 @@ class pilomarimage():
         self.ActionList = [['new',(height,width),imagetype,datatype]]
         return True
 
+    def OverlappingPairs(self, positions, sizes):
+        """ Find every pair of objects whose rectangles overlap, using a spatial hash.
+            positions = numpy array [[x,y],...] of object centers.
+            sizes = numpy array [[width,height],...] of objects.
+            Objects are hashed into grid cells as large as the biggest object, so overlapping objects
+            are always in the same or a neighbouring cell. Only those candidate pairs are tested,
+            instead of every pair of objects.
+            Returns arrays i, j, overlap_x, overlap_y for the overlapping pairs (i < j in hash order). """
+        n = len(positions)
+        empty = np.zeros(0,np.int64)
+        if n < 2: return empty, empty, np.zeros(0), np.zeros(0)
+        cell = max(float(sizes.max()),1.0) # Cell size. Objects further apart than this can't overlap.
+        c = np.floor(positions / cell).astype(np.int64)
+        c -= c.min(axis=0) # Cell coordinates from 0.
+        ncy = int(c[:,1].max()) + 3 # Padding so neighbouring cells never wrap into the next column.
+        key = (c[:,0] + 1) * ncy + (c[:,1] + 1)
+        order = np.argsort(key,kind='stable')
+        skey = key[order]
+        rank = np.empty(n,np.int64) # Position of each object in the sorted order.
+        rank[order] = np.arange(n)
+        pi = []
+        pj = []
+        for dx,dy in ((0,0),(1,-1),(1,0),(1,1),(0,1)): # Own cell plus the 'forward' half of the neighbours, so each pair is found once.
+            target = key + dx * ncy + dy
+            lo = np.searchsorted(skey,target,'left')
+            hi = np.searchsorted(skey,target,'right')
+            counts = hi - lo
+            if dx == 0 and dy == 0: # Same cell, only pair with objects later in the sorted order.
+                lo = rank + 1
+                counts = hi - lo
+            total = int(counts.sum())
+            if total == 0: continue
+            i = np.repeat(np.arange(n),counts)
+            j = order[np.arange(total) - np.repeat(np.cumsum(counts) - counts,counts) + np.repeat(lo,counts)]
+            pi.append(i)
+            pj.append(j)
+        if len(pi) == 0: return empty, empty, np.zeros(0), np.zeros(0)
+        i = np.concatenate(pi)
+        j = np.concatenate(pj)
+        overlap_x = (sizes[i,0] + sizes[j,0]) / 2 - np.abs(positions[i,0] - positions[j,0])
+        overlap_y = (sizes[i,1] + sizes[j,1]) / 2 - np.abs(positions[i,1] - positions[j,1])
+        keep = (overlap_x > 0) & (overlap_y > 0)
+        return i[keep], j[keep], overlap_x[keep], overlap_y[keep]
+
+    def ForceLayout(self, positions, objects, attractions=None, anchors=None, k=0.1, dt=0.1, iterations=100, delta_min=4.0):
+        """ Force directed layout used by ArrangeObjects() and SeparateObjects().
+            Same physics as the original all-pairs loops, but each iteration only tests pairs found
+            by OverlappingPairs() and all forces are calculated as arrays.
+            attractions = [[obj1,obj2],...] spring pairs. (ArrangeObjects)
+            anchors = [[x,y],...] each object is pulled back towards its anchor. (SeparateObjects)
+            Stops when the largest move in an iteration is below delta_min pixels.
+            Returns numpy array of positions. Sets self.LayoutIterations. """
+        width = self.GetWidth()
+        height = self.GetHeight()
+        object_positions = np.array(positions,dtype=float).reshape(-1,2)
+        n = len(object_positions)
+        sizes = np.array([o[:2] for o in objects],dtype=float).reshape(-1,2)
+        fixed = np.array([bool(o[2]) for o in objects],dtype=bool)
+        lower = sizes / 2 # Keep the objects within the image bounds.
+        upper = np.array([width,height],dtype=float) - sizes / 2
+        if attractions is not None and len(attractions) > 0:
+            attractions = np.array(attractions,dtype=np.int64).reshape(-1,2)
+        else: attractions = None
+        if anchors is not None: anchors = np.array(anchors,dtype=float).reshape(-1,2)
+        self.LayoutIterations = 0
+        for m in range(iterations): # Set limit to processing.
+            self.LayoutIterations = m + 1
+            forces = np.zeros_like(object_positions)
+            # Repulsive forces between overlapping objects.
+            i, j, overlap_x, overlap_y = self.OverlappingPairs(object_positions,sizes)
+            if len(i) > 0:
+                direction = object_positions[i] - object_positions[j]
+                norm = np.hypot(direction[:,0],direction[:,1])
+                same = norm == 0 # Objects exactly on top of each other, the original produced NaN here. Push them apart at an arbitrary angle.
+                if same.any():
+                    angle = (i[same] + j[same]) * 2.39996 # Golden angle, spreads coincident objects in different directions.
+                    direction[same] = np.stack([np.cos(angle),np.sin(angle)],axis=1)
+                    norm[same] = 1.0
+                force = direction / norm[:,None] * (overlap_x * overlap_y * k)[:,None]
+                for axis in (0,1):
+                    forces[:,axis] += np.bincount(i,weights=force[:,axis],minlength=n) - np.bincount(j,weights=force[:,axis],minlength=n)
+            # Spring forces between attracted objects.
+            if attractions is not None:
+                dk = (object_positions[attractions[:,0]] - object_positions[attractions[:,1]]) * k
+                for axis in (0,1):
+                    forces[:,axis] += np.bincount(attractions[:,1],weights=dk[:,axis],minlength=n) - np.bincount(attractions[:,0],weights=dk[:,axis],minlength=n)
+            forces[fixed] = 0 # Fixed objects never move.
+            # Spring force back to each object's anchor. (The original applied this to fixed objects too.)
+            if anchors is not None: forces -= (object_positions - anchors) * k
+            previous_positions = object_positions
+            object_positions = np.minimum(np.maximum(object_positions + forces * dt,lower),upper)
+            move = object_positions - previous_positions
+            delta = np.hypot(move[:,0],move[:,1]).max() if n > 0 else 0 # What's the largest move in this iteration?
+            if delta < delta_min: break # Stable solution found, nothing is moving enough.
+        return object_positions
+
     def ArrangeObjects(self, positions, objects, attractions, k=0.1, dt=0.1, iterations=100, delta_min=4.0):
         """
         Arrange Objects on an image using basic physics model (attractive and repulsive forces).
         This is a force directed model for distributing objects, it only avoids overlaps, it doesn't equally space items out.
+        Overlapping objects are found with a spatial hash, so hundreds of labels can be arranged quickly. (See ForceLayout())
         
         :param positions: List of [x, y] initial positions of the Objects. [[x,y],...]
         :param objects: List of object sizes as [[width, height , fixed],...]
@@ -2582,78 +2855,13 @@ class pilomarimage():
         :return: List of new object positions as [[x, y],...]
         
         """
-        # The basis of this code was generated by Bing ChatGPT Sep.2023.
-        width = self.GetWidth()
-        height = self.GetHeight()
-        
-        # Initialize label positions at the object positions
-        object_positions = np.array(positions,dtype=np.float)
+        return self.ForceLayout(positions,objects,attractions=attractions,k=k,dt=dt,iterations=iterations,delta_min=delta_min).tolist() # Return updated position list.
 
-        # Iteratively apply forces to the object list until the locations stabilise.
-        for m in range(iterations): # Set limit to processing.
-            
-            # Note the positions at the start of the iteration.
-            previous_positions = object_positions.copy()
-            
-            # Compute the force matrix between all pairs of objects
-            forces = np.zeros_like(object_positions)
-            
-            # Calculate repulsive forces between objects.
-            for i in range(len(objects)):
-                for j in range(i+1, len(objects)):
-                    # Compute the overlap between objects i and j
-                    object_i = objects[i] # Retrieve object attributes.
-                    object_j = objects[j]
-                    object_i_fixed = object_i[2] # Can the object move?
-                    object_j_fixed = object_j[2]  # Can the object move?
-                    overlap_x = max(0, (object_i[0] + object_j[0])/2 - abs(object_positions[i][0] - object_positions[j][0]))
-                    overlap_y = max(0, (object_i[1] + object_j[1])/2 - abs(object_positions[i][1] - object_positions[j][1]))
-                    
-                    # If there is an overlap, apply a repelling force
-                    if overlap_x > 0 and overlap_y > 0:
-                        direction = object_positions[i] - object_positions[j] # Subtract [j] positions from [i] positions.
-                        direction /= np.linalg.norm(direction) # Convert to -1.0 <> 1.0 direction (array of (x,y) still).
-                        force = direction * overlap_x * overlap_y * k # Apply force to both axes (x,y).
-                        if object_i_fixed == False: forces[i] += force # Apply force if object can move.
-                        if object_j_fixed == False: forces[j] -= force # Apply force if object can move.
-            
-            # Apply a spring force between any attracted objects.
-            for i in range(len(attractions)): # Go through the list of attractions.
-                index_a = attractions[i][0] # Find the two objects being attracted to each other.
-                index_b = attractions[i][1]
-                object_a = objects[index_a] # Get the object attributes.
-                object_b = objects[index_b]
-                position_a = object_positions[index_a] # Get the object positions.
-                position_b = object_positions[index_b]
-                object_a_fixed = object_a[2] # Can the object move?
-                object_b_fixed = object_b[2] # Can the object move?
-                displacement = position_a - position_b
-                dk = displacement * k
-                if object_a_fixed == False: forces[index_a] = forces[index_a] - dk # Apply attraction forces.
-                if object_b_fixed == False: forces[index_b] = forces[index_b] + dk
-            
-            # Update the label positions using the computed forces
-            fd = forces * dt
-            object_positions = object_positions + fd
-            
-            # Keep the objects within the image bounds
-            for i in range(len(objects)):
-                object_positions[i][0] = min(max(object_positions[i][0], objects[i][0]/2), width - objects[i][0]/2)
-                object_positions[i][1] = min(max(object_positions[i][1], objects[i][1]/2), height - objects[i][1]/2)
-
-            delta = 0 # What's the largest move detected after this iteration?
-            for i,origpos in enumerate(previous_positions): # Check how far each object has moved in this iteration.
-                newpos = object_positions[i]
-                move = ( ( (newpos[0] - origpos[0]) ** 2) + ( (newpos[1] - origpos[1]) ** 2)) ** 0.5
-                delta = max(move, delta) # Keep the largest move detected so far.
-            if delta < delta_min: break # Stable solution found, nothing is moving enough.
-        
-        return object_positions.tolist() # Return updated position list.
-    
     def SeparateObjects(self, positions, objects, k=0.1, dt=0.1, iterations=100, delta_min=4.0):
         """
         Arrange Objects on an image without overlapping using physics calculations.
         !! This is NOT a full force-directed model. It just reduces overlaps.
+        Overlapping objects are found with a spatial hash, so hundreds of labels can be separated quickly. (See ForceLayout())
         
         :param positions: List of [[x, y],...] initial positions of the Objects.
         :param objects: List of object sizes as [[width, height , fixed],...]
@@ -2667,69 +2875,8 @@ class pilomarimage():
         :return: List of new object positions as [[x, y],...]
         
         """
-        # The basis of this code was generated by Bing ChatGPT Sep.2023.
-        width = self.GetWidth()
-        height = self.GetHeight()
-        
-        # Initialize label positions at the object positions
-        object_positions = np.array(positions,dtype=np.float)
+        return self.ForceLayout(positions,objects,anchors=positions,k=k,dt=dt,iterations=iterations,delta_min=delta_min).tolist() # Return updated position list.
 
-        # Compute the distance matrix between all pairs of objects
-        # pdist() generates a 'compressed' matrix of the distances between each object.
-        # squareform() converts the compressed matrix into a 'redundant' matrix, but it's easier to find the distances between specific objects in this format.
-        # distances = squareform(pdist(object_positions)) # Calculated in ChatGPT but not used.
-        for m in range(iterations): # Set limit to processing.
-            
-            # Note the positions at the start of the iteration.
-            previous_positions = object_positions.copy()
-            
-            # Compute the force matrix between all pairs of objects
-            forces = np.zeros_like(object_positions)
-            
-            # Calculate repulsive forces between objects.
-            for i in range(len(objects)):
-                for j in range(i+1, len(objects)):
-                    # Compute the overlap between objects i and j
-                    object_i = objects[i]
-                    object_j = objects[j]
-                    object_i_fixed = object_i[2] 
-                    object_j_fixed = object_j[2] 
-                    overlap_x = max(0, (object_i[0] + object_j[0])/2 - abs(object_positions[i][0] - object_positions[j][0]))
-                    overlap_y = max(0, (object_i[1] + object_j[1])/2 - abs(object_positions[i][1] - object_positions[j][1]))
-                    
-                    # If there is an overlap, apply a repelling force
-                    if overlap_x > 0 and overlap_y > 0:
-                        direction = object_positions[i] - object_positions[j] # Subtract [j] positions from [i] positions.
-                        direction /= np.linalg.norm(direction) # Convert to -1.0 <> 1.0 direction (array of (x,y) still).
-                        force = direction * overlap_x * overlap_y * k # Apply force to both axes (x,y).
-                        if object_i_fixed == False: forces[i] += force # Apply force if object can move.
-                        if object_j_fixed == False: forces[j] -= force # Apply force if object can move.
-            
-            # Apply a spring force to attract the label to the object
-            for i in range(len(objects)):
-                displacement = object_positions[i] - positions[i]
-                dk = displacement * k
-                forces[i] = forces[i] - dk
-            
-            # Update the label positions using the computed forces
-            fd = forces * dt
-            object_positions = object_positions + fd
-            
-            # Keep the objects within the image bounds
-            for i in range(len(objects)):
-                object_positions[i][0] = min(max(object_positions[i][0], objects[i][0]/2), width - objects[i][0]/2)
-                object_positions[i][1] = min(max(object_positions[i][1], objects[i][1]/2), height - objects[i][1]/2)
-
-            delta = 0 # What's the largest move detected after this iteration?
-            for i,origpos in enumerate(previous_positions): # Check how far each object has moved in this iteration.
-                newpos = object_positions[i]
-                move = ( ( (newpos[0] - origpos[0]) ** 2) + ( (newpos[1] - origpos[1]) ** 2)) ** 0.5
-                delta = max(move, delta) # Keep the largest move detected so far.
-            #print ("SeparateObjects_full: m",m,"delta",delta)
-            if delta < delta_min: break # Stable solution found, nothing is moving enough.
-        
-        return object_positions.tolist()# , max_overlap # Return updated position list & a measure of the maximum overlap.
-        
     def RotateBufferAboutPoint(self,imagebuffer,location,angle):
         """ WIP: Building better angle text feature.
                 location is (x,y) tuple
@@ -2798,38 +2945,116 @@ class pilomarimage():
             
             minval = Minimum area of stars. 
             maxval = Maximum area of stars. 
-            maxstars = Maximum number of stars to return .
-            threshold = The brightness level (0-255) above which something is considered a star. """
+            maxstars = Maximum number of stars to return. The brightest stars are kept.
+            threshold = The brightness level (0-255) above which something is considered a star. 
+            
+            The contours are found the same way as the original version, but all of them are measured together 
+            with numpy instead of looping through each one. The same [x, y, radius] entries are returned, brightest first.
+            If more than self.CountStarsCrowded % of the image is above the threshold (crowded or noisy frames)
+            tracing hundreds of thousands of contours is slow, so the star pixels are labelled with connectedComponentsWithStats() instead. 
+            Contour rectangles and areas are derived from the labels. Areas agree exactly for rectangular dots, 
+            round dots read slightly larger. 
+            Returns starcount, starlist. 
             
+            Also sets self.StarData, a dictionary of numpy arrays in the same order as self.StarList...
+              'x','y':   Brightness weighted centroid. (Sub-pixel)
+              'flux':    Total brightness above the background.
+              'peak':    Brightest pixel above the background.
+              'area':    Number of pixels in the star.
+              'radius':  Radius, as in StarList.
+              'fwhm':    Full width at half maximum, from the area above half the peak brightness. (Saturated stars read large)
+            and the star spread (see CalculateStarSpread) from the same measurements. """
+            
+        start = time.perf_counter()
         self.Log("pilomarimage",self.Name,".CountStars(",minval,',',maxval,")",terminal=False)
         cvimagebuffer = self.NewBufferType('grayscale') # Return a copy of the image buffer in grayscale.
+        height, width = cvimagebuffer.shape[:2]
         # Threshold the image to make it more crisp.
         temp, threshed = cv2.threshold(cvimagebuffer, threshold, 255, cv2.THRESH_BINARY_INV|cv2.THRESH_OTSU)
-        # findcontours to identify 'dots' (contours) in the image. This will recognise STARS and also some patterns made by stars. So it needs filtering.
-        dots = cv2.findContours(threshed, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2]
-        # filter the 'dots' by their area. Small ones are stars, large ones are some other artifact.
-        starcount = 0
         starlist = []
-        for dot in dots: # Check each dot in turn.
-            if minval < cv2.contourArea(dot) < maxval: # We only want small dots to count as stars.
-                starcount += 1 # Increment count.
-                dot_x, dot_y, dot_w, dot_h = cv2.boundingRect(dot) # Bordering rectangle of dot.
-                dot_radius = int((dot_w + dot_h) / 4) # Half average of width and height.
-                ctr_x = int(dot_x + dot_w / 2) # x center of dot.
-                ctr_y = int(dot_y + dot_h / 2) # y center of dot.
-                staritem = [ctr_x, ctr_y, dot_radius]
-                starlist.append(staritem) # Construct list of star locations.
-            if starcount >= maxstars:
+        self.StarData = {'x':np.zeros(0),'y':np.zeros(0),'flux':np.zeros(0),'peak':np.zeros(0),'area':np.zeros(0,int),'radius':np.zeros(0,int),'fwhm':np.zeros(0)}
+        background = float(np.median(cvimagebuffer[::8,::8])) # Sky level.
+        brightness = None # Rough brightness of each dot, when it is cheap to get.
+        starpixels = threshed.size - cv2.countNonZero(threshed)
+        if starpixels > self.CountStarsCrowded * threshed.size / 100: # Crowded or noisy frame. Too many contours to trace efficiently.
+            # Label each group of star pixels instead. (4 way connections match the holes traced by findContours.)
+            # Convert to the equivalent contour rectangle (1 pixel larger all round) and contour area.
+            count, labels, stats, _ = cv2.connectedComponentsWithStats(cv2.bitwise_not(threshed), connectivity=4)
+            x, y, w, h, pixels = [stats[1:,i] for i in range(5)] # Ignore component 0, the background.
+            dot_x, dot_y, dot_w, dot_h = x - 1, y - 1, w + 2, h + 2
+            area = np.where((x > 0) & (y > 0) & (x + w < width) & (y + h < height), pixels + w + h - 1, 0) # Stars touching the edge have no contour.
+            brightness = np.bincount(labels.ravel(), weights=cvimagebuffer.ravel(), minlength=count)[1:] - background * pixels
+        else:
+            # findcontours to identify 'dots' (contours) in the image. This will recognise STARS and also some patterns made by stars. So it needs filtering.
+            dots = cv2.findContours(threshed, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2]
+            if len(dots) == 0: dots = [np.zeros((1,1,2),np.int32)] # Nothing found. (A single point has no area.)
+            # Bounding rectangle and area of every contour at once. (The same results as cv2.boundingRect and cv2.contourArea.)
+            lengths = np.fromiter((len(dot) for dot in dots), np.int64, len(dots))
+            points = np.concatenate(dots).reshape(-1,2)
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            xs, ys = points[:,0], points[:,1]
+            dot_x, dot_y = np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts)
+            dot_w, dot_h = np.maximum.reduceat(xs, starts) - dot_x + 1, np.maximum.reduceat(ys, starts) - dot_y + 1
+            following = np.arange(1, len(points) + 1)
+            following[starts + lengths - 1] = starts # Each contour is a closed loop.
+            cross = xs.astype(np.float64) * ys[following] - xs[following].astype(np.float64) * ys
+            area = np.abs(np.add.reduceat(cross, starts)) / 2 # Shoelace formula.
+        selected = np.flatnonzero((minval < area) & (area < maxval)) # We only want small dots to count as stars.
+        if brightness is not None and len(selected) > maxstars: # Only measure the brightest dots in detail.
+            selected = selected[np.argsort(-brightness[selected], kind='stable')[:maxstars]]
+        if len(selected) > 0:
+            dot_x, dot_y, dot_w, dot_h = dot_x[selected], dot_y[selected], dot_w[selected], dot_h[selected]
+            dot_radius = (dot_w + dot_h) // 4 # Half average of width and height.
+            ctr_x = dot_x + dot_w // 2 # x center of dot.
+            ctr_y = dot_y + dot_h // 2 # y center of dot.
+            # Measure the pixels of every star at once, using a window around each one.
+            # Star pixels are inside the contour's rectangle and below the (inverted) threshold.
+            # Stars are measured in groups of the same window size, so a few large objects don't inflate the window of every star.
+            count = len(selected)
+            flux, peak, cx, cy, pixels, halfmax = [np.zeros(count) for i in range(6)]
+            halves = np.minimum(np.maximum(dot_w, dot_h) // 2, 32)
+            for half in np.unique(halves):
+                group = np.flatnonzero(halves == half)
+                offsets = np.arange(-half, half + 1)
+                gx = np.clip(ctr_x[group,None,None] + offsets[None,None,:], 0, width - 1)
+                gy = np.clip(ctr_y[group,None,None] + offsets[None,:,None], 0, height - 1)
+                inside = ((gx > dot_x[group,None,None]) & (gx < (dot_x + dot_w - 1)[group,None,None]) & 
+                          (gy > dot_y[group,None,None]) & (gy < (dot_y + dot_h - 1)[group,None,None]) & (threshed[gy,gx] == 0))
+                value = np.where(inside, np.maximum(cvimagebuffer[gy,gx].astype(np.float32) - background, 0), 0)
+                flux[group] = value.sum(axis=(1,2))
+                peak[group] = value.max(axis=(1,2))
+                cx[group] = (value * gx).sum(axis=(1,2))
+                cy[group] = (value * gy).sum(axis=(1,2))
+                pixels[group] = inside.sum(axis=(1,2))
+                halfmax[group] = (inside & (value >= 0.5 * peak[group,None,None])).sum(axis=(1,2))
+            safeflux = np.maximum(flux, 1e-6)
+            cx /= safeflux
+            cy /= safeflux
+            fwhm = 2 * np.sqrt(halfmax / np.pi)
+            # Brightest first.
+            order = np.argsort(-flux, kind='stable')
+            if len(order) > maxstars:
                 self.Log("pilomarimage",self.Name,".CountStars:",maxstars,"star limit hit.",terminal=False)
-                break
+                order = order[:maxstars]
+            starlist = np.column_stack([ctr_x[order], ctr_y[order], dot_radius[order]]).tolist() # Construct list of star locations.
+            self.StarData = {'x':cx[order], 'y':cy[order], 'flux':flux[order], 'peak':peak[order], 
+                             'area':pixels[order].astype(int), 'radius':dot_radius[order], 'fwhm':fwhm[order]}
+        starcount = len(starlist)
         self.StarList = starlist
         self.StarCount = starcount
         self.CountStars_last_minval = minval # Record the parameters used. Smallest pixel area considered a star.
         self.CountStars_last_maxval = maxval # Record the parameters used. Largest pixel area considered a star.
         self.CountStars_last_maxstars = maxstars # Record the parameters used. Maximum number of items to consider a star.
         self.CountStars_last_threshold = threshold # Record the parameters used. Brightness threshold when increasing contrast.
-        self.CalculateStarSpread() # How widely spread are the stars across the image? Indicates good/bad tracking tuning.
-        self.Log("pilomarimage",self.Name,".CountStars: End. Counted",starcount,terminal=False)
+        # How widely spread are the stars across the image? Indicates good/bad tracking tuning. (Same as CalculateStarSpread)
+        if starcount > 0:
+            positions = np.array(starlist)
+            self.HorizontalSpread = 100 * float(np.ptp(positions[:,0])) / width
+            self.VerticalSpread = 100 * float(np.ptp(positions[:,1])) / height
+            self.AreaSpread = 100 * ((self.HorizontalSpread / 100) * (self.VerticalSpread / 100))
+        else: self.HorizontalSpread = self.VerticalSpread = self.AreaSpread = 0 # No spread to measure.
+        self.CountStarsSeconds = time.perf_counter() - start
+        self.Log("pilomarimage",self.Name,".CountStars: End. Counted",starcount,"in",round(self.CountStarsSeconds * 1000,1),"ms",terminal=False)
         return starcount, starlist
 
     def BVrange(self,BV):
@@ -3152,9 +3377,8 @@ class pilomarimage():
         comment = filterdata.get('comment','') # Get any associated comment, default ''.
         if comment != '': self.Log("pilomarimage",self.Name,".FS_Dehaze: Comment:",comment,terminal=False)
         self.Log("pilomarimage",self.Name,".FS_Dehaze(",samples,",",strength,")",terminal=False)
-        # Create a working buffer to construct the haze filter.
-        buffer = self.ImageBuffer.copy() # Copy the image buffer, we will blur this copy.
-        buffer = self.HorizontalBlurBuffer(buffer,band=samples) # Horizontally blur the buffer.
+        # Construct the haze filter. (HorizontalBlurBuffer returns a new buffer, the image buffer is not changed.)
+        buffer = self.CachedFilterProduct(filterdata,lambda: self.HorizontalBlurBuffer(self.ImageBuffer,band=samples)) # Horizontally blur the buffer.
         if strength > 0: # There needs to be some effect.
             if strength != 100: # Multiply all the channels appropriately.
                 buffer = self.PercentageBuffer(buffer,strength) # Reduce the strength of the buffer.
@@ -3190,20 +3414,16 @@ class pilomarimage():
         self.Log("pilomarimage",self.Name,".FS_RemoveGradient(",blur_size,")",terminal=False)
         
         # Load image
-        img = self.ImageBuffer
-        img_float = img.astype(np.float32)
+        img_float = self.FilterFloat(self.ImageBuffer)
 
         # Estimate background using a huge Gaussian blur
-        background = cv2.GaussianBlur(img_float, (blur_size, blur_size), 0)
+        background = self.CachedFilterProduct(filterdata,lambda: cv2.GaussianBlur(img_float, (blur_size, blur_size), 0))
 
         # Subtract background
-        corrected = img_float - background
+        corrected = np.subtract(img_float, background, out=img_float)
 
         # Normalize to 0–255
-        corrected = corrected - corrected.min()
-        corrected = corrected / corrected.max() * 255
-
-        self.ImageBuffer = corrected.astype(np.uint8)
+        self.ImageBuffer = self.NormalizeChannel(corrected)
         self.ActionList.append(['FS_RemoveGradient'])
         self.ModifiedTimestamp = self.NowUTC()
 
@@ -3226,13 +3446,13 @@ class pilomarimage():
         self.Log("pilomarimage",self.Name,".FS_LevelsHalfClip(",percentile,")",terminal=False)
 
         # Work in float for safe math
-        imgf = self.ImageBuffer.astype(np.float32)
+        imgf = self.FilterFloat(self.ImageBuffer)
 
         # Compute the Nth percentile per channel (shape: (3,))
         thresh = np.percentile(imgf, percentile, axis=(0, 1))
 
         # Clip everything below threshold
-        clipped = np.maximum(imgf, thresh)
+        clipped = np.maximum(imgf, thresh, out=imgf)
 
         # Subtract threshold per channel
         clipped -= thresh
@@ -3270,43 +3490,92 @@ class pilomarimage():
         if comment != '': self.Log("pilomarimage",self.Name,".FS_RemoveGradientMorph: Comment:",comment,terminal=False)
         self.Log("pilomarimage",self.Name,".FS_RemoveGradientMorph(",kernel_size,")",terminal=False)
         
-        img = self.ImageBuffer
-        img_float = img.astype(np.float32)
+        img_float = self.FilterFloat(self.ImageBuffer)
 
         # Structuring element
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
 
         # Morphological opening removes small bright objects (stars)
-        background = cv2.morphologyEx(img_float, cv2.MORPH_OPEN, kernel)
+        background = self.CachedFilterProduct(filterdata,lambda: cv2.morphologyEx(img_float, cv2.MORPH_OPEN, kernel))
 
-        corrected = img_float - background
+        corrected = np.subtract(img_float, background, out=img_float)
 
-        corrected = corrected - corrected.min()
-        corrected = corrected / corrected.max() * 255
-        
-        self.ImageBuffer = corrected.astype(np.uint8)
+        self.ImageBuffer = self.NormalizeChannel(corrected)
         self.ActionList.append(['FS_RemoveGradientMorph'])
         self.ModifiedTimestamp = self.NowUTC()
 
         return True
 
-    def FitPolynomialBackgroundGray(self,gray, order=3):
-        """ Based upon AI generated code. """
-        
-        h, w = gray.shape
-        y, x = np.mgrid[0:h, 0:w]
-
-        # Flatten
-        X = np.column_stack([x.ravel()**i * y.ravel()**j
-                             for i in range(order+1)
-                             for j in range(order+1-i)])
-        Y = gray.ravel()
-
-        # Solve least squares
+    def FitPolynomialBackground(self,buffer,order=3,mask=None,binning=1,minvalid=0.5):
+        """ Fit a 2D polynomial surface to an image buffer and return it at full resolution. (float32)
+            buffer = 2D grayscale buffer, or 3D buffer. Each channel of a 3D buffer gets its own surface.
+            order = Order of the polynomial.
+            mask = Optional 2D mask. Non-zero pixels (eg stars) are excluded from the fit.
+            binning = The fit uses the mean of each binning x binning cell instead of every pixel. 
+                      1 = fit every pixel, the same as the original full resolution fit. (default)
+            minvalid = When masked, cells with less than this fraction of unmasked pixels are ignored.
+            
+            The fit is weighted by the number of unmasked pixels in each cell, so it approximates the full resolution fit.
+            A smooth low order surface barely changes within a cell, so binning has very little effect on the result.
+            Measured on synthetic 4056x3040 frames (order 3 gradient + noise, binning 16 vs binning 1)...
+            - Unmasked: background differs by < 0.005 DN, 8 bit output differs by 1 DN in 0.2% of pixels.
+            - Masked (3000 stars): background differs by < 0.03 DN.
+            tests/test_background.py compares binning with the full resolution fit and the original fit, --benchmark on 12MP frames.
+            Pixels in the last partial cell at the right and bottom edges (less than binning pixels) are not sampled, 
+            but the surface is still evaluated there.
+            Coordinates are scaled to -1...+1 to keep the least squares well conditioned. The original fit used raw pixel 
+            coordinates (x^3 ~ 7E10) and lstsq discarded terms, on the same frames it missed the true surface by up to 43 DN.
+            This fit is within 0.05 DN of it, so results differ from the original far more than binning changes them.
+            The surface is evaluated as a single (h x n) . (n x n) . (n x w) matrix product per channel. """
+        h, w = buffer.shape[:2]
+        channels = 1 if len(buffer.shape) < 3 else buffer.shape[2]
+        binning = max(1,int(binning))
+        if h // binning <= order or w // binning <= order: binning = 1 # Image is too small to bin.
+        hb, wb = h // binning, w // binning
+        crop = buffer[:hb * binning,:wb * binning].astype(np.float32)
+        if mask is None:
+            cells = cv2.resize(crop,(wb,hb),interpolation=cv2.INTER_AREA) if binning > 1 else crop # Exact block means.
+            fraction = None
+        else:
+            valid = (mask[:hb * binning,:wb * binning] == 0).astype(np.float32)
+            crop *= valid if channels == 1 else valid[:,:,np.newaxis] # Zero the masked pixels.
+            if binning > 1:
+                crop = cv2.resize(crop,(wb,hb),interpolation=cv2.INTER_AREA) # Mean including the zeroed pixels.
+                valid = cv2.resize(valid,(wb,hb),interpolation=cv2.INTER_AREA) # Fraction of each cell unmasked.
+            fraction = valid.ravel()
+            cells = crop / np.maximum(valid,1e-6) if channels == 1 else crop / np.maximum(valid,1e-6)[:,:,np.newaxis] # Mean of the unmasked pixels.
+
+        def scaled(pixels,size): # Pixel coordinates scaled to -1...+1 across the image.
+            return (pixels - (size - 1) / 2) / max((size - 1) / 2,1)
+        terms = [(i,j) for i in range(order + 1) for j in range(order + 1 - i)] # x^i * y^j
+        xpow = np.vander(scaled(np.arange(wb) * binning + (binning - 1) / 2,w),order + 1,increasing=True) # Cell centres.
+        ypow = np.vander(scaled(np.arange(hb) * binning + (binning - 1) / 2,h),order + 1,increasing=True)
+        X = np.column_stack([np.outer(ypow[:,j],xpow[:,i]).ravel() for i,j in terms])
+        Y = cells.reshape(hb * wb,channels)
+        if fraction is not None: # Weight cells by their unmasked pixel count, drop mostly masked cells.
+            keep = fraction >= (minvalid if binning > 1 else 0.5)
+            weight = np.sqrt(fraction[keep])[:,np.newaxis]
+            X = X[keep] * weight
+            Y = Y[keep] * weight
+
+        # Solve least squares for all channels at once.
         coeffs, _, _, _ = np.linalg.lstsq(X, Y, rcond=None)
-        background = np.dot(X, coeffs).reshape(h, w)
+
+        # Evaluate at full resolution.
+        xpow = np.vander(scaled(np.arange(w),w),order + 1,increasing=True).astype(np.float32)
+        ypow = np.vander(scaled(np.arange(h),h),order + 1,increasing=True).astype(np.float32)
+        background = np.empty((h,w,channels),np.float32)
+        for c in range(channels):
+            C = np.zeros((order + 1,order + 1),np.float32)
+            for k,(i,j) in enumerate(terms): C[j,i] = coeffs[k,c]
+            background[:,:,c] = ypow @ C @ xpow.T
+        if len(buffer.shape) < 3: background = background[:,:,0]
         return background
 
+    def FitPolynomialBackgroundGray(self,gray, order=3, binning=1):
+        """ Fit a 2D polynomial surface to a grayscale image. See FitPolynomialBackground(). """
+        return self.FitPolynomialBackground(gray, order=order, binning=binning)
+
     def FS_RemoveGradientPolyGray(self,filterdata={'method':'removegradient_polygray','order':3}):
         """ Based upon AI generated code. 
         
@@ -3319,45 +3588,28 @@ class pilomarimage():
         - Vignetting correction        """
         
         order = filterdata.get('order',3)
+        binning = filterdata.get('binning',1) # Fit to the mean of binning x binning cells if the script asks for it. 1 = fit every pixel.
         comment = filterdata.get('comment','') # Get any associated comment, default ''.
         if comment != '': self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyGray: Comment:",comment,terminal=False)
-        self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyGray(",order,")",terminal=False)
+        self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyGray(",order,binning,")",terminal=False)
         
-        img = self.ImageBuffer.copy()
-        img = self.ChangeBufferType(img,'grayscale') # Make sure the buffer is grayscale.       
-        img_float = img.astype(np.float32)
-
-        background = self.FitPolynomialBackgroundGray(img_float, order=order)
+        img = self.ChangeBufferType(self.ImageBuffer,'grayscale') # Make sure the buffer is grayscale. (Returns the original buffer if it is already grayscale, it is not modified.)
+        img_float = self.FilterFloat(img)
 
-        corrected = img_float - background
-        corrected = corrected - corrected.min()
-        corrected = corrected / corrected.max() * 255
+        background = self.CachedFilterProduct(filterdata,lambda: self.FitPolynomialBackground(img_float, order=order, binning=binning))
 
-        self.ImageBuffer = corrected.astype(np.uint8)
+        corrected = np.subtract(img_float, background, out=img_float)
+        self.ImageBuffer = self.NormalizeChannel(corrected)
         self.ActionList.append(['FS_RemoveGradientPolyGray'])
         self.ModifiedTimestamp = self.NowUTC()
 
         return True
 
-    def FitPolynomialBackgroundColor(self,gray, order=3):
+    def FitPolynomialBackgroundColor(self,gray, order=3, binning=1):
         """
-        Fit a 2D polynomial surface to a grayscale image.
+        Fit a 2D polynomial surface to a single channel of a color image. See FitPolynomialBackground().
         """
-        h, w = gray.shape
-        y, x = np.mgrid[0:h, 0:w]
-    
-        # Build polynomial terms
-        X = np.column_stack([
-            (x.ravel()**i) * (y.ravel()**j)
-            for i in range(order + 1)
-            for j in range(order + 1 - i)
-        ])
-        Y = gray.ravel()
-    
-        # Solve least squares
-        coeffs, _, _, _ = np.linalg.lstsq(X, Y, rcond=None)
-        background = np.dot(X, coeffs).reshape(h, w)
-        return background
+        return self.FitPolynomialBackground(gray, order=order, binning=binning)
 
     #def FS_RemoveGradientPolyColor(self,image_path, output_path, order=3):
     def FS_RemoveGradientPolyColor(self,filterdata={'method':'removegradient_polycolor','order':3}):
@@ -3380,20 +3632,18 @@ class pilomarimage():
                                 Apply a contrast stretch afterward (CLAHE works well) """
                                 
         order = filterdata.get('order',3) # Order for polynomial calculation.
+        binning = filterdata.get('binning',1) # Fit to the mean of binning x binning cells if the script asks for it. 1 = fit every pixel.
         comment = filterdata.get('comment','') # Get any associated comment, default ''.
         if comment != '': self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyColor: Comment:",comment,terminal=False)
-        self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyColor(",order,")",terminal=False)
+        self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyColor(",order,binning,")",terminal=False)
         
-        img = self.ImageBuffer.copy()
-        img_float = img.astype(np.float32)
+        img_float = self.FilterFloat(self.ImageBuffer)
 
         # Split channels
         b, g, r = cv2.split(img_float)
 
         # Fit polynomial to each channel
-        b_bg = self.FitPolynomialBackgroundColor(b, order)
-        g_bg = self.FitPolynomialBackgroundColor(g, order)
-        r_bg = self.FitPolynomialBackgroundColor(r, order)
+        b_bg, g_bg, r_bg = self.CachedFilterProduct(filterdata,lambda: cv2.split(self.FitPolynomialBackground(img_float, order=order, binning=binning)))
 
         # Subtract background
         b_corr = b - b_bg
@@ -3432,34 +3682,12 @@ class pilomarimage():
 
         return mask
 
-    def FitPolynomialBackgroundMasked(self,gray, mask, order=3):
+    def FitPolynomialBackgroundMasked(self,gray, mask, order=3, binning=1):
         """
         Fit a 2D polynomial surface to a grayscale image,
-        ignoring masked pixels (stars).
+        ignoring masked pixels (stars). See FitPolynomialBackground().
         """
-        
-        h, w = gray.shape
-        y, x = np.mgrid[0:h, 0:w]
-
-        # Flatten
-        X = np.column_stack([
-            (x.ravel()**i) * (y.ravel()**j)
-            for i in range(order + 1)
-            for j in range(order + 1 - i)
-        ])
-        Y = gray.ravel()
-        M = mask.ravel()
-
-        # Keep only unmasked pixels
-        X_fit = X[M == 0]
-        Y_fit = Y[M == 0]
-
-        # Solve least squares
-        coeffs, _, _, _ = np.linalg.lstsq(X_fit, Y_fit, rcond=None)
-
-        # Reconstruct background
-        background = np.dot(X, coeffs).reshape(h, w)
-        return background
+        return self.FitPolynomialBackground(gray, order=order, mask=mask, binning=binning)
 
     #def FS_RemoveGradientPolyColorMasked(self,image_path, output_path, order=3):
     def FS_RemoveGradientPolyColorMasked(self,filterdata={'method':'removegradient_polycolormasked','order':3}):
@@ -3489,24 +3717,23 @@ class pilomarimage():
         - Nebula rich regions        """
         
         order = filterdata.get('order',3) # Order for polynomial calculation.
+        binning = filterdata.get('binning',1) # Fit to the mean of binning x binning cells if the script asks for it. 1 = fit every pixel.
         comment = filterdata.get('comment','') # Get any associated comment, default ''.
         if comment != '': self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyColorMasked: Comment:",comment,terminal=False)
-        self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyColorMasked(",order,")",terminal=False)
+        self.Log("pilomarimage",self.Name,".FS_RemoveGradientPolyColorMasked(",order,binning,")",terminal=False)
         
-        img = self.ImageBuffer.copy()
-        img_float = img.astype(np.float32)
+        img_float = self.FilterFloat(self.ImageBuffer)
 
         # Split channels
         b, g, r = cv2.split(img_float)
 
-        # Create star mask from luminance
-        gray = cv2.cvtColor(img_float.astype(np.uint8), cv2.COLOR_BGR2GRAY)
-        star_mask = self.DetectStarMaskGray(gray)
-
-        # Fit polynomial to each channel using the mask
-        b_bg = self.FitPolynomialBackgroundMasked(b, star_mask, order)
-        g_bg = self.FitPolynomialBackgroundMasked(g, star_mask, order)
-        r_bg = self.FitPolynomialBackgroundMasked(r, star_mask, order)
+        def fit_background(): 
+            # Create star mask from luminance
+            gray = cv2.cvtColor(img_float.astype(np.uint8), cv2.COLOR_BGR2GRAY)
+            star_mask = self.DetectStarMaskGray(gray)
+            # Fit polynomial to each channel using the mask
+            return cv2.split(self.FitPolynomialBackground(img_float, order=order, mask=star_mask, binning=binning))
+        b_bg, g_bg, r_bg = self.CachedFilterProduct(filterdata,fit_background)
 
         # Subtract background
         b_corr = b - b_bg
@@ -3523,6 +3750,82 @@ class pilomarimage():
 
         return True
 
+    def FilterFloat(self,buffer):
+        """ Return a float32 copy of a buffer for the filter steps. 
+            The same work buffer is reused from step to step and frame to frame while the shape stays the same,
+            instead of allocating a fresh full frame intermediate every time. """
+        if self.FilterWork is None or self.FilterWork.shape != buffer.shape:
+            self.FilterWork = np.empty(buffer.shape,np.float32)
+        np.copyto(self.FilterWork,buffer,casting='unsafe')
+        return self.FilterWork
+
+    def FilterSignature(self):
+        """ Small grayscale thumbnail of the current image buffer. 
+            Used to decide if a cached filter product still matches the sky. """
+        buffer = self.ImageBuffer
+        if len(buffer.shape) > 2: buffer = buffer.mean(axis=2,dtype=np.float32) if buffer.shape[2] != 3 else cv2.cvtColor(buffer.astype(np.float32),cv2.COLOR_BGR2GRAY)
+        return cv2.resize(buffer.astype(np.float32),(32,24),interpolation=cv2.INTER_AREA)
+
+    def CachedFilterProduct(self,filterdata,builder):
+        """ Return a slowly varying filter product (eg a gradient model) from the cache, or build it with builder().
+            Invalidation policy. The product is rebuilt when any of these is true...
+            - Caching is disabled (self.FilterCacheEnabled or filterdata 'cache':False)
+            - The step parameters, frame shape or datatype have changed.
+            - It is older than self.FilterCacheMaxAge seconds.
+            - It has been reused self.FilterCacheMaxUses times.
+            - The frame's thumbnail differs from the one it was built from by more than self.FilterCacheTolerance. (Clouds, slew, dawn...)
+            Call ClearFilterCache() to force rebuilding, eg after a target change. """
+        key = json.dumps({k:v for k,v in filterdata.items() if k != 'comment'},sort_keys=True,default=str) + str(self.ImageBuffer.shape) + str(self.ImageBuffer.dtype)
+        self.LastFilterCached = False
+        if not self.FilterCacheEnabled or not filterdata.get('cache',True): return builder()
+        signature = self.FilterSignature()
+        entry = self.FilterCache.get(key,None)
+        if entry != None:
+            age = (self.NowUTC() - entry['created']).total_seconds()
+            change = float(np.mean(np.abs(signature - entry['signature'])))
+            if age <= self.FilterCacheMaxAge and entry['uses'] < self.FilterCacheMaxUses and change <= self.FilterCacheTolerance:
+                entry['uses'] += 1
+                self.LastFilterCached = True
+                self.Log("pilomarimage",self.Name,".CachedFilterProduct(): Reused",filterdata.get('method',None),"age",round(age,1),"s uses",entry['uses'],"change",round(change,2),terminal=False)
+                return entry['product']
+            self.Log("pilomarimage",self.Name,".CachedFilterProduct(): Expired",filterdata.get('method',None),"age",round(age,1),"s uses",entry['uses'],"change",round(change,2),terminal=False)
+        product = builder()
+        self.FilterCache[key] = {'product':product,'signature':signature,'created':self.NowUTC(),'uses':0}
+        return product
+
+    def ClearFilterCache(self):
+        """ Discard all cached filter products. """
+        self.FilterCache = {}
+        return True
+
+    def FilterLUT(self,filterdata):
+        """ Return a 256 entry lookup table equivalent to a filter step, or None if the step is not a simple per-pixel mapping.
+            Used to fuse consecutive per-pixel steps into a single pass over uint8 images. """
+        if filterdata.get('method',None) != 'threshold': return None
+        threshold_type = filterdata.get('type',cv2.THRESH_BINARY)
+        if threshold_type == None: threshold_type = cv2.THRESH_BINARY
+        if threshold_type & (cv2.THRESH_OTSU | cv2.THRESH_TRIANGLE): return None # Adaptive, depends upon the image content.
+        _, lut = cv2.threshold(np.arange(256,dtype=np.uint8),filterdata.get('threshold',127),filterdata.get('maxval',255),threshold_type)
+        return lut.reshape(256)
+
+    def PlanFilterScript(self,filterscript):
+        """ Turn a filter script into a list of steps to execute. [[stepname,filterdata],...]
+            Consecutive per-pixel steps (see FilterLUT) are fused into one 'lut' step.
+            Consecutive grayscale steps are reduced to one. """
+        plan = []
+        for entryname,filterdata in filterscript.items():
+            lut = self.FilterLUT(filterdata)
+            if len(plan) > 0:
+                prevname,prevdata = plan[-1]
+                prevlut = prevdata['lut'] if prevdata.get('method',None) == 'lut' else self.FilterLUT(prevdata)
+                if lut is not None and prevlut is not None: # Both steps are simple per-pixel mappings, combine them.
+                    plan[-1] = [prevname + '+' + entryname,{'method':'lut','lut':lut[prevlut],'fused':prevdata.get('fused',[prevdata]) + [filterdata]}]
+                    continue
+                if filterdata.get('method',None) in ['grayscale','greyscale'] and prevdata.get('method',None) in ['grayscale','greyscale']:
+                    continue # Already grayscale.
+            plan.append([entryname,filterdata])
+        return plan
+
     def RunFilterMethod(self,filterdata,window=None):
         """
         Run an individual filter method on the current image buffer.
@@ -3541,9 +3844,17 @@ class pilomarimage():
         elif filtermethod == 'removegradient_polycolor': result = self.FS_RemoveGradientPolyColor(filterdata) # Apply a FS_RemoveGradientPolyColor filter.
         elif filtermethod == 'removegradient_polycolormasked': result = self.FS_RemoveGradientPolyColorMasked(filterdata) # Apply a FS_RemoveGradientPolyColorMasked filter.
         elif filtermethod == 'levelshalfclip': result = self.FS_LevelsHalfClip(filterdata) # Apply a FS_LevelsHalfClip filter.
+        elif filtermethod == 'lut': # Fused per-pixel steps. (Created by PlanFilterScript.)
+            if self.ImageBuffer.dtype == np.uint8: 
+                self.ImageBuffer = cv2.LUT(self.ImageBuffer,filterdata['lut'])
+                self.ActionList.append(['FS_LUT',len(filterdata['fused'])])
+            else: # Not 8 bit data, run the original steps instead.
+                for fused in filterdata['fused']: 
+                    result = self.RunFilterMethod(fused,window=window)
+                    if not result: break
         else: # Filter method is not recognised.
-            self.Log("pilomarimage.RunFilterMethod(",filtercount,") filtermethod",filtermethod,"does not exist.",level='error')
-            print("**ERROR** pilomarimage.RunFilterMethod(",filtercount,") filtermethod",filtermethod,"does not exist.")
+            self.Log("pilomarimage.RunFilterMethod() filtermethod",filtermethod,"does not exist.",level='error')
+            print("**ERROR** pilomarimage.RunFilterMethod() filtermethod",filtermethod,"does not exist.")
             result = False
         return result
 
@@ -3615,6 +3926,11 @@ class pilomarimage():
                     'comment':'Apply adaptive threshold to boost remaining stars.',
                     } # /BoostStars
                 } # /UrbanFilter
+
+        Consecutive fixed threshold steps are fused into a single lookup table pass (see PlanFilterScript).
+        Background models in dehaze, removegradient* steps are cached between frames (see CachedFilterProduct).
+        Add 'cache':False to a step to always recalculate it. 
+        The time taken by each step is logged and kept in self.FilterTimings.
             
         """
         self.Log("pilomarimage",self.Name,".RunFilterScript()",terminal=False)
@@ -3631,8 +3947,10 @@ class pilomarimage():
             
         filtercount = 0
         result = True
+        self.FilterTimings = [] # Timing of each step in this run.
+        scriptstart = time.perf_counter()
         
-        for entryname,filterdata in filterscript.items(): # Go through each set of filters in turn.
+        for entryname,filterdata in self.PlanFilterScript(filterscript): # Go through each set of filters in turn.
             filtercount += 1 # Increment count.
             self.Log("pilomarimage.RunFilterScript(",scriptname,"): Running",filtercount,entryname,"...",terminal=debug) # Report the name of the filter
             if debug:
@@ -3640,7 +3958,13 @@ class pilomarimage():
                 for line in temp:
                     print(line)
             # Each 'item' should be a sub-dictionary of a filter and its parameters to apply to the current image.
+            self.LastFilterCached = False
+            stepstart = time.perf_counter()
             result = self.RunFilterMethod(filterdata,window=window)
+            stepseconds = time.perf_counter() - stepstart
+            self.FilterTimings.append([entryname,filterdata.get('method',None),stepseconds,self.LastFilterCached])
+            self.Log("pilomarimage.RunFilterScript(",scriptname,"): Step",filtercount,entryname,"took",round(stepseconds * 1000,1),"ms",
+                     "(cached)" if self.LastFilterCached else "",terminal=debug)
             if not result: break # Failure.
             # Save image after each step.
             if debug:
@@ -3648,6 +3972,9 @@ class pilomarimage():
                 self.SaveFile(intermediate_name)
                 if hasattr(window,'Print'): window.Print("Saving intermediate",intermediate_name.split("/")[-1])
                 self.Log("pilomarimage.RunFilterScript(): Step",filtercount,"result saved as",intermediate_name,terminal=debug)
+        summary = " ".join([step[0] + ":" + str(round(step[2] * 1000,1)) + ("ms(c)" if step[3] else "ms") for step in self.FilterTimings])
+        self.Log("pilomarimage.RunFilterScript(",scriptname,"): Timing",round((time.perf_counter() - scriptstart) * 1000,1),"ms",summary,terminal=debug)
+        if hasattr(window,'Print'): window.Print(scriptname,str(round((time.perf_counter() - scriptstart) * 1000)) + "ms",summary) # Per step timing.
         if result:
             self.Log("pilomarimage.RunFilterScript(",scriptname,"): completed.",terminal=debug)
         else:
@@ -5031,20 +5358,19 @@ class pilomarimage():
 
     def AnimateFrames(self,filepattern,filename,framerate=10,cleanup=False):
         """ Take a file pattern and generate an animation from the individual images.
+            Frames are encoded in filename order by pilomartimelapse, ffmpeg is no longer required.
             cleanup = True: When the video file is complete the original frames are deleted.
               BEWARE! It's a brutal delete, make sure your filepattern is good! """
         self.Log("Generating animation of observation previews...",terminal=False)
-        from pilomaroscommand import oscommand # Pilomar's OS command executor.
-        OSCommand = oscommand(None) # Create OS Command executor. 
-        osCmd = OSCommand.Execute # Shortcut point to the execution method which returns the output.
-        # *Q* GLOB facility may disappear from later versions of ffmpeg, this will need revising when that happens.
-        cmd = "ffmpeg -y -framerate " + str(framerate) + " -pattern_type glob -i '" + filepattern + "' -vf scale='iw/2:ih/2' " + filename
-        osCmd(cmd)
-        if cleanup: # Remove the original frames, they are nolonger required.
-            cmd = 'rm ' + filepattern
-            osCmd(cmd)
-        self.Log("GeneratePreviewAvi: Completed animation of observation previews.",terminal=False)
-        return True
+        import glob
+        filenames = sorted(glob.glob(filepattern))
+        movie = pilomartimelapse(str(self.Name) + '_animation',framerate=framerate,logger=self.Logger)
+        result = movie.EncodeFiles(filenames,filename)
+        if cleanup and result != None: # Remove the original frames, they are nolonger required.
+            for f in filenames:
+                os.remove(f)
+        self.Log("GeneratePreviewAvi: Completed animation of observation previews.",movie.Stats(),terminal=False)
+        return result != None
         
     def DescribeImage(self):
         """ Print information about the current image buffer. """
@@ -5128,5 +5454,546 @@ class pilomarkeogram():
         """ Export and save the keogram data as a .jpg file on disc. """    
         self.Keogram.SaveFile(filename) # imwrite doesn't report errors very well, beware.
 
+class pilomarstacker():
+    """ Streaming live stacker built upon pilomarimage.AccumulateBuffer().
+        Each new frame is...
+          - Registered against the first frame. (Phase correlation on a downsampled grayscale copy, translation only.)
+          - Sigma clipped against rolling per-pixel statistics. (Exponentially weighted mean/variance over 'window' frames.)
+          - Accumulated into a running mean, and also into a running median approximation.
+        Memory is bounded: a handful of float32 frame-sized arrays, regardless of how many frames are stacked.
+        Usage
+        MyStack = pilomarstacker('stack',window=8,sigma=3.0)
+        MyStack.Add(imagehandler1)
+        MyStack.Add(imagehandler2)
+        ... MyStack.Preview is refreshed after every frame.
+        MyStack.Preview.SaveFile('stack.jpg')
+        """
+    
+    def __init__(self,name,window=8,sigma=3.0,registerscale=0.25,maxshift=0.1,minresponse=0.05,preview=True,logger=None):
+        self.Name = name # A name for this instance.
+        self.Window = max(2,int(window)) # Number of frames represented by the rolling statistics.
+        self.Alpha = 1.0 / self.Window # Weight of each new frame in the rolling statistics.
+        self.Sigma = sigma # Pixels further than this many standard deviations from the rolling mean are rejected.
+        self.NoiseFloor = 2.0 # Minimum standard deviation used for clipping. Stops rejection in perfectly flat areas.
+        self.RegisterScale = registerscale # Registration is performed on a copy scaled by this factor.
+        self.MaxShift = maxshift # Reject frames which move further than this proportion of the image width.
+        self.MinResponse = minresponse # Reject frames whose phase correlation response is weaker than this. (Clouds, no stars.)
+        self.PreviewEnabled = preview # Refresh self.Preview after every frame?
+        self.Stack = pilomarimage(name=name + '_stack',logger=logger) # Holds the accumulator.
+        self.Frame = pilomarimage(name=name + '_frame',logger=None) # Working buffer for the aligned frame.
+        self.Preview = pilomarimage(name=name + '_preview',logger=None) # Latest stacked preview.
+        self.Log = self.Stack.Log
+        self.Reset()
+        
+    def Reset(self):
+        """ Start a fresh stack. """
+        self.Stack.Clear()
+        self.Preview.Clear()
+        self.Reference = None # Downsampled grayscale reference frame.
+        self.Hanning = None # Window function for phase correlation.
+        self.Mean = None # Rolling mean of each pixel.
+        self.Var = None # Rolling variance of each pixel.
+        self.Median = None # Running median approximation of each pixel.
+        self.FrameCount = 0 # Frames offered.
+        self.AcceptedCount = 0 # Frames stacked.
+        self.RejectedFrames = 0 # Frames that failed registration.
+        self.LastShift = (0.0,0.0) # Shift applied to the most recent frame. (x,y pixels)
+        self.LastResponse = 0.0 # Phase correlation response of the most recent frame.
+        self.LastRejectedPc = 0.0 # % of pixels clipped from the most recent frame.
+        self.FrameSeconds = [] # Recent per-frame processing times.
+        self.PreviewSeconds = [] # Recent preview refresh times.
+    
+    def _RegisterGray(self,buffer):
+        """ Return a downsampled float32 grayscale copy of a buffer for registration. """
+        if len(buffer.shape) > 2 and buffer.shape[2] > 1: gray = cv2.cvtColor(buffer,cv2.COLOR_BGR2GRAY)
+        else: gray = buffer
+        return cv2.resize(gray,None,fx=self.RegisterScale,fy=self.RegisterScale,interpolation=cv2.INTER_AREA).astype(np.float32)
+        
+    def Register(self,buffer):
+        """ Measure the (x,y) pixel shift of a buffer relative to the reference frame.
+            Returns (dx,dy,response). """
+        small = self._RegisterGray(buffer)
+        if self.Reference is None: # First frame becomes the reference.
+            self.Reference = small
+            self.Hanning = cv2.createHanningWindow((small.shape[1],small.shape[0]),cv2.CV_32F)
+            return 0.0,0.0,1.0
+        (dx,dy),response = cv2.phaseCorrelate(self.Reference,small,self.Hanning)
+        return dx / self.RegisterScale,dy / self.RegisterScale,response
+        
+    def Add(self,imagehandler):
+        """ Register, clip and stack a new frame. 
+            imagehandler is an instance of pilomarimage containing the latest image.
+            Returns TRUE if the frame was stacked. """
+        start = time.perf_counter()
+        self.FrameCount += 1
+        buffer = imagehandler.ImageBuffer
+        height,width = buffer.shape[:2]
+        dx,dy,response = self.Register(buffer)
+        self.LastResponse = response
+        if math.hypot(dx,dy) > self.MaxShift * width or response < self.MinResponse: # Can't trust the registration.
+            self.Log("pilomarstacker",self.Name,".Add(): Frame rejected. shift",round(dx,1),round(dy,1),"response",round(response,3),terminal=False)
+            self.RejectedFrames += 1
+            return False
+        self.LastShift = (dx,dy)
+        # Shift the frame back onto the reference. Uncovered borders are excluded from the stack.
+        matrix = np.float32([[1,0,-dx],[0,1,-dy]])
+        aligned = cv2.warpAffine(buffer.astype(np.float32),matrix,(width,height),flags=cv2.INTER_LINEAR,borderMode=cv2.BORDER_CONSTANT,borderValue=0)
+        valid = np.zeros(aligned.shape,bool)
+        valid[max(0,int(math.ceil(-dy))):height - max(0,int(math.ceil(dy))),max(0,int(math.ceil(-dx))):width - max(0,int(math.ceil(dx)))] = True
+        if self.Mean is None: # First stacked frame seeds the rolling statistics.
+            self.Mean = aligned.copy()
+            self.Var = np.full_like(aligned,self.NoiseFloor ** 2)
+            self.Median = aligned.copy()
+            accept = valid
+        else:
+            std = np.sqrt(self.Var)
+            np.maximum(std,self.NoiseFloor,out=std)
+            diff = aligned - self.Mean
+            accept = valid & (np.abs(diff) <= self.Sigma * std)
+            if self.AcceptedCount < 2: accept = valid # Statistics are not established yet.
+            # Update rolling statistics with the winsorized frame, so that outliers cannot drag them.
+            np.clip(diff,-self.Sigma * std,self.Sigma * std,out=diff)
+            diff *= valid
+            self.Mean += self.Alpha * diff
+            self.Var *= (1 - self.Alpha)
+            self.Var += self.Alpha * (1 - self.Alpha) * diff * diff
+            # Frugal median approximation. Step towards each new value by a fraction of the local spread.
+            step = np.sign(aligned - self.Median) * std * (2 * self.Alpha)
+            self.Median += step * accept
+        self.LastRejectedPc = 100.0 * (1.0 - np.count_nonzero(accept) / max(1,np.count_nonzero(valid)))
+        self.Frame.ImageBuffer = aligned
+        self.Frame.Name = imagehandler.Name
+        self.Stack.AccumulateBuffer(self.Frame,mask=accept)
+        self.Stack.AccumulatorType = buffer.dtype
+        self.AcceptedCount += 1
+        if self.PreviewEnabled: self.RefreshPreview()
+        self.FrameSeconds = (self.FrameSeconds + [time.perf_counter() - start])[-100:]
+        self.Log("pilomarstacker",self.Name,".Add(): Stacked frame",self.AcceptedCount,"shift",round(dx,1),round(dy,1),
+                 "clipped",round(self.LastRejectedPc,2),"%",round(self.FrameSeconds[-1],3),"s",terminal=False)
+        return True
+        
+    def RefreshPreview(self,method='mean'):
+        """ Rebuild self.Preview from the current stack.
+            method = 'mean': Sigma clipped mean. 'median': Running median approximation. """
+        start = time.perf_counter()
+        if method == 'median' and self.Median is not None:
+            self.Preview.LoadBuffer(np.clip(self.Median,0,np.iinfo(self.Stack.AccumulatorType).max if np.issubdtype(self.Stack.AccumulatorType,np.integer) else None).astype(self.Stack.AccumulatorType))
+        elif self.Stack.ResolveAccumulator():
+            self.Preview.LoadBuffer(self.Stack.ImageBuffer)
+        self.PreviewSeconds = (self.PreviewSeconds + [time.perf_counter() - start])[-100:]
+        return self.Preview.ImageExists()
+        
+    def AverageFrameSeconds(self):
+        """ Average processing time of recent frames. """
+        if len(self.FrameSeconds) == 0: return 0.0
+        return sum(self.FrameSeconds) / len(self.FrameSeconds)
+        
+    def MemoryBytes(self):
+        """ Total bytes held by the stacker's per-pixel arrays. Does not grow with the number of frames. """
+        arrays = [self.Mean,self.Var,self.Median,self.Reference,self.Stack.ImageAccumulator,self.Stack.ImageCounter,self.Stack.ImageBuffer,self.Preview.ImageBuffer,self.Frame.ImageBuffer]
+        return sum([a.nbytes for a in arrays if a is not None])
+        
+class pilomarmeteordetector():
+    """ Streaming meteor detector. Scans each frame as it is captured instead of searching the files afterwards.
+        Each new frame is...
+          - Reduced to a downsampled grayscale copy.
+          - Compared with a rolling background. (Exponentially weighted mean/variance over 'window' frames.)
+          - Pixels brighter than the background by 'sigma' standard deviations are grouped into connected blobs.
+          - Long thin blobs are reported as candidate streaks. (Meteors, aircraft, satellites.)
+          - Candidates are appended to a tab separated index file.
+        Stars, noise and slow changes are absorbed by the rolling background. 
+        If too much of the frame changes at once (slew, cloud, exposure change) the background is restarted.
+        Usage
+        MyDetector = pilomarmeteordetector('meteors',indexfile='meteorcandidates.txt')
+        streaks = MyDetector.Scan(imagehandler,filename='light_001.jpg')
+        """
+    
+    def __init__(self,name,scale=0.25,window=8,sigma=5.0,minlength=100,minelongation=6.0,maxchangepc=2.0,indexfile=None,logger=None):
+        self.Name = name # A name for this instance.
+        self.Scale = scale # Frames are scanned at this fraction of their original size.
+        self.Window = max(2,int(window)) # Number of frames represented by the rolling background.
+        self.Alpha = 1.0 / self.Window # Weight of each new frame in the rolling background.
+        self.Sigma = sigma # Pixels brighter than the background by this many standard deviations are considered.
+        self.NoiseFloor = 2.0 # Minimum standard deviation used. Stops detections in perfectly flat areas.
+        self.MinLength = minlength # Minimum streak length. (Full resolution pixels)
+        self.MinElongation = minelongation # Minimum length/width ratio of a streak.
+        self.MaxChangePc = maxchangepc # If more than this % of the frame changes, restart the background instead.
+        self.IndexFile = indexfile # Optional tab separated file of candidates.
+        self.Work = pilomarimage(name=name,logger=logger) # Provides logging and timestamps.
+        self.Log = self.Work.Log
+        self.Reset()
+        
+    def Reset(self):
+        """ Forget the rolling background. """
+        self.Mean = None # Rolling mean of each downsampled pixel.
+        self.Var = None # Rolling variance of each downsampled pixel.
+        self.FrameCount = 0 # Frames scanned.
+        self.CandidateFrames = 0 # Frames containing at least one candidate.
+        self.Restarts = 0 # Number of times the background was restarted.
+        self.LastCandidates = [] # Candidates from the most recent frame.
+        self.FrameSeconds = [] # Recent per-frame processing times.
+        
+    def _ScanGray(self,buffer):
+        """ Return a downsampled float32 grayscale copy of a buffer. """
+        if len(buffer.shape) > 2 and buffer.shape[2] > 1: gray = cv2.cvtColor(buffer,cv2.COLOR_BGR2GRAY if buffer.shape[2] == 3 else cv2.COLOR_BGRA2GRAY)
+        else: gray = buffer
+        return cv2.resize(gray,None,fx=self.Scale,fy=self.Scale,interpolation=cv2.INTER_AREA).astype(np.float32)
+        
+    def Scan(self,imagehandler,filename=None,timestamp=None,indexfile=None):
+        """ Scan a new frame for streaks. 
+            imagehandler is an instance of pilomarimage containing the latest image (or the numpy buffer itself).
+            filename and timestamp are recorded in the candidate index.
+            indexfile overrides self.IndexFile for this frame.
+            Returns a list of candidates [[x1,y1,x2,y2,length,width,peak],...] in full resolution pixels. """
+        start = time.perf_counter()
+        self.FrameCount += 1
+        self.LastCandidates = []
+        small = self._ScanGray(getattr(imagehandler,'ImageBuffer',imagehandler))
+        if self.Mean is None or self.Mean.shape != small.shape: # First frame seeds the background.
+            self.Mean = small
+            self.Var = np.full_like(small,self.NoiseFloor ** 2)
+            self.FrameSeconds = (self.FrameSeconds + [time.perf_counter() - start])[-100:]
+            return self.LastCandidates
+        std = np.sqrt(self.Var)
+        np.maximum(std,self.NoiseFloor,out=std)
+        diff = small - self.Mean
+        # Compare against the local maximum of the background, so stars that wander by a pixel (imperfect tracking) are not flagged.
+        kernel = np.ones((3,3),np.uint8)
+        bright = ((small - cv2.dilate(self.Mean,kernel)) > self.Sigma * cv2.dilate(std,kernel)).astype(np.uint8)
+        changepc = 100.0 * np.count_nonzero(bright) / bright.size
+        if changepc > self.MaxChangePc: # Too much has changed to trust the background. Start again from this frame.
+            self.Log("pilomarmeteordetector",self.Name,".Scan(): Background restarted,",round(changepc,2),"% changed.",terminal=False)
+            self.Restarts += 1
+            self.Mean = small
+            self.Var = np.full_like(small,self.NoiseFloor ** 2)
+            self.FrameSeconds = (self.FrameSeconds + [time.perf_counter() - start])[-100:]
+            return self.LastCandidates
+        # Group bright pixels. A small dilation joins the broken pieces of faint streaks.
+        joined = cv2.dilate(bright,kernel)
+        count,labels,stats,centroids = cv2.connectedComponentsWithStats(joined,connectivity=8)
+        minlength = self.MinLength * self.Scale # Minimum length in downsampled pixels.
+        for i in range(1,count):
+            x,y,w,h,area = stats[i]
+            if max(w,h) < minlength: continue # Too short in any direction.
+            ys,xs = np.nonzero(labels[y:y + h,x:x + w] == i)
+            points = np.column_stack([xs + x,ys + y]).astype(np.float32)
+            centre = points.mean(axis=0)
+            eigenvalues,eigenvectors = np.linalg.eigh(np.cov((points - centre).T))
+            length = math.sqrt(12 * max(eigenvalues[1],0)) # A uniform line of length L has variance L^2/12 along it.
+            width = max(1.0,math.sqrt(12 * max(eigenvalues[0],0)))
+            if length < minlength or length / width < self.MinElongation: continue # Not a streak.
+            axis = eigenvectors[:,1]
+            along = (points - centre) @ axis
+            x1,y1 = (centre + axis * along.min()) / self.Scale
+            x2,y2 = (centre + axis * along.max()) / self.Scale
+            peak = float(diff[y:y + h,x:x + w][labels[y:y + h,x:x + w] == i].max())
+            self.LastCandidates.append([int(x1),int(y1),int(x2),int(y2),round(length / self.Scale,1),round(width / self.Scale,1),round(peak,1)])
+        # Update the rolling background with the winsorized frame, leaving out the streaks so they do not burn in.
+        np.clip(diff,-self.Sigma * std,self.Sigma * std,out=diff)
+        diff[joined > 0] = 0
+        self.Mean += self.Alpha * diff
+        self.Var *= (1 - self.Alpha)
+        self.Var += self.Alpha * (1 - self.Alpha) * diff * diff
+        if len(self.LastCandidates) > 0:
+            self.CandidateFrames += 1
+            self.Log("pilomarmeteordetector",self.Name,".Scan():",len(self.LastCandidates),"candidate(s) in",filename,self.LastCandidates,terminal=False)
+            self.WriteIndex(self.LastCandidates,filename=filename,timestamp=timestamp,indexfile=indexfile)
+        self.FrameSeconds = (self.FrameSeconds + [time.perf_counter() - start])[-100:]
+        return self.LastCandidates
+        
+    def WriteIndex(self,candidates,filename=None,timestamp=None,indexfile=None):
+        """ Append candidates to the tab separated index file. One line per candidate. """
+        if indexfile == None: indexfile = self.IndexFile
+        if indexfile == None: return False
+        if timestamp == None: timestamp = self.Work.NowUTC()
+        if not os.path.exists(indexfile): # Create header line if it's a new file.
+            with open(indexfile,'w') as f:
+                f.write('Timestamp\tFrame\tFile\tX1\tY1\tX2\tY2\tLength\tWidth\tPeak\n')
+        with open(indexfile,'a') as f:
+            for candidate in candidates:
+                f.write(str(timestamp) + '\t' + str(self.FrameCount) + '\t' + str(filename) + '\t' + '\t'.join([str(c) for c in candidate]) + '\n')
+        return True
+        
+    def AverageFrameSeconds(self):
+        """ Average processing time of recent frames. """
+        if len(self.FrameSeconds) == 0: return 0.0
+        return sum(self.FrameSeconds) / len(self.FrameSeconds)
+        
+class pilomarcloudestimator():
+    """ Streaming cloud/transparency estimator. Cheap enough to run on every light frame.
+        Each new frame is...
+          - Reduced to a downsampled grayscale copy.
+          - Split into a grid of cells. The median of each cell measures the sky background, the spread of the cell medians measures patchiness.
+          - Searched for stars: local maxima brighter than the background by 'sigma' x the noise.
+        The star count is compared with the expected count (eg: catalogue stars in the field of view) if one is given.
+        The detected/expected ratio is compared against the best recent ratio (the clear sky reference), so the
+        absolute magnitude limit of the camera doesn't matter.
+        Sky background brightening and patchiness against the clearest recent frames add to the penalty.
+        Score 1.0 = as clear as the reference, 0.0 = no stars.
+        A rolling history smooths the score, Paused() applies hysteresis so capture can pause and resume cleanly.
+        Nothing is written to disc unless debugfolder is set.
+        Usage
+        MyClouds = pilomarcloudestimator('cloud')
+        result = MyClouds.Estimate(imagehandler,expectedstars=120)
+        if MyClouds.Paused(): ... skip capture ...
+        """
+    
+    def __init__(self,name,scale=0.25,grid=(12,16),sigma=5.0,history=30,smoothing=3,pausescore=0.3,resumescore=0.5,decay=0.995,debugfolder=None,logger=None):
+        self.Name = name # A name for this instance.
+        self.Scale = scale # Frames are analysed at this fraction of their original size.
+        self.Grid = grid # (rows,columns) of background cells.
+        self.Sigma = sigma # Stars must be this many noise standard deviations above the background.
+        self.NoiseFloor = 1.0 # Minimum noise level. Stops every pixel counting as a star in perfectly flat (clipped) images.
+        self.Smoothing = max(1,int(smoothing)) # Number of recent scores in the smoothed score.
+        self.PauseScore = pausescore # Pause capture when the smoothed score drops below this.
+        self.ResumeScore = resumescore # Resume capture when the smoothed score rises above this.
+        self.Decay = decay # The clear sky reference relaxes by this factor per frame, so it can adapt to a changing field or sky.
+        self.DebugFolder = debugfolder # Optional folder for intermediate images. (Debugging only)
+        self.HistoryLength = max(self.Smoothing,int(history))
+        self.Work = pilomarimage(name=name,logger=logger) # Provides logging and timestamps.
+        self.Log = self.Work.Log
+        self.Reset()
+        
+    def Reset(self):
+        """ Forget the history and the clear sky reference. """
+        self.History = [] # Recent results, oldest first.
+        self.RefRatio = None # Best recent detected/expected star ratio.
+        self.RefSky = None # Darkest recent sky background.
+        self.RefPatch = None # Smoothest recent sky background.
+        self.PausedState = False # Current pause decision.
+        self.FrameCount = 0
+        self.FrameSeconds = [] # Recent per-frame processing times.
+        
+    def _Gray(self,buffer):
+        """ Return a downsampled float32 grayscale copy of a buffer. """
+        if len(buffer.shape) > 2 and buffer.shape[2] > 1: gray = cv2.cvtColor(buffer,cv2.COLOR_BGR2GRAY if buffer.shape[2] == 3 else cv2.COLOR_BGRA2GRAY)
+        else: gray = buffer
+        return cv2.resize(gray,None,fx=self.Scale,fy=self.Scale,interpolation=cv2.INTER_AREA).astype(np.float32)
+        
+    def _CellMedians(self,gray):
+        """ Median of each background cell. Stars hardly affect a median, so this follows the sky itself. """
+        rows,cols = self.Grid
+        h = (gray.shape[0] // rows) * rows
+        w = (gray.shape[1] // cols) * cols
+        cells = gray[:h,:w].reshape(rows,h // rows,cols,w // cols).transpose(0,2,1,3).reshape(rows,cols,-1)
+        return np.median(cells,axis=2)
+        
+    def Estimate(self,imagehandler,expectedstars=None,timestamp=None):
+        """ Estimate the sky quality of a new frame.
+            imagehandler is an instance of pilomarimage containing the latest image (or the numpy buffer itself).
+            expectedstars = Optional number of stars expected in the field (eg: from the catalogue). Only the ratio between frames matters.
+            Returns a dictionary containing...
+              score: 0.0 (no stars) to 1.0 (as good as the clear sky reference).
+              smoothed: Median score of the most recent frames.
+              stars: Stars detected in the downsampled frame.
+              starfraction: Detected star ratio relative to the clear sky reference.
+              sky: Median sky background. (0-255 for 8 bit images)
+              noise: Background noise.
+              patchiness: Spread of the background cells in noise units. Clouds make the background uneven.
+              paused: The pause decision after this frame. """
+        start = time.perf_counter()
+        self.FrameCount += 1
+        gray = self._Gray(getattr(imagehandler,'ImageBuffer',imagehandler))
+        cells = self._CellMedians(gray)
+        background = cv2.resize(cells,(gray.shape[1],gray.shape[0]),interpolation=cv2.INTER_LINEAR) # Smooth background model.
+        residual = gray - background
+        noise = max(self.NoiseFloor,1.4826 * float(np.median(np.abs(residual)))) # Robust noise estimate.
+        peaks = (residual > self.Sigma * noise) & (gray >= cv2.dilate(gray,np.ones((3,3),np.uint8))) # Bright local maxima.
+        stars = int(np.count_nonzero(peaks))
+        sky = float(np.median(cells))
+        patchiness = float(np.std(cells)) / noise
+        ratio = stars / float(expectedstars) if expectedstars not in [None,0] else float(stars)
+        # Update the clear sky references. They follow better frames immediately and relax slowly otherwise.
+        if self.RefRatio == None:
+            self.RefRatio,self.RefSky,self.RefPatch = ratio,sky,patchiness
+        else:
+            self.RefRatio = max(ratio,self.RefRatio * self.Decay)
+            self.RefSky = min(sky,self.RefSky + (sky - self.RefSky) * (1 - self.Decay))
+            self.RefPatch = min(patchiness,self.RefPatch + (patchiness - self.RefPatch) * (1 - self.Decay))
+        starfraction = min(1.0,ratio / self.RefRatio) if self.RefRatio > 0 else 0.0
+        skypenalty = min(1.0,max(0.0,(sky - self.RefSky) / max(10 * noise,5.0))) # Cloud lit by light pollution brightens the background.
+        patchpenalty = min(1.0,max(0.0,(patchiness - self.RefPatch) / 10.0)) # Cloud edges make the background uneven.
+        score = round(0.7 * starfraction + 0.3 * (1.0 - max(skypenalty,patchpenalty)),3)
+        if self.RefRatio <= 0: score = round(0.3 * (1.0 - max(skypenalty,patchpenalty)),3) # No stars seen yet at all.
+        result = {'frame':self.FrameCount,'score':score,'stars':stars,'starfraction':round(starfraction,3),'sky':round(sky,2),
+                  'noise':round(noise,2),'patchiness':round(patchiness,2),'timestamp':timestamp}
+        self.History = (self.History + [result])[-self.HistoryLength:]
+        result['smoothed'] = self.SmoothedScore()
+        if self.PausedState and result['smoothed'] >= self.ResumeScore: self.PausedState = False
+        elif not self.PausedState and result['smoothed'] < self.PauseScore: self.PausedState = True
+        result['paused'] = self.PausedState
+        if self.DebugFolder != None: # Only touch the disc when debugging.
+            cv2.imwrite(os.path.join(self.DebugFolder,self.Name + '_gray.jpg'),np.clip(gray,0,255).astype(np.uint8))
+            cv2.imwrite(os.path.join(self.DebugFolder,self.Name + '_stars.png'),peaks.astype(np.uint8) * 255)
+            self.Log("pilomarcloudestimator",self.Name,".Estimate():",result,terminal=False)
+        self.FrameSeconds = (self.FrameSeconds + [time.perf_counter() - start])[-100:]
+        return result
+        
+    def SmoothedScore(self):
+        """ Median score of the most recent frames. 1.0 if nothing has been measured yet. """
+        if len(self.History) == 0: return 1.0
+        return float(np.median([h['score'] for h in self.History[-self.Smoothing:]]))
+        
+    def Paused(self):
+        """ Should capture be paused because of cloud? """
+        return self.PausedState
+        
+    def Latest(self):
+        """ The most recent result, or None. """
+        if len(self.History) == 0: return None
+        return self.History[-1]
+        
+    def Status(self):
+        """ One line summary for the dashboard and logs. """
+        latest = self.Latest()
+        if latest == None: return 'Sky: --'
+        text = 'Sky: ' + str(int(round(latest['smoothed'] * 100))) + '% stars ' + str(latest['stars']) + ' (' + str(int(round(latest['starfraction'] * 100))) + '%) bg ' + str(latest['sky'])
+        if self.PausedState: text += ' PAUSED'
+        return text
+        
+    def AverageFrameSeconds(self):
+        """ Average processing time of recent frames. """
+        if len(self.FrameSeconds) == 0: return 0.0
+        return sum(self.FrameSeconds) / len(self.FrameSeconds)
+        
+class pilomartimelapse():
+    """ Incremental timelapse encoder using OpenCV's VideoWriter (no external ffmpeg).
+        Frames are downsampled in memory and appended to the movie as they are captured,
+        so the movie is ready as soon as Finish() is called.
+        Existing folders of images can still be encoded in batch mode with EncodeFiles().
+        Usage
+        MyMovie = pilomartimelapse('preview',framerate=10,scale=0.5)
+        MyMovie.Start('preview.mp4')
+        MyMovie.AddFrame(imagehandler1) # pilomarimage instance, numpy buffer or jpg filename.
+        MyMovie.AddFrame(imagehandler2)
+        MyMovie.Finish()
+        """
+
+    def __init__(self,name,framerate=10,scale=0.5,fourcc='mp4v',logger=None):
+        """ framerate = frames per second in the movie.
+            scale = frames are resized by this factor. (0.5 matches the previous ffmpeg 'iw/2:ih/2' filter)
+            fourcc = OpenCV codec code. 'mp4v' is available in standard OpenCV builds. """
+        self.Name = name # A name for this instance.
+        self.FrameRate = framerate
+        self.Scale = scale
+        self.FourCC = fourcc
+        self.Logger = logger
+        self.Writer = None # cv2.VideoWriter, opened when the first frame arrives.
+        self.FileName = None # Set by Start(), the movie is active until Finish().
+        self.Reset()
+
+    def Log(self,*args,**kwargs):
+        """ Pass messages to the logger if there is one. """
+        if self.Logger != None: self.Logger.Log(*args,**kwargs)
+
+    def Reset(self):
+        """ Clear the statistics ready for a new movie. """
+        self.FrameSize = None # (width,height) of the movie.
+        self.Frames = 0 # Frames written.
+        self.Skipped = 0 # Frames that could not be read.
+        self.EncodeSeconds = 0.0 # Time spent reading, resizing and encoding.
+        self.StartTime = None
+
+    def Start(self,filename):
+        """ Begin a new movie. Any movie already in progress is finished first. """
+        if self.Active(): self.Finish()
+        self.Reset()
+        self.FileName = filename
+        self.StartTime = time.time()
+        self.Log("pilomartimelapse",self.Name,".Start(",filename,")",terminal=False)
+        return True
+
+    def ReadFlag(self):
+        """ JPEG files can be decoded directly at 1/2, 1/4 or 1/8 size, which is much faster than decoding then resizing. """
+        if self.Scale <= 0.125: return cv2.IMREAD_REDUCED_COLOR_8
+        if self.Scale <= 0.25: return cv2.IMREAD_REDUCED_COLOR_4
+        if self.Scale <= 0.5: return cv2.IMREAD_REDUCED_COLOR_2
+        return cv2.IMREAD_COLOR
+
+    def PrepareFrame(self,frame):
+        """ Convert a pilomarimage, numpy buffer or filename into a BGR frame of the movie's size. """
+        reduced = 1.0 # How much has the frame already been reduced?
+        if isinstance(frame,str):
+            flag = self.ReadFlag()
+            buffer = cv2.imread(frame,flag)
+            if buffer is None: return None
+            reduced = {cv2.IMREAD_REDUCED_COLOR_8:0.125,cv2.IMREAD_REDUCED_COLOR_4:0.25,cv2.IMREAD_REDUCED_COLOR_2:0.5}.get(flag,1.0)
+        elif hasattr(frame,'ImageBuffer'): buffer = frame.ImageBuffer
+        else: buffer = frame
+        if buffer is None: return None
+        if buffer.dtype != np.uint8: buffer = cv2.convertScaleAbs(buffer,alpha=255.0 / max(1.0,float(buffer.max()))) # 16bit etc.
+        if buffer.ndim == 2: buffer = cv2.cvtColor(buffer,cv2.COLOR_GRAY2BGR)
+        elif buffer.shape[2] == 4: buffer = cv2.cvtColor(buffer,cv2.COLOR_BGRA2BGR)
+        if self.FrameSize == None: # First frame sets the size of the movie. Codecs prefer even dimensions.
+            scale = self.Scale / reduced
+            self.FrameSize = (max(2,int(buffer.shape[1] * scale) // 2 * 2),max(2,int(buffer.shape[0] * scale) // 2 * 2))
+        if (buffer.shape[1],buffer.shape[0]) != self.FrameSize:
+            buffer = cv2.resize(buffer,self.FrameSize,interpolation=cv2.INTER_AREA)
+        return buffer
+
+    def AddFrame(self,frame):
+        """ Append one frame to the movie. frame = pilomarimage instance, numpy buffer or image filename.
+            Returns True if the frame was written. """
+        if self.FileName == None:
+            self.Log("pilomartimelapse",self.Name,".AddFrame(): Start() has not been called.",terminal=False)
+            return False
+        start = time.perf_counter()
+        try:
+            buffer = self.PrepareFrame(frame)
+            if buffer is None:
+                self.Skipped += 1
+                return False
+            if self.Writer == None: # Open the movie now the frame size is known.
+                self.Writer = cv2.VideoWriter(self.FileName,cv2.VideoWriter_fourcc(*self.FourCC),self.FrameRate,self.FrameSize)
+                if not self.Writer.isOpened():
+                    self.Log("pilomartimelapse",self.Name,".AddFrame(): Cannot open",self.FileName,"with codec",self.FourCC,level='error',terminal=False)
+                    self.Writer = None
+                    self.Skipped += 1
+                    return False
+            self.Writer.write(buffer)
+            self.Frames += 1
+        except Exception as e:
+            self.Log("pilomartimelapse",self.Name,".AddFrame(): Failed",e,level='warning',terminal=False)
+            self.Skipped += 1
+            return False
+        finally:
+            self.EncodeSeconds += time.perf_counter() - start
+        return True
+
+    def Finish(self):
+        """ Close the movie. Returns the filename, or None if no frames were written. """
+        start = time.perf_counter()
+        result = None
+        if self.Writer != None:
+            self.Writer.release()
+            self.Writer = None
+            result = self.FileName
+        self.EncodeSeconds += time.perf_counter() - start
+        self.Log("pilomartimelapse",self.Name,".Finish():",self.FileName,self.Stats(),terminal=False)
+        self.FileName = None
+        return result
+
+    def Active(self):
+        """ Has a movie been started and is it receiving frames? (The writer itself opens with the first frame.) """
+        return self.FileName != None
+
+    def Stats(self):
+        """ Progress and throughput so far. """
+        return {'frames':self.Frames,'skipped':self.Skipped,'size':self.FrameSize,'encode_s':round(self.EncodeSeconds,3),
+                'fps':round(self.Frames / self.EncodeSeconds,2) if self.EncodeSeconds > 0 else 0.0}
+
+    def EncodeFiles(self,filenames,filename,progress=None):
+        """ Batch mode: encode an existing list of image files into a new movie.
+            filenames are encoded in the order given. (Use sorted(glob.glob(pattern)) for a folder.)
+            progress = optional function(done,total,stats) called every 5% or so.
+            Returns the movie filename, or None if nothing was encoded. """
+        self.Start(filename)
+        total = len(filenames)
+        step = max(1,total // 20)
+        for i,f in enumerate(filenames):
+            self.AddFrame(f)
+            if progress != None and ((i + 1) % step == 0 or i + 1 == total): progress(i + 1,total,self.Stats())
+        return self.Finish()
+
 if __name__ == '__main__':
     pi = pilomarimage()
@@ -14,12 +14,20 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 # 09.Dec.2023 Added PackageSearchResult() function to help with analysing functionality.
+# 18.Oct.2026 Added logextractor class. PackageSearchResult() now streams the log in-process instead of calling egrep and zip.
+# 19.Oct.2026 logextractor searches each literal prefix with bytes.find() instead of one regular expression per category.
 
 from datetime import datetime, timedelta, timezone
 from textcolor import textcolor
 import os # OS Command execution
 import traceback # Used to record the stacktrace if recording an error.
 import sys # For access to stderr output.
+import re # Regular expression matching for log extraction.
+import zipfile # Compressed extraction bundles.
+import json # Extraction offset index.
+import hashlib # Detects when a log file has been replaced.
+import bisect # Timestamp checkpoint lookup.
+import time # Extraction timing.
 
 class logfile(): # 2 references.
     """ An object to maintain a log file recording the activities and events in the program.
@@ -57,6 +65,7 @@ class logfile(): # 2 references.
         self.DetailFilter = ['u','f','d'] # Specify the detail levels that are recorded (user choices, flow, detail).
         self.LevelFilter = ['i','w','e'] # Specify which message types are recorded (info, warning, error).
         self.FastFlush = False # If TRUE all writes to the log file are immediately flushed. Hits the SD card hard!
+        self.Extractor = None # logextractor instance, created when PackageSearchResult() is first used.
         if os.path.exists(filename):
             if append == True:
                 self.Log("logfile: Appending to existing",filename,terminal=False)
@@ -277,26 +286,409 @@ class logfile(): # 2 references.
     #    os.system(cmd)
     #    return zipfile
 
-    def PackageSearchResult(self,searchterms,ignorecase=False):
+    def PackageSearchResult(self,searchterms,ignorecase=False,category=None,start=None,end=None):
         """ Generate a ZIP file with a selection of entries from the current log file. 
-            searchterms = the selection phrase for grep.
+            searchterms = the selection phrase (egrep style regular expression).
                 Examples: "RPi received|RPi queueing" - Lists lines containing either phrase.        
+            category = None : One-off search of the whole log into a new uniquely named ZIP file.
+                       'name' : Incremental search. Only log data added since the previous call for this
+                                category is read, the new lines are appended to the category's ZIP bundle.
+            start/end = Optional datetime range, only lines timestamped within the range are included.
+            The log is streamed in-process, no external egrep or zip commands are used.
             Returns a ZIP filename. """
-        resultfile = self.UniqueFilename(self.FileName)
-        zipfile = resultfile.split('.')[0] + '.zip'
         self.Log("logfile.PackageSearchResult(",searchterms,") Begin.",terminal=False)
+        if self.Extractor == None: # Create the extractor on first use.
+            self.Extractor = logextractor(self.FileName,logger=self)
+        if category == None: # One-off search.
+            resultfile = self.UniqueFilename(self.FileName)
+            zipname = resultfile.split('.')[0] + '.zip'
+            self.Extractor.Search(searchterms,zipname,ignorecase=ignorecase,start=start,end=end,member=os.path.basename(resultfile))
+        else: # Incremental search, maintains the offset index.
+            self.Extractor.AddCategory(category,searchterms,ignorecase=ignorecase,start=start,end=end)
+            zipname = self.Extractor.Extract([category])[category]
+        self.Log("logfile.PackageSearchResult: Generated",zipname,terminal=False)
+        return zipname
+
+class logextractor():
+    """ Streaming extraction of selected lines from a (potentially very large) log file.
+        Several categories can be extracted at once, each category is a regular expression plus
+        an optional time range. The log file is read once in large binary chunks and every category
+        is matched against each chunk in memory.
+        Matching lines are written into a ZIP bundle per category. Each extraction appends a new member
+        to the bundle containing only the lines found since the previous extraction.
+        A small JSON index alongside the log records how far each category has been extracted and
+        a sparse list of timestamp checkpoints, so repeat extractions only read new data and time
+        ranges can seek directly to the right part of the file. """
+
+    __version__ = '0.1.0'
+
+    def __init__(self,filename,indexfile=None,chunksize=8*1024*1024,logger=None,compresslevel=1):
+        """ filename = the log file to extract from.
+            indexfile = the offset index, defaults to the log filename with '.idx' appended.
+            chunksize = bytes read from the log file per pass.
+            logger = optional logfile instance for progress messages.
+            compresslevel = deflate level for the bundles. 1 is about 3x quicker than zip's default 6,
+                            the bundles are about a fifth larger. """
+        self.FileName = filename
+        self.IndexFile = indexfile
+        if self.IndexFile == None: self.IndexFile = filename + '.idx'
+        self.ChunkSize = chunksize
+        self.CompressLevel = compresslevel
+        self.Logger = logger
+        self.Categories = {} # name:{definition and progress}
+        self.Checkpoints = [] # [[timestamp, offset],...] Sparse timestamp index for the log file.
+        self.Signature = None # Hash of the start of the log file, identifies when the log is replaced.
+        self.LastStats = {} # Statistics from the most recent scan.
+        self.Folded = False # Was the last compiled pattern lowercased?
+        self.LoadIndex()
+
+    def Log(self,*args,**kwargs):
+        """ Pass messages to the logger if there is one. """
+        if self.Logger != None: self.Logger.Log(*args,**kwargs)
+
+    def FileSignature(self):
+        """ Hash the first few hundred bytes of the log. If these change, the log file has been replaced. """
+        try:
+            with open(self.FileName,'rb') as f:
+                return hashlib.sha1(f.read(256)).hexdigest()
+        except OSError:
+            return None
+
+    def LoadIndex(self):
+        """ Load the offset index if there is one. """
+        try:
+            with open(self.IndexFile,'r') as f:
+                index = json.load(f)
+        except (OSError,ValueError):
+            return False
+        self.Signature = index.get('signature',None)
+        self.Checkpoints = index.get('checkpoints',[])
+        for name,category in index.get('categories',{}).items():
+            category['patterns'] = None # Compiled when needed.
+            self.Categories[name] = category
+        return True
+
+    def SaveIndex(self):
+        """ Save the offset index. """
+        index = {'version':self.__version__,'filename':self.FileName,'signature':self.Signature,'checkpoints':self.Checkpoints,'categories':{}}
+        for name,category in self.Categories.items():
+            index['categories'][name] = {key:value for key,value in category.items() if key != 'patterns'}
+        temp = self.IndexFile + '.tmp'
+        with open(temp,'w') as f:
+            json.dump(index,f)
+        os.replace(temp,self.IndexFile) # Atomic, never leaves a half written index.
+
+    def ResetIndex(self):
+        """ The log file has been replaced. Start all categories again from the beginning. """
+        self.Log("logextractor.ResetIndex(): Log file changed, restarting index.",terminal=False)
+        self.Checkpoints = []
+        for category in self.Categories.values():
+            category['offset'] = 0
+        self.Signature = self.FileSignature()
+
+    def TimeKey(self,dt):
+        """ Convert datetime or string to the byte prefix used at the start of each log line. """
+        if dt == None: return None
+        if isinstance(dt,datetime): dt = dt.strftime('%Y-%m-%d %H:%M:%S')
+        return str(dt)[:19].encode()
+
+    def CompilePattern(self,searchterms,ignorecase=False):
+        """ Compile an egrep style search phrase. Returns a list of patterns, one per top level alternative.
+            A line matches the phrase if it matches any of them.
+            python only uses its fast literal search when a pattern starts with a literal, so 'a|b|c' is much
+            slower than searching for 'a', 'b' and 'c' separately. (This is most of egrep's advantage.)
+            re.IGNORECASE stops the fast literal search too, so where it is safe a case-insensitive
+            phrase is lowercased instead and matched against a lowercased copy of the log. (Check .Folded) """
+        flags = re.MULTILINE
+        self.Folded = False
         if ignorecase:
-            # -a : Treat file as text.
-            # -i : ignore case.
-            cmd = 'egrep -a -i "' + searchterms + '" ' + self.FileName + '>' + resultfile
-        else:
-            cmd = 'egrep -a "' + searchterms + '" ' + self.FileName + '>' + resultfile
-        self.Log("logfile.PackageSearchResult:",cmd,terminal=False)
-        os.system(cmd)
-        cmd = 'zip ' + zipfile + ' ' + resultfile
-        self.Log("logfile.PackageSearchResult:",cmd,terminal=False)
-        os.system(cmd)
-        return zipfile
+            if re.search(r'\\[A-Z]',searchterms) == None: # No \S, \W, \D etc that would change meaning.
+                searchterms = searchterms.lower()
+                self.Folded = True
+            else: flags = flags | re.IGNORECASE
+        return [self.CompileAlternative(alternative,flags) for alternative in self.Alternatives(searchterms)]
+
+    def Alternatives(self,searchterms):
+        """ Split a search phrase at each '|' that is not inside brackets, a character class or escaped. """
+        alternatives = []
+        current = ''
+        depth = 0
+        escaped = False
+        classstart = None # Position of the '[' of the character class we're in.
+        for c in searchterms:
+            if escaped: escaped = False
+            elif c == '\\': escaped = True
+            elif classstart != None:
+                if c == ']' and current[classstart:] not in ('[','[^'): classstart = None # A leading ']' is part of the class.
+            elif c == '[': classstart = len(current)
+            elif c == '(': depth += 1
+            elif c == ')' and depth > 0: depth -= 1 # An unbalanced ')' is a literal.
+            elif c == '|' and depth == 0:
+                alternatives.append(current)
+                current = ''
+                continue
+            current += c
+        alternatives.append(current)
+        return alternatives
+
+    def CompileAlternative(self,searchterms,flags):
+        """ Compile one alternative of an egrep style search phrase.
+            egrep treats an unbalanced ')' as a literal character, python does not, so those are escaped. """
+        try:
+            return re.compile(searchterms.encode(),flags)
+        except re.error:
+            fixed = ''
+            depth = 0
+            escaped = False
+            for c in searchterms:
+                if escaped: escaped = False
+                elif c == '\\': escaped = True
+                elif c == '(': depth += 1
+                elif c == ')':
+                    if depth == 0: c = '\\)' # Unbalanced, treat as literal.
+                    else: depth -= 1
+                fixed += c
+            return re.compile(fixed.encode(),flags)
+
+    def AddCategory(self,name,searchterms,ignorecase=False,start=None,end=None,bundle=None):
+        """ Define (or redefine) an extraction category.
+            name = category name, used in the bundle filename.
+            searchterms = egrep style regular expression.
+            start/end = optional datetime range.
+            bundle = ZIP filename, defaults to {logfile}_{name}.zip
+            If the definition changes, the category restarts from the beginning of the log. """
+        if bundle == None: bundle = os.path.splitext(self.FileName)[0] + '_' + name + '.zip'
+        definition = {'searchterms':searchterms,'ignorecase':ignorecase,
+                      'start':None if start == None else self.TimeKey(start).decode(),
+                      'end':None if end == None else self.TimeKey(end).decode(),
+                      'bundle':bundle}
+        category = self.Categories.get(name,None)
+        if category == None or any(category.get(key,None) != value for key,value in definition.items()): # New or changed.
+            category = dict(definition)
+            category['offset'] = 0 # Byte offset of the next unread line.
+            category['lines'] = 0 # Total lines extracted.
+            category['parts'] = 0 # Members in the bundle.
+            self.Categories[name] = category
+        category['patterns'] = self.CompilePattern(searchterms,ignorecase)
+        category['folded'] = self.Folded
+        return category
+
+    def StartOffset(self,category):
+        """ Where should the scan for this category begin? 
+            Uses the checkpoints to skip over data before the category's start time. """
+        offset = category['offset']
+        if category['start'] != None and len(self.Checkpoints) > 0:
+            keys = [c[0] for c in self.Checkpoints]
+            i = bisect.bisect_right(keys,category['start']) - 1 # Last checkpoint at or before the start time.
+            if i >= 0: offset = max(offset,self.Checkpoints[i][1])
+        return offset
+
+    def Extract(self,names=None):
+        """ Bring the bundles for the named categories (default all) up to date with the log file.
+            Returns {name:bundle filename}. """
+        if names == None: names = list(self.Categories.keys())
+        categories = {}
+        for name in names:
+            category = self.Categories[name]
+            if category.get('patterns',None) == None:
+                category['patterns'] = self.CompilePattern(category['searchterms'],category['ignorecase'])
+                category['folded'] = self.Folded
+            categories[name] = category
+        signature = self.FileSignature()
+        size = os.path.getsize(self.FileName) if os.path.exists(self.FileName) else 0
+        if signature != self.Signature or any(c['offset'] > size for c in categories.values()):
+            self.ResetIndex()
+        self.Scan(categories,size)
+        self.SaveIndex()
+        return {name:category['bundle'] for name,category in categories.items()}
+
+    def Search(self,searchterms,bundle,ignorecase=False,start=None,end=None,member=None):
+        """ One-off search of the whole log into a new bundle. The index is not updated
+            except for any new timestamp checkpoints. """
+        if os.path.exists(bundle): os.remove(bundle) # Always a fresh result.
+        category = {'searchterms':searchterms,'ignorecase':ignorecase,
+                    'start':None if start == None else self.TimeKey(start).decode(),
+                    'end':None if end == None else self.TimeKey(end).decode(),
+                    'bundle':bundle,'member':member,'offset':0,'lines':0,'parts':0,
+                    'patterns':self.CompilePattern(searchterms,ignorecase),'folded':self.Folded}
+        if self.FileSignature() != self.Signature: self.ResetIndex()
+        size = os.path.getsize(self.FileName) if os.path.exists(self.FileName) else 0
+        self.Scan({'search':category},size)
+        if not os.path.exists(bundle): # Nothing matched, still generate the (empty) result.
+            with zipfile.ZipFile(bundle,'w') as z:
+                z.writestr(member if member != None else 'search.log','')
+        self.SaveIndex()
+        return bundle
+
+    def Scan(self,categories,size):
+        """ Read the log file once from the earliest point needed by any category up to 'size'.
+            Each chunk is matched against every category that still needs it.
+            Only whole lines are consumed, a partial line at the end of the file is left for next time. """
+        starttime = time.time()
+        plan = self.SearchPlan(categories)
+        begin = {name:self.StartOffset(category) for name,category in categories.items()}
+        position = min(begin.values()) if len(begin) > 0 else size
+        lastcheckpoint = self.Checkpoints[-1][1] if len(self.Checkpoints) > 0 else -1
+        writers = {} # name:(zipfile,member stream) opened when the first line is found.
+        found = {name:0 for name in categories}
+        bytesread = 0
+        try:
+            with open(self.FileName,'rb',buffering=0) as f:
+                while position < size:
+                    chunk = bytearray(min(self.ChunkSize,size - position)) # Read straight into the chunk, no copies.
+                    f.seek(position)
+                    length = f.readinto(chunk)
+                    if length == 0: break
+                    bytesread += length
+                    del chunk[length:]
+                    cut = chunk.rfind(b'\n') + 1 # Only whole lines.
+                    while cut == 0 and position + len(chunk) < size: # A line longer than the chunk, keep reading.
+                        data = f.read(min(self.ChunkSize,size - position - len(chunk)))
+                        if len(data) == 0: break
+                        bytesread += len(data)
+                        chunk += data
+                        cut = chunk.rfind(b'\n') + 1
+                    if cut == 0: break # Only a partial line left, it's read next time.
+                    del chunk[cut:] # The partial line at the end is read again with the next chunk.
+                    chunkend = position + cut
+                    firstkey = chunk[:19]
+                    lastkey = chunk[chunk.rfind(b'\n',0,cut - 1) + 1:][:19]
+                    if position > lastcheckpoint and self.IsTimeKey(firstkey): # Extend the timestamp index.
+                        self.Checkpoints.append([firstkey.decode(),position])
+                        lastcheckpoint = position
+                    limits = {} # name:(first unread byte in the chunk, start key, end key) for each category needing this chunk.
+                    for name,category in categories.items():
+                        if begin[name] >= chunkend: continue # Already extracted.
+                        start = None if category['start'] == None else category['start'].encode()
+                        end = None if category['end'] == None else category['end'].encode()
+                        if start != None and self.IsTimeKey(lastkey) and lastkey < start: continue # Whole chunk is too early.
+                        if end != None and self.IsTimeKey(firstkey) and firstkey > end: continue # Whole chunk is too late.
+                        limits[name] = (max(0,begin[name] - position),start,end)
+                    if len(limits) > 0:
+                        for name,count in self.ScanChunk(chunk,plan,limits,categories,writers).items():
+                            found[name] += count
+                    position = chunkend
+        finally:
+            for z,stream in writers.values():
+                stream.close()
+                z.close()
+        for name,category in categories.items():
+            category['offset'] = max(category['offset'],position)
+            category['lines'] += found[name]
+            if name in writers: category['parts'] += 1
+        elapsed = time.time() - starttime
+        self.LastStats = {'bytes':bytesread,'seconds':elapsed,'mbps':bytesread / 1048576 / max(elapsed,1e-9),'lines':found}
+        self.Log("logextractor.Scan(): Read",bytesread,"bytes in",round(elapsed,3),"s",found,terminal=False)
+        return found
+
+    def IsTimeKey(self,key):
+        """ Does this look like a log line timestamp? (YYYY-MM-DD HH:MM:SS) """
+        return len(key) == 19 and key[4:5] == b'-' and key[10:11] == b' '
+
+    def LiteralPrefix(self,pattern):
+        """ The literal text every match of a compiled pattern must start with. b'' if there isn't any. """
+        if pattern.flags & re.IGNORECASE: return b'' # Can't search for it as plain bytes.
+        source = pattern.pattern
+        for i in range(len(source)):
+            c = source[i:i + 1]
+            if c in b'.^$*+?{}[]\\|()':
+                if c in b'*?{' and i > 0: i -= 1 # The quantifier applies to the previous character.
+                return source[:i]
+        return source
+
+    def SearchPlan(self,categories):
+        """ Group the alternatives of all the categories by the literal text they start with.
+            Alternatives that share a prefix are found by one bytes search, eg 'RPi received' and
+            'RPi received: motor status' are both found by searching for 'rpi received'.
+            Returns {folded:{prefix:[(name,alternative prefix,pattern),...]}}
+            A b'' prefix holds the alternatives that can only be found by a regular expression search. """
+        plan = {False:{},True:{}}
+        for name,category in categories.items():
+            searches = plan[category['folded']]
+            for pattern in category['patterns']:
+                prefix = self.LiteralPrefix(pattern)
+                searches.setdefault(prefix,[]).append((name,prefix,pattern))
+        for folded,searches in plan.items(): # Merge any prefix that starts with a shorter one into it.
+            for prefix in sorted(searches,key=len):
+                if prefix == b'': continue
+                for shorter in searches:
+                    if shorter != b'' and len(shorter) < len(prefix) and prefix.startswith(shorter):
+                        searches[shorter].extend(searches.pop(prefix))
+                        break
+        return plan
+
+    def ScanChunk(self,chunk,plan,limits,categories,writers):
+        """ Find every line in the chunk matching each category in limits and write them to the category bundles.
+            limits = {name:(first unread byte in the chunk, start key, end key)}
+            Searches for each literal prefix in the plan with bytes.find() and expands each hit to its whole line,
+            which is far quicker than testing line by line. Each line is then only tested against the alternatives
+            sharing that prefix. Case-insensitive categories are searched in a lowercased copy of the chunk.
+            Returns {name:lines found}. """
+        n = len(chunk)
+        spans = {name:[] for name in limits} # name:[{linestart:lineend} per search]
+        for folded,searches in plan.items():
+            if not any(name in limits for alternatives in searches.values() for name,prefix,pattern in alternatives): continue
+            text = chunk.lower() if folded else chunk
+            find = text.find
+            rfind = text.rfind
+            for root,alternatives in searches.items():
+                alternatives = [alternative for alternative in alternatives if alternative[0] in limits]
+                if len(alternatives) == 0: continue
+                found = {name:{} for name,prefix,pattern in alternatives}
+                for name in found: spans[name].append(found[name])
+                checks = [] # (lines found, test, literal or pattern, limited) for each alternative.
+                for name,prefix,pattern in alternatives:
+                    if prefix != pattern.pattern: test = 2 # Regular expression.
+                    elif prefix != root: test = 1 # Plain text, longer than the prefix searched for.
+                    else: test = 0 # Plain text, every hit matches.
+                    checks.append((found[name],test,prefix if test == 1 else pattern,limits[name] if limits[name] != (0,None,None) else None))
+                pos = min(limits[name][0] for name in found)
+                nexthits = [-1] * len(alternatives) # Next match of each regular expression, -2 when there are no more.
+                while pos < n:
+                    if root != b'':
+                        hit = find(root,pos)
+                        if hit < 0: break
+                    else: # No literal prefix, search with the regular expressions.
+                        for i in range(len(alternatives)):
+                            if nexthits[i] != -2 and nexthits[i] < pos:
+                                m = alternatives[i][2].search(text,pos)
+                                nexthits[i] = -2 if m == None else m.start()
+                        hits = [hit for hit in nexthits if hit != -2]
+                        if len(hits) == 0: break
+                        hit = min(hits)
+                    linestart = rfind(b'\n',pos,hit) + 1 or pos
+                    pos = find(b'\n',hit) + 1 or n # End of the line.
+                    for lines,test,target,limited in checks:
+                        if test:
+                            if test == 1:
+                                if find(target,hit,pos) < 0: continue
+                            elif target.search(text,hit,pos) == None: continue
+                        if limited != None:
+                            first,start,end = limited
+                            if linestart < first: continue # Already extracted.
+                            key = chunk[linestart:linestart + 19]
+                            if self.IsTimeKey(key) and ((start != None and key < start) or (end != None and key > end)): continue
+                        lines[linestart] = pos # A line matching several alternatives is only kept once.
+        counts = {}
+        for name,searches in spans.items():
+            searches = [found for found in searches if len(found) > 0]
+            if len(searches) > 1: # Found by several searches, merge them back into log order.
+                merged = {}
+                for found in searches: merged.update(found)
+                lines = [chunk[linestart:merged[linestart]] for linestart in sorted(merged)]
+            elif len(searches) == 1:
+                lines = list(map(chunk.__getitem__,map(slice,searches[0].keys(),searches[0].values())))
+            else: lines = []
+            counts[name] = len(lines)
+            if len(lines) > 0:
+                if name not in writers: # First lines for this category, open a new bundle member.
+                    category = categories[name]
+                    z = zipfile.ZipFile(category['bundle'],'a',compression=zipfile.ZIP_DEFLATED,compresslevel=self.CompressLevel,allowZip64=True)
+                    member = category.get('member',None)
+                    if member == None: member = name + '_' + str(category['parts'] + 1).zfill(4) + '.log'
+                    writers[name] = (z,z.open(member,'w',force_zip64=True))
+                writers[name][1].write(b''.join(lines))
+        return counts
 
 #
         
\ No newline at end of file
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+# Pilomar's per-folder file manifest.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# A campaign can run over many nights and collect tens of thousands of images. Listing those
+# folders every time the dashboard wants an image count is slow on SD cards and USB sticks.
+# Each image folder keeps a small manifest file instead, updated as pilomar writes each file.
+# Counts, sizes and 'latest file' lookups come from the manifest.
+#
+# File layout: {folder}/.pilomar_manifest - one JSON list per line, appended as files change.
+#   ["h",version,dirmtime]          header (first line)
+#   ["+",name,size,mtime,dirmtime]  file added or changed
+#   ["-",name,dirmtime]             file removed
+# dirmtime is the folder's st_mtime_ns after the change. The folder's mtime changes whenever an entry is
+# created or deleted, so comparing it with the last recorded value is a cheap consistency check (one stat).
+# When it doesn't match, the folder is listed again and the manifest is rebuilt from disc.
+# The log is compacted (rewritten) when it has grown much larger than the number of files it describes.
+# tests/test_manifest.py compares manifest counts with directory listings.
+
+import os
+import json
+import threading
+import time
+
+MANIFEST_NAME = '.pilomar_manifest'
+MANIFEST_VERSION = 1
+
+class foldermanifest():
+    """ File manifest for one folder. Thread safe. """
+
+    def __init__(self,folder,logger=None):
+        """ folder = Path of the folder described.
+            logger = Optional logfile instance. """
+        self.Folder = str(folder)
+        self.FileName = os.path.join(self.Folder,MANIFEST_NAME)
+        self.Logger = logger
+        self.Entries = {} # filename : (size bytes, mtime seconds)
+        self.DirMtime = None # Folder st_mtime_ns when the manifest last matched the disc.
+        self.Records = 0 # Lines in the manifest file. Used to decide when to compact it.
+        self.Rebuilds = 0 # How many times the manifest was rebuilt from disc.
+        self.CountCache = {} # Count() results, cleared whenever the entries change. The dashboard asks for counts every loop.
+        self.Lock = threading.RLock()
+
+    def Log(self,*args,**kwargs):
+        """ Write to the logger if there is one. """
+        if self.Logger != None:
+            self.Logger.Log(*args,**kwargs)
+
+    def DirectoryMtime(self):
+        """ Current st_mtime_ns of the folder, None if it doesn't exist. """
+        try:
+            return os.stat(self.Folder).st_mtime_ns
+        except OSError:
+            return None
+
+    def Load(self):
+        """ Read the manifest from disc. Rebuild it if it is missing, damaged or out of date.
+            Returns True if the manifest could be used as it was. """
+        with self.Lock:
+            self.Entries = {}
+            self.CountCache = {}
+            self.DirMtime = None
+            self.Records = 0
+            dirmtime = self.DirectoryMtime()
+            if dirmtime == None: # Folder doesn't exist (yet). Nothing in it.
+                return True
+            recorded = None
+            try:
+                with open(self.FileName,'r') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if record[0] == '+':
+                            self.Entries[record[1]] = (record[2],record[3])
+                            recorded = record[4]
+                        elif record[0] == '-':
+                            self.Entries.pop(record[1],None)
+                            recorded = record[2]
+                        elif record[0] == 'h':
+                            if record[1] != MANIFEST_VERSION: raise ValueError('version ' + str(record[1]))
+                            recorded = record[2]
+                        self.Records += 1
+            except FileNotFoundError:
+                self.Log("foldermanifest.Load(): No manifest in",self.Folder,"building it.",terminal=False)
+                self.Check(rebuild=True)
+                return False
+            except Exception as e: # Damaged, eg: power lost while it was written.
+                self.Log("foldermanifest.Load(): Manifest in",self.Folder,"unreadable (",e,") rebuilding it.",level='warning',terminal=False)
+                self.Check(rebuild=True)
+                return False
+            self.DirMtime = recorded
+            if recorded != dirmtime: # Something changed in the folder that the manifest didn't see.
+                result = self.Check(rebuild=True)
+                return not result['rebuilt']
+            return True
+
+    def Scan(self):
+        """ List the folder on disc. Returns {filename:(size,mtime)}. """
+        found = {}
+        try:
+            with os.scandir(self.Folder) as it:
+                for entry in it:
+                    if entry.name == MANIFEST_NAME or entry.name.startswith(MANIFEST_NAME + '.'): continue
+                    try:
+                        if not entry.is_file(): continue
+                        st = entry.stat()
+                    except OSError: # Deleted while we were looking.
+                        continue
+                    found[entry.name] = (st.st_size,round(st.st_mtime,3))
+        except FileNotFoundError:
+            pass
+        return found
+
+    def Check(self,rebuild=True):
+        """ Consistency check. Compare the manifest with the folder on disc.
+            rebuild = True replaces the manifest with what is on disc if they differ.
+            Returns {'missing':[in manifest, not on disc], 'extra':[on disc, not in manifest], 'changed':[size/mtime differ], 'rebuilt':bool} """
+        with self.Lock:
+            dirmtime = self.DirectoryMtime()
+            ondisc = self.Scan()
+            missing = sorted(set(self.Entries) - set(ondisc))
+            extra = sorted(set(ondisc) - set(self.Entries))
+            changed = sorted(name for name,value in ondisc.items() if name in self.Entries and tuple(self.Entries[name]) != value)
+            result = {'missing':missing,'extra':extra,'changed':changed,'rebuilt':False}
+            if rebuild and (missing or extra or changed or self.DirMtime != dirmtime or not os.path.exists(self.FileName)):
+                self.Entries = ondisc
+                self.CountCache = {}
+                if dirmtime != None: self.Save()
+                else: self.DirMtime = None
+                self.Rebuilds += 1
+                result['rebuilt'] = True
+                if missing or extra or changed:
+                    self.Log("foldermanifest.Check(): Rebuilt",self.Folder,len(missing),"missing",len(extra),"extra",len(changed),"changed.",terminal=False)
+            return result
+
+    def QuickCheck(self):
+        """ Cheap consistency check: one stat of the folder. Rebuilds the manifest only if the folder changed behind its back.
+            Returns True if a rebuild was needed. """
+        with self.Lock:
+            if self.DirectoryMtime() == self.DirMtime: return False
+            return self.Check(rebuild=True)['rebuilt']
+
+    def Save(self):
+        """ Rewrite the manifest file from memory (compaction).
+            The file is rewritten in place, which doesn't change the folder's mtime, so the recorded dirmtime stays valid. """
+        with self.Lock:
+            try:
+                if not os.path.exists(self.FileName): # Creating the file changes the folder's mtime, so do that first.
+                    open(self.FileName,'a').close()
+                self.DirMtime = self.DirectoryMtime()
+                lines = [json.dumps(['h',MANIFEST_VERSION,self.DirMtime])]
+                lines += [json.dumps(['+',name,size,mtime,self.DirMtime]) for name,(size,mtime) in self.Entries.items()]
+                with open(self.FileName,'w') as f:
+                    f.write('\n'.join(lines) + '\n')
+                self.Records = len(lines)
+            except OSError as e: # Read only media etc. The manifest still works in memory.
+                self.Log("foldermanifest.Save(): Cannot write",self.FileName,e,level='warning',terminal=False)
+
+    def Append(self,record):
+        """ Append one record to the manifest file, compact it if it has grown too long. """
+        try:
+            with open(self.FileName,'a') as f:
+                f.write(json.dumps(record) + '\n')
+            self.Records += 1
+        except OSError as e:
+            self.Log("foldermanifest.Append(): Cannot write",self.FileName,e,level='warning',terminal=False)
+        if self.Records > 2 * len(self.Entries) + 100: self.Save()
+
+    def Add(self,filename):
+        """ Record that a file in this folder has been written (or removed, if it no longer exists).
+            filename = Name or full path of the file. Returns True if the file exists. """
+        name = os.path.basename(str(filename))
+        path = os.path.join(self.Folder,name)
+        try:
+            st = os.stat(path)
+        except OSError: # Not there, make sure it's not in the manifest either.
+            self.Remove(name)
+            return False
+        with self.Lock:
+            if not os.path.exists(self.FileName): # First file in a new folder.
+                self.Entries[name] = (st.st_size,round(st.st_mtime,3))
+                self.CountCache = {}
+                self.Save()
+                return True
+            value = (st.st_size,round(st.st_mtime,3))
+            if self.Entries.get(name) == value and self.DirectoryMtime() == self.DirMtime: return True # No change.
+            self.Entries[name] = value
+            self.CountCache = {}
+            self.DirMtime = self.DirectoryMtime()
+            self.Append(['+',name,value[0],value[1],self.DirMtime])
+        return True
+
+    def Remove(self,filename):
+        """ Record that a file in this folder has been deleted. """
+        name = os.path.basename(str(filename))
+        with self.Lock:
+            if name not in self.Entries: return
+            del self.Entries[name]
+            self.CountCache = {}
+            self.DirMtime = self.DirectoryMtime()
+            self.Append(['-',name,self.DirMtime])
+
+    def Files(self,prefix='',suffix=''):
+        """ Sorted list of filenames in the folder, optionally filtered by prefix and suffix (eg: '.jpg'). """
+        with self.Lock:
+            names = list(self.Entries.keys())
+        return sorted(name for name in names if name.startswith(prefix) and name.lower().endswith(suffix.lower()))
+
+    def Count(self,filetypes=None,unique=True):
+        """ Number of files. filetypes = optional list of extensions (without '.').
+            unique = True counts files with the same name but different extensions once. (eg: light_x.jpg + light_x.dng) """
+        key = (None if filetypes == None else tuple(filetypes),unique)
+        with self.Lock:
+            if key in self.CountCache: return self.CountCache[key]
+            names = list(self.Entries.keys())
+            if filetypes != None:
+                filetypes = [ft.lower() for ft in filetypes]
+                names = [name for name in names if name.split('.')[-1].lower() in filetypes]
+            if unique: result = len(set(name.split('.')[0] for name in names))
+            else: result = len(names)
+            self.CountCache[key] = result
+        return result
+
+    def TotalBytes(self,filetypes=None):
+        """ Total size of the files (optionally only some extensions). """
+        with self.Lock:
+            items = list(self.Entries.items())
+        if filetypes != None:
+            filetypes = [ft.lower() for ft in filetypes]
+            items = [(name,value) for name,value in items if name.split('.')[-1].lower() in filetypes]
+        return sum(value[0] for name,value in items)
+
+    def Latest(self,prefix='',suffix=''):
+        """ Full path of the most recently modified file (optionally filtered), None if there isn't one. """
+        with self.Lock:
+            items = [(value[1],name) for name,value in self.Entries.items() if name.startswith(prefix) and name.lower().endswith(suffix.lower())]
+        if len(items) == 0: return None
+        return os.path.join(self.Folder,max(items)[1])
@@ -0,0 +1,303 @@
+#!/usr/bin/python
+
+# Pilomar's dispatch table for messages received from the microcontroller.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# obs_session.MctlHandler() used to route each message through a chain of 19 line.startswith() tests,
+# and every handler then split the line again. A motor status message was split 3 times (CheckMotorStatus,
+# ReceiveStatus and CheckTrajectory) and its timestamps converted twice.
+#
+# Now:
+#   - Each message is split once into an mctlmessage record.
+#   - The verb is the first 2 words ('motor status', 'tune complete') or failing that the first word ('binary').
+#     Anything starting with '#' is a comment. A dictionary lookup on the first word finds the handler, 2 word
+#     verbs need a second lookup on the second word. Nothing else is built per message.
+#   - Timestamp conversions are cached. The motors report with the same timestamps several times a second.
+#   - A handler can register a parser which converts the fields it needs into typed attributes of the record,
+#     so handlers and the motor objects read record.Angle, record.ValidUntil etc. instead of lineitems[8].
+#   - Every verb counts its messages, errors, parse time and handler time. Those are shown on the dashboard.
+#
+# Handler exceptions are counted and then raised again, the caller decides what happens, same as before.
+#
+# tests/test_messages.py feeds the same messages through the old startswith() chain and handlers and through the
+# dispatch table into the current handlers, and compares the state they leave behind.
+
+import time
+from datetime import datetime, timezone
+
+COMMENT_VERB = '#'
+UNRECOGNISED_VERB = 'unrecognised'
+
+# ------------------------------------------------------------------------------------------------------
+
+def MctlTimestamp(text):
+    """ Convert the microcontroller's YYYYMMDDHHMMSS timestamp into a UTC datetime.
+        pilomar.py passes its own MctlStringToDatetime() to the dispatcher instead. """
+    text = (text + (' ' * 14))[:14]
+    return datetime(int(text[0:4]),int(text[4:6]),int(text[6:8]),int(text[8:10]),int(text[10:12]),int(text[12:14]),0,tzinfo=timezone.utc)
+
+def ToBool(text):
+    """ 'y[es]' or 't[rue]' are True, everything else is False. """
+    return text[:1].lower() in ('t','y')
+
+def ToIntOrNone(text):
+    """ Integer value, or None if the text isn't an integer. """
+    try: return int(text)
+    except ValueError: return None
+
+def ToFloatOrNone(text):
+    """ Float value, or None if the text isn't a number. """
+    try: return float(text)
+    except ValueError: return None
+
+# ------------------------------------------------------------------------------------------------------
+
+class mctlmessage():
+    """ One message from the microcontroller, split once.
+        Parsers add typed attributes to the record for their verb. """
+
+    def __init__(self,line):
+        self.Line = line # The original text.
+        self.Items = line.split(' ') # Space separated fields.
+        self.Verb = None # Set by the dispatcher.
+
+    def Item(self,index,default=None):
+        """ Raw field, or default if the message is too short. """
+        if index < len(self.Items): return self.Items[index]
+        return default
+
+    def __repr__(self):
+        fields = {key:value for key,value in self.__dict__.items() if key not in ('Line','Items')}
+        return 'mctlmessage(' + str(fields) + ')'
+
+# ------------------------------------------------------------------------------------------------------
+# Parsers. Each takes the record and the timestamp converter, and adds typed attributes.
+# Fields that the previous handlers converted unconditionally are converted strictly here, so a corrupted
+# message fails in the same way it did before.
+
+def ParseMotorStatus(record,timestamp):
+    """ motor status 20260210110322 altitude n 20260210110322 0 20929 19.6209 y n 0.002 23269 tmr none none n n n
+          0     1          2           3    4         5       6   7     8     9 10  11   12   13  14   15  16 17 18 """
+    items = record.Items
+    record.Timestamp = timestamp(items[2]) # 2: When the microcontroller sent the message.
+    record.Motor = items[3] # 3: Motor name.
+    record.TrajectoryValid = ToBool(items[4]) # 4: Trajectory valid.
+    record.ValidUntil = timestamp(items[5]) # 5: Trajectory valid until.
+    record.TrajectoryEntries = int(items[6]) # 6: Trajectory entries.
+    record.Position = ToIntOrNone(items[7]) # 7: Motor position (steps).
+    record.Angle = ToFloatOrNone(items[8]) # 8: Motor angle.
+    record.Configured = ToBool(items[9]) # 9: Motor configured.
+    record.OnTarget = ToBool(items[10]) # 10: Motor on target.
+    record.StepPeriod = float(items[11]) # 11: Current step period.
+    record.VMotAdc = int(items[12]) if len(items) > 12 else None # 12: Motor supply ADC (Pico2 boards).
+    record.Reason = record.Item(13) # 13: Why the message was sent.
+    record.SensorValue = record.SensorAngle = None # 14, 15: Position sensor, only if both are valid.
+    if len(items) > 15 and ToIntOrNone(items[14]) != None and ToFloatOrNone(items[15]) != None:
+        record.SensorValue = int(items[14])
+        record.SensorAngle = float(items[15])
+    record.SensorConfigured = ToBool(items[16]) if len(items) > 16 else False # 16: Position sensor configured.
+    record.DriverFault = ToBool(items[17]) if len(items) > 17 else False # 17: Motor driver fault.
+    record.MotorHalt = ToBool(items[18]) if len(items) > 18 else False # 18: Motor HALT latch.
+
+def ParseSessionStatus(record,timestamp):
+    """ session status 20241202220208 y n y 247 0 tmr 0 1.2.0
+           0      1           2       3 4 5  6  7  8  9  10 """
+    items = record.Items
+    record.Timestamp = timestamp(items[2]) # 2: Microcontroller time.
+    record.ClockSynchronised = ToBool(items[3]) # 3: Clocks agree.
+    record.AutonomousControl = ToBool(items[4]) # 4: Motors can drive themselves.
+    record.RemoteControl = ToBool(items[5]) # 5: Motors can be commanded remotely.
+    record.LifeSeconds = int(items[6]) # 6: Alive seconds.
+    record.SafetyFlushes = int(items[7]) if len(items) > 7 else 0 # 7: Trajectory safety flushes.
+    record.Reason = record.Item(8) # 8: Why the message was sent.
+    record.ExceptionCount = int(items[9]) if len(items) > 9 else None # 9: Microcontroller exceptions.
+    record.Version = record.Item(10) # 10: code.py version.
+
+def ParseCommsStatus(record,timestamp):
+    """ comms status 20210409090929 0 0 538 0
+          0      1          2       3 4  5  6 """
+    items = record.Items
+    record.RxErrors = int(items[3]) # 3: Messages from the RPi rejected by the microcontroller.
+    record.RxBytes = int(items[4]) # 4: Bytes received from the RPi.
+    record.TxBytes = int(items[5]) # 5: Bytes written to the RPi.
+    record.WriteDrops = int(items[6]) # 6: Messages dropped by the microcontroller.
+
+def ParseCpuStatus(record,timestamp):
+    """ cpu status 20241202220908 POWER_ON 200.0 0.0 245040 138768 21 RP2350_PICO
+         0    1         2            3       4    5     6     7     8     9 """
+    items = record.Items
+    record.ResetReason = items[3] # 3: Reset reason.
+    record.Clockspeed = 1e6 * float(items[4]) # 4: Clockspeed (MHz in the message, Hz here).
+    record.Voltage = ToFloatOrNone(items[5]) # 5: CPU voltage if available.
+    record.MemAlloc = int(items[6]) # 6: Memory allocated.
+    record.MemFree = int(items[7]) # 7: Memory free.
+    record.Temperature = float(items[8]) # 8: CPU temperature.
+    record.Features = items[9].split('_') if len(items) > 9 else None # 9: Feature list.
+
+def ParseBinary(record,timestamp):
+    """ binary accept 1
+        binary ack 12 16 16
+          0     1   2  3  4 """
+    items = record.Items
+    record.Action = record.Item(1) # 'accept' or 'ack'
+    record.Sequence = record.Item(2) # Protocol version for 'accept', frame sequence for 'ack'.
+    if record.Action == 'ack' and len(items) >= 5:
+        record.Accepted = int(items[3]) # 3: Segments accepted.
+        record.Segments = int(items[4]) # 4: Segments in the frame.
+
+def ParseMotorName(record,timestamp):
+    """ tune complete {name} ... The motor name is the 3rd field. """
+    record.Motor = record.Items[2]
+
+# ------------------------------------------------------------------------------------------------------
+
+class messageroute():
+    """ A registered verb, its handler, parser and statistics. """
+
+    def __init__(self,verb,handler=None,parser=None):
+        self.Verb = verb
+        self.Handler = handler
+        self.Parser = parser
+        self.Count = 0 # Messages dispatched.
+        self.Errors = 0 # Parser or handler exceptions.
+        self.Parse = 0.0 # Total parse time. (s)
+        self.Handle = 0.0 # Total parse + handler time. (s)
+        self.Max = 0.0 # Longest parse + handler time. (s)
+
+    def Reset(self):
+        """ Clear the statistics. """
+        self.Count = self.Errors = 0
+        self.Parse = self.Handle = self.Max = 0.0
+
+class messagedispatcher():
+    """ Route microcontroller messages to handlers by verb. """
+
+    def __init__(self,timestamp=MctlTimestamp,clock=time.perf_counter,cachesize=256):
+        """ timestamp = Converter for microcontroller timestamps.
+            clock = Timer for the handler statistics.
+            cachesize = Converted timestamps remembered. 0 converts every time. """
+        self.Convert = timestamp
+        self.CacheSize = cachesize
+        self.Timestamps = {} # Recent timestamp text : datetime. (datetimes are immutable, safe to share)
+        self.Clock = clock
+        self.Routes = {} # first word : (1 word route or None, {second word : 2 word route} or None)
+        self.Comment = messageroute(COMMENT_VERB) # Anything starting with '#'.
+        self.Unrecognised = messageroute(UNRECOGNISED_VERB) # Anything else.
+        self.Messages = 0 # Total messages dispatched.
+
+    def Timestamp(self,text):
+        """ Converted timestamp, cached. The motors report several times per second with the same timestamps,
+            and the trajectory valid until time rarely changes, so most conversions are repeats. """
+        value = self.Timestamps.get(text)
+        if value == None:
+            if len(self.Timestamps) >= self.CacheSize: self.Timestamps.clear() # Old timestamps don't come back.
+            value = self.Convert(text)
+            self.Timestamps[text] = value
+        return value
+
+    def Register(self,verb,handler=None,parser=None):
+        """ Register a handler for a verb. handler=None just counts the messages (they are already logged).
+            Verbs are 1 or 2 words, '#' covers all comments. """
+        route = messageroute(verb,handler,parser)
+        if verb == COMMENT_VERB:
+            self.Comment = route
+            return
+        words = verb.split(' ',1)
+        single,seconds = self.Routes.get(words[0],(None,None))
+        if len(words) == 1: single = route
+        else:
+            if seconds == None: seconds = {}
+            seconds[words[1]] = route
+        self.Routes[words[0]] = (single,seconds)
+
+    def RegisterUnrecognised(self,handler):
+        """ Handler for messages that match no verb. """
+        self.Unrecognised.Handler = handler
+
+    def Route(self,items,line):
+        """ The route for a split message. One dictionary lookup on the first word, a second for 2 word verbs. """
+        single,seconds = self.Routes.get(items[0],(None,None))
+        if seconds != None and len(items) > 1:
+            route = seconds.get(items[1])
+            if route != None: return route
+        if single != None: return single
+        if line.startswith(COMMENT_VERB): return self.Comment
+        return self.Unrecognised
+
+    def Verb(self,record):
+        """ Find the registered verb for a record. """
+        return self.Route(record.Items,record.Line).Verb
+
+    def AllRoutes(self):
+        """ Every route, including comments and unrecognised messages. """
+        result = [self.Comment,self.Unrecognised]
+        for single,seconds in self.Routes.values():
+            if single != None: result.append(single)
+            if seconds != None: result.extend(seconds.values())
+        return result
+
+    def Dispatch(self,line):
+        """ Parse and handle one message. Returns the record.
+            Parser and handler exceptions are counted and raised again. """
+        start = self.Clock()
+        record = mctlmessage(line)
+        route = self.Route(record.Items,line)
+        record.Verb = route.Verb
+        route.Count += 1
+        self.Messages += 1
+        try:
+            if route.Parser != None:
+                route.Parser(record,self.Timestamp)
+                route.Parse += self.Clock() - start
+            if route.Handler != None: route.Handler(record)
+        except Exception:
+            route.Errors += 1
+            raise
+        finally:
+            elapsed = self.Clock() - start
+            route.Handle += elapsed
+            if elapsed > route.Max: route.Max = elapsed
+        return record
+
+    def Report(self):
+        """ Statistics per verb, busiest first. Times in milliseconds. """
+        result = {}
+        for route in sorted(self.AllRoutes(),key=lambda route: -route.Count):
+            count = route.Count
+            if count == 0: continue
+            result[route.Verb] = {'count':count,'errors':route.Errors,
+                                  'parse_ms_mean':round(1000 * route.Parse / count,3),
+                                  'handle_ms_mean':round(1000 * route.Handle / count,3),
+                                  'handle_ms_max':round(1000 * route.Max,3)}
+        return result
+
+    def Status(self,width=60):
+        """ One line summary for the dashboard. 'verb:count/mean ms' busiest first. """
+        parts = []
+        for verb,stats in self.Report().items():
+            parts.append(verb.split(' ')[0] + ':' + str(stats['count']) + '/' + str(stats['handle_ms_mean']))
+        return ' '.join(parts)[:width]
+
+    def Reset(self):
+        """ Clear the statistics. """
+        for route in self.AllRoutes(): route.Reset()
+        self.Messages = 0
+
+# ------------------------------------------------------------------------------------------------------
+
+# Verbs registered by obs_session, with their parsers.
+PILOMAR_VERBS = (('session status',ParseSessionStatus),('comms status',ParseCommsStatus),('controller log',None),('log',None),
+                 ('cleared trajectory',None),('cpu status',ParseCpuStatus),('motor status',ParseMotorStatus),
+                 ('controller heartbeat',None),('heartbeat',None),('acknowledged',None),('#',None),('controller version',None),
+                 ('goto rejected',None),('tune complete',ParseMotorName),('controller started',None),('pin status',None),
+                 ('defined motors',None),('binary',ParseBinary))
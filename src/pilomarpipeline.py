@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+# Pilomar's overlapped capture pipeline.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# The camera sensor is the scarce resource during an observation. Everything that happens
+# to an image after the shutter closes (meteor scan, image details, timelapse encoding,
+# preview markup, drift analysis) can happen while the NEXT exposure is already running.
+#
+# Each stage has its own worker thread fed by a bounded queue.
+#   - Submit(block=True) waits for space. Used for work that must not be lost (light frame processing).
+#     If processing falls behind, the capture loop stalls instead of memory filling up with frames.
+#   - Submit(block=False) drops the job if the stage is still busy. Used for optional work (previews).
+# The pipeline also measures the sensor duty cycle: how much of the wall time the sensor spent exposing.
+#
+# Most of the heavy lifting (OpenCV, numpy, file I/O) releases the GIL so the stages really do overlap
+# with the exposure, even though this is all running in one python process.
+# tests/test_pipeline.py compares serial and overlapped capture loops.
+
+import threading
+import time
+from queue import Queue, Full
+from collections import deque
+
+class capturestage():
+    """ One stage of the capture pipeline. Runs function(job) for each submitted job in its own thread. """
+
+    def __init__(self,name,function,depth=2,threaded=True,logger=None):
+        """ name = Name of the stage, used in logs and status reports.
+            function = Called with each job (a dictionary).
+            depth = Number of jobs that can wait in the queue before Submit() blocks or drops.
+            threaded = False runs each job immediately in the caller's thread. (The original serial behaviour.)
+            logger = Optional logfile instance. """
+        self.Name = name
+        self.Function = function
+        self.Depth = max(1,int(depth))
+        self.Threaded = threaded
+        self.Logger = logger
+        self.Queue = Queue(maxsize=self.Depth)
+        self.Thread = None
+        self.Busy = False # True while a job is being processed.
+        self.Submitted = 0 # Jobs accepted.
+        self.Processed = 0 # Jobs completed.
+        self.Dropped = 0 # Optional jobs rejected because the stage was full.
+        self.Errors = 0 # Jobs that raised an exception.
+        self.BusySeconds = 0.0 # Total time spent processing jobs.
+        self.BlockedSeconds = 0.0 # Total time the producer waited for space in the queue. (Backpressure)
+        self.LastSeconds = 0.0 # Processing time of the most recent job.
+        self.LastLag = 0.0 # Time from submission to completion of the most recent job.
+
+    def Log(self,*args,**kwargs):
+        """ Write to the logger if there is one. """
+        if self.Logger != None:
+            self.Logger.Log(*args,**kwargs)
+
+    def Start(self):
+        """ Start the worker thread. """
+        if self.Threaded and self.Thread == None:
+            self.Thread = threading.Thread(target=self.Worker,name='pipeline_' + self.Name,daemon=True)
+            self.Thread.start()
+            self.Log("capturestage.Start():",self.Name,"depth",self.Depth,terminal=False)
+
+    def Submit(self,job,block=True):
+        """ Pass a job to the stage.
+            block = True waits for space in the queue. False drops the job if the queue is full.
+            Returns True if the job was accepted. """
+        job['_submitted'] = time.time()
+        if not self.Threaded or self.Thread == None: # Serial mode, run it now.
+            self.Submitted += 1
+            self.Run(job)
+            return True
+        if block:
+            start = time.time()
+            self.Queue.put(job)
+            self.BlockedSeconds += time.time() - start
+        else:
+            try:
+                self.Queue.put_nowait(job)
+            except Full:
+                self.Dropped += 1
+                return False
+        self.Submitted += 1
+        return True
+
+    def Run(self,job):
+        """ Process one job, measure it and contain any failure. """
+        self.Busy = True
+        start = time.time()
+        try:
+            self.Function(job)
+        except Exception as e:
+            self.Errors += 1
+            self.Log("capturestage.Run():",self.Name,"job failed:",str(e),level='error',terminal=False)
+            if self.Logger != None and hasattr(self.Logger,'ReportException'):
+                self.Logger.ReportException(e,comment='capturestage.Run(): ' + self.Name)
+        end = time.time()
+        self.LastSeconds = end - start
+        self.LastLag = end - job.get('_submitted',start)
+        self.BusySeconds += self.LastSeconds
+        self.Processed += 1
+        self.Busy = False
+
+    def Worker(self):
+        """ Worker thread. A None job stops it. """
+        while True:
+            job = self.Queue.get()
+            if job is None:
+                self.Queue.task_done()
+                break
+            self.Run(job)
+            self.Queue.task_done()
+
+    def Pending(self):
+        """ Number of jobs waiting or in progress.
+            A threaded stage counts from put() to task_done(), so a job the worker has just taken off the queue
+            but not started yet still counts. (Busy is only set once Run() starts) """
+        if self.Threaded and self.Thread != None:
+            with self.Queue.mutex:
+                return self.Queue.unfinished_tasks
+        return 1 if self.Busy else 0
+
+    def Idle(self):
+        """ True if the stage has nothing waiting or in progress. """
+        return self.Pending() == 0
+
+    def Stop(self,timeout=None):
+        """ Finish all outstanding jobs then stop the worker thread. """
+        if self.Thread != None:
+            self.Queue.put(None) # Processed after everything already queued.
+            self.Thread.join(timeout)
+            if self.Thread.is_alive():
+                self.Log("capturestage.Stop():",self.Name,"did not finish within",timeout,"s.",level='warning',terminal=False)
+            else:
+                self.Thread = None
+        self.Log("capturestage.Stop():",self.Name,self.Stats(),terminal=False)
+
+    def Stats(self):
+        """ Summary of the stage's work. """
+        return {'name':self.Name,'submitted':self.Submitted,'processed':self.Processed,'dropped':self.Dropped,'errors':self.Errors,
+                'busy_s':round(self.BusySeconds,2),'blocked_s':round(self.BlockedSeconds,2),'last_s':round(self.LastSeconds,3),'lag_s':round(self.LastLag,3)}
+
+class capturepipeline():
+    """ A set of capturestages plus duty cycle measurement for the camera sensor. """
+
+    def __init__(self,threaded=True,depth=2,window=20,logger=None):
+        """ threaded = False runs every stage in the caller's thread. (Serial, as before.)
+            depth = Default queue depth for new stages.
+            window = Number of recent captures the duty cycle is measured over.
+            logger = Optional logfile instance. """
+        self.Threaded = threaded
+        self.Depth = depth
+        self.Logger = logger
+        self.Stages = {}
+        self.Captures = deque(maxlen=max(2,window)) # (start,end,exposure) unix seconds of recent light captures.
+        self.Lock = threading.Lock()
+
+    def Log(self,*args,**kwargs):
+        """ Write to the logger if there is one. """
+        if self.Logger != None:
+            self.Logger.Log(*args,**kwargs)
+
+    def AddStage(self,name,function,depth=None):
+        """ Define a new stage. Returns the capturestage instance. """
+        if depth == None: depth = self.Depth
+        stage = capturestage(name,function,depth=depth,threaded=self.Threaded,logger=self.Logger)
+        self.Stages[name] = stage
+        return stage
+
+    def Start(self):
+        """ Start all stage worker threads. """
+        for stage in self.Stages.values():
+            stage.Start()
+        self.Log("capturepipeline.Start(): threaded =",self.Threaded,"stages",list(self.Stages.keys()),terminal=False)
+
+    def Submit(self,name,job,block=True):
+        """ Pass a job to a named stage. Returns True if it was accepted. """
+        return self.Stages[name].Submit(job,block=block)
+
+    def Idle(self,name=None):
+        """ True if the named stage (or all stages) has nothing waiting or in progress. """
+        if name != None: return self.Stages[name].Idle()
+        return all(stage.Idle() for stage in self.Stages.values())
+
+    def Pending(self,name=None):
+        """ Jobs waiting or in progress in the named stage (or all stages). """
+        if name != None: return self.Stages[name].Pending()
+        return sum(stage.Pending() for stage in self.Stages.values())
+
+    def Stop(self,timeout=None):
+        """ Drain and stop all stages. """
+        for stage in self.Stages.values():
+            stage.Stop(timeout)
+        self.Log("capturepipeline.Stop():",self.Status(),terminal=False)
+
+    def RecordCapture(self,start,end,exposure):
+        """ Note a completed light capture. start/end = datetime or unix seconds, exposure = seconds. """
+        if hasattr(start,'timestamp'): start = start.timestamp()
+        if hasattr(end,'timestamp'): end = end.timestamp()
+        with self.Lock:
+            self.Captures.append((start,end,exposure))
+
+    def ResetDuty(self):
+        """ Forget capture history, eg: after a pause in observing. """
+        with self.Lock:
+            self.Captures.clear()
+
+    def DutyCycle(self):
+        """ Duty cycle over the recent captures. Returns (sensor,exposure) as fractions, or (None,None) if not known yet.
+            sensor = time spent inside the capture call / wall time.
+            exposure = requested exposure time / wall time.
+            Wall time runs from the start of the oldest capture in the window to the end of the latest one. """
+        with self.Lock:
+            captures = list(self.Captures)
+        if len(captures) < 2: return None,None
+        wall = captures[-1][1] - captures[0][0]
+        if wall <= 0: return None,None
+        sensor = sum(end - start for start,end,exposure in captures)
+        exposure = sum(exposure for start,end,exposure in captures)
+        return min(1.0,sensor / wall),min(1.0,exposure / wall)
+
+    def Status(self):
+        """ One line summary for the dashboard and logs. """
+        sensor,exposure = self.DutyCycle()
+        if sensor == None: text = 'Duty: --'
+        else: text = 'Duty: ' + str(int(round(sensor * 100))) + '% (exp ' + str(int(round(exposure * 100))) + '%)'
+        for stage in self.Stages.values():
+            text += ' ' + stage.Name[:4] + ':' + str(stage.Pending()) + '/' + str(stage.Depth)
+            if stage.Dropped > 0: text += '-' + str(stage.Dropped)
+        return text
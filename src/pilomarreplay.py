@@ -0,0 +1,393 @@
+#!/usr/bin/python
+
+# Pilomar's replay of captured microcontroller communication logs.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# The microcontroller, obs_session and motorcontrol classes only react to a live serial port, so the host
+# side of a session could not be re-run without the Pico attached.
+#
+# ZipCommsLog() extracts every 'RPi received' and 'RPi queueing' line from the main log. This replays one:
+#   - A pseudo terminal stands in for the UART. Point the UARTOverride parameter at the path it reports
+#     and pilomar.py opens it like any other serial port.
+#   - Every 'RPi received' message is written to the pty with its checksum at the time it was originally
+#     logged, or faster ('speed' 10 = 10 times faster). Log times are when pilomar processed each message,
+#     which is within a fraction of a second of when it arrived.
+#   - retime: The YYYYMMDDHHMMSS timestamps inside each message are shifted by the gap between its log time
+#     and the moment it is replayed, otherwise every trajectory looks expired and the clocks look
+#     unsynchronised. Intervals inside a message (eg trajectory valid until) keep their length, so an
+#     accelerated replay still sees a trajectory window of the original size.
+#   - acknowledge: The message ids in the log belong to the original session. The recorded 'rec: [n]' and
+#     'binary ack' lines are dropped and the pty acknowledges whatever the host sends now, as the
+#     microcontroller would.
+#   - Everything the host writes is recorded with its time, text lines and binary frames. The result is
+#     saved in the same format as the comms log, so the original and the replay can be compared.
+#
+# Compare: Commands from each log are reduced to a skeleton (timestamps, message ids and numbers removed),
+# the sequences are diffed and the command counts and response times (host write after the latest
+# received message) are reported side by side.
+#
+# State: Without a pty, the received messages go through the pilomarmessages dispatch table into a plain
+# record of the protocol state (motor configured, trajectory valid, clock synchronised ...). Every change
+# is recorded as a transition, and the transitions and parse rate are printed.
+#
+# Usage: python pilomarreplay.py serve {commslog} [speed] [noretime] [noack]
+#        python pilomarreplay.py compare {original commslog} {replay log}
+#        python pilomarreplay.py state {commslog}
+#   commslog = ZIP file from ZipCommsLog() or a plain extract of the main log.
+#
+# tests/test_replay.py plays a synthetic log through the pty to a scripted host.
+
+import os
+import re
+import sys
+import pty
+import tty
+import time
+import select
+import difflib
+import zipfile
+import threading
+import calendar
+from datetime import datetime, timezone
+
+import pilomarframing
+import pilomarmessages
+from pilomartransmit import ParseAck, Percentile
+
+RECEIVED_PATTERN = re.compile(r'RPi received: (.*)$')
+QUEUED_PATTERN = re.compile(r'RPi queueing \(Q# \d+\): (.*)$')
+TIMESTAMP_PATTERN = re.compile(r'\b(\d{14})\b') # Microcontroller timestamps.
+MESSAGEID_PATTERN = re.compile(r' ?\[\d+\]$') # Message id added by microcontroller.Write().
+NUMBER_PATTERN = re.compile(r'-?\b\d+(\.\d+)?\b')
+
+# ------------------------------------------------------------------------------------------------------
+
+class commsentry():
+    """ One line of a comms log. Direction 'rx' = received by the RPi, 'tx' = sent by the RPi. """
+
+    def __init__(self,when,direction,text):
+        self.Time = when # datetime
+        self.Direction = direction
+        self.Text = text
+
+    def __repr__(self):
+        return 'commsentry(' + str(self.Time) + ',' + self.Direction + ',' + self.Text + ')'
+
+def ParseLogLine(text):
+    """ Convert one main log line into a commsentry, None if it isn't UART traffic.
+        2025-01-15 20:00:00.123456+00:00 {tab} 0.001234 {tab} RPi received: motor status ... """
+    fields = text.rstrip('\n').split('\t',2)
+    if len(fields) < 3: return None
+    try: when = datetime.fromisoformat(fields[0])
+    except ValueError: return None
+    if when.tzinfo == None: when = when.replace(tzinfo=timezone.utc)
+    match = RECEIVED_PATTERN.search(fields[2])
+    if match: return commsentry(when,'rx',match.group(1))
+    match = QUEUED_PATTERN.search(fields[2])
+    if match: return commsentry(when,'tx',match.group(1))
+    return None
+
+def ReadCommsLog(filename):
+    """ All UART traffic from a comms log, in time order.
+        A ZIP bundle from ZipCommsLog() may hold several incremental extracts, they are read in name order. """
+    texts = []
+    if zipfile.is_zipfile(filename):
+        with zipfile.ZipFile(filename,'r') as z:
+            for name in sorted(z.namelist()):
+                texts.append(z.read(name).decode('utf-8','replace'))
+    else:
+        with open(filename,'r',errors='replace') as f:
+            texts.append(f.read())
+    entries = []
+    for text in texts:
+        for line in text.split('\n'):
+            entry = ParseLogLine(line)
+            if entry != None: entries.append(entry)
+    entries.sort(key=lambda entry: entry.Time) # Stable, keeps the order of lines logged in the same microsecond.
+    return entries
+
+def WriteCommsLog(filename,entries):
+    """ Save entries in the main log format, readable by ReadCommsLog(). """
+    previous = None
+    with open(filename,'w') as f:
+        for entry in entries:
+            elapsed = 0.0 if previous == None else (entry.Time - previous).total_seconds()
+            previous = entry.Time
+            if entry.Direction == 'rx': text = 'RPi received: ' + entry.Text
+            else: text = 'RPi queueing (Q# 0): ' + entry.Text
+            f.write(str(entry.Time) + '\t' + '{:.6f}'.format(elapsed) + '\t' + text + '\n')
+
+def Retime(line,shift):
+    """ Shift every YYYYMMDDHHMMSS timestamp in a message by shift seconds. """
+    def shifted(match):
+        try: seconds = calendar.timegm(time.strptime(match.group(1),'%Y%m%d%H%M%S'))
+        except ValueError: return match.group(1) # Not a timestamp after all.
+        return time.strftime('%Y%m%d%H%M%S',time.gmtime(seconds + shift))
+    return TIMESTAMP_PATTERN.sub(shifted,line)
+
+def Skeleton(line):
+    """ A command without message id, timestamps or numbers. Replays are compared on this. """
+    line = MESSAGEID_PATTERN.sub('',line.strip())
+    line = TIMESTAMP_PATTERN.sub('T',line)
+    return NUMBER_PATTERN.sub('N',line)
+
+def IsAcknowledgement(line):
+    """ Recorded acknowledgements refer to message ids from the original session. """
+    return ParseAck(line) != None or line.startswith('binary ack')
+
+# ------------------------------------------------------------------------------------------------------
+
+class virtualserial():
+    """ A pseudo terminal which plays the microcontroller side of a comms log. """
+
+    def __init__(self,entries,speed=1.0,retime=True,acknowledge=True,clock=time.monotonic):
+        """ entries = commsentry list from ReadCommsLog().
+            speed = Replay speed, 1.0 = real time.
+            retime = Shift timestamps inside the messages to the replay time.
+            acknowledge = Acknowledge the host's messages instead of replaying the recorded acknowledgements. """
+        self.Speed = max(0.001,speed)
+        self.Retime = retime
+        self.Acknowledge = acknowledge
+        self.Clock = clock
+        self.Received = [entry for entry in entries if entry.Direction == 'rx' and not (acknowledge and IsAcknowledgement(entry.Text))]
+        self.Original = entries
+        self.Master,self.Slave = pty.openpty()
+        tty.setraw(self.Slave) # No echo or line editing, it's a serial line.
+        self.Path = os.ttyname(self.Slave) # Give this to pilomar.py as the UARTOverride.
+        self.Receiver = pilomarframing.framereceiver() # Splits the host's output into lines and frames.
+        self.Recorded = [] # commsentry list of everything played and received.
+        self.Played = 0 # Messages written to the host.
+        self.ChecksumErrors = 0 # Host lines with bad checksums.
+        self.Started = None
+        self.Finished = threading.Event()
+        self.Stopping = False
+        self.Thread = None
+
+    def Now(self):
+        """ Wall clock time for the replay log. """
+        return datetime.now(timezone.utc)
+
+    def Start(self):
+        """ Start playing in the background. """
+        self.Thread = threading.Thread(target=self.Loop,daemon=True)
+        self.Thread.start()
+
+    def Stop(self):
+        """ Stop playing and close the pty. """
+        self.Stopping = True
+        if self.Thread != None: self.Thread.join()
+        for fd in (self.Master,self.Slave):
+            try: os.close(fd)
+            except OSError: pass
+
+    def Send(self,line):
+        """ Write one message to the host, the way the microcontroller does. """
+        os.write(self.Master,(line + '|' + pilomarframing.Checksum(line) + '\n').encode('utf-8'))
+        self.Recorded.append(commsentry(self.Now(),'rx',line))
+
+    def Collect(self):
+        """ Read and record whatever the host has written. """
+        while select.select([self.Master],[],[],0)[0]:
+            try: data = os.read(self.Master,4096)
+            except OSError: return # Host closed the port.
+            if len(data) == 0: return
+            self.Receiver.Feed(data)
+        now = self.Now()
+        for line in self.Receiver.Lines:
+            i = line.rfind('|')
+            if i < 0 or line[i + 1:] != pilomarframing.Checksum(line[:i]):
+                self.ChecksumErrors += 1
+                self.Recorded.append(commsentry(now,'tx',line)) # Record it anyway.
+                continue
+            line = line[:i]
+            self.Recorded.append(commsentry(now,'tx',line))
+            messageid = MESSAGEID_PATTERN.search(line)
+            if self.Acknowledge and messageid != None and not line.startswith('#'): # Comments aren't acknowledged.
+                self.Send('log :' + time.strftime('%Y%m%d%H%M%S',time.gmtime()) + ':rec: ' + messageid.group(0).strip())
+        for frametype,sequence,payload in self.Receiver.Frames:
+            segments = len(payload) // pilomarframing.SEGMENT_SIZE
+            self.Recorded.append(commsentry(now,'tx','binary frame ' + str(sequence) + ' ' + str(segments) + ' segments'))
+            if self.Acknowledge: self.Send('binary ack ' + str(sequence) + ' ' + str(segments) + ' ' + str(segments))
+        self.Receiver.Lines = []
+        self.Receiver.Frames = []
+
+    def Loop(self):
+        """ Play the received messages at their original pace, divided by Speed. """
+        self.Started = self.Clock()
+        if len(self.Received) > 0: first = self.Received[0].Time
+        for entry in self.Received:
+            due = self.Started + (entry.Time - first).total_seconds() / self.Speed
+            while not self.Stopping and self.Clock() < due:
+                self.Collect()
+                time.sleep(min(0.005,max(0.0,due - self.Clock())))
+            if self.Stopping: break
+            if self.Retime: self.Send(Retime(entry.Text,round((self.Now() - entry.Time).total_seconds())))
+            else: self.Send(entry.Text)
+            self.Played += 1
+        self.Finished.set()
+        while not self.Stopping: # Keep recording until told to stop.
+            self.Collect()
+            time.sleep(0.005)
+        self.Collect()
+
+    def Save(self,filename):
+        """ Save the replay in comms log format. """
+        WriteCommsLog(filename,self.Recorded)
+
+# ------------------------------------------------------------------------------------------------------
+
+def ResponseTimes(entries):
+    """ Seconds from the latest received message to each host write. """
+    result = []
+    latest = None
+    for entry in entries:
+        if entry.Direction == 'rx': latest = entry.Time
+        elif latest != None: result.append((entry.Time - latest).total_seconds())
+    return result
+
+def Commands(entries):
+    """ Skeletons of the host's commands. Binary frames are reduced to 'binary frame'. """
+    result = []
+    for entry in entries:
+        if entry.Direction != 'tx': continue
+        if entry.Text.startswith('binary frame'): result.append('binary frame')
+        else: result.append(Skeleton(entry.Text))
+    return result
+
+def Compare(original,replay,show=10):
+    """ Compare the host's commands in two comms logs. Returns (similarity 0..1, differences). """
+    a = Commands(original)
+    b = Commands(replay)
+    matcher = difflib.SequenceMatcher(None,a,b,autojunk=False)
+    differences = [opcode for opcode in matcher.get_opcodes() if opcode[0] != 'equal']
+    similarity = matcher.ratio()
+    print('Commands: original',len(a),'replay',len(b),'similarity',round(similarity,4),',',len(differences),'differences.')
+    for tag,i1,i2,j1,j2 in differences[:show]:
+        print('  ',tag,'original',i1,a[i1:i2][:3],'replay',j1,b[j1:j2][:3])
+    verbs = {}
+    for index,commands in enumerate((a,b)):
+        for command in commands:
+            verb = command.split(' ')[0]
+            verbs.setdefault(verb,[0,0])[index] += 1
+    for verb,(x,y) in sorted(verbs.items(),key=lambda item: -max(item[1])):
+        print('  ' + verb.ljust(14),str(x).rjust(7),str(y).rjust(7),'' if x == y else '*')
+    for name,entries in (('original',original),('replay',replay)):
+        times = ResponseTimes(entries)
+        print('  Response',name.ljust(8),'p50',Percentile(times,50),'p99',Percentile(times,99),'s')
+    return similarity,differences
+
+# ------------------------------------------------------------------------------------------------------
+
+class protocolstate():
+    """ The microcontroller state as the RPi sees it, built from the received messages alone. """
+
+    def __init__(self):
+        self.State = {} # key : value
+        self.Transitions = [] # (message number, key, old value, new value)
+        self.Message = 0
+        self.Dispatcher = pilomarmessages.messagedispatcher()
+        for verb,parser in pilomarmessages.PILOMAR_VERBS: self.Dispatcher.Register(verb,parser=parser)
+        self.Dispatcher.Register('motor status',self.MotorStatus,pilomarmessages.ParseMotorStatus)
+        self.Dispatcher.Register('session status',self.SessionStatus,pilomarmessages.ParseSessionStatus)
+        self.Dispatcher.Register('comms status',self.CommsStatus,pilomarmessages.ParseCommsStatus)
+        self.Dispatcher.Register('binary',self.Binary,pilomarmessages.ParseBinary)
+        self.Dispatcher.Register('controller started',self.Started)
+        self.Dispatcher.Register('controller version',self.Version)
+
+    def Set(self,key,value):
+        """ Update one value, record the transition if it changed. """
+        old = self.State.get(key)
+        if old != value:
+            self.State[key] = value
+            self.Transitions.append((self.Message,key,old,value))
+
+    def MotorStatus(self,record):
+        self.Set(record.Motor + '.configured',record.Configured)
+        self.Set(record.Motor + '.trajectory',record.TrajectoryValid)
+        self.Set(record.Motor + '.ontarget',record.OnTarget)
+        self.Set(record.Motor + '.fault',record.DriverFault)
+        self.Set(record.Motor + '.halt',record.MotorHalt)
+        self.Set(record.Motor + '.sensor',record.SensorConfigured)
+
+    def SessionStatus(self,record):
+        self.Set('clock',record.ClockSynchronised)
+        self.Set('autonomous',record.AutonomousControl)
+        self.Set('remote',record.RemoteControl)
+        self.Set('flushes',record.SafetyFlushes)
+        if record.ExceptionCount != None: self.Set('exceptions',record.ExceptionCount)
+
+    def CommsStatus(self,record):
+        self.Set('rxerrors',record.RxErrors)
+        self.Set('writedrops',record.WriteDrops)
+
+    def Binary(self,record):
+        if record.Action == 'accept': self.Set('binary',record.Sequence)
+
+    def Started(self,record):
+        self.Set('restarts',self.State.get('restarts',0) + 1)
+
+    def Version(self,record):
+        self.Set('version',record.Item(2))
+
+    def Replay(self,entries):
+        """ Apply every received message. Returns parse failures. """
+        failures = 0
+        for entry in entries:
+            if entry.Direction != 'rx': continue
+            self.Message += 1
+            try: self.Dispatcher.Dispatch(entry.Text)
+            except Exception: failures += 1 # Corrupted messages, counted by the dispatcher too.
+        return failures
+
+def ReplayState(entries,repeat=3):
+    """ Replay the received messages into protocolstate, 'repeat' times for a steady rate. Returns the transitions of each replay. """
+    results = []
+    begin = time.perf_counter()
+    for n in range(repeat):
+        state = protocolstate()
+        failures = state.Replay(entries)
+        results.append(state.Transitions)
+    elapsed = time.perf_counter() - begin
+    messages = repeat * len([entry for entry in entries if entry.Direction == 'rx'])
+    print('State replay:',messages // repeat,'messages,',len(results[0]),'transitions,',failures,'failures,',
+          round(messages / max(elapsed,1e-9)),'messages/s.')
+    for transition in results[0][:20]: print('  ',transition)
+    return results
+
+# ------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == 'serve':
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3].replace('.','',1).isdigit() else 1.0
+        device = virtualserial(ReadCommsLog(sys.argv[2]),speed=speed,retime='noretime' not in sys.argv,acknowledge='noack' not in sys.argv)
+        print('Replaying',len(device.Received),'messages at',speed,'x on',device.Path)
+        print('Set the UARTOverride parameter to',device.Path,'then start pilomar.py. Ctrl-C to stop.')
+        device.Start()
+        try:
+            while not device.Finished.wait(1.0): print('  played',device.Played,'of',len(device.Received),end='\r')
+            print('\nReplay complete, still recording. Ctrl-C to stop.')
+            while True: time.sleep(1.0)
+        except KeyboardInterrupt: pass
+        device.Stop()
+        filename = os.path.splitext(sys.argv[2])[0] + '_replay.log'
+        device.Save(filename)
+        print('Saved',len(device.Recorded),'entries to',filename)
+        Compare(device.Original,device.Recorded)
+    elif len(sys.argv) > 3 and sys.argv[1] == 'compare':
+        Compare(ReadCommsLog(sys.argv[2]),ReadCommsLog(sys.argv[3]))
+    elif len(sys.argv) > 2 and sys.argv[1] == 'state':
+        ReplayState(ReadCommsLog(sys.argv[2]))
+    else:
+        print('Usage: python pilomarreplay.py serve {commslog} [speed] [noretime] [noack]')
+        print('       python pilomarreplay.py compare {original commslog} {replay log}')
+        print('       python pilomarreplay.py state {commslog}')
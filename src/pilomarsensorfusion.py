@@ -0,0 +1,294 @@
+#!/usr/bin/python
+
+# Pilomar's position sensor fusion. Compares the motor step count with the position sensors.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Each motor status message may carry a position sensor reading (AS5600 on azimuth, LIS3DH on altitude).
+# motorcontrol used to log every reading and compare it with the step count one sample at a time, so a single
+# noisy or glitched reading looked like a position error.
+#
+# positionfusion keeps a bounded history per axis of
+#     error = sensor angle - angle from the step count (degrees, wrapped to +/-180)
+# and separates it into:
+#   - Offset: where the sensor zero sits relative to the step count zero. Fixed, learned from the first
+#     'settle' readings after a reset or a tune, never corrected by tuning.
+#   - Backlash: the gears take up slack when the axis reverses, so the error depends on the direction
+#     of travel. Estimated as half the difference between the median errors moving forward and backward.
+#   - Slip: what is left after removing offset and backlash. This is the only part a TUNE can fix.
+# Outliers (further than 'outlier' robust standard deviations from the recent median) are counted and ignored.
+# Robust standard deviation = 1.4826 * median absolute deviation, which ignores the outliers themselves.
+#
+# Correction() only proposes a tune when
+#   - enough readings have been collected since the last tune,
+#   - the median slip is beyond the deadband (in steps),
+#   - and the median is significantly different from zero: |median| > 'confidence' standard errors.
+# Nothing more is proposed until the tune completes, then the slip history restarts because the old readings
+# describe a position that has been corrected. Manual and optical drift tunes are recorded too. They put the axis
+# where it is meant to be, which may include removing a slip, so the offset is learned again from the readings
+# that follow instead of being adjusted by the size of the tune. Otherwise a slip fixed by optical tracking
+# would still look like slip and be tuned a second time.
+# A run of consecutive 'outliers' is a real step change (the axis slipped), those readings are accepted and
+# the slip history restarts from them.
+#
+# HistogramLines(), Report() and Status() publish the error distribution for the dashboard and the diagnostics listing.
+#
+# Pass a main log file to this module to replay the position_sensor_trace entries for each motor.
+# tests/test_sensorfusion.py validates the estimates and tuning decisions on simulated traces.
+
+import sys
+import math
+from collections import deque
+
+ROBUST_SIGMA = 1.4826 # Median absolute deviation to standard deviation for normally distributed noise.
+
+def Wrap(degrees):
+    """ Angle difference wrapped into -180..+180 degrees. """
+    return (degrees + 180.0) % 360.0 - 180.0
+
+def Median(values):
+    """ Median of a sequence, None if empty. """
+    ordered = sorted(values)
+    n = len(ordered)
+    if n == 0: return None
+    if n % 2 == 1: return ordered[n // 2]
+    return 0.5 * (ordered[n // 2 - 1] + ordered[n // 2])
+
+def RobustSigma(values,centre=None):
+    """ Standard deviation estimated from the median absolute deviation. """
+    if len(values) == 0: return None
+    if centre == None: centre = Median(values)
+    return ROBUST_SIGMA * Median([abs(v - centre) for v in values])
+
+class positionfusion():
+    """ Fuses step count and position sensor readings for one axis. """
+
+    def __init__(self,stepsperrev,history=240,settle=20,minsamples=30,deadband=50,confidence=4.0,outlier=5.0,noisefloor=None,binsteps=10,bins=21):
+        """ stepsperrev = Motor steps for a full revolution of the axis.
+            history = Readings kept for the statistics.
+            settle = Readings used to learn the sensor offset.
+            minsamples = Readings needed since the last tune before a correction is considered.
+            deadband = Smallest correction worth making (steps).
+            confidence = Standard errors the median slip must exceed.
+            outlier = Robust standard deviations beyond which a reading is ignored.
+            noisefloor = Smallest noise assumed (degrees), stops a perfectly quiet sensor rejecting everything. Default 1 step.
+            binsteps, bins = Histogram bin width (steps) and count. Outer bins collect everything beyond. """
+        self.StepsPerRev = stepsperrev
+        self.History = history
+        self.Settle = settle
+        self.MinSamples = minsamples
+        self.Deadband = deadband
+        self.Confidence = confidence
+        self.Outlier = outlier
+        self.NoiseFloor = noisefloor if noisefloor != None else 360.0 / stepsperrev
+        self.BinSteps = binsteps
+        self.Bins = bins
+        self.Reset()
+
+    def Reset(self):
+        """ Forget everything. Call when the sensor or motor configuration changes. """
+        self.Offset = None # Sensor zero relative to the step count zero (degrees).
+        self.SettleErrors = [] # Readings used to learn the offset.
+        self.SettleDirection = 0 # Direction of travel while the offset was learned.
+        self.PreviousLevel = None # Level() before a deliberate tune, while the offset is learned again.
+        self.Forward = deque(maxlen=self.History) # Accepted errors while moving forward.
+        self.Backward = deque(maxlen=self.History) # Accepted errors while moving backward. Kept apart so a long run in one direction doesn't lose the backlash.
+        self.SlipErrors = deque(maxlen=2 * self.MinSamples) # Recent slip since the last tune (degrees).
+        self.Rejected = [] # Consecutive rejected errors.
+        self.Histogram = [0] * self.Bins # Slip in steps, all time.
+        self.PreviousAngle = None
+        self.Direction = 0 # Last direction of travel, +1 / -1, 0 unknown.
+        self.Samples = 0
+        self.Outliers = 0
+        self.LevelShifts = 0
+        self.Corrections = 0
+        self.CorrectedSteps = 0
+        self.Pending = deque() # (steps, slip correction?) for tunes sent but not yet completed.
+        self.Latest = None # Latest error (degrees) before any filtering.
+
+    def AngleToStep(self,degrees):
+        return int(round(degrees * self.StepsPerRev / 360.0))
+
+    def DirectionHistory(self,direction):
+        """ Error history for a direction of travel. Stationary readings count as forward. """
+        if direction < 0: return self.Backward
+        return self.Forward
+
+    def Backlash(self):
+        """ Half the forward/backward difference (degrees), 0.0 until both directions have been seen. """
+        if len(self.Forward) < self.Settle // 2 or len(self.Backward) < self.Settle // 2: return 0.0
+        return 0.5 * (Median(self.Forward) - Median(self.Backward))
+
+    def Level(self):
+        """ The offset without the backlash of the direction it was learned in (degrees). """
+        return self.Offset - self.SettleDirection * self.Backlash()
+
+    def Expected(self,direction):
+        """ Error expected from offset and backlash alone, for the direction of travel.
+            The offset was learned with the slack taken up in SettleDirection. """
+        if self.Offset == None: return 0.0
+        if direction == 0: direction = 1
+        return self.Offset + (direction - self.SettleDirection) * self.Backlash()
+
+    def Add(self,angle,sensorangle):
+        """ Record a reading. angle = angle from the step count, sensorangle = measured angle.
+            Returns True if the reading was accepted. """
+        self.Samples += 1
+        if self.PreviousAngle != None:
+            move = Wrap(angle - self.PreviousAngle)
+            if move > 0: self.Direction = 1
+            elif move < 0: self.Direction = -1 # Stationary readings keep the last direction, the slack stays taken up.
+        self.PreviousAngle = angle
+        error = Wrap(sensorangle - angle)
+        self.Latest = error
+        if self.Offset == None: # Still learning the offset.
+            self.SettleErrors.append(error)
+            self.SettleDirection += self.Direction
+            if len(self.SettleErrors) >= self.Settle:
+                centre = Median(self.SettleErrors)
+                sigma = max(RobustSigma(self.SettleErrors,centre),self.NoiseFloor)
+                self.Offset = Median([e for e in self.SettleErrors if abs(e - centre) <= self.Outlier * sigma])
+                self.SettleDirection = (self.SettleDirection > 0) - (self.SettleDirection < 0) # Majority direction, 0 if stationary.
+                if self.PreviousLevel != None: # Learned again after a deliberate tune, the histories moved by the same amount.
+                    self.Shift(self.Level() - self.PreviousLevel)
+                    self.PreviousLevel = None
+            return True
+        history = self.DirectionHistory(self.Direction)
+        if len(history) >= self.Settle: # Enough history in this direction to judge outliers.
+            recent = list(history)[-self.Settle * 2:]
+            centre = Median(recent)
+            sigma = max(RobustSigma(recent,centre),self.NoiseFloor)
+            if abs(error - centre) > self.Outlier * sigma:
+                self.Rejected.append((error,self.Direction))
+                if len(self.Rejected) < self.Settle // 2: # Glitches are isolated.
+                    self.Outliers += 1
+                    return False
+                self.LevelShifts += 1 # Consistently different: the axis really moved. Accept them all.
+                self.Shift(Median([e for e,d in self.Rejected]) - centre) # The slip moved both directions.
+                self.SlipErrors.clear() # Readings before the shift describe the old position.
+                for e,d in self.Rejected[:-1]: self.Accept(e,d)
+        self.Rejected = []
+        self.Accept(error,self.Direction)
+        return True
+
+    def Shift(self,degrees):
+        """ Move both direction histories, the backlash estimate is unchanged. """
+        self.Forward = deque([e + degrees for e in self.Forward],maxlen=self.History)
+        self.Backward = deque([e + degrees for e in self.Backward],maxlen=self.History)
+
+    def Accept(self,error,direction):
+        """ Add an accepted error to the histories. """
+        self.DirectionHistory(direction).append(error)
+        slip = error - self.Expected(direction)
+        self.SlipErrors.append(slip)
+        steps = self.AngleToStep(slip)
+        self.Histogram[min(self.Bins - 1,max(0,self.Bins // 2 + int(math.floor(steps / self.BinSteps + 0.5))))] += 1
+
+    def Slip(self):
+        """ (median slip degrees, standard error degrees, readings) since the last tune. None if there are none. """
+        n = len(self.SlipErrors)
+        if n == 0: return None
+        centre = Median(self.SlipErrors)
+        sigma = max(RobustSigma(self.SlipErrors,centre),self.NoiseFloor)
+        return centre,sigma * math.sqrt(math.pi / 2.0) / math.sqrt(n),n # Standard error of a median.
+
+    def Correction(self):
+        """ Steps to TUNE the motor by, or None if the slip isn't both large and significant.
+            Positive sensor error = the axis is ahead of the step count, so the tune is negative. """
+        slip = self.Slip()
+        if slip == None or len(self.Pending) > 0: return None
+        centre,standarderror,n = slip
+        if n < self.MinSamples: return None
+        steps = self.AngleToStep(centre)
+        if abs(steps) <= self.Deadband: return None
+        if abs(centre) <= self.Confidence * standarderror: return None
+        return -steps
+
+    def Tuned(self,steps,slip=True):
+        """ A tune was sent. No corrections are proposed until it completes.
+            slip = True: it corrects slip found by Correction().
+                   False: a deliberate move (manual or optical drift tune), the axis is meant to end up there. """
+        if slip:
+            self.Corrections += 1
+            self.CorrectedSteps += steps
+        self.Pending.append((steps,slip))
+
+    def TuneComplete(self):
+        """ The microcontroller finished the oldest pending tune. The slip history describes the old position, start again.
+            After a deliberate tune the axis is where it is meant to be, whatever slip it had before. The offset is learned
+            again from the next readings, so neither the tune nor the slip it removed is corrected later. """
+        if len(self.Pending) == 0: return
+        steps,slip = self.Pending.popleft()
+        if slip: self.Shift(360.0 * steps / self.StepsPerRev) # The sensor error changes by this much.
+        elif self.Offset != None or self.PreviousLevel != None: # Deliberate, learn the offset again.
+            if self.Offset != None: self.PreviousLevel = self.Level()
+            self.Offset = None
+            self.SettleErrors = []
+            self.SettleDirection = 0
+        self.SlipErrors.clear()
+        self.Rejected = []
+
+    def Report(self):
+        """ Current estimates in steps. """
+        slip = self.Slip()
+        return {'samples':self.Samples,'outliers':self.Outliers,'shifts':self.LevelShifts,
+                'offset':None if self.Offset == None else self.AngleToStep(self.Offset),
+                'backlash':self.AngleToStep(self.Backlash()),
+                'slip':None if slip == None else self.AngleToStep(slip[0]),
+                'noise':None if slip == None else self.AngleToStep(slip[1] * math.sqrt(slip[2] / (math.pi / 2.0))),
+                'corrections':self.Corrections,'corrected':self.CorrectedSteps}
+
+    def Status(self):
+        """ One line summary for the dashboard. """
+        r = self.Report()
+        if r['offset'] == None: return 'Settling ' + str(len(self.SettleErrors)) + '/' + str(self.Settle)
+        return ('Slip ' + str(r['slip']) + ' Offs ' + str(r['offset']) + ' Blsh ' + str(r['backlash']) + ' Noise ' + str(r['noise']) +
+                ' Rej ' + str(r['outliers']) + ' Tunes ' + str(r['corrections']) + ' steps')
+
+    def HistogramLines(self,width=40):
+        """ Text histogram of the slip distribution. """
+        lines = []
+        top = max(max(self.Histogram),1)
+        for i,count in enumerate(self.Histogram):
+            low = (i - self.Bins // 2) * self.BinSteps
+            if i == 0: label = '<' + str(low + self.BinSteps // 2)
+            elif i == self.Bins - 1: label = '>' + str(low - self.BinSteps // 2)
+            else: label = str(low)
+            lines.append(label.rjust(6) + ' ' + str(count).rjust(6) + ' ' + '#' * int(round(width * count / top)))
+        return lines
+
+# ------------------------------------------------------------------------------------------------------
+
+def ReadSensorTrace(filename):
+    """ (motor name, step count angle, sensor angle) from position_sensor_trace entries in a main log. """
+    result = []
+    with open(filename,'r',errors='replace') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t',2)
+            if len(fields) < 3 or not fields[2].startswith('position_sensor_trace:'): continue
+            items = fields[2].split(' ')
+            try: result.append((items[1],float(items[4]),float(items[5]))) # name, date, time, CurrentAngle, sensor angle.
+            except (IndexError,ValueError): continue # Column headings.
+    return result
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1: # Replay recorded traces, one fusion per motor. No tunes are applied.
+        fusions = {}
+        stepsperrev = int(sys.argv[2]) if len(sys.argv) > 2 else 48000 * 4
+        for motor,angle,sensor in ReadSensorTrace(sys.argv[1]):
+            fusion = fusions.setdefault(motor,positionfusion(stepsperrev))
+            fusion.Add(angle,sensor)
+        for motor,fusion in fusions.items():
+            print(motor,fusion.Report(),'correction',fusion.Correction())
+            for line in fusion.HistogramLines(): print('  ' + line)
+    else:
+        print('Usage: python pilomarsensorfusion.py {main log file} [steps per revolution]')
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+# Pilomar's slew planner. Predicts how long a GOTO will take and chooses the path the motors should follow.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# A GOTO is performed by steppermotor.MoveMotorFast() in the pico2_tmc2209 firmware. slewprofile mirrors it:
+#   - The firmware position wraps at a full revolution, the target is clipped to MinAngle..MaxAngle, and the
+#     motor moves target - current steps. With OptimiseMoves it goes the other way round if that's shorter.
+#   - Every pulse is WaitTime on and WaitTime off. WaitTime starts at SlowTime and shortens by DeltaTime per
+#     step until it reaches FastTime. So the time for n steps has a closed form.
+#     NOTE: The firmware accelerates with DeltaTime, which is fixed at 0.003s. The TimeDelta value sent in the
+#           configuration (and chosen in SpeedMenu) is stored but not used, so the model follows the firmware.
+#   - With SlewEnabled the move is split into 3 phases, each restarting from SlowTime:
+#       fine microsteps to a coarse step boundary, coarse steps until within 100 coarse steps of the target,
+#       then fine microsteps to finish. Changing the TMC2209 microstep resolution takes about 0.12s each way.
+#   - Every pulse also costs firmware time that can't overlap the pulse itself: StepMove() bookkeeping and the
+#     ns_sleep() overrun on the 'on' half. (pulse)
+#   - Between pulses the firmware sends status and polls the UART. If that work takes longer than the 'off'
+#     part of the pulse it slows the motor down. (overhead) Each goto also has a fixed cost for preparing the move
+#     and switching the driver. (fixed)
+#   - The completion status waits behind the messages queued when the goto started, uarthost sends one line
+#     every 100ms. So even a tiny goto takes a few seconds to report completion. (minimum)
+#   - The RPi adds its own latency: sending the goto and noticing completion. (GoToAngle polls once per second.)
+#
+# slewprofile.Plan() compares the legal ways to reach a target angle (the angle itself, or +/-360 if within the
+# motor limits) and includes the backlash pre-alignment move when the motor would otherwise arrive moving
+# backwards. The fastest predicted path wins.
+#
+# Run this module directly to print predicted slew times for each speed profile.
+# tests/test_slew.py checks the closed form against a step by step replay of the firmware logic (FirmwareSeconds).
+# Pass a main log file to compare the predictions recorded in slew_trace entries with the measured slews.
+# circuitpython/pico2sim.py slew checks the predictions against the firmware running in the simulator.
+
+import sys
+import math
+
+FIRMWARE_DELTATIME = 0.003 # steppermotor.DeltaTime. Acceleration per step of the pulse length. (s)
+MODE_SWITCH_TIME = 0.12 # Time to change the TMC2209 microstep resolution. (s)
+PULSE_OVERHEAD = 0.0004 # Firmware time added to every pulse. (s) Calibrated with circuitpython/pico2sim.py slew.
+STEP_OVERHEAD = 0.0013 # Firmware work between pulses during a slew, status and UART polling. (s) Calibrated with circuitpython/pico2sim.py slew.
+GOTO_OVERHEAD = 0.6 # Firmware time per goto that doesn't depend on the distance. (s) Calibrated with circuitpython/pico2sim.py slew.
+GOTO_MINIMUM = 5.6 # Shortest time from goto to completion status, the output queue drains first. (s) Calibrated with circuitpython/pico2sim.py slew.
+COMMAND_LATENCY = 1.0 # RPi side, goto transmission and completion polling. (s)
+SLEW_TOLERANCE = 100 # Coarse moves stop this many coarse steps from the target. (steppermotor.CalculateSlewLimits)
+
+def PulseSum(n,slow,fast,delta):
+    """ Total of n pulse lengths starting at slow, shortening by delta each step, never shorter than fast. """
+    if n <= 0: return 0.0
+    if slow <= fast or delta <= 0: return n * slow
+    m = int(math.ceil((slow - fast) / delta)) # Steps taken before reaching full speed.
+    k = min(n,m)
+    return k * slow - delta * k * (k - 1) / 2.0 + (n - k) * fast
+
+class slewleg():
+    """ One goto command. """
+
+    def __init__(self,fromangle,toangle,steps,seconds):
+        self.From = fromangle
+        self.To = toangle
+        self.Steps = steps # Signed fine microsteps the firmware will take.
+        self.Seconds = seconds
+
+    def __repr__(self):
+        return 'slewleg(' + str(round(self.From,3)) + '->' + str(round(self.To,3)) + ',' + str(self.Steps) + ' steps,' + str(round(self.Seconds,1)) + 's)'
+
+class slewpath():
+    """ The goto commands to reach a target and the predicted time. """
+
+    def __init__(self,target,angle,legs,clipped=False):
+        self.Target = target # The angle requested.
+        self.Angle = angle # The equivalent angle the motor is sent to.
+        self.Legs = legs
+        self.Clipped = clipped # The target was outside the motor limits.
+        self.Seconds = sum([leg.Seconds for leg in legs])
+
+    def Text(self):
+        """ Summary for logs and the dashboard. """
+        text = str(round(self.Angle,3)) + ' in ' + str(round(self.Seconds,1)) + 's'
+        if len(self.Legs) > 1: text += ' (' + str(len(self.Legs)) + ' moves)'
+        if self.Clipped: text += ' clipped'
+        return text
+
+class slewprofile():
+    """ How one axis moves during a GOTO. """
+
+    def __init__(self,stepsperrev,fasttime,slowtime,deltatime=FIRMWARE_DELTATIME,slewmultiplier=1,slewenabled=False,optimisemoves=False,
+                 minangle=0.0,maxangle=360.0,backlash=0.0,pulse=PULSE_OVERHEAD,overhead=STEP_OVERHEAD,fixed=GOTO_OVERHEAD,minimum=GOTO_MINIMUM,switchtime=MODE_SWITCH_TIME,latency=COMMAND_LATENCY):
+        """ stepsperrev = Fine microsteps per revolution of the axis. (Full steps * microstepping * gear ratio)
+            fasttime, slowtime, deltatime = Pulse lengths and acceleration. (s)
+            slewmultiplier = Fine microsteps per coarse step.
+            slewenabled = Can the motor use coarse steps for large moves?
+            optimisemoves = Can the firmware take the short way round?
+            minangle, maxangle = Motor limits. (degrees)
+            backlash = Gear backlash. (degrees)
+            pulse = Firmware time added to every pulse. (s)
+            overhead = Firmware work between pulses. (s)
+            fixed = Firmware time per goto. (s)
+            minimum = Shortest goto, waiting for the output queue. (s)
+            switchtime = Microstep resolution change. (s)
+            latency = RPi side time added to each goto. (s) """
+        self.StepsPerRev = stepsperrev
+        self.FastTime = fasttime
+        self.SlowTime = slowtime
+        self.DeltaTime = deltatime
+        self.SlewMultiplier = max(1,int(slewmultiplier))
+        self.SlewEnabled = slewenabled
+        self.OptimiseMoves = optimisemoves
+        self.MinAngle = minangle
+        self.MaxAngle = maxangle
+        self.Backlash = backlash
+        self.Pulse = pulse
+        self.Overhead = overhead
+        self.Fixed = fixed
+        self.Minimum = minimum
+        self.SwitchTime = switchtime
+        self.Latency = latency
+
+    def AngleToStep(self,angle):
+        """ Same as steppermotor.AngleToStep() """
+        return int(round(angle * float(self.StepsPerRev) / 360,0))
+
+    def Clip(self,angle):
+        return min(self.MaxAngle,max(self.MinAngle,angle))
+
+    def Steps(self,fromangle,toangle):
+        """ Signed fine microsteps the firmware takes between two angles. """
+        current = self.AngleToStep(fromangle) % self.StepsPerRev # The firmware position wraps at a full revolution.
+        steps = self.AngleToStep(self.Clip(toangle)) - current
+        if self.OptimiseMoves and abs(steps) > int(self.StepsPerRev / 2): # Firmware takes the short way round.
+            if steps > 0: steps -= self.StepsPerRev
+            else: steps += self.StepsPerRev
+        return steps
+
+    def PhaseSeconds(self,n):
+        """ n pulses from a standing start. The 'off' half of each pulse is stretched by the firmware overhead. """
+        return PulseSum(n,self.SlowTime,self.FastTime,self.DeltaTime) + PulseSum(n,max(self.SlowTime,self.Overhead),max(self.FastTime,self.Overhead),self.DeltaTime) + n * self.Pulse
+
+    def Phases(self,fromangle,steps):
+        """ (fine, coarse, fine) step counts of MoveMotorFast(). Coarse steps count as one pulse each. """
+        n = abs(steps)
+        if not self.SlewEnabled: return 0,0,n
+        mult = self.SlewMultiplier
+        current = self.AngleToStep(fromangle) % self.StepsPerRev
+        if steps > 0: first = (-current) % mult # Fine steps to the next coarse step boundary.
+        else: first = current % mult
+        first = min(first,n)
+        remaining = n - first
+        tolerance = SLEW_TOLERANCE * mult
+        coarse = int(math.ceil((remaining - tolerance) / mult)) if remaining > tolerance else 0
+        return first,coarse,remaining - coarse * mult
+
+    def MoveSeconds(self,fromangle,toangle):
+        """ Predicted duration of a single goto. Returns (signed steps, seconds). """
+        steps = self.Steps(fromangle,toangle)
+        if steps == 0: return 0,0.0
+        first,coarse,last = self.Phases(fromangle,steps)
+        seconds = self.Fixed + self.PhaseSeconds(first) + self.PhaseSeconds(coarse) + self.PhaseSeconds(last)
+        if self.SlewEnabled: seconds += 2 * self.SwitchTime # Coarse and back to fine.
+        return steps,self.Latency + max(seconds,self.Minimum) # The completion status can't overtake the output queue.
+
+    def Leg(self,fromangle,toangle):
+        steps,seconds = self.MoveSeconds(fromangle,toangle)
+        return slewleg(fromangle,toangle,steps,seconds)
+
+    def Path(self,current,angle,target=None,backlash=True,clipped=False):
+        """ The goto commands to reach 'angle'. Adds a pre-alignment move if the motor would arrive moving backwards. """
+        legs = []
+        if backlash and self.Backlash != 0 and self.Steps(current,angle) < 0: # Arriving backwards leaves the gears slack.
+            past = self.Clip(angle - self.Backlash) # Go past the target, then come back to it moving forwards.
+            legs.append(self.Leg(current,past))
+            legs.append(self.Leg(past,angle))
+        else:
+            legs.append(self.Leg(current,angle))
+        return slewpath(angle if target == None else target,angle,legs,clipped)
+
+    def Plan(self,current,target,backlash=True):
+        """ Fastest legal path from the current angle to the target.
+
+            Parameters ---------------------------------------
+            current (float) : Current motor angle.
+            target (float) : Requested angle.
+            backlash (bool) : Take up the gear backlash by arriving moving forwards.
+
+            Returns ------------------------------------------
+            slewpath
+        """
+        candidates = []
+        for shift in (0.0,-360.0,360.0): # The same direction in the sky.
+            angle = target + shift
+            if self.MinAngle <= angle <= self.MaxAngle:
+                candidates.append(self.Path(current,angle,target,backlash))
+        if len(candidates) == 0: # Unreachable, the firmware will stop at the limit.
+            candidates.append(self.Path(current,self.Clip(target),target,backlash,clipped=True))
+        return min(candidates,key=lambda path: path.Seconds)
+
+# ------------------------------------------------------------------------------------------------------
+
+def FirmwareSeconds(profile,fromangle,toangle):
+    """ Step by step replay of the MoveMotorFast() logic, to check the closed form. Fixed costs excluded. """
+    N = profile.StepsPerRev
+    position = profile.AngleToStep(fromangle) % N
+    target = profile.AngleToStep(profile.Clip(toangle))
+    pending = target - position
+    if profile.OptimiseMoves and abs(pending) > int(N / 2):
+        pending = pending - N if pending > 0 else pending + N
+    if pending == 0: return 0.0
+    direction = 1 if pending > 0 else -1
+    mult = profile.SlewMultiplier
+    seconds = 0.0
+    def pulse(wait): return wait + max(wait,profile.Overhead) + profile.Pulse
+    if profile.SlewEnabled:
+        wait = profile.SlowTime
+        while pending != 0 and position % mult != 0:
+            seconds += pulse(wait)
+            wait = max(wait - profile.DeltaTime,profile.FastTime)
+            position = (position + direction) % N
+            pending -= direction
+        seconds += profile.SwitchTime
+        wait = profile.SlowTime
+        remaining = abs(pending)
+        while pending != 0 and remaining > SLEW_TOLERANCE * mult:
+            seconds += pulse(wait)
+            wait = max(wait - profile.DeltaTime,profile.FastTime)
+            pending -= direction * mult
+            remaining -= mult
+        seconds += profile.SwitchTime
+    wait = profile.SlowTime
+    while pending != 0:
+        seconds += pulse(wait)
+        wait = max(wait - profile.DeltaTime,profile.FastTime)
+        pending -= direction
+    return seconds
+
+def ReadSlewTrace(filename):
+    """ (motor, from angle, to angle, predicted seconds, measured seconds) from slew_trace entries in a main log. """
+    result = []
+    with open(filename,'r',errors='replace') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t',2)
+            if len(fields) < 3 or not fields[2].startswith('slew_trace:'): continue
+            items = fields[2].split(' ')
+            try: result.append((items[1],float(items[2]),float(items[3]),float(items[4]),float(items[5])))
+            except (IndexError,ValueError): continue
+    return result
+
+def CompareRecorded(records):
+    """ Prediction error summary for recorded or simulated slews. records = (name, from, to, predicted, measured) """
+    errors = sorted([abs(predicted - measured) / max(measured,1.0) for name,fromangle,toangle,predicted,measured in records])
+    if len(errors) == 0: return {'slews':0}
+    return {'slews':len(errors),
+            'error_pct_p50':round(100 * errors[len(errors) // 2],1),
+            'error_pct_max':round(100 * errors[-1],1)}
+
+def DefaultProfile(speed,**kwargs):
+    """ A typical tmc2209 axis: 400 step motor, 4 microsteps for tracking, full steps for slews, 240:1 gearing. """
+    return slewprofile(400 * 4 * 240,speed['FastTime'],speed['SlowTime'],slewmultiplier=4,slewenabled=True,**kwargs)
+
+SPEEDLIST = {'Slow':{'FastTime':0.002,'SlowTime':0.05},'Medium':{'FastTime':0.001,'SlowTime':0.05},
+             'Fast':{'FastTime':0.0005,'SlowTime':0.05},'Turbo':{'FastTime':0.0001,'SlowTime':0.05}} # As Parameters.SpeedList in pilomar.py.
+
+def PrintSlewTimes():
+    """ Predicted slew times for each speed profile. """
+    print('Predicted slew times, SlewEnabled, 400 steps/rev, 4 microsteps, 240:1 gearing (includes',COMMAND_LATENCY,'s RPi latency):')
+    print('degrees'.rjust(8) + ''.join([name.rjust(10) for name in SPEEDLIST]))
+    for degrees in (1,10,45,90,180):
+        print(str(degrees).rjust(8) + ''.join([(str(round(DefaultProfile(speed).MoveSeconds(0.0,float(degrees))[1],1)) + 's').rjust(10) for speed in SPEEDLIST.values()]))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1: # Compare recorded slews.
+        records = ReadSlewTrace(sys.argv[1])
+        for record in records: print(record)
+        print(CompareRecorded(records))
+    else:
+        PrintSlewTimes()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+# Pilomar's structured telemetry recorder.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# High rate events (motor status, trajectory segments, UART traffic, camera timing) are recorded
+# here as fixed size binary records as well as the free text log. This avoids having to grep the
+# values back out of the log file afterwards.
+#
+# File layout: one series of files per channel. {folder}/{prefix}_{channel}_{part}.tlm
+#   4 bytes  b'PTLM'
+#   4 bytes  header length (little-endian uint32)
+#   n bytes  JSON header {'channel','fields':[[name,format],...],'created',...}
+#   records  fixed size, little-endian struct. First field is always 't' (UTC unix seconds, float64).
+# Because records are fixed size a whole file loads straight into a numpy structured array.
+# tests/test_telemetry.py reads records back and measures the recording cost against a text log line.
+
+import os
+import json
+import glob
+import struct
+import threading
+import time
+import numpy as np
+
+try: # pandas is optional, only needed to load telemetry as a DataFrame.
+    import pandas
+except ImportError:
+    pandas = None
+
+MAGIC = b'PTLM'
+
+# Standard channels recorded by pilomar.
+CHANNELS = {
+    'motorstatus': [('motor','8s'),('mctltime','d'),('trajvalid','?'),('trajentries','i'),('position','q'),('angle','d'),
+                    ('configured','?'),('ontarget','?'),('stepperiod','d'),('vmotadc','i'),('sensorvalue','i'),('sensorangle','d'),
+                    ('fault','?'),('halt','?')],
+    'trajectory':  [('motor','8s'),('startutc','d'),('startangle','d'),('endutc','d'),('endangle','d'),('startpos','q'),('endpos','q'),('cached','?')],
+    'uart':        [('direction','1s'),('valid','?'),('queue','H'),('length','H'),('text','72s')],
+    'camera':      [('photocount','i'),('exposure','d'),('obsstart','d'),('obsend','d'),('capturems','d'),('mult','d'),('success','?'),('streaks','?')],
+    }
+
+class telemetrychannel():
+    """ One telemetry channel. Records are packed into an in-memory buffer and written
+        to disc in blocks. Files rotate when they reach maxbytes. """
+
+    def __init__(self,folder,prefix,name,fields,maxbytes,flushrecords,flushseconds,clock=time.time):
+        self.Folder = folder
+        self.Prefix = prefix
+        self.Name = name
+        self.Fields = [('t','d')] + list(fields) # Every record starts with its timestamp.
+        self.Struct = struct.Struct('<' + ''.join(f for _,f in self.Fields))
+        self.RecordSize = self.Struct.size
+        self.MaxBytes = maxbytes
+        self.FlushRecords = flushrecords
+        self.FlushSeconds = flushseconds
+        self.Clock = clock
+        self.Buffer = bytearray()
+        self.Pending = 0 # Records in the buffer.
+        self.LastFlush = time.monotonic()
+        self.Part = 0
+        self.File = None
+        self.FileName = None
+        self.FileBytes = 0
+        self.Records = 0 # Total records recorded.
+        self.Lock = threading.Lock() # Comms and camera threads may record at the same time.
+
+    def Open(self):
+        """ Start the next file in the series. """
+        self.Part += 1
+        self.FileName = os.path.join(self.Folder,self.Prefix + '_' + self.Name + '_' + str(self.Part).zfill(3) + '.tlm')
+        header = json.dumps({'channel':self.Name,'fields':self.Fields,'created':self.Clock(),'part':self.Part}).encode()
+        self.File = open(self.FileName,'ab')
+        self.File.write(MAGIC + struct.pack('<I',len(header)) + header)
+        self.FileBytes = 8 + len(header)
+
+    def Record(self,timestamp,values):
+        """ Pack one record into the buffer. """
+        with self.Lock:
+            self.Buffer += self.Struct.pack(timestamp,*values)
+            self.Pending += 1
+            self.Records += 1
+            if self.Pending >= self.FlushRecords or time.monotonic() - self.LastFlush >= self.FlushSeconds:
+                self.Flush()
+
+    def Flush(self):
+        """ Write buffered records to disc. Caller holds the lock (or is closing). """
+        if self.Pending == 0: return
+        if self.File == None: self.Open()
+        elif self.FileBytes + len(self.Buffer) > self.MaxBytes: # Rotate to a fresh file.
+            self.File.close()
+            self.Open()
+        self.File.write(self.Buffer)
+        self.File.flush()
+        self.FileBytes += len(self.Buffer)
+        self.Buffer = bytearray()
+        self.Pending = 0
+        self.LastFlush = time.monotonic()
+
+    def Close(self):
+        """ Flush and close the current file. """
+        with self.Lock:
+            self.Flush()
+            if self.File != None:
+                self.File.close()
+                self.File = None
+
+class telemetry():
+    """ Structured binary telemetry recorder.
+        Define channels with typed fields, then call Record() from the code that generates the events.
+        Values are struct formats: 'd' float, 'i'/'q' integers, 'H' unsigned short, '?' boolean, 'Ns' fixed length bytes.
+        Strings are encoded and truncated to fit. None is recorded as NaN (float) or -1 (integer). """
+
+    __version__ = '0.1.0'
+
+    def __init__(self,folder,prefix,maxbytes=32*1024*1024,flushrecords=200,flushseconds=5.0,channels=CHANNELS,logger=None,clock=time.time):
+        """ folder = where the telemetry files are written.
+            prefix = start of each filename, eg: the log filename without extension.
+            maxbytes = rotate each channel's file when it exceeds this size.
+            flushrecords / flushseconds = buffered records are written when either limit is reached.
+            channels = {name:[(field,format),...]} initial channel definitions.
+            clock = UTC unix seconds for records without a timestamp. pilomar passes its NowUTC() so records
+                    line up with the log files, including any clock offset. """
+        self.Folder = folder
+        self.Prefix = prefix
+        self.MaxBytes = maxbytes
+        self.FlushRecords = flushrecords
+        self.FlushSeconds = flushseconds
+        self.Logger = logger
+        self.Clock = clock
+        self.Enabled = True # Record() does nothing when disabled.
+        self.Channels = {}
+        self.Cost = {} # channel : [calls, seconds, longest] Time spent inside Record() at the real call sites.
+        self.Errors = 0
+        for name,fields in channels.items():
+            self.DefineChannel(name,fields)
+
+    def Log(self,*args,**kwargs):
+        """ Pass messages to the logger if there is one. """
+        if self.Logger != None: self.Logger.Log(*args,**kwargs)
+
+    def DefineChannel(self,name,fields):
+        """ Add a channel. fields = [(fieldname,struct format),...] """
+        self.Channels[name] = telemetrychannel(self.Folder,self.Prefix,name,fields,self.MaxBytes,self.FlushRecords,self.FlushSeconds,self.Clock)
+        self.Cost[name] = [0,0.0,0.0]
+        return self.Channels[name]
+
+    def Record(self,channel,*values,timestamp=None):
+        """ Record one event on a channel. Values must follow the channel's field order.
+            timestamp = UTC datetime or unix seconds, defaults to now.
+            This is called on hot paths, so it never raises. Failures are counted in .Errors
+            The time spent here is measured per channel, see Overhead(). """
+        if not self.Enabled: return False
+        start = time.perf_counter()
+        try:
+            c = self.Channels[channel]
+            if timestamp == None: timestamp = self.Clock()
+            elif not isinstance(timestamp,(int,float)): timestamp = timestamp.timestamp()
+            clean = []
+            for (_,fmt),value in zip(c.Fields[1:],values):
+                if value == None: value = float('nan') if fmt in ('d','f') else (b'' if fmt[-1] == 's' else (False if fmt == '?' else -1))
+                elif fmt[-1] == 's' and isinstance(value,str): value = value.encode('utf-8','replace')
+                elif hasattr(value,'timestamp'): value = value.timestamp() # datetime fields.
+                clean.append(value)
+            c.Record(timestamp,clean)
+            result = True
+        except Exception as e:
+            self.Errors += 1
+            if self.Errors <= 10: self.Log("telemetry.Record(",channel,"): Failed",e,terminal=False)
+            result = False
+        elapsed = time.perf_counter() - start
+        cost = self.Cost.get(channel)
+        if cost != None: # Not exact if 2 threads record on one channel at once, close enough for a statistic.
+            cost[0] += 1
+            cost[1] += elapsed
+            if elapsed > cost[2]: cost[2] = elapsed
+        return result
+
+    def Flush(self):
+        """ Write all buffered records to disc. """
+        for c in self.Channels.values():
+            with c.Lock:
+                c.Flush()
+
+    def Close(self):
+        """ Flush and close all channels. """
+        for c in self.Channels.values():
+            c.Close()
+
+    def Status(self):
+        """ Summary of records written per channel. """
+        return {name:c.Records for name,c in self.Channels.items()}
+
+    def Overhead(self):
+        """ Time spent recording at the real call sites, per channel. Microseconds. (Includes flushes to disc) """
+        result = {}
+        for name,(calls,seconds,longest) in self.Cost.items():
+            if calls == 0: continue
+            result[name] = {'calls':calls,'mean_us':round(seconds / calls * 1e6,2),'max_us':round(longest * 1e6,1),'total_s':round(seconds,3)}
+        return result
+
+def TelemetryDtype(fields):
+    """ numpy structured dtype for a channel's records. """
+    return np.dtype([(name,'<' + ('S' + fmt[:-1] if fmt[-1] == 's' else ('b1' if fmt == '?' else fmt))) for name,fmt in fields])
+
+def ReadTelemetryFile(filename,mapped=False):
+    """ Load one telemetry file into a numpy structured array.
+        A partly written final record (eg: after a crash) is ignored.
+        mapped = True maps the file instead of reading it. """
+    with open(filename,'rb') as f:
+        if f.read(4) != MAGIC: raise ValueError(filename + ' is not a telemetry file')
+        length = struct.unpack('<I',f.read(4))[0]
+        header = json.loads(f.read(length))
+    dtype = TelemetryDtype(header['fields'])
+    offset = 8 + length
+    count = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if mapped: data = np.memmap(filename,dtype=dtype,mode='r',offset=offset,shape=(count,))
+    else: data = np.fromfile(filename,dtype=dtype,count=count,offset=offset)
+    return data, header
+
+def ReadTelemetry(folder,channel,prefix='*',start=None,end=None,dataframe=False):
+    """ Load all parts of a channel (eg: a whole night) into one numpy structured array.
+        prefix = filename prefix (glob pattern allowed) to select a session.
+        start/end = optional UTC datetime or unix seconds range.
+        dataframe = True returns a pandas DataFrame indexed by UTC timestamp. Text fields are decoded. """
+    files = sorted(glob.glob(os.path.join(folder,prefix + '_' + channel + '_*.tlm')))
+    arrays = [ReadTelemetryFile(f)[0] for f in files]
+    if len(arrays) == 0: return None
+    data = np.concatenate(arrays)
+    if start != None or end != None:
+        if start != None and not isinstance(start,(int,float)): start = start.timestamp()
+        if end != None and not isinstance(end,(int,float)): end = end.timestamp()
+        keep = np.ones(len(data),dtype=bool)
+        if start != None: keep &= data['t'] >= start
+        if end != None: keep &= data['t'] <= end
+        data = data[keep]
+    if not dataframe: return data
+    if pandas == None: raise ImportError('ReadTelemetry(): pandas is not installed, use dataframe=False')
+    df = pandas.DataFrame({name:(np.char.decode(data[name],'utf-8','replace') if data.dtype[name].kind == 'S' else data[name]) for name in data.dtype.names})
+    df.index = pandas.to_datetime(df.pop('t'),unit='s',utc=True)
+    return df
@@ -0,0 +1,237 @@
+#!/usr/bin/python
+
+# Pilomar's trajectory segment planner. Chooses how long each straight line trajectory segment can be.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# motorcontrol.ExtendTrajectory() sends the motor path as a chain of straight line segments (start time/angle, end time/angle).
+# The microcontroller interpolates linearly along each segment, so the pointing error within a segment is the gap
+# between the chord and the real arc. For an axis moving with angular acceleration 'a' (degrees/s/s) the largest gap over
+# a segment of T seconds is at the middle and is
+#     error = |a| * T * T / 8
+# so the longest segment that stays within the tolerance is
+#     T = sqrt(8 * tolerance / |a|)
+#
+# segmentplanner.Plan() estimates the acceleration from 3 positions one minimum segment apart (second difference),
+# proposes T from the formula (with a safety margin), then checks the real chord error at 1/4, 1/2 and 3/4 of the
+# segment. If the rate of change of acceleration is high (near the zenith or the meridian) the check fails and T is
+# shrunk using the measured error, a few times at most, before falling back to the minimum segment.
+#
+# The previous approach extended the segment 15 seconds at a time and measured the drift away from the gradient of the
+# first minute, stopping at 0.005 degrees. That is up to 100 position calculations per segment, and the drift it measures
+# is about 4 times the chord error, so segments were much shorter than the tolerance needs.
+#
+# Segments are never shorter than the minimum (the microcontroller holds 32 segments per motor). Close to the zenith
+# the azimuth swings so fast that the minimum segment alone exceeds the tolerance, eg 0.11 degrees for a star passing
+# 1 degree from the zenith. Both approaches are limited there, the planner keeps to the minimum segment.
+#
+# Run this module directly for a report comparing segment counts, maximum chord error and position calculations
+# of both approaches over a range of declinations. The 'floor' column is the error of fixed minimum segments.
+# tests/test_trajectory.py checks the planner against paths with known answers and the report totals.
+
+import sys
+import math
+
+SIDEREAL_RATE = 360.0 / 86164.0905 # Degrees of hour angle per second.
+
+def Wrap(degrees):
+    """ Angle difference wrapped into -180..+180 degrees. """
+    return (degrees + 180.0) % 360.0 - 180.0
+
+def ChordError(angle,seconds,fractions=(0.25,0.5,0.75)):
+    """ Largest gap (degrees) between the straight segment and the real path, checked at a few points.
+        angle = function returning the axis angle a number of seconds after the segment start. """
+    start = angle(0)
+    end = angle(seconds)
+    return max([abs(angle(f * seconds) - (start + f * (end - start))) for f in fractions])
+
+class segmentplanner():
+    """ Chooses trajectory segment lengths from the local angular acceleration. """
+
+    def __init__(self,tolerance=0.005,minimum=60,maximum=1560,margin=0.8,attempts=4):
+        """ tolerance = Largest allowed gap between a segment and the real path (degrees).
+            minimum = Shortest segment (seconds). Also the spacing of the acceleration estimate.
+            maximum = Longest segment (seconds). Several segments must stay queued on the microcontroller.
+            margin = Fraction of the tolerance aimed for, so the check usually passes first time.
+            attempts = How many times a segment can be shrunk before falling back to the minimum. """
+        self.Tolerance = tolerance
+        self.Minimum = minimum
+        self.Maximum = maximum
+        self.Margin = margin
+        self.Attempts = attempts
+        self.Reset()
+
+    def Reset(self):
+        """ Clear the statistics. """
+        self.Plans = 0 # Segments planned.
+        self.Seconds = 0 # Total duration of the segments planned.
+        self.Evaluations = 0 # Position calculations requested.
+        self.Shrinks = 0 # Proposals that failed the check and were shortened.
+        self.Fallbacks = 0 # Segments that fell back to the minimum length.
+
+    def Plan(self,angle,tolerance=None,low=None,high=None,known=None):
+        """ Longest whole number of seconds that keeps the segment within the tolerance.
+
+            Parameters ---------------------------------------
+            angle (function) : Axis angle (degrees) a number of seconds after the segment start.
+            tolerance (float) : Overrides the planner's tolerance (degrees).
+            low, high (float) : Angle limits. A segment is not extended beyond them.
+            known (dict) : Angles already calculated by the caller, keyed by seconds.
+
+            Returns ------------------------------------------
+            (seconds, end angle)
+        """
+        if tolerance == None: tolerance = self.Tolerance
+        cache = dict(known) if known else {}
+        def at(seconds): # Each position calculation is expensive, never repeat one.
+            if seconds not in cache:
+                cache[seconds] = angle(seconds)
+                self.Evaluations += 1
+            return cache[seconds]
+        h = self.Minimum
+        curvature = abs(at(2 * h) - 2 * at(h) + at(0)) / (h * h) # Second difference estimate of the acceleration.
+        if curvature > 0: seconds = math.sqrt(8 * tolerance * self.Margin / curvature)
+        else: seconds = self.Maximum
+        seconds = int(min(self.Maximum,max(self.Minimum,seconds)))
+        for attempt in range(self.Attempts):
+            if seconds <= self.Minimum: break
+            end = at(seconds)
+            if (low != None and end < low) or (high != None and end > high): # Would leave the permitted range.
+                seconds = max(self.Minimum,(seconds + self.Minimum) // 2)
+            else:
+                error = ChordError(at,seconds)
+                if error <= tolerance: break # Good enough.
+                seconds = int(max(self.Minimum,min(0.9 * seconds,seconds * math.sqrt(tolerance * self.Margin / error)))) # Refine with the measured error.
+            self.Shrinks += 1
+        else: # Still failing after all attempts.
+            seconds = self.Minimum
+        if seconds <= self.Minimum:
+            seconds = self.Minimum
+            self.Fallbacks += 1
+        self.Plans += 1
+        self.Seconds += seconds
+        return seconds, at(seconds)
+
+    def Report(self):
+        """ Summary of the segments planned so far. """
+        return {'segments':self.Plans,
+                'mean_seconds':round(self.Seconds / self.Plans,1) if self.Plans > 0 else None,
+                'evaluations_per_segment':round(self.Evaluations / self.Plans,2) if self.Plans > 0 else None,
+                'shrinks':self.Shrinks,
+                'fallbacks':self.Fallbacks}
+
+    def Status(self):
+        """ One line summary for the dashboard. """
+        if self.Plans == 0: return 'No segments planned'
+        return 'Seg ' + str(self.Plans) + ' avg ' + str(int(self.Seconds / self.Plans)) + 's calc/seg ' + str(round(self.Evaluations / self.Plans,1))
+
+# ------------------------------------------------------------------------------------------------------
+
+def LegacyPlan(angle,segmentsize=60,threshold=0.005,low=None,high=None):
+    """ The previous trial and error extension from ExtendTrajectory(), for comparison.
+        Returns (seconds, end angle, position calculations). """
+    startangle = angle(0)
+    seconds = segmentsize
+    endangle = angle(seconds)
+    evaluations = 2
+    gradient = (endangle - startangle) / segmentsize
+    size = segmentsize
+    for iteration in range(100):
+        size += int(segmentsize / 4)
+        nextangle = angle(size)
+        evaluations += 1
+        if (low != None and nextangle < low) or (high != None and nextangle > high): break
+        if abs(nextangle - (startangle + gradient * size)) <= threshold:
+            seconds = size
+            endangle = nextangle
+        else:
+            break
+    return seconds, endangle, evaluations
+
+def StarAzAlt(declination,latitude,hourangle):
+    """ Azimuth (0..360 from north through east) and altitude (degrees) of a fixed star. """
+    d = math.radians(declination)
+    p = math.radians(latitude)
+    h = math.radians(hourangle)
+    alt = math.asin(math.sin(p) * math.sin(d) + math.cos(p) * math.cos(d) * math.cos(h))
+    az = math.atan2(-math.cos(d) * math.sin(h),math.sin(d) * math.cos(p) - math.cos(d) * math.cos(h) * math.sin(p))
+    return math.degrees(az) % 360.0, math.degrees(alt)
+
+def TrackAxis(declination,latitude,axis,planner=None,segmentsize=60,tolerance=0.005,hours=12.0,minaltitude=5.0,sample=5,fixed=False):
+    """ Plan a whole track of a star from hour angle -hours/2 to +hours/2 while it is above minaltitude.
+        axis = 0 azimuth, 1 altitude. Uses the planner if given, otherwise LegacyPlan().
+        fixed = True uses segments of exactly segmentsize seconds, the smallest error either approach can reach.
+        Returns (hours tracked, segments, maximum chord error, position calculations). """
+    def raw(t): return StarAzAlt(declination,latitude,SIDEREAL_RATE * (t - hours * 1800.0))[axis]
+    def above(t): return StarAzAlt(declination,latitude,SIDEREAL_RATE * (t - hours * 1800.0))[1] >= minaltitude
+    t = 0
+    end = int(hours * 3600)
+    while t < end and not above(t): t += sample
+    first = t
+    segments = 0
+    maxerror = 0.0
+    evaluations = 0
+    while t < end and above(t):
+        base = raw(t)
+        def angle(s,t=t,base=base): return base + Wrap(raw(t + s) - base) # Continuous through the 0/360 azimuth crossing.
+        if fixed:
+            seconds, endangle = segmentsize, angle(segmentsize)
+            evaluations += 1
+        elif planner != None:
+            before = planner.Evaluations
+            seconds, endangle = planner.Plan(angle,tolerance=tolerance)
+            evaluations += planner.Evaluations - before
+        else:
+            seconds, endangle, count = LegacyPlan(angle,segmentsize,tolerance)
+            evaluations += count
+        for s in range(0,seconds + 1,sample): # What the microcontroller would really follow.
+            maxerror = max(maxerror,abs(angle(s) - (base + (endangle - base) * s / seconds)))
+        segments += 1
+        t += seconds
+    tracked = (t - first) / 3600.0
+    return tracked, segments, maxerror, evaluations
+
+def CompareReport(latitude=52.0,declinations=(-30,-10,0,10,20,30,40,50,51,53,60,70,80),tolerance=0.005,segmentsize=60):
+    """ Segments per hour, maximum chord error and position calculations, legacy vs planned, for each axis. """
+    lines = []
+    lines.append('Latitude ' + str(latitude) + ', tolerance ' + str(tolerance) + ' deg, minimum segment ' + str(segmentsize) + 's.')
+    lines.append('axis      dec  hours   floor |  legacy seg/h  max err  calc/seg |  planned seg/h  max err  calc/seg')
+    totals = {}
+    for axis,name in ((0,'azimuth'),(1,'altitude')):
+        for declination in declinations:
+            planner = segmentplanner(tolerance=tolerance,minimum=segmentsize,maximum=segmentsize + 100 * int(segmentsize / 4))
+            hours, oldsegs, olderror, oldcalcs = TrackAxis(declination,latitude,axis,None,segmentsize,tolerance)
+            hours2, newsegs, newerror, newcalcs = TrackAxis(declination,latitude,axis,planner,segmentsize,tolerance)
+            hours3, fixedsegs, floor, fixedcalcs = TrackAxis(declination,latitude,axis,None,segmentsize,tolerance,fixed=True)
+            if hours <= 0: continue
+            total = totals.setdefault(name,[0,0,0,0,0.0,0.0,0.0])
+            total[0] += oldsegs
+            total[1] += newsegs
+            total[2] += oldcalcs
+            total[3] += newcalcs
+            total[4] = max(total[4],olderror)
+            total[5] = max(total[5],newerror)
+            total[6] = max(total[6],newerror - max(tolerance,floor)) # How far the planner strays beyond what is achievable.
+            lines.append(name.ljust(8) + str(declination).rjust(5) + str(round(hours,1)).rjust(7) + str(round(floor,4)).rjust(8) + ' |' +
+                         str(round(oldsegs / hours,1)).rjust(14) + str(round(olderror,4)).rjust(9) + str(round(oldcalcs / oldsegs,1)).rjust(10) + ' |' +
+                         str(round(newsegs / hours2,1)).rjust(15) + str(round(newerror,4)).rjust(9) + str(round(newcalcs / newsegs,1)).rjust(10))
+    for name,total in totals.items():
+        lines.append(name + ': segments ' + str(total[0]) + ' -> ' + str(total[1]) + ' (' + str(round(100.0 * (1 - total[1] / total[0]),1)) + '% fewer), ' +
+                     'position calculations ' + str(total[2]) + ' -> ' + str(total[3]) + ', worst error ' + str(round(total[4],4)) + ' -> ' + str(round(total[5],4)) + ' deg, ' +
+                     'worst excess over max(tolerance,floor) ' + str(round(max(0.0,total[6]),4)) + ' deg.')
+    return lines, totals
+
+if __name__ == "__main__":
+    latitude = float(sys.argv[1]) if len(sys.argv) > 1 else 52.0 # Alternative latitude and tolerance.
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+    lines, totals = CompareReport(latitude=latitude,tolerance=tolerance)
+    for line in lines: print(line)
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+
+# Pilomar's transmit scheduler for messages sent to the microcontroller.
+
+# This software is published under the GNU General Public License v3.0.
+# Also respect any pre-existing terms of any components that this incorporates.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# microcontroller.WritePoll() used to send one 32 byte chunk every 0.2 seconds, whatever the message.
+# That protects the microcontroller's receive buffer, but a burst of configuration messages takes many
+# seconds and a 'stop' waits behind every trajectory segment already queued.
+#
+# The microcontroller reports every message it receives with a 'rec: [n]' log line, and every binary frame
+# with 'binary ack {sequence} ...'. So the RPi knows how much data is still in flight:
+#   - Messages are written as fast as the link allows while the unacknowledged bytes and messages fit
+#     inside a window. The window is smaller than the microcontroller's 1024 byte UART receive buffer and
+#     its 20 line input queue, so nothing overflows even while the microcontroller is busy stepping.
+#   - An acknowledgement releases that message and everything written before it.
+#   - Old firmware, corrupted lines and lost log lines never acknowledge, so messages in flight for
+#     longer than AckTimeout are released anyway. The worst case is the old timer pacing.
+#   - Comments are never acknowledged by the microcontroller, they don't count against the window.
+#
+# Messages are sent in priority order, FIFO within each priority.
+#   URGENT: stop, exit. Ignore the window and go next.
+#   NORMAL: configuration, status requests, clock, goto, clear trajectory, comments.
+#   BULK:   trajectory segments and binary frames.
+# A message that is partly written always finishes first, lines cannot be interleaved.
+# Only stop and exit overtake queued messages. A 'goto' stays in order behind any configuration it depends on.
+# 'clear trajectory' stays in order too, and discards the trajectory segments and frames still queued, otherwise
+# they would overtake it as BULK messages or refill the trajectory straight after it was cleared.
+#
+# Queue depth, write latency (queued -> last byte written) and acknowledgement latency are recorded per message class.
+# tests/test_transmit.py checks the flow control and priorities over a pty loopback.
+
+import time
+import threading
+from collections import deque
+
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ('urgent','normal','bulk')
+URGENT_CLASSES = ('stop','exit') # Motion safety first. These are the only messages that overtake the queue.
+CLEARING_CLASSES = ('clear',) # Discard the queued BULK messages. ('clear trajectory')
+BULK_CLASSES = ('trajectory','frame') # Plenty of time in hand, the trajectory window is 20 minutes.
+
+def MessageClass(line):
+    """ The message class is the command verb. '#' for comments. """
+    if line.startswith('#'): return '#'
+    return line.split(' ',1)[0]
+
+def MessagePriority(messageclass):
+    """ Priority of a message class. """
+    if messageclass in URGENT_CLASSES: return PRIORITY_URGENT
+    if messageclass in BULK_CLASSES: return PRIORITY_BULK
+    return PRIORITY_NORMAL
+
+def ParseAck(line):
+    """ Message id from a microcontroller receipt log line, eg 'log :20250115200000:rec: [12]'. None if it isn't one. """
+    i = line.find('rec: [')
+    if i < 0: return None
+    j = line.find(']',i)
+    try:
+        return int(line[i + 6:j])
+    except ValueError:
+        return None
+
+def Percentile(values,percent):
+    """ Nearest rank percentile of a sequence, None if empty. """
+    if len(values) == 0: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1,int(len(ordered) * percent / 100.0))]
+
+class transmitmessage():
+    """ A message waiting for, or in, transmission. """
+
+    def __init__(self,data,messageclass,priority,messageid=None,frame=None,queued=0.0):
+        self.Data = data # Encoded bytes, including the line terminator.
+        self.Class = messageclass
+        self.Priority = priority
+        self.Id = messageid # Text message id, acknowledged by 'rec: [id]'.
+        self.Frame = frame # Binary frame sequence number, acknowledged by 'binary ack'.
+        self.Tracked = messageid != None or frame != None # Comments have an id but are never acknowledged.
+        self.Offset = 0 # Bytes written so far.
+        self.Queued = queued
+        self.Written = None
+
+class transmitscheduler():
+    """ Priority ordered, acknowledgement paced transmit queue. """
+
+    def __init__(self,chunkbytes=32,windowbytes=768,windowmessages=10,acktimeout=2.0,history=200,clock=time.monotonic):
+        """ chunkbytes = Largest single write.
+            windowbytes = Unacknowledged bytes allowed in flight. (Microcontroller UART buffer is 1024 bytes)
+            windowmessages = Unacknowledged messages allowed in flight. (Microcontroller input queue holds 20 lines)
+            acktimeout = Seconds before an unacknowledged message is assumed delivered.
+            history = Latencies kept per message class for the percentiles.
+            clock = Time source in seconds. """
+        self.ChunkBytes = chunkbytes
+        self.WindowBytes = windowbytes
+        self.WindowMessages = windowmessages
+        self.AckTimeout = acktimeout
+        self.History = history
+        self.Clock = clock
+        self.Lock = threading.Lock() # Messages are queued from several threads, the comms thread writes them.
+        self.Queues = [deque() for name in PRIORITY_NAMES] # One FIFO per priority.
+        self.Current = None # Message being written.
+        self.InFlight = deque() # Written, waiting for acknowledgement. Oldest first.
+        self.InFlightBytes = 0
+        self.Classes = {} # class : statistics
+        self.Stalls = 0 # How often the window held a message back.
+        self.Timeouts = 0 # Messages released without an acknowledgement.
+        self.Acknowledged = 0 # Messages released by an acknowledgement.
+
+    def ClassStats(self,messageclass):
+        """ Statistics for a message class, created when first seen. """
+        stats = self.Classes.get(messageclass)
+        if stats == None:
+            stats = {'queued':0,'sent':0,'acked':0,'timeouts':0,'dropped':0,'latency':deque(maxlen=self.History),'acklatency':deque(maxlen=self.History)}
+            self.Classes[messageclass] = stats
+        return stats
+
+    def Add(self,data,messageclass,messageid=None,frame=None,priority=None):
+        """ Queue a message.
+            data = Bytes to send, including any terminator.
+            messageclass = See MessageClass(), 'frame' for binary frames.
+            messageid = Text message id, None if the microcontroller won't acknowledge it.
+            frame = Binary frame sequence number.
+            priority = Overrides MessagePriority(messageclass).
+            Returns the message. """
+        if priority == None: priority = MessagePriority(messageclass)
+        if messageclass == '#': messageid = None # The microcontroller doesn't acknowledge comments.
+        with self.Lock:
+            if messageclass in CLEARING_CLASSES: self.DropQueued(PRIORITY_BULK)
+            message = transmitmessage(data,messageclass,priority,messageid,frame,self.Clock())
+            self.Queues[priority].append(message)
+            self.ClassStats(messageclass)['queued'] += 1
+        return message
+
+    def DropQueued(self,priority):
+        """ Discard the messages waiting at one priority. A partly written message still finishes. Call with the Lock held. """
+        queue = self.Queues[priority]
+        for message in queue: self.ClassStats(message.Class)['dropped'] += 1
+        queue.clear()
+
+    def WindowOpen(self,size):
+        """ Can 'size' more bytes go out? Something always goes when nothing is in flight. """
+        if len(self.InFlight) == 0: return True
+        return self.InFlightBytes + size <= self.WindowBytes and len(self.InFlight) < self.WindowMessages
+
+    def Next(self,window=True):
+        """ The next chunk to write. Returns (bytes,message) or (None,None) if nothing can be sent now.
+            window = False ignores the flow control window. (Final flush, nothing is reading the acknowledgements) """
+        with self.Lock:
+            now = self.Clock()
+            self.Expire(now)
+            if self.Current == None:
+                queue = None
+                for q in self.Queues:
+                    if len(q) > 0:
+                        queue = q
+                        break
+                if queue == None: return None,None # Nothing to send.
+                message = queue[0]
+                if window and message.Priority != PRIORITY_URGENT and not self.WindowOpen(len(message.Data)):
+                    self.Stalls += 1
+                    return None,None # Wait for acknowledgements.
+                self.Current = queue.popleft()
+            message = self.Current
+            chunk = message.Data[message.Offset:message.Offset + self.ChunkBytes]
+            message.Offset += len(chunk)
+            if message.Offset >= len(message.Data): # Completely written.
+                self.Current = None
+                message.Written = now
+                stats = self.ClassStats(message.Class)
+                stats['sent'] += 1
+                stats['latency'].append(now - message.Queued)
+                if message.Tracked:
+                    self.InFlight.append(message)
+                    self.InFlightBytes += len(message.Data)
+            return chunk,message
+
+    def Release(self,count,now,acknowledged):
+        """ Remove the oldest 'count' messages from the in flight list. """
+        for i in range(count):
+            message = self.InFlight.popleft()
+            self.InFlightBytes -= len(message.Data)
+            stats = self.ClassStats(message.Class)
+            if acknowledged:
+                self.Acknowledged += 1
+                stats['acked'] += 1
+                stats['acklatency'].append(now - message.Queued)
+            else:
+                self.Timeouts += 1
+                stats['timeouts'] += 1
+
+    def Expire(self,now):
+        """ Release messages that were never acknowledged. """
+        count = 0
+        for message in self.InFlight:
+            if now - message.Written <= self.AckTimeout: break
+            count += 1
+        if count > 0: self.Release(count,now,False)
+
+    def Ack(self,messageid=None,frame=None):
+        """ The microcontroller received a text message (messageid) or binary frame (frame).
+            Releases it and everything written before it. Returns True if it was in flight. """
+        with self.Lock:
+            for i,message in enumerate(self.InFlight):
+                if (messageid != None and message.Id == messageid) or (frame != None and message.Frame == frame):
+                    self.Release(i + 1,self.Clock(),True)
+                    return True
+        return False
+
+    def Clear(self):
+        """ Drop everything queued and in flight. A partly written message is abandoned too. Returns the number of messages dropped. """
+        with self.Lock:
+            dropped = sum([len(q) for q in self.Queues]) + (1 if self.Current != None else 0)
+            for q in self.Queues: q.clear()
+            self.Current = None
+            self.InFlight.clear()
+            self.InFlightBytes = 0
+        return dropped
+
+    def Depth(self,priority=None):
+        """ Messages waiting to be written, including the one being written. """
+        if priority != None: return len(self.Queues[priority])
+        return sum([len(q) for q in self.Queues]) + (1 if self.Current != None else 0)
+
+    def First(self):
+        """ The message that will be written next, None if the queue is empty. """
+        if self.Current != None: return self.Current
+        for q in self.Queues:
+            if len(q) > 0: return q[0]
+        return None
+
+    def Latency(self,percent=50,messageclass=None):
+        """ Write latency percentile in seconds, for one message class or all of them. None if nothing sent yet. """
+        with self.Lock:
+            if messageclass != None: values = list(self.ClassStats(messageclass)['latency'])
+            else: values = [v for stats in self.Classes.values() for v in stats['latency']]
+        return Percentile(values,percent)
+
+    def Report(self):
+        """ Queue depth and latency per message class. Latencies in milliseconds. """
+        result = {}
+        with self.Lock:
+            depth = {}
+            for q in self.Queues:
+                for message in q: depth[message.Class] = depth.get(message.Class,0) + 1
+            for name,stats in sorted(self.Classes.items()):
+                latency = list(stats['latency'])
+                acklatency = list(stats['acklatency'])
+                result[name] = {'priority':PRIORITY_NAMES[MessagePriority(name)],'depth':depth.get(name,0),
+                                'queued':stats['queued'],'sent':stats['sent'],'acked':stats['acked'],'timeouts':stats['timeouts'],'dropped':stats['dropped']}
+                for key,values in (('latency',latency),('ack',acklatency)):
+                    for percent in (50,99):
+                        value = Percentile(values,percent)
+                        result[name][key + '_ms_p' + str(percent)] = None if value == None else round(value * 1000,1)
+        return result
+
+    def Status(self):
+        """ One line summary for logs. """
+        return 'depth ' + str(self.Depth()) + ' inflight ' + str(len(self.InFlight)) + '/' + str(self.InFlightBytes) + 'b stalls ' + str(self.Stalls) + \
+               ' acked ' + str(self.Acknowledged) + ' timeouts ' + str(self.Timeouts)
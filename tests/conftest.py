@@ -0,0 +1,33 @@
+# pytest configuration for the Pilomar tests.
+# Run from the repository root:
+#   python -m pytest -q tests               Functional checks and small benchmarks. (Quick)
+#   python -m pytest -q -s tests --benchmark  Also run the full size timing benchmarks and print their results.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['src','circuitpython']: # The modules are run as scripts from these folders, not installed.
+    path = os.path.join(ROOT,folder)
+    if path not in sys.path: sys.path.insert(0,path)
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark',action='store_true',default=False,help='Run the full size timing benchmarks.')
+    parser.addoption('--commslog',default=None,help='Comms log extracted by ZipCommsLog() to replay through the message handlers.')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers','benchmark: full size timing benchmark, only runs with --benchmark.')
+
+def pytest_collection_modifyitems(config,items):
+    if config.getoption('--benchmark'): return
+    skip = pytest.mark.skip(reason='Timing benchmark, use --benchmark to run it.')
+    for item in items:
+        if 'benchmark' in item.keywords: item.add_marker(skip)
+
+@pytest.fixture
+def rng():
+    """ Seeded random generator so every run sees the same synthetic data. """
+    return np.random.default_rng(1)
@@ -0,0 +1,243 @@
+# obs_session and motorcontrol message handlers as they were before the dispatch table (user-045), for tests/test_messages.py.
+# The method bodies are copied unchanged from src/pilomar.py, only the docstrings are left out.
+# This file is not imported. pilomarharness.Load() runs it inside the pilomar.py namespace, so Mctl, MotorControls,
+# NowUTC() etc. are the same objects the current handlers use.
+
+class legacy_motorcontrol(motorcontrol):
+    """ motorcontrol with the ReceiveStatus(line) it had before the dispatch table. """
+
+    def ReceiveStatus(self,line):
+        lineitems = line.split(' ')
+        configuredflag = StringToBool(lineitems[9]) # Is the motor configured?
+        if configuredflag != self.MotorConfigured:
+            self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): Configured flag set to ",configuredflag,terminal=False)
+        self.MotorConfigured = configuredflag # Update the configured flag.
+        if self.MotorConfigured: # Only believe the angle once the motor is configured, otherwise it's just a default value and probably inaccurate.
+            self.PreviousAngle = self.CurrentAngle # Store previous position.
+            self.CurrentAngle = float(lineitems[8])
+            self.StoreRecoveryAngle() # Record the latest position of the motor for restart/recovery later.
+            self.TrajectoryValid = StringToBool(lineitems[4])
+            self.TrajectoryValidUntil = MctlStringToDatetime(lineitems[5])
+            self.TrajectoryEntries = int(lineitems[6])
+            self.OnTarget = StringToBool(lineitems[10]) # Is the motor on target?
+        else:
+            self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): Motor is not yet configured. Position and trajectory info ignored. Configuring now.",terminal=False)
+            self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName, "): Check RPi<>Mctl communication if problem persists.",terminal=False)
+            self.SendConfig() # Send motor configuration now.
+        # Calculate the following attributes regardless of configuration status.
+        self.StepPeriod = float(lineitems[11])
+        self.PreviousMctlTimestamp = self.StatusMctlTimestamp # Store previous timestamp
+        self.StatusMctlTimestamp = MctlStringToDatetime(lineitems[2]) # When did the Microcontroller send the status message?
+        self.StatusLocalTimestamp = NowUTC() # When did the RPi process the status message?
+        if len(lineitems) > 12:
+            self.VMotAdc = int(lineitems[12]) # Store the ADC value that is measuring the motor power supply voltage.
+            self.VMotToVolts() # Convert that to estimated volts. Populates self.VMotVolts attribute.
+        else: self.VMotAdc = self.VMotVolts = 0
+        if len(lineitems) > 15 and IsInt(lineitems[14]) and IsFloat(lineitems[15]): # We have a valid position_sensor position sensor reading.
+            self.update_position_sensor(value=int(lineitems[14]),angle=float(lineitems[15])) # Update values recorded for position_sensor position sensor.
+        else: # There is no position sensor reading available.
+            self.position_sensor_value = None
+        if len(lineitems) > 16: # position_sensor configured flag is available.
+            self.position_sensor_configured = StringToBool(lineitems[16])
+        else:
+            self.position_sensor_configured = False
+        if len(lineitems) > 17: # MotorController fault flag is available.
+            temp = StringToBool(lineitems[17])
+            if temp != self.DriverFault:
+                self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): DriverFault changed to",temp,terminal=False)
+                self.DriverFault = temp
+        else:
+            self.DriverFault = False
+        if len(lineitems) > 18: # MotorHalt latch
+            temp = StringToBool(lineitems[18])
+            if temp != self.MotorHalt:
+                self.Session.Log("motorcontrol.ReceiveStatus(",self.MotorName,"): MotorHalt changed to",temp,terminal=False)
+                self.MotorHalt = temp
+        else:
+            self.MotorHalt = False
+        _ = self.CalculateAxisSpeed() # Check motor speed.
+        Telemetry.Record('motorstatus',self.MotorName,self.StatusMctlTimestamp,StringToBool(lineitems[4]),TextToInt(lineitems[6]),TextToInt(lineitems[7]),
+                         float(lineitems[8]) if IsFloat(lineitems[8]) else None,self.MotorConfigured,self.OnTarget,self.StepPeriod,self.VMotAdc,
+                         self.position_sensor_value,self.position_sensor_angle if self.position_sensor_value != None else None,self.DriverFault,self.MotorHalt)
+        return True
+
+class legacy_obs_session(obs_session):
+    """ obs_session with the startswith() chain and the line handlers it had before the dispatch table. """
+
+    def Handle(self,line):
+        """ One pass of the old MctlHandler() loop for a line with data. """
+        if line.startswith('session'): self.CheckSessionStatus(line) # Gather information about the microcontroller general health.
+        elif line.startswith('comms'): self.CheckCommsStats(line) # Gather statistics about UART communication handling.
+        elif line.startswith('controller log'): pass # Just log messages from the microcontroller. No action needed.
+        elif line.startswith('log'): pass # Just log messages from the microcontroller. No action needed.
+        elif line.startswith('cleared trajectory'): pass # Just log these.
+        elif line.startswith('cpu status'): self.CheckCpuStatus(line) # Check CPU status information from the microcontroller.
+        elif line.startswith('motor'): self.CheckMotorStatus(line) # Check motor info from microcontroller, respond with missing config etc.
+        elif line.startswith('controller heartbeat'): pass # Just log these.
+        elif line.startswith('heartbeat'): pass # Just log these.
+        elif line.startswith('acknowledged'): pass # Just log these.
+        elif line.startswith('#'): pass # Comments from microcontroller, ignore them.
+        elif line.startswith('controller version'): self.CheckControllerVersion(line) # Check that software is compatible across devices.
+        elif line.startswith('goto rejected'): self.CheckGotoRejected(line) # A goto command was rejected.
+        elif line.startswith('tune complete'): self.CheckTuneComplete(line) # A tune command has been processed.
+        elif line.startswith('controller started'): self.CheckControllerStarted(line) # Microcontroller reports a restart. Trigger chain of updates.
+        elif line.startswith('pin status'): self.MctlPinStatus(line) # Store the reported pin status from the microcontroller.
+        elif line.startswith('defined motors'): pass # Just log these.
+        elif line.startswith('binary'): self.CheckBinary(line) # Binary frame negotiation and acknowledgements.
+        else: self.UnrecognisedMessage(line) # Unexpected or corrupted message.
+
+    def CheckCpuStatus(self,line):
+        lineitems = line.split(' ')
+        Mctl.ReportedResetReason = lineitems[3] # eg 'POWER_ON' # RESET REASON if reported.
+        Mctl.ReportedClockspeed = 1e6 * float(lineitems[4]) # Clock speed in MHz
+        if IsFloat(lineitems[5]): Mctl.ReportedVoltage = float(lineitems[5]) # CPU voltage if known
+        else: Mctl.ReportedVoltage = 0.0 # Nothing reported.
+        Mctl.ReportedMemAlloc = int(lineitems[6]) # Memory allocated (bytes)
+        Mctl.ReportedMemFree = int(lineitems[7]) # Memory free (bytes)
+        Mctl.ReportedTemperature = float(lineitems[8]) # CPU temperature (C)
+        if len(lineitems) > 9: # Get the feature list from the microcontroller software.
+            Mctl.ReportedFeatures = lineitems[9].split('_')
+
+    def CheckMotorStatus(self,line):
+        lineitems = line.split(' ') # Split out all the elements of the line.
+        motorname = lineitems[3] # Extract motor name.
+        foundit = False
+        for i in MotorControls:
+            if i.MotorName == motorname:
+                foundit = True
+                i.ReceiveStatus(line) # Update motor status information.
+        self.CheckTrajectory(line,self.Target) # Check observation is active and keep trajectory up-to-date if needed.
+        if not foundit: # The motor name was not recognised.
+            self.Session.Log('obs_session.CheckMotorStatus did not recognise the motor name (',motorname, ')', level='error')
+
+    def CheckSessionStatus(self,line):
+        lineitems = line.split(' ')
+        remotetime = MctlStringToDatetime(lineitems[2]) # What does the remote system report as the time?
+        self.TimeDiff = NowUTC() - remotetime # What's the time difference?
+        Mctl.ClockSynchronised = StringToBool(lineitems[3])
+        Mctl.AutonomousControl = StringToBool(lineitems[4])
+        Mctl.RemoteControl = StringToBool(lineitems[5])
+        Mctl.MctlLifeSeconds = int(lineitems[6])
+        if len(lineitems) > 7: # How many times has the microcontroller flushed the trajectory because of comms problems?
+            self.TrajectorySafetyFlushes = int(lineitems[7])
+        else:
+            self.TrajectorySafetyFlushes = 0
+        if len(lineitems) > 9: # Exception count is included in the message.
+           Mctl.MctlExceptionCount = int(lineitems[9])
+        if len(lineitems) > 10: # Code.py version number is available.
+           self.ControllerVersion = lineitems[10]
+        if Mctl.ClockSynchronised == False: # Clock has not yet been synchronised.
+            # Synchronise clocks.
+            line = 'set time ' + CleanDatetimeString(str(NowUTC()))
+            Mctl.Write(line)
+        if Mctl.ClockSynchronised: temp = 'Synchronised'
+        else: temp = 'Unsynchronised'
+
+    def CheckCommsStats(self,line):
+        lineitems = line.split(' ')
+        Mctl.MctlRxErrors = int(lineitems[3])
+        Mctl.MctlRxBytes = int(lineitems[4])
+        Mctl.MctlTxBytes = int(lineitems[5])
+        Mctl.MctlWriteDrops = int(lineitems[6])
+
+    def CheckTrajectory(self,line,targetobj): # Needs reworking for actual Skyfield trajectory.
+        lineitems = line.split(' ')
+        motorname = lineitems[3]
+        # This should only send a trajectory update IF we're TRACKING something!
+        if self.MaintainTrajectory:
+            foundit = False
+            for i in MotorControls:
+                if i.MotorName == motorname:
+                   foundit = True
+                   i.TrajectoryEntries = int(lineitems[6])
+                   i.TrajectoryValid = StringToBool(lineitems[4])
+                   i.TrajectoryValidUntil = MctlStringToDatetime(lineitems[5])
+                   duration = i.TrajectoryValidUntil - NowUTC()
+                   #if duration.total_seconds() < Parameters.TrajectoryWindow and self.ClockSynchronised: # We need to add time to the trajectory plan.
+                   if duration.total_seconds() < Parameters.TrajectoryWindow and Mctl.ClockSynchronised: # We need to add time to the trajectory plan.
+                       if not Mctl.BinaryTrajectories: # Text protocol, one segment per status message.
+                           self.Session.Log('obs_session.CheckTrajectory: Decided to extend.',terminal=False)
+                           i.ExtendTrajectory(targetobj)
+                       elif not Mctl.FramePending(): # Binary frames, fill the window in one go.
+                           self.Session.Log('obs_session.CheckTrajectory: Decided to extend (binary).',terminal=False)
+                           for n in range(Mctl.BinaryFrameSegments): # Limit the batch, the next acknowledgement triggers more.
+                               endutc = i.ExtendTrajectory(targetobj)
+                               if endutc is None: break # Trajectory is complete.
+                               i.TrajectoryValidUntil = endutc # Next segment starts where this one ends.
+                               if (endutc - NowUTC()).total_seconds() >= Parameters.TrajectoryWindow: break # Window is full.
+            if not foundit: # The motor name was not recognised.
+                self.Session.Log('obs_session.CheckTrajectory did not recognise the motor name (',motorname, ')', level='error')
+
+    def CheckBinary(self,line):
+        lineitems = line.split(' ')
+        if len(lineitems) >= 3 and lineitems[1] == 'accept':
+            Mctl.BinaryTrajectories = Parameters.MctlBinaryFrames # Trajectories are sent in binary frames from now on.
+            self.Session.Log('obs_session.CheckBinary: Microcontroller accepted binary frames version',lineitems[2],terminal=False)
+        elif len(lineitems) >= 5 and lineitems[1] == 'ack':
+            Mctl.FramesAcknowledged += 1
+            if lineitems[2] == str((Mctl.FrameSequence - 1) & 0xFFFF): Mctl.FramePendingTime = None # Latest frame arrived, more can be sent.
+            rejected = int(lineitems[4]) - int(lineitems[3])
+            if rejected > 0:
+                Mctl.FrameSegmentsRejected += rejected
+                self.Session.Log('obs_session.CheckBinary: Microcontroller rejected',rejected,'segments from frame',lineitems[2],terminal=False)
+        else:
+            self.UnrecognisedMessage(line)
+
+    def CheckControllerStarted(self,line):
+        Mctl.MctlRestarted()
+        for i in MotorControls:
+            i.Restarted() # Need to mark that the motor is nolonger configured.
+        self.Session.Log('obs_session:CheckControllerStarted(): Microcontroller reports restart.',terminal=False)
+        ErrorWindow.Print(NowHMS() + ' Microcontroller reports restart.')
+
+    def CheckGotoRejected(self,line):
+        self.Session.Log('obs_session:MctlHandler(): Microcontroller rejected goto command.',terminal=False)
+        ErrorWindow.Print(NowHMS() + ' Microcontroller rejected goto command: ' + line)
+
+    def CheckTuneComplete(self,line): # A tune command has been processed.
+        foundit = False
+        lineitems = line.split(' ')
+        motorname = lineitems[2] # Which motor?
+        for i in MotorControls:
+            if i.MotorName == motorname:
+                i.TuneComplete(line)
+                foundit = True
+        if not foundit: # The motor name was not recognised.
+            self.Session.Log('obs_session.CheckTuneComplete did not recognise the motor name (',motorname, ')', level='error')
+
+    def UnrecognisedMessage(self,line):
+        self.Session.Log('obs_session:UnrecognisedMessage():',line,terminal=False)
+        ErrorWindow.Print(NowHMS() + ' Unrecognised message: ' + line)
+
+    def CheckControllerVersion(self,line):
+        self.Session.Log('obs_session:CheckControllerVersion(): ' + line,terminal=False)
+        lineitems = line.split(' ')
+        result = False
+        if len(lineitems) > 2:
+            self.ControllerVersion = lineitems[2]
+            try:
+                compversion = self.ControllerVersion[:self.ControllerVersion.rindex('.')] # Ignore patch level. Select "a.b" from "a.b.c" format version numbers.
+                if compversion in ACCEPTABLECONTROLLERVERSIONS:
+                    result = True # Version is good.
+                else:
+                    self.Session.Log('obs_session.CheckControllerVersion():',self.ControllerVersion,'is not in',ACCEPTABLECONTROLLERVERSIONS,terminal=True)
+                    ErrorWindow.Print(NowHMS() + ' Controller version ' + compversion + ' is not in ' + str(ACCEPTABLECONTROLLERVERSIONS))
+            except Exception as e:
+                self.Session.Log('obs_session.CheckControllerVersion(): Failed to check',self.ControllerVersion,level='error')
+                self.Session.Log('obs_session.CheckControllerVersion(): Failed with',str(e),level='error')
+        else:
+            self.Session.Log('obs_session.CheckControllerVersion(): Response is incomplete:',line,level='warning')
+        return result
+
+    def MctlPinStatus(self,line):
+        self.Session.Log('obs_session.MctlPinStatus(): Received',line,terminal=False)
+        i = 3 # Start reading the entries out of the received message and update the information in a local dictionary.
+        lineitems = line.split(' ')
+        while i < len(lineitems): # Keep reading pin status entries until the whole line has been processed.
+            p_num = lineitems[i]
+            p_name = lineitems[i + 1]
+            p_status = StringToBool(lineitems[i + 2])
+            dict_entry = {'name':p_name, 'state':p_status, 'updated':StringToDatetime(lineitems[2])}
+            self.Session.Log('obs_session.MctlPinStatus(): Storing',dict_entry,'from',dict_entry['updated'],terminal=False)
+            self.MctlPinDict[p_num] = dict_entry
+            i += 3 # Move on to next entry.
@@ -0,0 +1,146 @@
+# Runs the obs_session and motorcontrol classes from src/pilomar.py without starting the program.
+# Importing pilomar.py starts the whole application (hardware, camera, dashboard), so Load() compiles only its
+# imports, functions, classes and literal constants into a fresh namespace. The objects the message handlers
+# talk to (Mctl, Telemetry, ErrorWindow, Parameters, the clock) are replaced by the recording doubles below.
+
+import ast
+import os
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PILOMAR = os.path.join(HERE,'..','src','pilomar.py')
+LEGACY = os.path.join(HERE,'legacyhandlers.py')
+NOW = datetime(2025,1,15,20,0,30,tzinfo=timezone.utc) # Frozen clock, part way into synthetic.commslog().
+
+# Motor parameters the handlers need. (The parameter file defaults for a tmc2209 board)
+MOTORPARAMETERS = {'azimuth':{'MinAngle':0.0,'MaxAngle':360.0,'RestAngle':180.0,'BacklashAngle':0.0,'Orientation':-1,'LimitAngle':None,
+                              'Horizon':None,'FastTime':0.0005,'SlowTime':0.05,'TimeDelta':0.001,'GearRatio':240,'OptimiseMoves':False,
+                              'MotorStepsPerRev':200,'MicrostepRatio':1,'SlewMicrostepRatio':1,'SlewEnabled':False},
+                   'altitude':{'MinAngle':-10.0,'MaxAngle':90.0,'RestAngle':0.0,'BacklashAngle':0.0,'Orientation':1,'LimitAngle':None,
+                               'Horizon':0.0,'FastTime':0.0005,'SlowTime':0.05,'TimeDelta':0.001,'GearRatio':240,'OptimiseMoves':False,
+                               'MotorStepsPerRev':200,'MicrostepRatio':1,'SlewMicrostepRatio':1,'SlewEnabled':False}}
+
+_Source = {} # filename : parsed module, parsing pilomar.py takes a while.
+
+def Definitions(filename):
+    """ The top level statements of a file that only define things: imports, functions, classes and literal constants. """
+    if filename not in _Source:
+        with open(filename,'r') as f: tree = ast.parse(f.read(),filename)
+        nodes = []
+        for node in tree.body:
+            if isinstance(node,(ast.Import,ast.ImportFrom,ast.FunctionDef,ast.ClassDef)): nodes.append(node)
+            elif isinstance(node,ast.Assign) and all([isinstance(target,ast.Name) for target in node.targets]):
+                try:
+                    ast.literal_eval(node.value)
+                    nodes.append(node)
+                except ValueError: pass # Built at runtime, eg Mctl = InitiateMctl().
+        _Source[filename] = [compile(ast.Module([node],[]),filename,'exec') for node in nodes]
+    return _Source[filename]
+
+class recorder():
+    """ Records every call as (name, args). """
+
+    def __init__(self):
+        self.Calls = []
+
+    def Record(self,*args,**kwargs):
+        self.Calls.append(('Record',args))
+
+    def Print(self,*args,**kwargs):
+        self.Calls.append(('Print',args))
+
+class session():
+    """ The parts of pilomarsession the handlers use. Log lines are recorded, not written. """
+
+    def __init__(self,parameters):
+        self.Parameters = parameters
+        self.Hardware = type('hardware',(),{'pcb_driver':'tmc2209'})()
+        self.Logged = []
+
+    def Log(self,*args,level='info',terminal=True,**kwargs):
+        self.Logged.append((level,' '.join([str(arg) for arg in args])))
+
+    def RaiseException(self,*args):
+        raise Exception(' '.join([str(arg) for arg in args]))
+
+def Parameters(namespace):
+    """ pilomar's parameters object with just the values the handlers read. (Nothing is loaded from or saved to disc) """
+    result = namespace['parameters'].__new__(namespace['parameters'])
+    result.MotorParameters = MOTORPARAMETERS
+    result.StepperDriverData = {}
+    result.DebugMode = False
+    result.TrajectoryWindow = 300 # Seconds of trajectory kept on the microcontroller.
+    result.MctlBinaryFrames = True
+    result.MotorStatusDelay = 10
+    result.TraceMove = False
+    result.FaultSensitive = False
+    return result
+
+class mctl():
+    """ The microcontroller's state and the messages queued for it. """
+
+    def __init__(self):
+        self.Written = [] # Every line passed to Write().
+        self.Restarts = 0
+        self.BinaryTrajectories = False
+        self.FrameSequence = 0
+        self.BinaryFrameSegments = 16
+        self.FramesAcknowledged = 0
+        self.FrameSegmentsRejected = 0
+        self.FramePendingTime = None
+
+    def Write(self,line):
+        self.Written.append(line)
+
+    def WriteFlush(self,send=True):
+        self.Written.append('<flush>')
+
+    def MctlRestarted(self):
+        self.Restarts += 1
+        self.FramePendingTime = None
+
+    def FramePending(self):
+        return self.FramePendingTime != None
+
+def Load(root,legacy=False,now=NOW):
+    """ Namespace holding pilomar.py's definitions, with doubles for the objects created at runtime.
+        root = Folder for the motor recovery files.
+        legacy = Also define legacy_obs_session and legacy_motorcontrol from legacyhandlers.py. """
+    namespace = {'__name__':'pilomar','__file__':PILOMAR}
+    for code in Definitions(PILOMAR):
+        try: exec(code,namespace)
+        except ImportError: pass # Hardware and astronomy libraries, the handlers don't use them.
+    if legacy:
+        for code in Definitions(LEGACY): exec(code,namespace)
+    namespace['Parameters'] = Parameters(namespace)
+    namespace['Mctl'] = mctl()
+    namespace['Telemetry'] = recorder()
+    namespace['ErrorWindow'] = recorder()
+    namespace['MainLog'] = session(namespace['Parameters'])
+    namespace['WarningFlags'] = namespace['warnings']()
+    namespace['DegreeSymbol'] = 'deg'
+    namespace['ProjectRoot'] = root
+    namespace['NowUTC'] = lambda: now
+    namespace['motorcontrol'].AllMotors = namespace['MotorControls'] = []
+    return namespace
+
+def Build(namespace,legacy=False):
+    """ An obs_session and both motors, the old or the current classes. Returns (session, obs_session). """
+    prefix = 'legacy_' if legacy else ''
+    sess = session(namespace['Parameters'])
+    for name in MOTORPARAMETERS:
+        os.makedirs(os.path.join(namespace['ProjectRoot'],'data',name + '_angle'),exist_ok=True) # VerifyFolder() would shell out to mkdir.
+        namespace[prefix + 'motorcontrol'](name,pilomarsession=sess)
+    return sess, namespace[prefix + 'obs_session'](pilomarsession=sess)
+
+def Tracking(root,legacy=False):
+    """ Fresh namespace, motors and an obs_session tracking a target.
+        Returns (namespace, session, obs_session, function that handles one received message). """
+    namespace = Load(str(root),legacy=legacy)
+    sess,obs = Build(namespace,legacy=legacy)
+    obs.SetMotorControlMode('trajectory')
+    obs.Target = 'target'
+    for motor in namespace['MotorControls']: # ExtendTrajectory() needs skyfield, record the requests instead.
+        motor.ExtendTrajectory = lambda target,motor=motor: sess.Logged.append(('extend',motor.MotorName,target))
+    handle = obs.Handle if legacy else obs.Dispatcher.Dispatch
+    return namespace,sess,obs,handle
@@ -0,0 +1,81 @@
+# Synthetic sky frames shared by the tests and benchmarks.
+# Every builder takes a numpy random generator so results repeat from run to run.
+
+import random
+from datetime import datetime, timedelta, timezone
+
+import cv2
+import numpy as np
+
+from pilomarimage import pilomarimage
+from pilomarreplay import commsentry
+
+COMMSLOG_START = datetime(2025,1,15,20,0,0,tzinfo=timezone.utc) # When commslog() sessions begin.
+
+def seed(value=1):
+    """ Seed the global generators used by pilomarimage.FakeNoise() and FakeMeteor(). """
+    random.seed(value)
+    np.random.seed(value)
+
+def starsky(height,width,rng,margin=0,density=2000,brightness=(204,204)):
+    """ Float32 BGR star field with 1 star per 'density' pixels. Each star's peak is drawn from the 'brightness' range.
+        'margin' pixels are added on every side so drifting frames can be cut from it with skyframe(). """
+    sky = np.zeros((height + 2 * margin,width + 2 * margin,3),np.float32)
+    for i in range(int(sky.shape[0] * sky.shape[1] / density)):
+        centre = (int(rng.integers(0,sky.shape[1])),int(rng.integers(0,sky.shape[0])))
+        radius = int(rng.integers(1,3))
+        level = float(rng.uniform(*brightness)) if brightness[1] > brightness[0] else float(brightness[0])
+        cv2.circle(sky,centre,radius,(level,level,level),-1)
+    return cv2.GaussianBlur(sky,(5,5),1.2)
+
+def skyframe(sky,ox,oy,margin,height,width):
+    """ uint8 frame cut from a starsky() with the camera offset by (ox,oy) pixels. """
+    matrix = np.float32([[1,0,-(margin + ox)],[0,1,-(margin + oy)]])
+    return np.clip(cv2.warpAffine(sky,matrix,(width,height)),0,255).astype(np.uint8)
+
+def starfield(height,width,stars,rng):
+    """ uint8 BGR field of 'stars' gaussian stars of random brightness and a random seeing blur. """
+    sky = np.zeros((height,width),np.float32)
+    xs = rng.integers(10,width - 10,stars)
+    ys = rng.integers(10,height - 10,stars)
+    sky[ys,xs] = rng.uniform(200,3000,stars) # Point sources, blurred into stars below.
+    sky = cv2.GaussianBlur(sky,(0,0),float(rng.uniform(1.0,2.0)))
+    return cv2.cvtColor(np.clip(sky,0,255).astype(np.uint8),cv2.COLOR_GRAY2BGR)
+
+def camera(buffer,name='synthetic'):
+    """ pilomarimage holding the buffer with the FakeField() and FakeNoise() camera effects added. """
+    frame = pilomarimage(name=name)
+    frame.LoadBuffer(buffer)
+    frame.FakeField()
+    frame.FakeNoise()
+    return frame
+
+def commslog(minutes=5,start=COMMSLOG_START):
+    """ Comms log entries shaped like a tracking session: a restart, status every 10 seconds, acknowledgements,
+        configuration, clock synchronisation and trajectory segments from the RPi. """
+    entries = []
+    sendid = 0
+    def ts(t): return t.strftime('%Y%m%d%H%M%S')
+    def tx(t,line):
+        nonlocal sendid
+        sendid += 1
+        entries.append(commsentry(t,'tx',line + ' [' + str(sendid) + ']'))
+        entries.append(commsentry(t + timedelta(seconds=0.05),'rx','log :' + ts(t) + ':rec: [' + str(sendid) + ']'))
+    entries.append(commsentry(start,'rx','controller started'))
+    entries.append(commsentry(start,'rx','controller version 1.2.0'))
+    for axis in ('azimuth','altitude'): tx(start + timedelta(seconds=0.2),'configure tmc2209 ' + ts(start) + ' ' + axis + ' 180.0 0.0 360.0')
+    for second in range(0,minutes * 60,10):
+        t = start + timedelta(seconds=second + 1)
+        configured = 'y' if second > 0 else 'n'
+        valid = 'y' if second > 20 else 'n'
+        entries.append(commsentry(t,'rx','session status ' + ts(t) + ' ' + ('y' if second > 0 else 'n') + ' ' + valid + ' y ' + str(second) + ' 0 tmr 0 1.2.0'))
+        if second == 0: tx(t + timedelta(seconds=0.01),'set time ' + ts(t))
+        for axis,angle in (('azimuth',180.0 + second / 600),('altitude',20.0 + second / 900)):
+            entries.append(commsentry(t + timedelta(seconds=0.1),'rx','motor status ' + ts(t) + ' ' + axis + ' ' + valid + ' ' +
+                                      ts(t + timedelta(seconds=60)) + ' 3 ' + str(int(angle * 100)) + ' ' + str(round(angle,4)) + ' ' +
+                                      configured + ' y 0.004 23269 tmr none none n n n'))
+            if configured == 'y': tx(t + timedelta(seconds=0.15),'trajectory ' + ts(t) + ' ' + axis + ' ' + ts(t) + ' ' + str(round(angle,4)) + ' ' +
+                                     ts(t + timedelta(seconds=60)) + ' ' + str(round(angle + 0.1,4)) + ' 45000 47500')
+        entries.append(commsentry(t + timedelta(seconds=0.2),'rx','comms status ' + ts(t) + ' 0 ' + str(second * 100) + ' ' + str(second * 300) + ' 0'))
+    entries.sort(key=lambda entry: entry.Time)
+    return entries
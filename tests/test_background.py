@@ -0,0 +1,110 @@
+# pilomarimage.FitPolynomialBackground(): polynomial gradient fits on a binned grid, against the original full
+# resolution fit and against binning=1.
+
+import copy
+import time
+
+import numpy as np
+import pytest
+
+from pilomarimage import pilomarimage
+
+def LegacyFit(gray,order=3,mask=None):
+    """ The original FitPolynomialBackgroundGray() / FitPolynomialBackgroundMasked(): every pixel, raw pixel coordinates. """
+    h, w = gray.shape
+    y, x = np.mgrid[0:h, 0:w]
+    X = np.column_stack([x.ravel()**i * y.ravel()**j
+                         for i in range(order+1)
+                         for j in range(order+1-i)])
+    Y = gray.ravel()
+    if mask is None: coeffs, _, _, _ = np.linalg.lstsq(X, Y, rcond=None)
+    else: coeffs, _, _, _ = np.linalg.lstsq(X[mask.ravel() == 0], Y[mask.ravel() == 0], rcond=None)
+    return np.dot(X, coeffs).reshape(h, w)
+
+def gradient(height,width,rng,stars=0):
+    """ Float32 gray frame: a cubic sky gradient (about 60 DN across the frame) plus noise, and optionally stars.
+        Returns (frame, true background). """
+    y,x = np.mgrid[-1:1:height * 1j,-1:1:width * 1j].astype(np.float32)
+    truth = 40 + 20 * x - 12 * y + 8 * x * y + 6 * x ** 2 - 5 * y ** 3 + 4 * x ** 2 * y
+    frame = truth + rng.normal(0,3,(height,width)).astype(np.float32)
+    for i in range(stars):
+        cx,cy = int(rng.integers(0,width)),int(rng.integers(0,height))
+        frame[max(0,cy - 2):cy + 3,max(0,cx - 2):cx + 3] += float(rng.uniform(50,150))
+    return frame,truth
+
+def timed(function,*args,**kwargs):
+    start = time.perf_counter()
+    result = function(*args,**kwargs)
+    return result,time.perf_counter() - start
+
+def compare(height,width,rng,stars=3000):
+    """ Old fit, new fit with binning=1 and binning=16, unmasked and star masked.
+        Returns a dictionary of timings and the largest differences in DN. """
+    image = pilomarimage(name='background')
+    results = {}
+    frame,truth = gradient(height,width,rng)
+    old,results['old_s'] = timed(LegacyFit,frame)
+    full,results['binning1_s'] = timed(image.FitPolynomialBackground,frame,binning=1)
+    binned,results['binning16_s'] = timed(image.FitPolynomialBackground,frame,binning=16)
+    results['binning16_vs_1'] = float(np.abs(binned - full).max())
+    results['new_vs_old'] = float(np.abs(binned - old).max())
+    results['old_vs_truth'] = float(np.abs(old - truth).max())
+    results['binning16_vs_truth'] = float(np.abs(binned - truth).max())
+    frame,truth = gradient(height,width,rng,stars=stars)
+    mask = image.DetectStarMaskGray(np.clip(frame,0,255).astype(np.uint8))
+    old,results['old_masked_s'] = timed(LegacyFit,frame,mask=mask)
+    full = image.FitPolynomialBackground(frame,mask=mask,binning=1)
+    binned,results['binning16_masked_s'] = timed(image.FitPolynomialBackground,frame,mask=mask,binning=16)
+    results['masked_binning16_vs_1'] = float(np.abs(binned - full).max())
+    results['masked_binning16_vs_truth'] = float(np.abs(binned - truth).max())
+    return results
+
+def check(results):
+    """ Binning moves the background by a few hundredths of a DN at most and the binned fit is never meaningfully
+        further from the true gradient than the old fit. (On 12MP frames the old fit is far off, see LegacyFit())
+        And binning is much faster than the old fit. """
+    assert results['binning16_vs_1'] < 0.05 and results['masked_binning16_vs_1'] < 0.1
+    assert results['binning16_vs_truth'] < 0.5 and results['masked_binning16_vs_truth'] < 0.5
+    assert results['binning16_vs_truth'] < results['old_vs_truth'] + 0.05
+    assert results['binning16_s'] * 10 < results['old_s'] and results['binning16_masked_s'] * 10 < results['old_masked_s']
+
+def test_binning(rng):
+    check(compare(760,1014,rng,stars=200))
+
+def output(buffer,step):
+    """ 8 bit buffer after running one filter step on a fresh image. """
+    image = pilomarimage(name='background')
+    image.LoadBuffer(buffer)
+    image.RunFilterMethod(copy.deepcopy(step))
+    return image.ImageBuffer.astype(np.int16)
+
+def scripts():
+    """ (script, step) for every polynomial gradient step in the default scripts. """
+    return [(script,name) for script,steps in pilomarimage.FILTERSCRIPTS.items() for name,step in steps.items()
+            if step.get('method','').startswith('removegradient_poly')]
+
+@pytest.mark.parametrize('script,name',scripts())
+def test_default_scripts_bounded(rng,script,name):
+    """ The default scripts fit on a 16 x 16 grid. Their 8 bit output is within 1 DN of the full resolution fit
+        ('binning':1), and within 0.05 DN on average. (Rounding flips a pixel by 1 DN here and there) """
+    step = pilomarimage.FILTERSCRIPTS[script][name]
+    assert step['binning'] == 16
+    frame,truth = gradient(760,1014,rng,stars=200)
+    buffer = np.clip(frame,0,255).astype(np.uint8)
+    if step['method'] != 'removegradient_polygray': buffer = np.dstack([buffer,buffer,buffer])
+    difference = np.abs(output(buffer,step) - output(buffer,dict(step,binning=1)))
+    assert difference.max() <= 1 and difference.mean() < 0.05
+
+def test_binning_opt_in(rng):
+    """ Scripts that don't ask for binning, eg custom scripts saved before it existed, keep the full resolution fit. """
+    frame,truth = gradient(380,507,rng)
+    buffer = np.clip(frame,0,255).astype(np.uint8)
+    step = {'method':'removegradient_polygray','order':3}
+    assert np.array_equal(output(buffer,step),output(buffer,dict(step,binning=1)))
+
+@pytest.mark.benchmark
+def test_benchmark_background(rng):
+    """ 12MP frames, the HQ camera's full resolution. """
+    results = compare(3040,4056,rng)
+    for key,value in results.items(): print(key,':',round(value,4))
+    check(results)
@@ -0,0 +1,90 @@
+# pilomarcalibration: master darks and flats built in strips, applied to light frames.
+
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from pilomarcalibration import LoadMaster, MasterFilename, calibrationbuilder, calibrator
+
+SKYNOISE = 2.0 # Standard deviation of the uniform sky in the light frame.
+
+def truth(rng,height,width,channels):
+    """ The true dark pattern (bias, amp glow in one corner, hot pixels) and flat field (vignetting, dust shadows). """
+    yy,xx = np.mgrid[0:height,0:width].astype(np.float32)
+    r2 = ((xx - width / 2) / width) ** 2 + ((yy - height / 2) / height) ** 2
+    pattern = 8 + 6 * np.exp(-((xx / width) ** 2 + (yy / height) ** 2) * 8)
+    hot = rng.integers(0,height * width,2000)
+    pattern.flat[hot] += rng.uniform(40,200,2000)
+    vignette = 1.0 - 0.6 * r2
+    for i in range(20):
+        cx,cy,rad = rng.uniform(0,width),rng.uniform(0,height),rng.uniform(10,60)
+        vignette *= 1.0 - 0.3 * np.exp(-(((xx - cx) ** 2 + (yy - cy) ** 2) / (rad ** 2)))
+    if channels > 1:
+        pattern = np.repeat(pattern[:,:,None],channels,axis=2)
+        vignette = np.repeat(vignette[:,:,None],channels,axis=2)
+    return pattern,vignette
+
+def calibrate(folder,rng,frames=50,height=3040,width=4056,channels=3,memory_mb=256):
+    """ Build master darks (median and sigma clipped) and a master flat from synthetic frames, compare them with the
+        true patterns, then calibrate a light frame of uniform sky.
+        Synthetic dark frames = pattern + read noise + 200 cosmic ray hits. Synthetic flat frames = vignette + shot noise.
+        Returns a dictionary of timings, errors and background levels. """
+    shape = (height,width,channels) if channels > 1 else (height,width)
+    pattern,vignette = truth(rng,height,width,channels)
+    darkfiles = []
+    flatfiles = []
+    for i in range(frames):
+        dark = pattern + rng.normal(0,3,shape)
+        dark.flat[rng.integers(0,dark.size,200)] = 255 # Cosmic rays.
+        darkfiles.append(os.path.join(folder,'dark_' + str(i).zfill(3) + '.png'))
+        cv2.imwrite(darkfiles[-1],np.clip(np.rint(dark),0,255).astype(np.uint8))
+        flat = 180 * vignette + rng.normal(0,4,shape)
+        flatfiles.append(os.path.join(folder,'flat_' + str(i).zfill(3) + '.png'))
+        cv2.imwrite(flatfiles[-1],np.clip(np.rint(flat),0,255).astype(np.uint8))
+    results = {'single_rms':float(np.sqrt(np.mean((cv2.imread(darkfiles[0],cv2.IMREAD_UNCHANGED).astype(np.float32) - pattern) ** 2)))}
+    builder = calibrationbuilder(memory_mb=memory_mb,scratchfolder=folder)
+    for method in ('median','sigma'):
+        start = time.time()
+        master,md = builder.Build('dark',darkfiles,MasterFilename(folder,'dark_' + method),method=method,metadata={'exposure':30.0})
+        results[method + '_build_s'] = time.time() - start
+        error = master - pattern
+        results[method + '_rms'] = float(np.sqrt(np.mean(error ** 2)))
+        results[method + '_cosmic_rays'] = int(np.sum(error > 30))
+    master,md = builder.Build('flat',flatfiles,MasterFilename(folder,'flat'),method='sigma')
+    darkmaster,darkmd = LoadMaster(MasterFilename(folder,'dark_sigma'))
+    cal = calibrator(dark=darkmaster,flat=master,darkmetadata=darkmd)
+    sky = np.clip(rng.normal(40,SKYNOISE,shape),0,255).astype(np.float32) # Uniform sky through the vignette and dust, plus the dark pattern.
+    light = np.clip(np.rint(sky * vignette + pattern),0,255).astype(np.uint8)
+    times = []
+    for i in range(10):
+        start = time.perf_counter()
+        out = cal.Apply(light,exposure=30.0)
+        times.append(time.perf_counter() - start)
+    results['apply_ms'] = 1000 * float(np.median(times))
+    results['std_before'] = float(np.std(light.astype(np.float32)))
+    results['std_after'] = float(np.std(out.astype(np.float32)))
+    results['strip_mb'] = builder.TileRows(frames,width,channels) * frames * width * channels * 4 * 4 / 1048576
+    results['stack_mb'] = frames * height * width * channels * 4 / 1048576
+    return results
+
+def check(results):
+    """ Masters are far closer to the truth than a single frame, sigma clipping removes every cosmic ray, and
+        calibration flattens the background, leaving little more than the sky's own noise. """
+    for method in ('median','sigma'):
+        assert results[method + '_rms'] < results['single_rms'] / 3, method + ' master is not much better than a single frame.'
+    assert results['sigma_cosmic_rays'] == 0
+    assert results['std_after'] < 0.6 * results['std_before'] and results['std_after'] < 1.2 * SKYNOISE
+    assert results['strip_mb'] < results['stack_mb']
+
+def test_calibration(tmp_path,rng):
+    check(calibrate(str(tmp_path),rng,frames=15,height=380,width=507,memory_mb=8))
+
+@pytest.mark.benchmark
+def test_benchmark_calibration(tmp_path,rng):
+    """ 50 x 12MP colour frames in a 256MB budget. """
+    results = calibrate(str(tmp_path),rng)
+    for key,value in results.items(): print(key,':',round(value,2) if isinstance(value,float) else value)
+    check(results)
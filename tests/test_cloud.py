@@ -0,0 +1,56 @@
+# pilomarcloudestimator: frame-rate cloud/transparency estimate and capture pause.
+
+import cv2
+import numpy as np
+import pytest
+
+import synthetic
+from pilomarimage import pilomarcloudestimator
+
+def night(estimator,rng,frames=60,height=760,width=1014):
+    """ Run a synthetic night: a star field with a bank of cloud drifting across it and back.
+        Cloud dims the stars underneath it and brightens the background (light pollution).
+        Returns a dictionary containing...
+          frame_ms: Average milliseconds per Estimate().
+          correlation: Correlation between the true clear fraction and the score. (1.0 = perfect)
+          paused_cloudy, paused_clear: Fraction of mostly cloudy (>60%) / clear (<10%) frames where capture was paused. """
+    estimator.Reset()
+    sky = synthetic.starsky(height,width,rng,density=1500,brightness=(60,255))[:,:,0]
+    yy,xx = np.mgrid[0:height,0:width].astype(np.float32)
+    edge = xx / width + 0.1 * np.sin(yy / height * 6) # Ragged cloud front.
+    truth = []
+    scores = []
+    paused = []
+    for i in range(frames):
+        position = 1.3 - 2.6 * abs(i / (frames - 1) - 0.5) # Front moves in then out again.
+        cloud = np.clip((position - edge) * 8,0,1)
+        cloud = cloud * (0.8 + 0.2 * cv2.GaussianBlur(rng.uniform(0,1,(height,width)).astype(np.float32),(0,0),15)) # Lumpy cloud.
+        frame = 15 + sky * (1 - cloud) + 40 * cloud + rng.normal(0,2.5,(height,width))
+        frame = cv2.cvtColor(np.clip(frame,0,255).astype(np.uint8),cv2.COLOR_GRAY2BGR)
+        result = estimator.Estimate(frame,expectedstars=100)
+        truth.append(1 - float(np.mean(cloud > 0.5)))
+        scores.append(result['score'])
+        paused.append(result['paused'])
+    truth = np.array(truth)
+    paused = np.array(paused)
+    return {'frames':frames,'size':(height,width),'frame_ms':round(1000 * estimator.AverageFrameSeconds(),2),
+            'correlation':round(float(np.corrcoef(truth,scores)[0,1]),3),
+            'paused_cloudy':round(float(np.mean(paused[truth < 0.4])) if np.any(truth < 0.4) else 0.0,3),
+            'paused_clear':round(float(np.mean(paused[truth > 0.9])) if np.any(truth > 0.9) else 0.0,3)}
+
+def check(results):
+    """ The score follows the cloud, and capture pauses under cloud but not in clear sky. """
+    assert results['correlation'] > 0.9
+    assert results['paused_cloudy'] > 0.5
+    assert results['paused_clear'] == 0.0
+
+def test_cloud_bank(rng):
+    check(night(pilomarcloudestimator('check'),rng,frames=40,height=380,width=507))
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('height,width,frames',[(760,1014,60),(3040,4056,20)])
+def test_benchmark_cloud(rng,height,width,frames):
+    """ Per-frame cost of the estimate. """
+    results = night(pilomarcloudestimator('benchmark'),rng,frames=frames,height=height,width=width)
+    print('Cloud estimation:',results)
+    check(results)
@@ -0,0 +1,87 @@
+# pilomarimage.CountStars(): all stars measured in bulk.
+
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import synthetic
+
+def original(frame,minval=3,maxval=650,maxstars=500,threshold=100):
+    """ The contour based count CountStars() replaced. Each dot is measured with its own OpenCV calls.
+        From: https://stackoverflow.com/questions/48154642/how-to-count-number-of-dots-in-an-image-using-python-and-opencv """
+    cvimagebuffer = frame.NewBufferType('grayscale')
+    temp, threshed = cv2.threshold(cvimagebuffer, threshold, 255, cv2.THRESH_BINARY_INV|cv2.THRESH_OTSU)
+    dots = cv2.findContours(threshed, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    starlist = []
+    for dot in dots:
+        if minval < cv2.contourArea(dot) < maxval: # Only small dots count as stars.
+            dot_x, dot_y, dot_w, dot_h = cv2.boundingRect(dot)
+            starlist.append([int(dot_x + dot_w / 2), int(dot_y + dot_h / 2), int((dot_w + dot_h) / 4)]) # [x, y, radius]
+        if len(starlist) >= maxstars: break
+    frame.StarList = starlist
+    frame.StarCount = len(starlist)
+    frame.CalculateStarSpread()
+    return len(starlist), starlist
+
+def compare(rng,frames=5,height=3040,width=4056,stars=2000):
+    """ Compare CountStars() with original() on synthetic star fields with the FakeField() and FakeNoise() effects.
+        Returns a dictionary containing...
+          new_ms, old_ms: Average milliseconds per call.
+          new_count, old_count: Average number of stars found.
+          identical: Fraction of the original [x,y,radius] entries found unchanged by the new version.
+          within_1px: Fraction of the original stars with a new star within 1 pixel.
+          spread_diff: Largest difference in AreaSpread.
+          limit_frames: Frames where the maxstars limit was hit. (Noise crossed the OTSU threshold)
+                        The original keeps the first contours found, the new version keeps the brightest, so these frames are not compared. """
+    synthetic.seed()
+    results = {'new_ms':[],'old_ms':[],'new_count':[],'old_count':[],'identical':[],'within_1px':[],'spread_diff':[]}
+    maxstars = stars * 2
+    limitframes = 0
+    for i in range(frames):
+        frame = synthetic.camera(synthetic.starfield(height,width,stars,rng))
+        start = time.perf_counter()
+        _,oldlist = original(frame,maxstars=maxstars)
+        results['old_ms'].append(1000 * (time.perf_counter() - start))
+        oldspread = frame.AreaSpread
+        _,newlist = frame.CountStars(maxstars=maxstars)
+        results['new_ms'].append(1000 * frame.CountStarsSeconds)
+        results['new_count'].append(len(newlist))
+        results['old_count'].append(len(oldlist))
+        if len(oldlist) >= maxstars:
+            limitframes += 1
+            continue
+        newset = set([tuple(star) for star in newlist])
+        results['identical'].append(sum([tuple(star) in newset for star in oldlist]) / max(1,len(oldlist)))
+        newpositions = np.array([star[:2] for star in newlist]).reshape(-1,2)
+        near = [len(newpositions) > 0 and np.abs(newpositions - star[:2]).max(axis=1).min() <= 1 for star in oldlist]
+        results['within_1px'].append(sum(near) / max(1,len(oldlist)))
+        results['spread_diff'].append(abs(frame.AreaSpread - oldspread))
+    summary = {key:round(float(max(value) if key == 'spread_diff' else np.mean(value)),3) for key,value in results.items() if len(value) > 0}
+    summary['limit_frames'] = limitframes
+    summary['compared'] = frames - limitframes
+    summary['size'] = (height,width)
+    return summary
+
+def check(results):
+    """ The new count finds the same stars as the original. """
+    assert results['compared'] > 0, "Every frame hit the maxstars limit, nothing was compared."
+    assert results['identical'] >= 0.99
+    assert results['within_1px'] == 1.0
+    assert results['spread_diff'] < 0.01
+
+def test_matches_original(rng):
+    check(compare(rng,frames=3,height=760,width=1014,stars=200))
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('height,width,stars,maxratio',[(760,1014,200,1.0),(3040,4056,2000,1.0),(3040,4056,8000,2.0)])
+def test_benchmark_countstars(rng,height,width,stars,maxratio):
+    """ Time per call, new against original.
+        The noisy frames are where the original traced thousands of contours, and the new version is much faster.
+        In a clean, crowded field both trace the same contours, but the new version also fills StarData for every star,
+        so it is allowed to take up to 'maxratio' times as long. """
+    results = compare(rng,height=height,width=width,stars=stars)
+    print('Star counting:',results)
+    check(results)
+    assert results['new_ms'] < maxratio * results['old_ms']
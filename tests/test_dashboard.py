@@ -0,0 +1,73 @@
+# pilomardashboard: dashboard drawn from snapshots in its own thread.
+
+import io
+import time
+
+import pytest
+
+from pilomardashboard import dashboardrenderer
+
+def render(snapshot,fields=1500,sink=None):
+    """ Stand in for the dashboard. Formats a window full of fields and writes them out. """
+    sink = io.StringIO() if sink == None else sink
+    for i in range(fields):
+        value = snapshot['az'] + i * 0.001
+        sink.write('\x1b[' + str(i % 40) + ';' + str(i % 80) + 'H' + str(round(value,3)).rjust(15) + '°')
+    return sink
+
+def loop(renderer,seconds=3.0,work=0.0005):
+    """ Stand in for the ObservationRun loop. Some control work, then publish a snapshot. """
+    end = time.monotonic() + seconds
+    az = 0.0
+    while time.monotonic() < end:
+        start = time.monotonic()
+        while time.monotonic() - start < work: az = (az + 0.0001) % 360 # Control work. (Trajectory, queues, checks)
+        renderer.Publish({'az':az},started=start)
+        time.sleep(0.001) # Keyboard scan and thread switches.
+    return renderer.Report()
+
+def compare(seconds):
+    """ Run the synthetic loop with inline and threaded rendering. """
+    results = {}
+    for name,period in (('inline',0.0),('threaded',1.0)):
+        renderer = dashboardrenderer(render,period=period)
+        renderer.Start()
+        results[name] = loop(renderer,seconds=seconds)
+        renderer.Stop()
+    return results
+
+def test_render_rate(seconds=1.0):
+    """ Inline mode draws every snapshot, threaded mode draws at the refresh rate. """
+    results = compare(seconds)
+    assert results['inline']['renders'] == results['inline']['loops']
+    assert results['threaded']['renders'] <= seconds / 1.0 + 1
+    assert results['threaded']['loops'] > results['threaded']['renders']
+
+def test_pause():
+    """ Pause holds the renderer off, nothing is drawn twice. """
+    drawn = []
+    renderer = dashboardrenderer(lambda snapshot: drawn.append(snapshot),period=0.0)
+    renderer.Pause()
+    renderer.Publish({'az':1.0})
+    assert drawn == [], "Paused renderer drew a snapshot."
+    renderer.Resume()
+    assert renderer.RenderLatest() and drawn == [{'az':1.0}]
+    assert not renderer.RenderLatest(), "Snapshot drawn twice."
+
+def test_render_errors():
+    """ A failing render function is counted and reported, the renderer carries on. """
+    failures = []
+    renderer = dashboardrenderer(lambda snapshot: 1 / 0,period=0.0,errorhandler=failures.append)
+    renderer.Publish({'az':1.0})
+    renderer.Publish({'az':2.0})
+    assert renderer.Errors == 2 and len(failures) == 2
+
+@pytest.mark.benchmark
+def test_benchmark_loop_latency(seconds=3.0):
+    """ Loop latency percentiles with inline and threaded rendering. """
+    results = compare(seconds)
+    print('\nmode         loops  renders  loop p50  loop p90  loop p99  loop max  render p50')
+    for name,report in results.items():
+        print(name.ljust(10),str(report['loops']).rjust(7),str(report['renders']).rjust(8),
+              *[(str(report[key]) + 'ms').rjust(9) for key in ('loop_ms_p50','loop_ms_p90','loop_ms_p99','loop_ms_max','render_ms_p50')])
+    assert results['threaded']['loop_ms_p50'] < results['inline']['loop_ms_p50'], "The control loop is faster without the drawing."
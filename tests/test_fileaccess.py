@@ -0,0 +1,93 @@
+# pilomarimage: memory-mapped .npy and .fits reads and writes.
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from pilomarimage import fits, pilomarimage
+
+def dropfilecache(filename):
+    """ Ask the O/S to forget its cached copy of a file, so the next read really comes from disc.
+        Returns True if the O/S accepted the request. (Linux, python 3.3+) """
+    if not hasattr(os,'posix_fadvise'): return False
+    try:
+        fd = os.open(filename,os.O_RDONLY)
+        try:
+            os.fsync(fd) # Dirty pages can't be dropped, write them out first.
+            os.posix_fadvise(fd,0,0,os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        return True
+    except OSError:
+        return False
+
+def writeframes(folder,rng,height,width,depth,frames):
+    """ Write synthetic 12bit frames as .npy files (and .fits for single channel frames when astropy is available).
+        Returns the list of filenames. """
+    frame = pilomarimage(name='synthetic')
+    frame.ImageBuffer = rng.integers(0,4096,size=(height,width,depth) if depth > 1 else (height,width),dtype=np.uint16)
+    filelist = []
+    for i in range(frames):
+        filename = os.path.join(folder,'frame_' + str(i) + '.npy')
+        assert frame.SaveNumpyFile(filename,mapped=True)
+        filelist.append(filename)
+        if fits != None and depth == 1: # FITS frames are single channel like the raw bayer data.
+            fitsname = filename.replace('.npy','.fits')
+            fits.PrimaryHDU(data=frame.ImageBuffer.astype(np.float32)).writeto(fitsname,overwrite=True)
+            filelist.append(fitsname)
+    return filelist
+
+@pytest.mark.parametrize('depth',[3,1])
+def test_mapped_matches_read(tmp_path,rng,depth):
+    """ A memory-mapped load returns exactly the rows a full read does, without pulling the file into RAM. """
+    for filename in writeframes(str(tmp_path),rng,300,400,depth,1):
+        read = pilomarimage(name='read')
+        mapped = pilomarimage(name='mapped')
+        assert read.LoadFile(filename,mapped=False) and mapped.LoadFile(filename,mapped=True)
+        assert not read.IsMapped()
+        assert mapped.IsMapped(), filename + " was not memory-mapped."
+        for y in [0,123,284]:
+            assert np.array_equal(read.GetRows(y,y + 16),mapped.GetRows(y,y + 16))
+        mapped.ResolveMapping()
+        assert not mapped.IsMapped()
+        assert np.array_equal(read.ImageBuffer,mapped.ImageBuffer)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('depth',[3,1])
+def test_benchmark_file_access(tmp_path,rng,depth,height=3040,width=4048,frames=3,randomrows=40,rowblock=16):
+    """ Full reads against memory-mapped reads of HQ camera sized frames as written by pilomarfits.py.
+          sequential: Read every row of each frame in turn.
+          random:     Read 'randomrows' random blocks of 'rowblock' rows from each frame. (eg. star cutouts, tracking samples)
+        Every file is written before any timing starts, and dropped from the O/S file cache before each read,
+        so each read comes from disc. 'cache' is 'warm' if the O/S refused, the figures then flatter both methods. """
+    filelist = writeframes(str(tmp_path),rng,height,width,depth,frames)
+    frame = pilomarimage(name='benchmark')
+    results = {}
+    checksums = {}
+    cold = True # Has every file been dropped from the file cache before it was read?
+    for mapped in [False,True]:
+        for test in ['sequential','random']:
+            seconds = 0.0
+            touched = 0 # Bytes actually pulled into the calculation.
+            testrng = np.random.default_rng(2) # Both methods read the same random rows.
+            total = 0.0
+            for filename in filelist:
+                cold = dropfilecache(filename) and cold # Not timed.
+                start = time.perf_counter()
+                frame.LoadFile(filename,mapped=mapped)
+                if test == 'sequential': rowlist = range(0,frame.GetHeight(),rowblock)
+                else: rowlist = testrng.integers(0,frame.GetHeight() - rowblock,size=randomrows)
+                for y in rowlist:
+                    block = frame.GetRows(y,y + rowblock)
+                    total += block.sum(dtype=np.float64) # Force the rows to be read.
+                    touched += block.nbytes
+                frame.Clear()
+                seconds += time.perf_counter() - start
+            results[('mmap' if mapped else 'read') + '_' + test] = {'seconds':round(seconds,4),'MB':round(touched / 1e6,1),'MB/s':round(touched / 1e6 / max(seconds,1e-9),1)}
+            checksums.setdefault(test,[]).append(total)
+    results['cache'] = 'cold' if cold else 'warm'
+    print('File access, depth',depth,':',results)
+    for test,totals in checksums.items():
+        assert totals[0] == totals[1], "Mapped " + test + " reads returned different data."
@@ -0,0 +1,121 @@
+# pilomarframing: binary trajectory frames in the same byte stream as the text lines.
+
+import calendar
+import os
+import pty
+import select
+import termios
+import threading
+import time
+import tty
+
+import pytest
+
+from pilomarframing import FRAME_TRAJECTORY, Checksum, DecodeSegments, EncodeTrajectoryFrames, ParseTrajectoryLine, framereceiver
+
+BAUDRATE = 115200
+
+def test_round_trip():
+    """ Frames and text lines separate cleanly, a bad CRC is counted and dropped, segments decode unchanged. """
+    sample = [('azimuth',1736971200,181.6003,1736971260,181.7003,45000,47500),('altitude',1736971200,45.25,1736971320,45.5,96000,96533)]
+    sequence,count,frame = EncodeTrajectoryFrames(sample,7)[0]
+    receiver = framereceiver()
+    receiver.Feed(b'# comment line|1234\n' + frame + b'set time 20250115200000 [2]|abcd\n' + frame[:-1] + b'\x00') # Second frame has a bad CRC.
+    assert receiver.Lines == ['# comment line|1234','set time 20250115200000 [2]|abcd'] and receiver.FrameErrors == 1 and receiver.Frames[0][1] == 7
+    decoded = DecodeSegments(receiver.Frames[0][2])
+    assert [(m,s,e,sp,ep) for m,s,sa,e,ea,sp,ep in decoded] == [(m,s,e,sp,ep) for m,s,sa,e,ea,sp,ep in sample]
+
+def test_parse_trajectory_line():
+    assert ParseTrajectoryLine('trajectory 20210409104504 azimuth 20210325223342 181.6003 20210325223442 181.7003 45000 47500')[1] == 1616711622
+
+def textstream(batch):
+    """ The segments as text lines. """
+    data = b''
+    for n,(motor,s,sa,e,ea,sp,ep) in enumerate(batch):
+        line = ' '.join(['trajectory',time.strftime('%Y%m%d%H%M%S',time.gmtime(s)),motor,time.strftime('%Y%m%d%H%M%S',time.gmtime(s)),str(sa),
+                         time.strftime('%Y%m%d%H%M%S',time.gmtime(e)),str(ea),str(sp),str(ep),'[' + str(n + 1) + ']'])
+        data += (line + '|' + Checksum(line) + '\n').encode('utf-8')
+    return data
+
+def binarystream(batch):
+    """ The segments as binary frames of 16. """
+    return b''.join([frame for sequence,count,frame in EncodeTrajectoryFrames(batch,1,16)])
+
+def send(data,expected,chunk,gap):
+    """ Write the data through a pty, 'chunk' bytes at a time, to a framereceiver that validates every text checksum
+        and frame CRC. A pty has no real baud rate, so the writer paces itself to the line rate (10 bits per byte).
+        Returns (segments received, elapsed, frame errors) """
+    master,slave = pty.openpty()
+    tty.setraw(slave)
+    attributes = termios.tcgetattr(slave)
+    attributes[4] = attributes[5] = getattr(termios,'B' + str(BAUDRATE))
+    termios.tcsetattr(slave,termios.TCSANOW,attributes)
+    receiver = framereceiver()
+    received = [0]
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            if select.select([slave],[],[],0.05)[0]:
+                receiver.Feed(os.read(slave,4096))
+                count = 0
+                for line in receiver.Lines:
+                    i = line.rfind('|')
+                    if line.startswith('trajectory') and i > 0 and Checksum(line[:i]) == line[i + 1:]: count += 1
+                for frametype,sequence,payload in receiver.Frames:
+                    if frametype == FRAME_TRAJECTORY: count += len(DecodeSegments(payload))
+                received[0] = count
+                if count >= expected: done.set()
+
+    thread = threading.Thread(target=reader,daemon=True)
+    thread.start()
+    begin = time.perf_counter()
+    for i in range(0,len(data),chunk):
+        piece = data[i:i + chunk]
+        os.write(master,piece)
+        time.sleep(max(gap,len(piece) * 10.0 / BAUDRATE)) # Line rate, or the WritePoll interval.
+    done.wait(5)
+    elapsed = time.perf_counter() - begin
+    done.set()
+    thread.join()
+    os.close(master)
+    os.close(slave)
+    return received[0],elapsed,receiver.FrameErrors
+
+def throughput(segments=200,pollsegments=20):
+    """ Segments per second from RPi to microcontroller, text lines vs binary frames, over a pty loopback.
+          link = bytes leave as fast as the line rate allows.
+          writepoll = the 32 byte chunk every 0.2 seconds that microcontroller.WritePoll() sends.
+        Returns {(mode, encoding):{'sent','received','bytes','seconds','errors'}} """
+    start = calendar.timegm((2025,1,15,20,0,0))
+    path = [('azimuth' if i % 2 == 0 else 'altitude',start + 60 * (i // 2),180.0 + i * 0.01,start + 60 * (i // 2 + 1),180.01 + i * 0.01,192000 + i * 11,192011 + i * 11) for i in range(segments)]
+    results = {}
+    for mode,count,chunk,gap in (('link',segments,64,0.0),('writepoll',pollsegments,32,0.2)):
+        for name,encoder in (('text',textstream),('binary',binarystream)):
+            data = encoder(path[:count])
+            received,elapsed,errors = send(data,count,chunk,gap)
+            results[(mode,name)] = {'sent':count,'received':received,'bytes':len(data),'seconds':elapsed,'errors':errors}
+    return results
+
+def check(results):
+    """ Every segment arrives intact, and frames carry them in fewer bytes and less time. """
+    for key,result in results.items():
+        assert result['received'] == result['sent'] and result['errors'] == 0, str(key) + ' lost segments.'
+    for mode in ('link','writepoll'):
+        text,binary = results[(mode,'text')],results[(mode,'binary')]
+        assert binary['bytes'] < text['bytes'] / 3
+        assert binary['seconds'] < text['seconds'], mode + ': frames should be faster than text lines.'
+
+def test_throughput():
+    check(throughput(segments=40,pollsegments=4))
+
+@pytest.mark.benchmark
+def test_benchmark_framing():
+    """ 200 segments at the line rate, 20 at the WritePoll rate. """
+    results = throughput()
+    print('\nPty loopback at',BAUDRATE,'baud.')
+    for (mode,name),result in results.items():
+        print(mode.ljust(10),name.ljust(7),str(result['received']) + '/' + str(result['sent']),'segments,',result['bytes'],
+              'bytes (' + str(round(result['bytes'] / result['sent'],1)) + '/segment),',round(result['seconds'],2),'s,',
+              round(result['received'] / result['seconds'],1),'segments/s, frame errors',result['errors'])
+    check(results)
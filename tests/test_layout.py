@@ -0,0 +1,105 @@
+# pilomarimage.ArrangeObjects()/SeparateObjects(): spatial-hash force layout.
+
+import time
+
+import numpy as np
+import pytest
+
+from pilomarimage import pilomarimage
+
+def allpairs(positions, objects, attractions=None, k=0.1, dt=0.1, iterations=100, delta_min=4.0, height=3040, width=4056):
+    """ The original all-pairs layout. attractions = None pulls each object back to its starting position (SeparateObjects),
+        otherwise the attracted pairs pull on each other (ArrangeObjects). """
+    object_positions = np.array(positions,dtype=float)
+    for m in range(iterations):
+        previous_positions = object_positions.copy()
+        forces = np.zeros_like(object_positions)
+        for i in range(len(objects)): # Repulsion between every overlapping pair.
+            for j in range(i+1, len(objects)):
+                overlap_x = max(0, (objects[i][0] + objects[j][0])/2 - abs(object_positions[i][0] - object_positions[j][0]))
+                overlap_y = max(0, (objects[i][1] + objects[j][1])/2 - abs(object_positions[i][1] - object_positions[j][1]))
+                if overlap_x > 0 and overlap_y > 0:
+                    direction = object_positions[i] - object_positions[j]
+                    direction /= np.linalg.norm(direction)
+                    force = direction * overlap_x * overlap_y * k
+                    if objects[i][2] == False: forces[i] += force
+                    if objects[j][2] == False: forces[j] -= force
+        if attractions == None: # Spring back to the starting position.
+            for i in range(len(objects)):
+                forces[i] = forces[i] - (object_positions[i] - positions[i]) * k
+        else: # Spring between attracted objects.
+            for index_a,index_b in attractions:
+                dk = (object_positions[index_a] - object_positions[index_b]) * k
+                if objects[index_a][2] == False: forces[index_a] = forces[index_a] - dk
+                if objects[index_b][2] == False: forces[index_b] = forces[index_b] + dk
+        object_positions = object_positions + forces * dt
+        for i in range(len(objects)): # Keep the objects within the image bounds.
+            object_positions[i][0] = min(max(object_positions[i][0], objects[i][0]/2), width - objects[i][0]/2)
+            object_positions[i][1] = min(max(object_positions[i][1], objects[i][1]/2), height - objects[i][1]/2)
+        delta = 0
+        for i,origpos in enumerate(previous_positions):
+            newpos = object_positions[i]
+            delta = max(( ( (newpos[0] - origpos[0]) ** 2) + ( (newpos[1] - origpos[1]) ** 2)) ** 0.5, delta)
+        if delta < delta_min: break
+    return object_positions.tolist()
+
+def overlap(frame,positions,objects):
+    """ (number of overlapping pairs, total overlapping area in pixels) of a layout. """
+    sizes = np.array([o[:2] for o in objects],dtype=float).reshape(-1,2)
+    i, j, overlap_x, overlap_y = frame.OverlappingPairs(np.array(positions,dtype=float).reshape(-1,2),sizes)
+    return len(i), float((overlap_x * overlap_y).sum())
+
+def layout(rng,labels=1000,height=3040,width=4056,k=0.1,dt=0.1,delta_min=4.0,compare=True):
+    """ Lay out star markup with ArrangeObjects()/SeparateObjects(), and optionally allpairs() for comparison.
+        Each star gets a fixed 6x6 marker and a movable text label attracted to it. (Typical markup)
+        Returns a dictionary containing...
+          arrange_ms, separate_ms: Milliseconds for the new versions.
+          arrange_old_ms, separate_old_ms: Milliseconds for the original versions (when compare=True).
+          *_overlap: (overlapping pairs, overlapping area) before and after each layout.
+          *_maxdiff: Largest difference in pixels between the new and original positions. """
+    frame = pilomarimage(name='layout')
+    frame.New(height,width,'grayscale')
+    stars = np.column_stack([rng.uniform(20,width - 20,labels),rng.uniform(20,height - 20,labels)])
+    labelsizes = np.column_stack([rng.integers(40,140,labels),np.full(labels,14)]) # Text labels of various lengths.
+    positions = np.vstack([stars,stars + [0,-12]]).tolist() # Markers, then labels just above their stars.
+    objects = [[6,6,True]] * labels + [[int(w),int(h),False] for w,h in labelsizes]
+    attractions = [[i,i + labels] for i in range(labels)]
+    results = {'labels':labels,'size':(height,width),'initial_overlap':overlap(frame,positions,objects)}
+    for name,method,args in [('arrange',frame.ArrangeObjects,(positions,objects,attractions)),('separate',frame.SeparateObjects,(positions,objects))]:
+        start = time.perf_counter()
+        new = method(*args,k=k,dt=dt,delta_min=delta_min)
+        results[name + '_ms'] = round(1000 * (time.perf_counter() - start),1)
+        results[name + '_iterations'] = frame.LayoutIterations
+        results[name + '_overlap'] = overlap(frame,new,objects)
+        if compare:
+            start = time.perf_counter()
+            old = allpairs(*args,k=k,dt=dt,delta_min=delta_min,height=height,width=width)
+            results[name + '_old_ms'] = round(1000 * (time.perf_counter() - start),1)
+            results[name + '_old_overlap'] = overlap(frame,old,objects)
+            results[name + '_maxdiff'] = float(np.abs(np.array(new) - np.array(old)).max())
+    return results
+
+def check(results):
+    """ The new layouts land where the all-pairs versions did. """
+    for name in ['arrange','separate']:
+        assert results[name + '_maxdiff'] < 1e-6
+        assert results[name + '_overlap'][0] == results[name + '_old_overlap'][0]
+
+def test_matches_allpairs(rng):
+    """ 150 labels on a small frame, so labels overlap and the layout has to iterate. """
+    results = layout(rng,labels=150,height=760,width=1014)
+    assert results['initial_overlap'][0] > 0
+    assert results['arrange_iterations'] > 1
+    check(results)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('labels',[100,300,1000])
+def test_benchmark_layout(rng,labels):
+    """ Time per layout, new against all-pairs. (The all-pairs version is too slow to run with 1000 labels.) """
+    compare = labels <= 300
+    results = layout(rng,labels=labels,compare=compare)
+    print('Label layout:',results)
+    if compare:
+        check(results)
+        for name in ['arrange','separate']:
+            assert results[name + '_ms'] < results[name + '_old_ms']
@@ -0,0 +1,106 @@
+# pilomarlogfile: streaming log extraction against the original egrep + zip commands.
+
+import os
+import random
+import shutil
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pilomarlogfile import logextractor
+
+MESSAGES = ["CameraHandler.TakePhoto(): Capturing light frame",
+            "RPi received: motor status azimuth position 12345 target 12400 speed 3",
+            "RPi queueing (Q# 1): trajectory 2026-10-18T22:10:00 123.456 45.678",
+            "motorcontrol.Update(): Position sync",
+            "pilomarimage.CountStars(): Stars found 1234",
+            "RPi received: 'ok'",
+            "obs_session.ObservationRun(): Warning, clouds detected",
+            "folderhandler.PrepFile(): session light_000123.jpg"]
+WEIGHTS = [20,10,3,25,20,15,1,6]
+
+# The categories ZipCommsLog() and friends extract.
+SEARCHES = {'comms':'RPi received|RPi queueing|warning|error','trajectory':'RPi queueing.*): trajectory ','motorstatus':'RPi received: motor status'}
+
+pytestmark = pytest.mark.skipif(shutil.which('egrep') == None or shutil.which('zip') == None,reason='Compares with egrep and zip.')
+
+def generate(f,mb,t):
+    """ Write about 'mb' of synthetic log lines to f, starting after time t. Returns the last timestamp. """
+    random.seed(1)
+    block = []
+    written = 0
+    while written < mb * 1048576:
+        t += timedelta(milliseconds=random.randint(1,200))
+        block.append(str(t) + "\t" + "{:.6f}".format(random.random()) + "\t" + random.choices(MESSAGES,WEIGHTS)[0] + "\n")
+        written += len(block[-1])
+        if len(block) >= 100000:
+            f.write(''.join(block))
+            block = []
+    f.write(''.join(block))
+    return t
+
+def extract(filename,sizemb,rounds=2,chunksize=8*1024*1024):
+    """ Extract the categories from a synthetic log of about sizemb with egrep + zip and with the streaming extractor,
+        then repeat with nothing new, append 1% more log and extract again, and search from an hour before the append.
+        Checkpoints are taken once per chunk, so a small log needs small chunks to seek.
+        The two full extractions are timed alternately 'rounds' times and the best of each is kept, a single run of
+        each varies by 20% on a busy machine.
+        Returns a dictionary of timings and line counts. """
+    with open(filename,'w') as f:
+        t = generate(f,sizemb,datetime(2026,10,18,20,0,0,tzinfo=timezone.utc))
+    sizemb = os.path.getsize(filename) / 1048576
+    results = {'size_mb':sizemb}
+    base = os.path.splitext(filename)[0]
+    for i in range(rounds):
+        t0 = time.time() # Original method, one egrep and zip per category.
+        for name,terms in SEARCHES.items():
+            subprocess.run('egrep -a -i "' + terms + '" ' + filename + ' > ' + base + '_egrep.log',shell=True)
+            subprocess.run('zip -q ' + base + '_egrep.zip ' + base + '_egrep.log',shell=True)
+            os.remove(base + '_egrep.zip')
+        results['egrep_zip_s'] = min(results.get('egrep_zip_s',1e9),time.time() - t0)
+        for target in [filename + '.idx'] + [base + '_' + name + '.zip' for name in SEARCHES]: # Streaming extractor, one pass.
+            if os.path.exists(target): os.remove(target)
+        extractor = logextractor(filename,chunksize=chunksize)
+        for name,terms in SEARCHES.items(): extractor.AddCategory(name,terms,ignorecase=True)
+        t0 = time.time()
+        extractor.Extract()
+        results['extract_s'] = min(results.get('extract_s',1e9),time.time() - t0)
+    results['extract_mbps'] = sizemb / results['extract_s']
+    results['lines'] = dict(extractor.LastStats['lines'])
+    results['egrep_lines'] = {name:int(subprocess.run('egrep -a -i -c "' + terms + '" ' + filename,shell=True,capture_output=True,text=True).stdout.strip())
+                              for name,terms in SEARCHES.items()}
+    t0 = time.time()
+    logextractor(filename,chunksize=chunksize).Extract() # Nothing new.
+    results['repeat_s'] = time.time() - t0
+    with open(filename,'a') as f: generate(f,max(1,int(sizemb / 100)),t + timedelta(days=1))
+    t0 = time.time()
+    extractor = logextractor(filename,chunksize=chunksize)
+    extractor.Extract()
+    results['incremental_s'] = time.time() - t0
+    results['incremental_lines'] = dict(extractor.LastStats['lines'])
+    t0 = time.time() # Last hour and the appended data only, seeks using the checkpoints.
+    extractor.Search(SEARCHES['comms'],base + '_search.zip',ignorecase=True,start=t - timedelta(hours=1))
+    results['timerange_s'] = time.time() - t0
+    results['timerange_mb_read'] = extractor.LastStats['bytes'] / 1048576
+    return results
+
+def check(results):
+    """ Every category holds the lines egrep finds. Repeats read nothing, appended data is extracted on its own and
+        a time range search reads only a small part of the log. """
+    assert results['lines'] == results['egrep_lines']
+    assert all([0 < results['incremental_lines'][name] < results['lines'][name] for name in SEARCHES]), 'Only the appended lines are extracted.'
+    assert results['repeat_s'] < results['extract_s'] and results['incremental_s'] < results['extract_s']
+    assert results['timerange_mb_read'] < results['size_mb'] / 3
+
+def test_extract(tmp_path):
+    check(extract(str(tmp_path / 'pilomar.log'),16,chunksize=1024*1024))
+
+@pytest.mark.benchmark
+def test_benchmark_extract(tmp_path):
+    """ A 2GB log, the size a long campaign reaches. """
+    results = extract(str(tmp_path / 'pilomar.log'),2048)
+    for key,value in results.items(): print(key,':',round(value,3) if isinstance(value,float) else value)
+    check(results)
+    assert results['extract_s'] < results['egrep_zip_s'], 'The streaming extractor should beat egrep + zip.'
@@ -0,0 +1,64 @@
+# pilomarmanifest: image counts from a per folder manifest instead of directory listings.
+
+import glob
+import os
+import time
+
+import pytest
+
+from pilomarmanifest import foldermanifest
+
+def counts(folder,files=20000,repeats=20):
+    """ Count a light folder by listing it and from its manifest, reload the manifest, then rebuild it after
+        files change behind its back.
+        Returns a dictionary of counts and timings. """
+    light = os.path.join(folder,'campaign_test','session_1','light')
+    os.makedirs(light)
+    manifest = foldermanifest(light)
+    manifest.Load()
+    results = {'files':files}
+    start = time.perf_counter()
+    for i in range(files):
+        filename = os.path.join(light,'light_' + str(i).zfill(6) + '_00.jpg')
+        with open(filename,'wb') as f: f.write(b'x' * 100)
+        manifest.Add(filename)
+    results['add_us'] = (time.perf_counter() - start) / files * 1e6
+    start = time.perf_counter()
+    for i in range(repeats): results['glob_count'] = len(glob.glob(folder + '/**/*.jpg',recursive=True))
+    results['glob_ms'] = (time.perf_counter() - start) / repeats * 1000
+    start = time.perf_counter()
+    for i in range(repeats): results['manifest_count'] = manifest.Count(['jpg','dng','fits'])
+    results['manifest_ms'] = (time.perf_counter() - start) / repeats * 1000
+    start = time.perf_counter()
+    for i in range(repeats): manifest.QuickCheck()
+    results['quickcheck_us'] = (time.perf_counter() - start) / repeats * 1e6
+    start = time.perf_counter()
+    reloaded = foldermanifest(light)
+    results['clean'] = reloaded.Load()
+    results['load_ms'] = (time.perf_counter() - start) * 1000
+    os.remove(os.path.join(light,'light_000000_00.jpg')) # Change behind the manifest's back.
+    with open(os.path.join(light,'extra.jpg'),'wb') as f: f.write(b'x')
+    start = time.perf_counter()
+    result = reloaded.Check(rebuild=True)
+    results['rebuild_ms'] = (time.perf_counter() - start) * 1000
+    results['missing'],results['extra'],results['rebuilt'] = result['missing'],result['extra'],result['rebuilt']
+    results['count_after'] = reloaded.Count(['jpg'])
+    return results
+
+def check(results):
+    """ The manifest agrees with the listing and is quicker, reloads clean and catches changes made behind its back. """
+    assert results['manifest_count'] == results['glob_count'] == results['files']
+    assert results['manifest_ms'] < results['glob_ms']
+    assert results['clean']
+    assert results['missing'] == ['light_000000_00.jpg'] and results['extra'] == ['extra.jpg'] and results['rebuilt']
+    assert results['count_after'] == results['files']
+
+def test_counts(tmp_path):
+    check(counts(str(tmp_path),files=500))
+
+@pytest.mark.benchmark
+def test_benchmark_manifest(tmp_path):
+    """ A campaign folder of 20000 images. """
+    results = counts(str(tmp_path))
+    for key,value in results.items(): print(key,':',round(value,2) if isinstance(value,float) else value)
+    check(results)
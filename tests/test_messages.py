@@ -0,0 +1,143 @@
+# pilomarmessages: microcontroller messages routed by a dispatch table instead of a startswith() chain.
+# The handler comparison runs the real obs_session and motorcontrol handlers from src/pilomar.py, see pilomarharness.py.
+# Pass --commslog FILE to replay a comms log extracted by ZipCommsLog() as well.
+
+import re
+import time
+
+import pytest
+
+import pilomarharness
+import synthetic
+from pilomarmessages import PILOMAR_VERBS, UNRECOGNISED_VERB, messagedispatcher
+
+# The MctlHandler() startswith() chain before the dispatch table.
+LEGACY_CHAIN = ('session','comms','controller log','log','cleared trajectory','cpu status','motor','controller heartbeat',
+                'heartbeat','acknowledged','#','controller version','goto rejected','tune complete','controller started',
+                'pin status','defined motors','binary')
+
+# One of every message the microcontroller sends.
+SAMPLES = ['motor status 20250115200010 altitude y 20250115203010 12 20929 19.6209 y n 0.002 23269 tmr none none n n n',
+           'motor status 20250115200010 azimuth y 20250115203010 12 48000 180.0 y y 0.004 23269 tmr 1034 180.5 y n n',
+           'motor status 20250115200020 azimuth y 20250115200040 12 48000 180.0 y y 0.004 23269 tmr 1034 180.5 y y y',
+           'motor status 20250115200020 azimuth n 20250115200020 0 48000 180.0 y n 0.0 0',
+           'session status 20250115200020 y n y 247 0 tmr 0 1.2.0','comms status 20250115200020 0 0 538 0',
+           'cpu status 20250115200020 POWER_ON 200.0 0.0 245040 138768 21 RP2350_PICO','log :20250115200020:rec: [12]',
+           'controller log something','controller heartbeat','heartbeat','acknowledged','# comment','controller version 1.2.0',
+           'controller version 0.9.1','goto rejected azimuth','tune complete azimuth 20250115200020 -12 20250115200015 1',
+           'controller started','pin status 20250115200020 A3 azstep n GP6 azfault y','defined motors azimuth altitude',
+           'binary accept 1','binary ack 0 16 16','binary ack 7 16 12','cleared trajectory azimuth','garbage']
+
+# Corrupted messages. The table raises the same exception as the chain did, and the state ends up the same.
+CORRUPTED = ['motor status 20250115200020 azimuth y 20250115200040 12 48000 1x0.0 y y 0.004 23269',
+             'motor status 20250115200020 azimuth','motor status 20250115200020 elevation y 20250115200040 1 0 0.0 y y 0.004 0',
+             'session status 20250115200020 y n y','comms status 20250115200020 0 x 538 0','cpu status 20250115200020 POWER_ON',
+             'tune complete','binary','binary ack 7','controller version']
+
+def LegacyRoute(line):
+    """ Which prefix the old chain matched. """
+    for prefix in LEGACY_CHAIN:
+        if line.startswith(prefix): return prefix
+    return UNRECOGNISED_VERB
+
+def CommsLogLines(filename):
+    """ Microcontroller messages from a comms log extracted by ZipCommsLog(), or a plain file of messages. """
+    pattern = re.compile(r'RPi received: (.*)$')
+    lines = []
+    with open(filename,'r') as f:
+        for text in f:
+            text = text.rstrip('\n')
+            match = pattern.search(text)
+            if match: text = match.group(1)
+            elif 'RPi ' in text: continue # Other log lines, eg 'RPi queueing'.
+            if len(text) > 0: lines.append(text)
+    return lines
+
+@pytest.fixture
+def messages(request):
+    """ The synthetic tracking session, the samples and the corrupted messages, then the --commslog file if given. """
+    lines = [entry.Text for entry in synthetic.commslog() if entry.Direction == 'rx'] + SAMPLES + CORRUPTED
+    filename = request.config.getoption('--commslog')
+    if filename != None: lines += CommsLogLines(filename)
+    return lines
+
+def route(lines):
+    """ [(line, prefix the old chain used, prefix the table used)] """
+    prefixes = {} # verb registered : prefix the old chain used for it
+    for verb,parser in PILOMAR_VERBS: prefixes[verb] = verb.split(' ')[0] if verb in ('session status','comms status','motor status') else verb
+    dispatcher = messagedispatcher()
+    for verb,parser in PILOMAR_VERBS: dispatcher.Register(verb)
+    return [(line,LegacyRoute(line),prefixes.get(dispatcher.Route(line.split(' '),line).Verb,UNRECOGNISED_VERB)) for line in lines]
+
+def test_routes_like_chain(messages):
+    """ Every message goes to the handler the chain chose. """
+    differences = [(line,old,new) for line,old,new in route(messages) if old != new]
+    assert differences == []
+
+def test_whole_words():
+    """ The table matches whole words, the chain matched prefixes. The only intended difference. """
+    assert route(['motorx status 1','sessions','commsy']) == [('motorx status 1','motor',UNRECOGNISED_VERB),('sessions','session',UNRECOGNISED_VERB),
+                                                            ('commsy','comms',UNRECOGNISED_VERB)]
+
+def snapshot(value,root,depth=0):
+    """ Plain copy of a value for comparison. Objects become (class name, attributes), paths lose the test folder. """
+    if isinstance(value,dict): return {key:snapshot(item,root,depth) for key,item in value.items() if key != 'Session'}
+    if isinstance(value,(list,tuple)): return [snapshot(item,root,depth) for item in value]
+    if isinstance(value,str): return value.replace(root,'<root>')
+    if callable(value): return type(value).__name__
+    if hasattr(value,'__dict__') and depth < 3: return (type(value).__name__.replace('legacy_',''),snapshot(vars(value),root,depth + 1))
+    return value
+
+def differences(old,new,path=''):
+    """ Paths to the values that differ between two snapshots. """
+    if isinstance(old,dict) and isinstance(new,dict):
+        return sum([differences(old.get(key),new.get(key),path + '.' + str(key)) for key in set(old) | set(new)],[])
+    return [] if old == new else [path]
+
+def state(namespace,sess,obs,root):
+    """ Everything a message can change: Mctl, the motors, the obs_session, telemetry, error window and log. """
+    fields = ('TimeDiff','TrajectorySafetyFlushes','ControllerVersion','MctlPinDict','MotorControlMode','MaintainTrajectory')
+    return {'Mctl':snapshot(vars(namespace['Mctl']),root),
+            'MotorControls':{motor.MotorName:snapshot(vars(motor),root) for motor in namespace['MotorControls']},
+            'obs_session':{field:snapshot(getattr(obs,field),root) for field in fields},
+            'Telemetry':snapshot(namespace['Telemetry'].Calls,root),'ErrorWindow':snapshot(namespace['ErrorWindow'].Calls,root),
+            'Log':snapshot(sess.Logged + namespace['MainLog'].Logged,root)}
+
+def test_handlers_match_legacy(tmp_path,messages):
+    """ Feed the same messages through the old chain and handlers, and through the dispatch table into the current
+        handlers. After every message the Mctl, motor and session attributes, the messages queued for the
+        microcontroller, telemetry and error window output are the same, and so are any exceptions. """
+    worlds = {name:pilomarharness.Tracking(tmp_path / name,legacy=name == 'legacy') for name in ('legacy','table')}
+    for line in messages:
+        if LegacyRoute(line) == 'motor' and not line.startswith('motor status'): continue # Whole word difference, see test_whole_words().
+        results = {}
+        for name,(namespace,sess,obs,handle) in worlds.items():
+            try:
+                handle(line)
+                error = None
+            except Exception as e: error = type(e).__name__
+            results[name] = (error,state(namespace,sess,obs,str(tmp_path / name)))
+        assert results['legacy'][0] == results['table'][0], line
+        for key in results['legacy'][1]:
+            assert results['legacy'][1][key] == results['table'][1][key], key + ' differs after ' + line + ' ' + str(differences(results['legacy'][1][key],results['table'][1][key]))
+    namespace = worlds['table'][0]
+    assert namespace['Mctl'].Written and namespace['Mctl'].Restarts > 0 and namespace['Telemetry'].Calls # The handlers did something.
+
+@pytest.mark.benchmark
+def test_benchmark_dispatch(tmp_path,messages):
+    """ Microseconds per message through the real handlers, old chain against dispatch table. """
+    lines = [line for line in messages if not line.startswith('controller started')] * max(1,4000 // len(messages)) # Restarts reconfigure the motors.
+    worlds = {name:pilomarharness.Tracking(tmp_path / name,legacy=name == 'legacy') for name in ('legacy','table')}
+    best = {}
+    for n in range(5): # The two take turns so background load hits them alike.
+        for name,(namespace,sess,obs,handle) in worlds.items():
+            start = time.perf_counter()
+            for line in lines:
+                try: handle(line)
+                except Exception: pass
+            elapsed = 1e6 * (time.perf_counter() - start) / len(lines)
+            best[name] = min(best.get(name,elapsed),elapsed)
+            del sess.Logged[:],namespace['Telemetry'].Calls[:],namespace['Mctl'].Written[:]
+    print('\nus/message (best of 5 passes):',{name:round(value,2) for name,value in best.items()})
+    print('handler ms/message:',{verb:stats['handle_ms_mean'] for verb,stats in worlds['table'][2].Dispatcher.Report().items()})
+    assert best['table'] < best['legacy'], 'Dispatch table is slower than the old chain.'
@@ -0,0 +1,84 @@
+# pilomarmeteordetector: streaming meteor detection during capture.
+
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import synthetic
+from pilomarimage import pilomarmeteordetector
+
+def scan(detector,rng,frames=60,height=760,width=1014,meteorpc=20,jitter=0.5,compare=True):
+    """ Scan a synthetic sequence and measure detection rates and per-frame cost.
+        The star field jitters by up to 'jitter' pixels per frame (imperfect tracking). 'meteorpc' percent of frames get a FakeMeteor() streak.
+        compare = TRUE also runs the original LineDetection() on every frame for comparison.
+        Returns a dictionary containing...
+          frame_ms:     Average milliseconds per Scan().
+          recall:       Fraction of meteor frames where a candidate lies along the meteor.
+          fp_per_frame: Candidates that do not lie along a meteor, per frame scanned.
+          line_*:       The same measurements for LineDetection(). """
+    synthetic.seed()
+    detector.Reset()
+    margin = 20
+    sky = synthetic.starsky(height,width,rng,margin=margin)
+    meteorframes = 0
+    hits = {'scan':0,'line':0}
+    falsepositives = {'scan':0,'line':0}
+    lineseconds = []
+
+    def alongstreak(candidate,streak): # Does the candidate line lie along the known streak?
+        x1,y1,x2,y2 = candidate[:4]
+        samples = [(int(x1 + (x2 - x1) * t),int(y1 + (y2 - y1) * t)) for t in np.linspace(0,1,21)]
+        inside = [streak[min(max(y,0),height - 1),min(max(x,0),width - 1)] for x,y in samples]
+        return sum(inside) >= 0.5 * len(inside)
+
+    for i in range(frames):
+        ox,oy = rng.uniform(-jitter,jitter,size=2)
+        frame = synthetic.camera(synthetic.skyframe(sky,ox,oy,margin,height,width))
+        streak = None
+        if i > 0 and rng.uniform(0,100) < meteorpc: # Never in the first frame, it only seeds the background.
+            before = frame.ImageBuffer.copy()
+            frame.FakeMeteor()
+            streak = cv2.dilate(((frame.ImageBuffer.astype(np.int16) - before).max(axis=2) > 20).astype(np.uint8),np.ones((9,9),np.uint8)) > 0
+            meteorframes += 1
+        results = {'scan':detector.Scan(frame)}
+        if compare:
+            linestart = time.perf_counter()
+            results['line'] = frame.LineDetection()
+            lineseconds.append(time.perf_counter() - linestart)
+        for method,candidates in results.items():
+            matched = [c for c in candidates if streak is not None and alongstreak(c,streak)]
+            if len(matched) > 0: hits[method] += 1
+            falsepositives[method] += len(candidates) - len(matched)
+    results = {'frames':frames,'size':(height,width),'meteor_frames':meteorframes,
+               'frame_ms':round(1000 * detector.AverageFrameSeconds(),2),
+               'recall':round(hits['scan'] / max(1,meteorframes),3),
+               'fp_per_frame':round(falsepositives['scan'] / frames,3),
+               'restarts':detector.Restarts}
+    if compare:
+        results.update({'line_frame_ms':round(1000 * sum(lineseconds) / max(1,len(lineseconds)),2),
+                        'line_recall':round(hits['line'] / max(1,meteorframes),3),
+                        'line_fp_per_frame':round(falsepositives['line'] / frames,3)})
+    return results
+
+def test_detection(rng):
+    """ Meteors are found in a jittering star field without false alarms from the stars or noise. """
+    results = scan(pilomarmeteordetector('check'),rng,frames=40,height=380,width=507,compare=False)
+    assert results['meteor_frames'] > 0
+    assert results['recall'] >= 0.8
+    assert results['fp_per_frame'] <= 0.1
+    assert results['restarts'] == 0
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('height,width,frames',[(760,1014,60),(3040,4056,20)])
+def test_benchmark_meteor(rng,height,width,frames):
+    """ Per-frame cost and detection rates, against LineDetection() at the smaller size. """
+    compare = height < 1000
+    results = scan(pilomarmeteordetector('benchmark'),rng,frames=frames,height=height,width=width,compare=compare)
+    print('Meteor detection:',results)
+    assert results['recall'] >= 0.8
+    assert results['fp_per_frame'] <= 0.1
+    if compare:
+        assert results['recall'] >= results['line_recall']
+        assert results['frame_ms'] < results['line_frame_ms']
@@ -0,0 +1,79 @@
+# pilomarpipeline: capture stages overlapped with the next exposure.
+
+import threading
+import time
+
+import pytest
+
+from pilomarpipeline import capturepipeline, capturestage
+
+def captureloop(threaded,exposure=4.0,frames=8,process=1.5,preview=3.0,tracking=2.0):
+    """ A capture loop with simulated work. The 'camera' sleeps for the exposure, the stages burn time in sleeps too
+        (like OpenCV calls that release the GIL). A tracking capture (1/4 of the exposure) is taken every 4th frame,
+        a preview is requested every 2nd frame.
+        Returns a dictionary containing...
+          elapsed: Seconds for the whole loop.
+          sensor, exposure: Duty cycles from the pipeline.
+          processed, previews: Jobs completed by the process and preview stages. """
+    pipeline = capturepipeline(threaded=threaded,depth=2)
+    pipeline.AddStage('process',lambda job: time.sleep(process))
+    pipeline.AddStage('preview',lambda job: time.sleep(preview),depth=1)
+    pipeline.AddStage('tracking',lambda job: time.sleep(tracking),depth=1)
+    pipeline.Start()
+    start = time.time()
+    for i in range(frames):
+        if i % 4 == 0 and pipeline.Idle('tracking'): # Tracking image occupies the sensor too.
+            time.sleep(exposure / 4)
+            pipeline.Submit('tracking',{},block=False)
+        capturestart = time.time()
+        time.sleep(exposure) # The exposure.
+        pipeline.RecordCapture(capturestart,time.time(),exposure)
+        pipeline.Submit('process',{'frame':i})
+        if i % 2 == 1: pipeline.Submit('preview',{'frame':i},block=False)
+    pipeline.Stop()
+    sensor,exposurefraction = pipeline.DutyCycle()
+    return {'elapsed':round(time.time() - start,2),'sensor':round(sensor,3),'exposure':round(exposurefraction,3),
+            'processed':pipeline.Stages['process'].Processed,'previews':pipeline.Stages['preview'].Processed,'status':pipeline.Status()}
+
+def compare(frames=8,scale=1.0):
+    """ Serial and overlapped loops with the work scaled down by 'scale'. """
+    return {name:captureloop(threaded,exposure=4.0 * scale,frames=frames,process=1.5 * scale,preview=3.0 * scale,tracking=2.0 * scale)
+            for name,threaded in (('serial',False),('overlapped',True))}
+
+def check(results,frames=8):
+    """ Overlapping keeps the sensor busy and loses no light frames. """
+    assert results['overlapped']['elapsed'] < results['serial']['elapsed']
+    assert results['overlapped']['sensor'] > 0.8 > results['serial']['sensor']
+    assert results['serial']['processed'] == results['overlapped']['processed'] == frames
+
+def test_overlap():
+    check(compare(scale=0.05))
+
+def test_stage_never_idle_with_job(jobs=50):
+    """ A stage must never look idle between taking a job off its queue and starting it.
+        The worker is held up for a moment after each get(), as if the OS switched threads there. """
+    release = threading.Event()
+    stage = capturestage('check',lambda job: release.wait())
+    get = stage.Queue.get
+    def preempted(*args,**kwargs):
+        job = get(*args,**kwargs)
+        time.sleep(0.002) # Worker switched out before Run() starts.
+        return job
+    stage.Queue.get = preempted
+    stage.Start()
+    for i in range(jobs):
+        release.clear()
+        stage.Submit({})
+        time.sleep(0.001) # Look while the worker is between get() and Run().
+        assert not stage.Idle(), 'Stage looked idle with a job in hand. (Job ' + str(i) + ')'
+        release.set()
+        while not stage.Idle(): time.sleep(0.0001)
+    stage.Stop()
+    assert stage.Processed == jobs and stage.Pending() == 0
+
+@pytest.mark.benchmark
+def test_benchmark_pipeline():
+    """ Full length exposures and stage times. """
+    results = compare()
+    for name,result in results.items(): print(name.ljust(10),result)
+    check(results)
@@ -0,0 +1,109 @@
+# pilomarreplay: captured comms logs played back through a virtual serial port.
+
+import os
+import select
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import pilomarframing
+import pilomarharness
+import synthetic
+from pilomarreplay import Compare, ReadCommsLog, ReplayState, Retime, WriteCommsLog, protocolstate, virtualserial
+from pilomartransmit import ParseAck
+
+def host(entries,speed):
+    """ Play the entries through the pty to a scripted host that answers like pilomar would:
+        'set time' after a restart and a trajectory segment for every configured motor status.
+        Returns a dictionary containing...
+          played, sent, acknowledged: Messages played by the pty, lines sent by the host and acknowledged by the pty.
+          received: Lines the host received. (Played messages plus acknowledgements)
+          not_retimed: Motor status messages whose timestamp wasn't moved to the replay time.
+          checksum_errors: Host lines the pty rejected.
+          similarity: Compare() of the host's commands with the ones in the entries. """
+    device = virtualserial(entries,speed=speed)
+    device.Start()
+    port = os.open(device.Path,os.O_RDWR | os.O_NOCTTY)
+    receiver = pilomarframing.framereceiver()
+    sendid = 0
+    acked = set()
+    received = 0
+    notretimed = 0
+    def write(line):
+        nonlocal sendid
+        sendid += 1
+        line = line + ' [' + str(sendid) + ']'
+        os.write(port,(line + '|' + pilomarframing.Checksum(line) + '\n').encode('utf-8'))
+    while not device.Finished.is_set() or select.select([port],[],[],0.2)[0]:
+        if not select.select([port],[],[],0.05)[0]: continue
+        receiver.Feed(os.read(port,4096))
+        for line in receiver.Lines:
+            i = line.rfind('|')
+            assert line[i + 1:] == pilomarframing.Checksum(line[:i]), 'Bad checksum from the replay: ' + line
+            line = line[:i]
+            received += 1
+            messageid = ParseAck(line)
+            if messageid != None: acked.add(messageid)
+            elif line.startswith('motor status'):
+                items = line.split(' ')
+                if abs((datetime.strptime(items[2],'%Y%m%d%H%M%S').replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()) > 5: notretimed += 1
+                if items[9] == 'y': write('trajectory ' + items[2] + ' ' + items[3] + ' ' + items[2] + ' ' + items[8] + ' ' + items[5] + ' ' + items[8] + ' 45000 47500')
+            elif line.startswith('controller started'): write('set time ' + time.strftime('%Y%m%d%H%M%S',time.gmtime()))
+        receiver.Lines = []
+    time.sleep(0.1)
+    device.Stop()
+    os.close(port)
+    similarity,differences = Compare(entries,device.Recorded)
+    return {'played':len(device.Received),'sent':sendid,'acknowledged':acked,'received':received,'not_retimed':notretimed,
+            'checksum_errors':device.ChecksumErrors,'similarity':similarity}
+
+def test_replay_through_pty():
+    """ Every message arrives retimed, every host line is acknowledged, and the host sends the logged commands. """
+    results = host(synthetic.commslog(minutes=2),speed=120.0)
+    assert results['received'] == results['played'] + len(results['acknowledged']), 'Messages lost in the pty.'
+    assert results['acknowledged'] == set(range(1,results['sent'] + 1)), 'Host messages were not all acknowledged.'
+    assert results['not_retimed'] == 0
+    assert results['checksum_errors'] == 0
+    assert results['similarity'] > 0.95, 'The scripted host should send the same commands as the synthetic log.'
+
+def test_commslog_round_trip(tmp_path):
+    """ WriteCommsLog() output reads back unchanged. """
+    entries = synthetic.commslog(minutes=1)
+    filename = str(tmp_path / 'comms.log')
+    WriteCommsLog(filename,entries)
+    assert [(entry.Time,entry.Direction,entry.Text) for entry in ReadCommsLog(filename)] == [(entry.Time,entry.Direction,entry.Text) for entry in entries]
+
+def test_retime():
+    """ Every timestamp moves, intervals inside the message keep their length. """
+    assert Retime('motor status 20250115200010 azimuth y 20250115200110 3',3600) == 'motor status 20250115210010 azimuth y 20250115210110 3'
+    assert Retime('motor status 20251399999999 azimuth',60) == 'motor status 20251399999999 azimuth' # Not a valid timestamp.
+
+def test_state_repeats():
+    """ Replays of the same log produce the same transitions. """
+    results = ReplayState(synthetic.commslog())
+    assert len(results[0]) > 0 and all([transitions == results[0] for transitions in results])
+
+def test_state_matches_handlers(tmp_path):
+    """ protocolstate ends in the state the real obs_session and motorcontrol handlers reach from the same log. """
+    entries = synthetic.commslog()
+    state = protocolstate()
+    assert state.Replay(entries) == 0
+    namespace,sess,obs,handle = pilomarharness.Tracking(tmp_path)
+    for entry in entries:
+        if entry.Direction == 'rx': handle(entry.Text)
+    mctl = namespace['Mctl']
+    expected = {'clock':mctl.ClockSynchronised,'autonomous':mctl.AutonomousControl,'remote':mctl.RemoteControl,
+                'flushes':obs.TrajectorySafetyFlushes,'exceptions':mctl.MctlExceptionCount,'rxerrors':mctl.MctlRxErrors,
+                'writedrops':mctl.MctlWriteDrops,'restarts':mctl.Restarts,'version':obs.ControllerVersion}
+    for motor in namespace['MotorControls']:
+        expected.update({motor.MotorName + '.configured':motor.MotorConfigured,motor.MotorName + '.trajectory':motor.TrajectoryValid,
+                         motor.MotorName + '.ontarget':motor.OnTarget,motor.MotorName + '.fault':motor.DriverFault,
+                         motor.MotorName + '.halt':motor.MotorHalt,motor.MotorName + '.sensor':motor.position_sensor_configured})
+    assert {key:state.State.get(key) for key in expected} == expected
+
+@pytest.mark.benchmark
+def test_benchmark_state():
+    """ Messages per second through the dispatch table, for an hour long log. (Printed by ReplayState()) """
+    results = ReplayState(synthetic.commslog(minutes=60))
+    assert all([transitions == results[0] for transitions in results])
@@ -0,0 +1,102 @@
+# pilomarsensorfusion: step count and position sensor fused into slip corrections.
+
+import math
+import random
+
+import pytest
+
+from pilomarsensorfusion import Wrap, positionfusion
+
+STEPSPERREV = 48000 * 4
+ONESTEP = 360.0 / STEPSPERREV
+
+def SimulatedTrace(stepsperrev=STEPSPERREV,hours=2.0,period=5.0,offset=2.0,backlash=0.15,noise=0.03,outliers=0.01,slips=((3600.0,0.5),),seed=1):
+    """ A tracking axis with reversals, sensor offset, backlash, noise, glitches and sudden slips.
+        Returns a list of (seconds, step count angle, sensor angle). """
+    rng = random.Random(seed)
+    trace = []
+    slip = 0.0
+    angle = 180.0
+    previous = angle
+    direction = 1
+    for n in range(int(hours * 3600 / period)):
+        t = n * period
+        angle = 180.0 + 5.0 * math.sin(2 * math.pi * t / 2400.0) # Reverses every 20 minutes.
+        if angle > previous: direction = 1
+        elif angle < previous: direction = -1
+        previous = angle
+        for when,size in slips:
+            if when <= t < when + period: slip += size
+        sensor = angle + offset + direction * backlash + slip + rng.gauss(0.0,noise)
+        if rng.random() < outliers: sensor += rng.choice((-1,1)) * rng.uniform(5,40) # Glitched reading.
+        trace.append((t,angle,Wrap(sensor)))
+    return trace
+
+def RunTrace(fusion,trace,tunedelay=3,deliberate=()):
+    """ Feed a trace through the fusion, applying each correction a few readings later as the microcontroller would.
+        deliberate = (seconds, steps) tunes from elsewhere, eg optical drift tracking.
+        Returns the list of (seconds, steps) corrections issued. """
+    corrections = []
+    pending = [] # (reading number, steps)
+    applied = 0.0 # Degrees of correction applied to the physical axis so far.
+    for n,(t,angle,sensor) in enumerate(trace):
+        while pending and pending[0][0] <= n:
+            applied += 360.0 * pending.pop(0)[1] / fusion.StepsPerRev
+            fusion.TuneComplete()
+        for when,steps in deliberate:
+            if n > 0 and trace[n - 1][0] < when <= t:
+                pending.append((n + tunedelay,steps))
+                fusion.Tuned(steps,slip=False)
+        fusion.Add(angle,Wrap(sensor + applied))
+        steps = fusion.Correction()
+        if steps != None:
+            corrections.append((t,steps))
+            pending.append((n + tunedelay,steps))
+            fusion.Tuned(steps)
+    return corrections
+
+def test_no_slip():
+    """ Noise alone never tunes, the offset and backlash are estimated and glitches are rejected. """
+    fusion = positionfusion(STEPSPERREV)
+    assert RunTrace(fusion,SimulatedTrace(slips=())) == [], 'Noise alone must not trigger a tune.'
+    report = fusion.Report()
+    assert abs(report['offset'] * ONESTEP - 2.0 - 0.15) < 0.02, 'Offset includes the backlash of the settling direction (forward).'
+    assert abs(report['backlash'] * ONESTEP - 0.15) < 0.03
+    assert report['outliers'] > 0, 'Glitches should be rejected.'
+
+def test_naive_tuning():
+    """ Tuning on single readings against the true offset would have tuned the slip free trace, fusion doesn't. """
+    fusion = positionfusion(STEPSPERREV)
+    trace = SimulatedTrace(slips=())
+    naive = len([t for t,angle,sensor in trace if abs(fusion.AngleToStep(Wrap(sensor - angle) - 2.0)) > fusion.Deadband])
+    assert naive > 0 and RunTrace(fusion,trace) == []
+
+def test_single_slip():
+    """ A 0.5 degree slip is tuned once, after it happens, and the tune cancels it. """
+    fusion = positionfusion(STEPSPERREV)
+    corrections = RunTrace(fusion,SimulatedTrace(slips=((3600.0,0.5),)))
+    assert len(corrections) == 1 and all([t >= 3600 for t,steps in corrections]), 'Tune only after the slip.'
+    assert abs(sum([steps for t,steps in corrections]) * ONESTEP + 0.5) < 0.05, 'Tunes should cancel the slip.'
+    assert abs(fusion.Report()['slip']) <= fusion.Deadband
+
+@pytest.mark.parametrize('seed',range(2,10))
+def test_multiple_slips(seed):
+    """ No false tunes without slips. Several slips, either way, the last one close to the deadband, leave
+        a residual within the deadband. """
+    assert RunTrace(positionfusion(STEPSPERREV),SimulatedTrace(slips=(),seed=seed)) == [], 'False tune.'
+    fusion = positionfusion(STEPSPERREV)
+    tunes = RunTrace(fusion,SimulatedTrace(slips=((3600.0,0.5),(5400.0,-0.3),(6000.0,0.1)),seed=seed))
+    residual = fusion.AngleToStep(0.3) + sum([steps for t,steps in tunes])
+    assert abs(residual) <= fusion.Deadband + 10, str(residual) + ' steps left uncorrected.'
+
+def test_deliberate_tunes_kept():
+    """ Tunes from elsewhere are not undone. """
+    assert RunTrace(positionfusion(STEPSPERREV),SimulatedTrace(slips=()),deliberate=((2000.0,300),(4000.0,-120))) == []
+
+@pytest.mark.parametrize('seed',range(1,10))
+def test_slip_removed_by_deliberate_tune(seed):
+    """ Optical drift tracking removes a slip before fusion does, fusion must not remove it again. """
+    fusion = positionfusion(STEPSPERREV)
+    tunes = RunTrace(fusion,SimulatedTrace(slips=((3600.0,0.5),),seed=seed),deliberate=((3620.0,-fusion.AngleToStep(0.5)),))
+    assert tunes == [], 'Tuned a slip already removed by a deliberate tune: ' + str(tunes)
+    assert abs(fusion.Report()['backlash'] * ONESTEP - 0.15) < 0.03, 'Backlash estimate lost after a deliberate tune.'
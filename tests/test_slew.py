@@ -0,0 +1,44 @@
+# pilomarslew: closed form slew times and path choices.
+
+import random
+
+import pytest
+
+from pilomarslew import SPEEDLIST, DefaultProfile, FirmwareSeconds
+
+@pytest.mark.parametrize('name',SPEEDLIST)
+def test_closed_form_matches_firmware(name):
+    """ MoveSeconds() agrees with the step by step replay of the firmware logic, tiny moves included. """
+    rng = random.Random(1)
+    for slewenabled in (True,False):
+        for optimise in (False,True):
+            profile = DefaultProfile(SPEEDLIST[name],optimisemoves=optimise,latency=0.0,fixed=0.0,minimum=0.0)
+            profile.SlewEnabled = slewenabled
+            for i in range(8):
+                a = rng.uniform(0,360)
+                b = rng.uniform(0,360) if i % 4 else a + rng.uniform(-0.05,0.05) # Include tiny moves.
+                closed = profile.MoveSeconds(a,b)[1]
+                replay = FirmwareSeconds(profile,a,b)
+                assert abs(closed - replay) < 1e-6 * max(1.0,replay), str((slewenabled,optimise,a,b,closed,replay))
+
+def test_backlash_prealignment():
+    """ Arriving backwards needs a pre-alignment move, also when the firmware takes the short way through 0. """
+    profile = DefaultProfile(SPEEDLIST['Medium'],minangle=0.0,maxangle=360.0,backlash=0.5)
+    path = profile.Plan(200.0,100.0)
+    assert len(path.Legs) == 2 and path.Legs[0].To == 99.5
+    assert len(profile.Plan(100.0,200.0).Legs) == 1
+    profile.OptimiseMoves = True
+    path = profile.Plan(10.0,350.0) # Firmware goes backwards through 0, needs the pre-alignment.
+    assert len(path.Legs) == 2 and path.Legs[0].Steps < 0
+    path = profile.Plan(350.0,10.0) # Firmware goes forwards through 360, no pre-alignment.
+    assert len(path.Legs) == 1 and path.Legs[0].Steps > 0
+
+def test_short_way_and_limits():
+    """ The shorter legal angle wins and targets outside the limits are clipped. """
+    profile = DefaultProfile(SPEEDLIST['Medium'],minangle=-180.0,maxangle=360.0)
+    path = profile.Plan(90.0,350.0) # Going down through 0 is shorter.
+    assert path.Angle == -10.0, path.Text()
+    path = profile.Plan(350.0,-10.0) # The firmware reports 350 for -10, going to -10 would be a full turn.
+    assert path.Angle == 350.0 and path.Seconds == 0.0, path.Text()
+    profile = DefaultProfile(SPEEDLIST['Medium'],minangle=0.0,maxangle=90.0)
+    assert profile.Plan(45.0,120.0).Clipped
@@ -0,0 +1,91 @@
+# pilomarstacker: streaming live stacker.
+
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+import synthetic
+from pilomarimage import pilomarimage, pilomarstacker
+
+def stack(stacker,rng,frames=30,height=760,width=1014,drift=1.5,meteors=3):
+    """ Stack a synthetic sequence and measure per-frame cost and output quality.
+        The star field drifts by up to 'drift' pixels per frame and 'meteors' frames get a FakeMeteor() streak.
+        Returns a dictionary containing...
+          frame_ms:        Average milliseconds per Add() (including the preview refresh).
+          noise_single:    Background noise (std) of a single frame.
+          noise_stack:     Background noise (std) of the stacked result.
+          noise_gain:      Ratio of the two. sqrt(frames) is ideal.
+          shift_error_px:  RMS error of the registration against the known drift.
+          meteor_residual: Mean excess brightness left along the meteor trails. (0 = fully rejected)
+          memory_mb:       Memory held by the stacker. """
+    synthetic.seed()
+    stacker.Reset()
+    margin = int(drift * frames) + 10
+    sky = synthetic.starsky(height,width,rng,margin=margin) # Oversized sky so shifted frames stay filled.
+    offsets = np.cumsum(rng.uniform(-drift,drift,size=(frames,2)),axis=0)
+    meteorframes = rng.choice(np.arange(2,frames),size=min(meteors,frames - 2),replace=False)
+    meteormask = np.zeros((height,width),bool)
+    single = None
+    shifterrors = []
+    for i in range(frames):
+        ox,oy = offsets[i]
+        frame = synthetic.camera(synthetic.skyframe(sky,ox,oy,margin,height,width))
+        if i in meteorframes:
+            before = frame.ImageBuffer.copy()
+            frame.FakeMeteor()
+            # Record where the streak landed in reference coordinates.
+            streak = (frame.ImageBuffer.astype(np.int16) - before).max(axis=2) > 50
+            streak = cv2.warpAffine(streak.astype(np.uint8),np.float32([[1,0,ox - offsets[0][0]],[0,1,oy - offsets[0][1]]]),(width,height)) > 0
+            meteormask |= streak
+        if single is None: single = frame.ImageBuffer.astype(np.float32)
+        stacker.Add(frame)
+        shifterrors.append(math.hypot(stacker.LastShift[0] + (ox - offsets[0][0]),stacker.LastShift[1] + (oy - offsets[0][1]))) # Sky moves opposite to the frame offset.
+    stacker.RefreshPreview()
+    # Background noise in the star free cells of the reference frame. Ignore the borders.
+    background = (cv2.dilate((sky[margin:margin + height,margin:margin + width].max(axis=2) > 2).astype(np.uint8),np.ones((5,5),np.uint8)) == 0)
+    background[:margin,:] = background[-margin:,:] = background[:,:margin] = background[:,-margin:] = False
+    background &= ~meteormask
+    def noise(image): # Background std with the field gradient removed.
+        gray = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+        return float(np.std(gray[background] - cv2.GaussianBlur(gray,(31,31),0)[background]))
+    stacked = stacker.Preview.ImageBuffer.astype(np.float32)
+    graystack = cv2.cvtColor(stacked,cv2.COLOR_BGR2GRAY)
+    residual = 0.0
+    if meteormask.any(): residual = float(np.mean(graystack[meteormask]) - np.median(graystack[background]))
+    noise_single = noise(single)
+    noise_stack = noise(stacked)
+    return {'frames':frames,'size':(height,width),
+            'frame_ms':round(1000 * stacker.AverageFrameSeconds(),2),
+            'preview_ms':round(1000 * sum(stacker.PreviewSeconds) / max(1,len(stacker.PreviewSeconds)),2),
+            'noise_single':round(noise_single,3),'noise_stack':round(noise_stack,3),
+            'noise_gain':round(noise_single / max(noise_stack,1e-6),2),'ideal_gain':round(math.sqrt(stacker.AcceptedCount),2),
+            'shift_error_px':round(float(np.sqrt(np.mean(np.square(shifterrors)))),3),
+            'meteor_residual':round(residual,2),
+            'memory_mb':round(stacker.MemoryBytes() / 1e6,1)}
+
+def check(results):
+    """ Quality every stack should reach, whatever its size. """
+    assert results['noise_gain'] > 0.5 * results['ideal_gain'], "Stacking should reduce the background noise."
+    assert results['shift_error_px'] < 1.0, "Registration should follow the drift to within a pixel."
+    assert results['meteor_residual'] < 5, "Sigma clipping should reject the meteor trails."
+
+def test_stack_quality(rng):
+    """ A short drifting sequence with meteors stacks cleanly. """
+    check(stack(pilomarstacker('check'),rng,frames=20,height=380,width=507))
+
+def test_memory_is_bounded(rng):
+    """ The stacker holds the same memory however many frames it has seen. """
+    stacker = pilomarstacker('check')
+    short = stack(stacker,rng,frames=5,height=190,width=253,meteors=0)
+    long = stack(stacker,rng,frames=25,height=190,width=253,meteors=0)
+    assert short['memory_mb'] == long['memory_mb']
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('height,width',[(760,1014),(1520,2028)])
+def test_benchmark_stack(rng,height,width):
+    """ Per-frame cost and quality of a 30 frame live stack. """
+    results = stack(pilomarstacker('benchmark'),rng,height=height,width=width)
+    print('Live stacking:',results)
+    check(results)
@@ -0,0 +1,104 @@
+# pilomartelemetry: fixed size binary records alongside the text log.
+
+import glob
+import os
+import time
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from pilomarlogfile import logfile
+from pilomartelemetry import ReadTelemetry, telemetry
+
+def record(folder,offset):
+    """ One event on each standard channel, the clock is a logfile's NowUTC() with an offset, like pilomar.
+        Returns the time the events were recorded. """
+    log = logfile(os.path.join(folder,'check.log'),clockoffset=offset)
+    t = telemetry(folder,'check',clock=lambda: log.NowUTC().timestamp())
+    now = log.NowUTC()
+    later = now + timedelta(seconds=60)
+    t.Record('motorstatus','azimuth',now,True,12,20929,19.6209,True,False,0.002,23269,None,None,False,False)
+    t.Record('trajectory','altitude',now,45.25,later,45.5,45000,47500,False)
+    t.Record('uart','r',True,3,60,'motor status 20260210110322 altitude n')
+    t.Record('camera',12,30.0,now,later,30512.3,1.017,True,False)
+    t.Close()
+    assert t.Errors == 0, 'Recording failed.'
+    return now
+
+def test_read_numpy(tmp_path):
+    """ Records read back as numpy, stamped by the log clock (offset included) and filtered by time. """
+    offset = 3600.0
+    now = record(str(tmp_path),offset)
+    motor = ReadTelemetry(str(tmp_path),'motorstatus')
+    assert len(motor) == 1 and motor['motor'][0] == b'azimuth' and motor['position'][0] == 20929 and motor['sensorvalue'][0] == -1
+    assert np.isnan(motor['sensorangle'][0]) and abs(motor['mctltime'][0] - now.timestamp()) < 1e-6
+    assert abs(motor['t'][0] - now.timestamp()) < 5 and abs(motor['t'][0] - time.time() - offset) < 5
+    trajectory = ReadTelemetry(str(tmp_path),'trajectory',start=now - timedelta(seconds=5))
+    assert len(trajectory) == 1 and trajectory['endangle'][0] == 45.5 and trajectory['endutc'][0] == (now + timedelta(seconds=60)).timestamp()
+    assert len(ReadTelemetry(str(tmp_path),'trajectory',end=now - timedelta(seconds=5))) == 0
+
+def test_read_dataframe(tmp_path):
+    """ The DataFrame export decodes text fields and is indexed by the UTC record time. """
+    pytest.importorskip('pandas')
+    now = record(str(tmp_path),3600.0)
+    df = ReadTelemetry(str(tmp_path),'uart',dataframe=True)
+    assert list(df.columns) == ['direction','valid','queue','length','text']
+    assert df['text'].iloc[0] == 'motor status 20260210110322 altitude n' and df['direction'].iloc[0] == 'r'
+    assert bool(df['valid'].iloc[0]) and int(df['queue'].iloc[0]) == 3
+    assert str(df.index.tz) == 'UTC' and abs(df.index[0].timestamp() - now.timestamp()) < 5
+    df = ReadTelemetry(str(tmp_path),'camera',dataframe=True)
+    assert int(df['photocount'].iloc[0]) == 12 and df['obsend'].iloc[0] - df['obsstart'].iloc[0] == 60
+
+def overhead(folder,calls=100000,records=1000000,maxbytes=16*1024*1024):
+    """ Recording cost per event against a free text log line, and the time to write and load a night's telemetry.
+        The per channel costs come from Overhead(), the measurement pilomar reports from its real call sites.
+        Returns a dictionary of results. """
+    results = {}
+    log = logfile(os.path.join(folder,'bench.log'))
+    os.makedirs(os.path.join(folder,'calls'))
+    os.makedirs(os.path.join(folder,'night'))
+    t = telemetry(os.path.join(folder,'calls'),'bench',clock=lambda: log.NowUTC().timestamp())
+    now = log.NowUTC()
+    samples = {'motorstatus':('azimuth',now,True,12,20929,19.6209,True,False,0.002,23269,None,None,False,False),
+               'trajectory':('azimuth',now,181.6003,now,181.7003,45000,47500,False),
+               'uart':('r',True,3,60,'motor status 20260210110322 altitude n 20260210110322 0 20929 19.6209 y n'),
+               'camera':(12,30.0,now,now,30512.3,1.017,True,False)}
+    for channel,values in samples.items():
+        for i in range(calls): t.Record(channel,*values)
+    for channel,cost in t.Overhead().items(): results[channel + '_us'] = cost['mean_us']
+    n = calls // 5
+    t0 = time.perf_counter()
+    for i in range(n): # The text log line written for the same event.
+        log.Log('RPi received: motor status 20260210110322 altitude n 20260210110322 0 20929 19.6209 y n 0.002 23269 tmr none none n n n',terminal=False)
+    results['textlog_us'] = (time.perf_counter() - t0) / n * 1e6
+    t.Close()
+    folder = os.path.join(folder,'night')
+    t = telemetry(folder,'night',maxbytes=maxbytes,flushrecords=1000)
+    t0 = time.perf_counter()
+    base = time.time()
+    for i in range(records): t.Record('uart','r',True,i % 50,60,'motor status',timestamp=base + i * 0.036)
+    t.Close()
+    results['write_records_per_s'] = records / (time.perf_counter() - t0)
+    results['files'] = len(glob.glob(os.path.join(folder,'*.tlm')))
+    t0 = time.perf_counter()
+    results['loaded'] = len(ReadTelemetry(folder,'uart'))
+    results['load_numpy_s'] = time.perf_counter() - t0
+    return results
+
+def check(results,records):
+    """ Every channel records faster than a text log line, and rotated files load back complete. """
+    for channel in ('motorstatus','trajectory','uart','camera'):
+        assert results[channel + '_us'] < results['textlog_us'], channel + ' costs more than a text log line.'
+    assert results['files'] > 1, 'Files should rotate.'
+    assert results['loaded'] == records
+
+def test_overhead(tmp_path):
+    check(overhead(str(tmp_path),calls=5000,records=20000,maxbytes=256*1024),records=20000)
+
+@pytest.mark.benchmark
+def test_benchmark_telemetry(tmp_path):
+    """ 100000 calls per channel and a night of UART records. """
+    results = overhead(str(tmp_path))
+    for key,value in results.items(): print(key,':',round(value,3) if isinstance(value,float) else value)
+    check(results,records=1000000)
@@ -0,0 +1,63 @@
+# pilomartimelapse: incremental movie encoding during capture.
+
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import synthetic
+from pilomarimage import pilomartimelapse
+
+def moviecount(filename):
+    """ Number of frames held in a movie file. """
+    check = cv2.VideoCapture(filename)
+    frames = int(check.get(cv2.CAP_PROP_FRAME_COUNT))
+    check.release()
+    return frames
+
+def test_session_sequence(tmp_path,frames=5):
+    """ Start -> AddFrame -> Finish on synthetic frames, as the capture session uses it. """
+    movie = pilomartimelapse('check')
+    moviefile = str(tmp_path / 'check.mp4')
+    assert not movie.Active(), "Active before Start()."
+    movie.Start(moviefile)
+    assert movie.Active(), "Not active after Start(), callers would never add frames."
+    for i in range(frames):
+        if movie.Active(): movie.AddFrame(np.full((240,320,3),i * 40,dtype=np.uint8)) # Callers check Active() first.
+    stats = movie.Stats()
+    assert movie.Finish() == moviefile and os.path.getsize(moviefile) > 0, "Finish() did not return the movie."
+    assert stats['frames'] == frames
+    assert not movie.Active(), "Still active after Finish()."
+    assert moviecount(moviefile) == frames
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('height,width,frames',[(760,1014,60),(3040,4056,20)])
+def test_benchmark_encoding(tmp_path,rng,height,width,frames):
+    """ Incremental encoding during capture against batch encoding of the same frames saved as jpg files.
+        add_ms is the cost per captured frame, finish_ms is what is left to do when the session ends. """
+    movie = pilomartimelapse('benchmark')
+    sky = synthetic.starsky(height,width,rng,margin=2 * frames)
+    results = {'frames':frames,'size':(height,width)}
+    movie.Start(str(tmp_path / 'incremental.mp4'))
+    addtimes = []
+    for i in range(frames):
+        frame = synthetic.skyframe(sky,i * 4,0,2 * frames,height,width) # Drifting star field.
+        cv2.imwrite(str(tmp_path / ('preview_' + str(i).zfill(4) + '.jpg')),frame) # For the batch test.
+        start = time.perf_counter()
+        movie.AddFrame(frame)
+        addtimes.append(time.perf_counter() - start)
+    results['add_ms'] = round(1000 * float(np.mean(addtimes)),1)
+    start = time.perf_counter()
+    incremental = movie.Finish()
+    results['finish_ms'] = round(1000 * (time.perf_counter() - start),1)
+    start = time.perf_counter()
+    batch = movie.EncodeFiles(sorted(glob.glob(str(tmp_path / 'preview_*.jpg'))),str(tmp_path / 'batch.mp4'))
+    results['batch_s'] = round(time.perf_counter() - start,2)
+    results['batch_fps'] = round(frames / results['batch_s'],1)
+    print('Timelapse encoding:',results)
+    assert moviecount(incremental) == frames
+    assert moviecount(batch) == frames
+    assert results['finish_ms'] < 1000 * results['batch_s'], "Finishing the incremental movie should cost less than a batch encode."
@@ -0,0 +1,26 @@
+# pilomartrajectory: trajectory segment lengths chosen from the chord error.
+
+import math
+
+from pilomartrajectory import CompareReport, segmentplanner
+
+def test_known_paths():
+    """ Straight, constant acceleration and rapidly changing paths get the segment the chord error formula allows. """
+    planner = segmentplanner(tolerance=0.005,minimum=60,maximum=1560)
+    seconds, end = planner.Plan(lambda s: 10.0 + 0.004 * s)
+    assert seconds == 1560, 'A straight path should use the longest segment.'
+    a = 2e-7 # Constant acceleration, longest segment is sqrt(8 * tol / a) = 447s, aimed at 80% of the tolerance.
+    seconds, end = planner.Plan(lambda s: 0.5 * a * s * s)
+    assert 380 <= seconds <= 447 and a * seconds * seconds / 8 <= 0.005
+    seconds, end = planner.Plan(lambda s: 0.5 * a * s * s,low=0.0,high=0.005)
+    assert end <= 0.005, 'Segment must stay within the angle limits.'
+    seconds, end = planner.Plan(lambda s: 0.01 * math.sin(s / 30.0) * s) # Nothing beyond the minimum is safe.
+    assert seconds == 60
+
+def test_fewer_segments_within_tolerance():
+    """ Over the report's declinations the planner needs fewer segments than the drift search, and only exceeds
+        the tolerance where fixed minimum segments would too. """
+    lines, totals = CompareReport()
+    for name,total in totals.items():
+        assert total[1] < total[0], name + ': planner should need fewer segments.'
+        assert total[6] <= 0.0005, name + ': planner exceeds the tolerance where shorter segments would not.'
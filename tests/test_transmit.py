@@ -0,0 +1,150 @@
+# pilomartransmit: flow control and priorities, checked over a pty loopback.
+# The far end of the pty behaves like the microcontroller's uarthost:
+#   - It only reads the UART between main loop iterations, every BUSYSECONDS while it steps the motors.
+#     More than 1024 bytes arriving between two reads would overflow the real UART buffer.
+#   - Each received line is acknowledged with a 'rec: [n]' log line. Log lines are batched until more than
+#     80 characters wait, like logfile.SendCheck().
+# A pty has no real baud rate, so the writer paces itself to the line rate (10 bits per byte).
+
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+import pytest
+
+from pilomarframing import Checksum
+from pilomartransmit import MessageClass, ParseAck, transmitscheduler
+
+BAUDRATE = 115200
+BUSYSECONDS = 0.25
+
+# Burst of configuration after InitiateMctl(): 2 motors of configuration, clock and status requests.
+CONFIGURE = 'configure tmc2209 20250115200000 {} 180.0 0.0 360.0 0.0 -1 0.001 0.05 0.003 10 n n none 240 400 4 1 1.0 0.75 0.5 10 180.0 n n'
+BURST = [(0.0,CONFIGURE.format(motor)) for motor in ('azimuth','altitude')] * 4 + [(0.0,'set time 20250115200000'),(0.0,'status'),(0.0,'pin status')] * 4
+SEGMENT = 'trajectory 20250115200000 azimuth 20250115200100 181.6003 20250115200200 181.7003 45000 47500'
+
+def encode(line,messageid):
+    line = line + ' [' + str(messageid) + ']'
+    return (line + '|' + Checksum(line) + '\n').encode('utf-8')
+
+class farend():
+    """ The microcontroller end of the pty. """
+
+    def __init__(self,fd):
+        self.Fd = fd
+        self.Buffer = bytearray()
+        self.Received = [] # Lines in arrival order.
+        self.Pending = '' # Batched log lines.
+        self.MaxRead = 0 # Largest number of bytes waiting at one read.
+        self.Done = threading.Event()
+        self.Thread = threading.Thread(target=self.Loop,daemon=True)
+        self.Thread.start()
+
+    def Loop(self):
+        while not self.Done.is_set():
+            time.sleep(BUSYSECONDS) # Stepping the motors, not reading the UART.
+            data = b''
+            while select.select([self.Fd],[],[],0)[0]:
+                data += os.read(self.Fd,4096)
+            self.MaxRead = max(self.MaxRead,len(data))
+            self.Buffer += data
+            while b'\n' in self.Buffer:
+                i = self.Buffer.index(b'\n')
+                line = self.Buffer[:i].decode('utf-8').split('|')[0]
+                del self.Buffer[:i + 1]
+                self.Received.append(line)
+                x = line.split(' ')[-1]
+                if not line.startswith('#') and x.startswith('['):
+                    self.Pending += '20250115200000:rec: ' + x + '\n'
+            if len(self.Pending) > 80:
+                for entry in self.Pending.split('\n')[:-1]:
+                    line = 'log :' + entry
+                    os.write(self.Fd,(line + '|' + Checksum(line) + '\n').encode('utf-8'))
+                self.Pending = ''
+
+def run(messages,scheduled,gap=0.0,timeout=30.0):
+    """ messages = [(delay,line)] queued 'delay' seconds after the start.
+        scheduled = Use the window, otherwise write as fast as the line (and 'gap') allows.
+        Returns (farend, elapsed, scheduler) """
+    master,slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    far = farend(slave)
+    scheduler = transmitscheduler() if scheduled else transmitscheduler(windowbytes=1 << 30,windowmessages=1 << 30)
+    begin = time.monotonic()
+    todo = list(enumerate(messages,1))
+    inbound = bytearray()
+    lastwrite = 0.0
+    while time.monotonic() - begin < timeout:
+        now = time.monotonic()
+        while todo and todo[0][1][0] <= now - begin:
+            messageid,(delay,line) = todo.pop(0)
+            scheduler.Add(encode(line,messageid),MessageClass(line),messageid)
+        if now - lastwrite >= gap:
+            chunk,message = scheduler.Next(window=scheduled)
+            if chunk != None:
+                os.write(master,chunk)
+                lastwrite = now
+                time.sleep(len(chunk) * 10.0 / BAUDRATE) # Line rate.
+        while select.select([master],[],[],0)[0]: # Acknowledgements.
+            inbound += os.read(master,4096)
+        while b'\n' in inbound:
+            i = inbound.index(b'\n')
+            messageid = ParseAck(inbound[:i].decode('utf-8'))
+            del inbound[:i + 1]
+            if messageid != None: scheduler.Ack(messageid)
+        if not todo and scheduler.Depth() == 0 and len(far.Received) >= len(messages): break
+        time.sleep(0.002)
+    elapsed = time.monotonic() - begin
+    far.Done.set()
+    far.Thread.join()
+    os.close(master)
+    os.close(slave)
+    return far,elapsed,scheduler
+
+def burst(methods):
+    """ The configuration burst sent by each method, {name:(scheduled, gap)}.
+        Returns {name:(largest UART backlog, elapsed, lines received)} """
+    results = {}
+    for name,(scheduled,gap) in methods.items():
+        far,elapsed,scheduler = run(BURST,scheduled,gap=gap)
+        results[name] = (far.MaxRead,elapsed,len(far.Received))
+    return results
+
+def test_window_protects_buffer():
+    """ Unpaced, the burst overflows the microcontroller's 1024 byte buffer. The window doesn't, and loses nothing. """
+    results = burst({'unpaced':(False,0.0),'window':(True,0.0)})
+    assert results['unpaced'][0] > 1024, 'Expected the unpaced burst to overflow the microcontroller buffer.'
+    assert results['window'][0] <= 1024 and results['window'][2] == len(BURST)
+
+def test_stop_overtakes_trajectory():
+    """ 'stop' and 'status' queued while 30 trajectory segments wait overtake them. """
+    far,elapsed,scheduler = run([(0.0,SEGMENT)] * 30 + [(0.3,'stop'),(0.3,'status')],True)
+    order = [line.split(' ')[0] for line in far.Received]
+    report = scheduler.Report()
+    assert order.index('stop') < order.index('status') < 15
+    assert report['trajectory']['acked'] > 0 and report['stop']['latency_ms_p50'] < report['trajectory']['latency_ms_p50']
+
+def test_clear_keeps_order():
+    """ Only stop overtakes the queue. 'clear trajectory' discards the stale segments queued before it, nothing from
+        the old trajectory follows it. A 'goto' stays behind the configuration queued before it. """
+    messages = [(0.0,SEGMENT)] * 30 + [(0.3,CONFIGURE.format('azimuth')),(0.3,'goto azimuth 90.0'),(0.3,'stop'),(0.3,'clear trajectory'),(0.3,'status')]
+    far,elapsed,scheduler = run(messages,True,timeout=3.0) # Dropped segments never arrive, so this runs to the timeout.
+    order = [line.split(' ')[0] for line in far.Received]
+    report = scheduler.Report()
+    assert order.index('stop') < order.index('configure') < order.index('goto') < order.index('clear') < order.index('status')
+    assert 'trajectory' not in order[order.index('clear'):], 'Stale trajectory segments arrived after the clear.'
+    assert report['trajectory']['dropped'] > 0 and len(far.Received) + report['trajectory']['dropped'] == len(messages)
+
+@pytest.mark.benchmark
+def test_benchmark_burst():
+    """ The window against the old fixed 0.2s timer. """
+    results = burst({'timer 0.2s':(False,0.2),'unpaced':(False,0.0),'window':(True,0.0)})
+    print('\nBurst of',len(BURST),'messages,',sum([len(encode(line,1)) for delay,line in BURST]),'bytes.')
+    for name,(backlog,elapsed,received) in results.items():
+        print('  ' + name.ljust(11),received,'received in',round(elapsed,2),'s, largest UART backlog',backlog,'bytes')
+    assert results['window'][0] <= 1024
+    assert results['window'][1] < results['timer 0.2s'][1], 'Window should beat the fixed timer.'